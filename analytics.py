@@ -1,42 +1,36 @@
 # Analytics API for Traffic Management System
-from fastapi import APIRouter
-from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException
 import json
 import random
+import asyncio
+import os
+import time
 from typing import List, Dict
 
+import model_server
+import subsystems
+from cache import response_cache
+from rollups import TRAFFIC_TABLES, rollup_store
+from system_metrics import SPAN, controller_summary, latency, metrics
+
 router = APIRouter(prefix="/api/analytics", tags=["analytics"])
 
-@router.get("/traffic/hourly")
-async def get_hourly_traffic():
-    # Generate hourly traffic data for the last 24 hours
-    hours = []
-    traffic_counts = []
-    avg_speeds = []
-
-    for i in range(24):
-        hour = (datetime.now() - timedelta(hours=23-i)).strftime('%H:00')
-
-        # Simulate rush hour patterns
-        if 7 <= i <= 9 or 17 <= i <= 19:  # Rush hours
-            count = random.randint(80, 120)
-            speed = random.randint(25, 35)
-        elif 22 <= i or i <= 5:  # Night hours
-            count = random.randint(10, 30)
-            speed = random.randint(45, 55)
-        else:  # Regular hours
-            count = random.randint(40, 70)
-            speed = random.randint(35, 45)
-
-        hours.append(hour)
-        traffic_counts.append(count)
-        avg_speeds.append(speed)
+# Alert when a window's figures cross these
+HEALTH_THRESHOLDS = {
+    'api_p95_ms': float(os.environ.get("HEALTH_API_P95_MS", 500)),
+    'error_rate': float(os.environ.get("HEALTH_ERROR_RATE", 0.01)),
+    'cpu_percent': float(os.environ.get("HEALTH_CPU_PERCENT", 90)),
+    'model_queue': float(os.environ.get("HEALTH_MODEL_QUEUE", 4 * model_server.MAX_BATCH)),
+    'sos_pending': float(os.environ.get("HEALTH_SOS_PENDING", 10))
+}
 
-    return {
-        "hours": hours,
-        "traffic_counts": traffic_counts,
-        "avg_speeds": avg_speeds
-    }
+@router.get("/traffic/hourly")
+async def get_hourly_traffic(junction: str = None, source: str = "controller"):
+    # Last 24 hours answered from the hourly rollups; source=fcd reads the
+    # ones built from SUMO's FCD output (SUMO_INGEST=1) instead
+    if source not in TRAFFIC_TABLES:
+        raise HTTPException(status_code=422, detail=f"Unknown rollup source: {source}")
+    return rollup_store.hourly_traffic(hours=24, junction=junction, source=source)
 
 @router.get("/performance/comparison")
 async def get_performance_comparison():
@@ -70,31 +64,8 @@ async def get_performance_comparison():
 
 @router.get("/violations/trends")
 async def get_violation_trends():
-    # Violation trends over the last 30 days
-    days = []
-    red_light_violations = []
-    speeding_violations = []
-    other_violations = []
-
-    for i in range(30):
-        day = (datetime.now() - timedelta(days=29-i)).strftime('%m-%d')
-        days.append(day)
-
-        # Simulate decreasing trend (AI improvement)
-        base_red_light = max(5, 15 - (i * 0.2))
-        base_speeding = max(3, 12 - (i * 0.15))
-        base_other = max(2, 8 - (i * 0.1))
-
-        red_light_violations.append(int(base_red_light + random.randint(-2, 2)))
-        speeding_violations.append(int(base_speeding + random.randint(-1, 2)))
-        other_violations.append(int(base_other + random.randint(-1, 1)))
-
-    return {
-        "days": days,
-        "red_light_violations": red_light_violations,
-        "speeding_violations": speeding_violations,
-        "other_violations": other_violations
-    }
+    # Violation trends over the last 30 days from the daily rollups
+    return rollup_store.daily_violations(days=30)
 
 @router.get("/junctions/efficiency")
 async def get_junction_efficiency():
@@ -141,16 +112,85 @@ async def get_ai_model_performance():
     }
 
 @router.get("/system/health")
-async def get_system_health():
-    return {
-        "overall_health": "excellent",
-        "uptime": "99.8%",
-        "components": {
-            "sumo_simulation": {"status": "running", "cpu_usage": 45.2, "memory_usage": 68.7},
-            "ai_models": {"status": "running", "gpu_usage": 67.3, "inference_time": 120},
-            "database": {"status": "running", "connections": 15, "query_time": 2.3},
-            "api_server": {"status": "running", "requests_per_minute": 245, "response_time": 89}
+async def get_system_health(window: int = 60):
+    # Measured over the last `window` seconds (up to the collector's span)
+    window = max(1, min(window, SPAN))
+    http = metrics.stats("http", window)
+    errors = metrics.stats("http.errors", window)
+    cpu = metrics.stats("process.cpu_percent", window)
+    rss = metrics.stats("process.rss_mb", window)
+    inference = metrics.stats("model.inference", window)
+    db = metrics.stats("db.transaction", window)
+    queues = metrics.gauge_stats(window)
+    predictor = subsystems.registry["predictor"].describe()
+    error_rate = round(errors["count"] / http["count"], 4) if http and errors else 0.0
+
+    components = {
+        "sumo_simulation": controller_summary(),
+        "ai_models": {
+            "status": "running" if predictor["status"] == "ready" else predictor["status"],
+            "inference_ms": latency(inference),
+            "batches_per_minute": round(inference["rate"] * 60, 1) if inference else 0.0,
+            "request_latency_ms": latency(metrics.stats("model.latency", window)),
+            "queue": queues.get("model.queued")
         },
-        "alerts": [],
+        "database": {
+            "status": "running",
+            "transactions_per_minute": round(db["rate"] * 60, 1) if db else 0.0,
+            "transaction_ms": latency(db)
+        },
+        "api_server": {
+            "status": "running",
+            "requests_per_minute": round(http["rate"] * 60, 1) if http else 0.0,
+            "response_time_ms": latency(http),
+            "error_rate": error_rate,
+            "cpu_percent": round(cpu["mean"], 1) if cpu else None,
+            "rss_mb": round(rss["last"], 1) if rss else None
+        }
+    }
+
+    alerts = []
+    limits = HEALTH_THRESHOLDS
+    if http and http["p95"] > limits["api_p95_ms"]:
+        alerts.append(f"API p95 latency {http['p95']}ms over {limits['api_p95_ms']}ms")
+    if error_rate > limits["error_rate"]:
+        alerts.append(f"API error rate {error_rate:.1%} over {limits['error_rate']:.1%}")
+    if cpu and cpu["mean"] > limits["cpu_percent"]:
+        alerts.append(f"API process CPU at {cpu['mean']:.0f}%")
+    if components["sumo_simulation"]["status"] == "stalled":
+        alerts.append(f"Controller has not reported for {components['sumo_simulation']['age_seconds']}s")
+    if predictor["status"] == "failed":
+        alerts.append(f"Predictor failed to load: {predictor['error']}")
+    model_queue, sos_pending = queues.get("model.queued"), queues.get("sos.pending")
+    if model_queue and model_queue["max"] > limits["model_queue"]:
+        alerts.append(f"Model queue reached {model_queue['max']:.0f} requests")
+    if sos_pending and sos_pending["current"] > limits["sos_pending"]:
+        alerts.append(f"{sos_pending['current']:.0f} SOS requests waiting for a unit")
+
+    ready, _ = subsystems.readiness()
+    return {
+        "overall_health": "degraded" if alerts else ("healthy" if ready else "starting"),
+        "uptime_seconds": round(time.time() - metrics.started),
+        "window_seconds": window,
+        "components": components,
+        "queues": queues,
+        "alerts": alerts,
         "maintenance_window": "Sunday 02:00-04:00 AM"
     }
+
+@router.get("/rollups/status")
+async def get_rollup_status():
+    return {"watermarks": rollup_store.watermarks()}
+
+async def run_rollups_periodically(interval=None):
+    # Incremental rollup job: each pass reads only newly appended log lines
+    interval = interval or float(os.environ.get("ROLLUP_INTERVAL", 60))
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            ingested = await loop.run_in_executor(None, rollup_store.run_once)
+            if any(ingested.values()):
+                response_cache.bump_data_version("analytics")
+        except Exception as e:
+            print(f"Error updating rollups: {e}")
+        await asyncio.sleep(interval)
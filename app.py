@@ -1,29 +1,41 @@
 # FastAPI Backend for Smart Traffic Management System
-from fastapi import FastAPI, WebSocket, HTTPException
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, WebSocket, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
 import uvicorn
 import json
 import asyncio
+import os
 from datetime import datetime
-import sqlite3
 from typing import List, Dict
 
-app = FastAPI(title="Smart Traffic Management API", version="1.0.0")
-
-# Enable CORS for frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+import analytics
+import cache
+import forecaster
+import model_server
+import online_learning
+import plan_scheduler
+import profiler
+import sos
+import stream
+import subsystems
+import sumo_outputs
+import system_metrics
+import telemetry
+import tracing
+import violations
+from event_bus import bus
+
+# Core endpoints; the feature APIs live in their own router modules
+router = APIRouter()
 
 # WebSocket connections
 active_connections: List[WebSocket] = []
 
-@app.websocket("/ws")
+@router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     active_connections.append(websocket)
@@ -37,22 +49,52 @@ async def websocket_endpoint(websocket: WebSocket):
         active_connections.remove(websocket)
 
 async def broadcast_message(message: dict):
-    for connection in active_connections:
-        try:
-            await connection.send_text(json.dumps(message))
-        except:
-            active_connections.remove(connection)
-
-@app.get("/")
+    # Fan out through the event bus so clients on every worker receive it
+    await bus.publish("broadcast", message)
+
+async def send_to_local_connections(message: dict):
+    with tracing.span("ws.broadcast", parent=message.get("trace")):
+        payload = json.dumps(message)
+        for connection in list(active_connections):
+            try:
+                await connection.send_text(payload)
+            except:
+                active_connections.remove(connection)
+    if active_connections:
+        # From the event's origin (an SOS call, a detection) to the alert
+        tracing.finish("to_websocket", message.get("trace"))
+
+bus.subscribe("broadcast", send_to_local_connections)
+
+@router.get("/")
 async def root():
     return {"message": "Smart Traffic Management API", "version": "1.0.0"}
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+@router.get("/health")
+async def health_check(request: Request):
+    # Liveness is implied by answering; readiness waits on required subsystems
+    ready, subsystem_status = subsystems.readiness()
+    return {
+        "status": "healthy",
+        "live": True,
+        "ready": ready,
+        "startup": request.app.state.startup,
+        "subsystems": subsystem_status,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/health/live")
+async def liveness_check():
+    return {"live": True}
+
+@router.get("/health/ready")
+async def readiness_check():
+    ready, subsystem_status = subsystems.readiness()
+    return JSONResponse(status_code=200 if ready else 503,
+                        content={"ready": ready, "subsystems": subsystem_status})
 
 # Traffic data endpoints
-@app.get("/api/traffic/current")
+@router.get("/api/traffic/current")
 async def get_current_traffic():
     # Mock traffic data - would connect to TraCI in real implementation
     traffic_data = {
@@ -67,52 +109,7 @@ async def get_current_traffic():
     }
     return traffic_data
 
-@app.post("/api/sos/submit")
-async def submit_sos(sos_data: dict):
-    sos_id = f"SOS_{int(datetime.now().timestamp())}"
-
-    # Process SOS request
-    response = {
-        "sos_id": sos_id,
-        "status": "received",
-        "message": "Emergency services have been notified",
-        "estimated_response_time": "5-8 minutes"
-    }
-
-    # Broadcast SOS alert to connected clients
-    await broadcast_message({
-        "type": "sos_alert",
-        "data": {"sos_id": sos_id, "emergency_type": sos_data.get("emergency_type")}
-    })
-
-    return response
-
-@app.get("/api/violations/recent")
-async def get_recent_violations():
-    # Mock violation data
-    violations = [
-        {
-            "id": "V001",
-            "vehicle_id": "KA01AB1234",
-            "type": "RED_LIGHT_VIOLATION",
-            "location": "J0",
-            "timestamp": "2024-01-15T10:30:00",
-            "fine_amount": 1000,
-            "status": "pending"
-        },
-        {
-            "id": "V002", 
-            "vehicle_id": "KA02CD5678",
-            "type": "SPEEDING_VIOLATION",
-            "location": "E0",
-            "timestamp": "2024-01-15T11:15:00",
-            "fine_amount": 500,
-            "status": "pending"
-        }
-    ]
-    return violations
-
-@app.post("/api/route/optimize")
+@router.post("/api/route/optimize")
 async def optimize_route(route_data: dict):
     origin = route_data.get("origin")
     destination = route_data.get("destination")
@@ -132,5 +129,114 @@ async def optimize_route(route_data: dict):
 
     return optimized_route
 
+@router.get("/api/traffic/prediction/{junction_id}")
+async def get_traffic_prediction(junction_id: str, hours_ahead: int = 1):
+    # Concurrent requests are micro-batched into one predictor call; the
+    # predictor loads on first use (or during warm-up) on the model thread
+    return await model_server.predict_density(junction_id, hours_ahead)
+
+def create_app(warmup=None) -> FastAPI:
+    app = FastAPI(title="Smart Traffic Management API", version="1.0.0",
+                  default_response_class=cache.FastJSONResponse)
+
+    # ETag/304 + compression for the read-heavy dashboard endpoints
+    app.add_middleware(cache.ResponseCacheMiddleware, cache=cache.response_cache)
+
+    # Enable CORS for frontend (added last so it wraps cached responses too)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.include_router(router)
+    app.include_router(telemetry.router)
+    app.include_router(stream.router)
+    app.include_router(analytics.router)
+    app.include_router(violations.router)
+    app.include_router(sos.router)
+    app.include_router(cache.router)
+    app.include_router(forecaster.router)
+    app.include_router(model_server.router)
+    app.include_router(online_learning.router)
+    app.include_router(plan_scheduler.router)
+    app.include_router(tracing.router)
+    app.include_router(profiler.router)
+    app.include_router(sumo_outputs.router)
+
+    # Heavy subsystems warm up in background threads after startup
+    if warmup is None:
+        warmup = [name for name in os.environ.get("WARMUP_SUBSYSTEMS", "predictor").split(",") if name]
+    # /health/ready only reports ready once the warm-up set has loaded
+    subsystems.require(warmup)
+
+    app.state.startup = {"startup_ms": None, "first_request_ms": None}
+
+    @app.on_event("startup")
+    async def on_startup():
+        await bus.start()
+        subsystems.warm_up(warmup)
+        app.state.rollup_task = asyncio.ensure_future(analytics.run_rollups_periodically())
+        # SUMO_INGEST=1 tails SUMO's summary/FCD output into telemetry and rollups
+        app.state.ingest_task = (asyncio.ensure_future(sumo_outputs.run_ingest_periodically())
+                                 if sumo_outputs.ENABLED else None)
+        # Queue depths and process CPU/RSS, sampled once a second
+        system_metrics.metrics.start_sampler()
+        # kill -USR1 <worker pid> toggles a sampling profile of this worker
+        profiler.install_signal_handlers()
+        app.state.startup["startup_ms"] = round((time.perf_counter() - _import_started) * 1000, 1)
+
+    @app.on_event("shutdown")
+    async def on_shutdown():
+        app.state.rollup_task.cancel()
+        if app.state.ingest_task is not None:
+            app.state.ingest_task.cancel()
+        system_metrics.metrics.stop_sampler()
+        await bus.stop()
+
+    if tracing.ENABLED:
+        @app.middleware("http")
+        async def trace_requests(request: Request, call_next):
+            # Root span per request, or a child of the caller's traceparent
+            parent = tracing.from_traceparent(request.headers.get("traceparent"))
+            with tracing.span("http", parent=parent) as current:
+                response = await call_next(request)
+                route = request.scope.get("route")
+                tracing.rename(current, f"http {request.method} {route.path if route else 'unmatched'}")
+            return response
+
+    @app.middleware("http")
+    async def measure_requests(request: Request, call_next):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            # Latency to the response headers, per route template; cache hits
+            # never reach the router, so they go under their (fixed) path
+            route = request.scope.get("route")
+            path = request.url.path
+            if route is not None:
+                path = route.path
+            elif cache.response_cache.route_for(path) is None:
+                path = "unmatched"
+            system_metrics.metrics.record_request(f"http {request.method} {path}", status,
+                                                  (time.perf_counter() - started) * 1000)
+
+        if app.state.startup["first_request_ms"] is None:
+            # Cold start: module import to first response served
+            cold_start = round((time.perf_counter() - _import_started) * 1000, 1)
+            app.state.startup["first_request_ms"] = cold_start
+            if cold_start > 1000:
+                print(f"Warning: cold start took {cold_start}ms (budget 1000ms)")
+        return response
+
+    return app
+
+app = create_app()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
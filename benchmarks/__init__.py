@@ -0,0 +1 @@
+# Offline Benchmark Suite - python -m benchmarks run / compare (see harness.py)
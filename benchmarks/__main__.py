@@ -0,0 +1,92 @@
+# Benchmark CLI - run the suite, save results and gate on regressions
+import argparse
+import os
+import sys
+
+from benchmarks import harness
+
+# Bench modules import the top-level project modules
+if harness.REPO not in sys.path:
+    sys.path.insert(0, harness.REPO)
+
+LATEST = os.path.join(harness.RESULTS_DIR, "latest.json")
+BASELINE = os.path.join(harness.RESULTS_DIR, "baseline.json")
+
+
+def run_suite(args):
+    if args.quick:
+        return harness.run(args.k, repeats=3, min_time=0.05)
+    return harness.run(args.k, repeats=args.repeats, min_time=args.min_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_run_options(command):
+        command.add_argument("-k", action="append", default=[], help="only benchmarks whose name contains this")
+        command.add_argument("--quick", action="store_true", help="3 short repeats, for a smoke run")
+        command.add_argument("--repeats", type=int, default=5)
+        command.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat")
+
+    run = commands.add_parser("run", help="run the suite and save the results as JSON")
+    add_run_options(run)
+    run.add_argument("--out", default=LATEST)
+    run.add_argument("--save-baseline", action="store_true", help="also make these results the baseline")
+
+    compare = commands.add_parser("compare", help="flag regressions against a saved baseline")
+    add_run_options(compare)
+    compare.add_argument("--baseline", default=BASELINE)
+    compare.add_argument("--current", help="results file to check (default: run the suite now)")
+    compare.add_argument("--threshold", type=float, default=harness.DEFAULT_THRESHOLD,
+                         help="fractional slowdown that fails the gate (default 0.10)")
+
+    commands.add_parser("list", help="list the registered benchmarks")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        harness.load_modules()
+        for name, bench in harness.BENCHMARKS.items():
+            print(f"{name:<44} {bench.group:<12} per {bench.unit}")
+        return 0
+
+    if args.command == "run":
+        report = run_suite(args)
+        harness.save(report, args.out)
+        print(f"Saved {len(report['results'])} results to {args.out}")
+        if args.save_baseline:
+            harness.save(report, BASELINE)
+            print(f"Baseline updated: {BASELINE}")
+        return 0
+
+    try:
+        baseline = harness.load(args.baseline)
+    except (OSError, ValueError) as e:
+        print(f"No usable baseline ({e}); create one with: python -m benchmarks run --save-baseline")
+        return 2
+    if args.current:
+        current = harness.load(args.current)
+    else:
+        current = run_suite(args)
+        harness.save(current, LATEST)
+
+    mismatch = harness.machine_mismatch(baseline, current)
+    if mismatch:
+        print(f"Warning: baseline was recorded on a different machine ({', '.join(mismatch)} differ)")
+    if args.k:
+        # Only compare what was asked for
+        baseline = dict(baseline, results={name: r for name, r in baseline['results'].items()
+                                           if any(pattern in name for pattern in args.k)})
+    rows = harness.compare(baseline, current, args.threshold)
+    print()
+    harness.print_comparison(rows)
+    regressions = [row['name'] for row in rows if row['status'] == 'regression']
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) past the threshold: {', '.join(regressions)}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# Detection Benchmarks - violation checks, YOLO post-processing and plate OCR batching
+import functools
+import itertools
+import os
+import types
+
+import numpy as np
+
+from benchmarks.harness import REPO, Skip, benchmark
+
+VIOLATION_VEHICLES = 10000
+PLATES = 16
+# Recorded detections: an .npz of per-frame (N, 6) arrays of x1, y1, x2, y2, conf, cls
+RECORDED_BOXES = os.environ.get("BENCH_YOLO_BOXES", os.path.join(REPO, "..", "data", "benchmarks", "yolo_boxes.npz"))
+COCO_VEHICLES = {2: 'car', 3: 'motorcycle', 5: 'bus', 7: 'truck'}
+
+
+@benchmark("violations.check[10k vehicles]", unit="10k vehicles")
+def violation_checks():
+    # Red-light and speeding checks over every signal and edge of a grid
+    # loaded with 10k vehicles on the TraCI stand-in
+    from max_pressure import grid_network
+    from sim_backend import create_backend
+    from violation_checker import ViolationChecker
+    sim = create_backend("queue", network=grid_network(24, 24), demand_rate=2000, route_length=(2, 4),
+                         end_time=float("inf"), seed=3)
+    sim.start()
+    for _ in range(200):
+        if len(sim.slots) >= VIOLATION_VEHICLES:
+            break
+        sim.simulationStep()
+    checker = ViolationChecker(backend=sim)
+    edges = sim.edge.getIDList()
+    signals = sim.trafficlight.getIDList()
+
+    def op():
+        for tl_id in signals:
+            checker.check_red_light_violation(tl_id)
+        for edge_id in edges:
+            checker.check_speeding_violation(edge_id)
+    return op, len(sim.slots) / VIOLATION_VEHICLES
+
+
+def recorded_boxes(frames=60, seed=0):
+    if os.path.exists(RECORDED_BOXES):
+        with np.load(RECORDED_BOXES) as data:
+            return [data[key].astype(np.float32) for key in sorted(data.files)]
+    # No recording: deterministic 720p street scenes with 20-60 boxes each,
+    # a mix of vehicle and non-vehicle classes and confidences
+    rng = np.random.default_rng(seed)
+    result = []
+    for _ in range(frames):
+        n = int(rng.integers(20, 61))
+        x1, y1 = rng.uniform(0, 1180, n), rng.uniform(0, 620, n)
+        w, h = rng.uniform(20, 300, n), rng.uniform(20, 200, n)
+        result.append(np.column_stack([x1, y1, np.minimum(x1 + w, 1280), np.minimum(y1 + h, 720),
+                                       rng.uniform(0.2, 0.95, n),
+                                       rng.choice([0, 1, 2, 2, 2, 3, 5, 7, 9], n)]).astype(np.float32))
+    return result
+
+
+@benchmark("detect.postprocess", unit="frame")
+def yolo_postprocess():
+    # Only the per-box filtering after the model runs; no weights are loaded
+    import torch
+    from ultralytics.engine.results import Results
+    from detect import VehicleDetector
+    names = {i: COCO_VEHICLES.get(i, f"class_{i}") for i in range(80)}
+    detector = VehicleDetector(model=types.SimpleNamespace(names=names))
+    image = np.zeros((720, 1280, 3), dtype=np.uint8)
+    frames = itertools.cycle([[Results(image, path="frame.jpg", names=names, boxes=torch.from_numpy(boxes))]
+                              for boxes in recorded_boxes()])
+    return lambda: detector.collect_detections(next(frames))
+
+
+@functools.lru_cache(maxsize=1)
+def ocr_reader():
+    import easyocr
+    try:
+        return easyocr.Reader(['en'], gpu=False, download_enabled=False, verbose=False)
+    except Exception as e:
+        raise Skip(f"EasyOCR models not available offline: {e}")
+
+
+def plate_crops(count=PLATES, seed=0):
+    import cv2
+    rng = np.random.default_rng(seed)
+    crops = []
+    for _ in range(count):
+        text = f"KA{rng.integers(1, 99):02d}AB{rng.integers(1000, 9999)}"
+        crop = np.full((64, 256, 3), 255, dtype=np.uint8)
+        cv2.putText(crop, text, (8, 44), cv2.FONT_HERSHEY_SIMPLEX, 1.1, (0, 0, 0), 2)
+        crops.append(crop)
+    return crops
+
+
+@benchmark(f"ocr.plates.sequential[{PLATES}]", unit="plate")
+def ocr_sequential():
+    reader, crops = ocr_reader(), plate_crops()
+
+    def op():
+        for crop in crops:
+            reader.readtext(crop)
+    return op, PLATES
+
+
+@benchmark(f"ocr.plates.batched[{PLATES}]", unit="plate")
+def ocr_batched():
+    reader, crops = ocr_reader(), plate_crops()
+    return (lambda: reader.readtext_batched(crops, n_width=256, n_height=64, batch_size=PLATES)), PLATES
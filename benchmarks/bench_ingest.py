@@ -0,0 +1,77 @@
+# Ingest Benchmarks - streaming SUMO summary and FCD output through the chunk builder
+import os
+
+from benchmarks.harness import REPO, benchmark, scratch_dir
+
+NET_FILE = os.path.join(REPO, "net.net.xml")
+HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n\n'
+          '<!-- generated by the ingest benchmark from the queue stand-in\n'
+          '<configuration>\n    <fcd-output value="fcd_output.xml"/>\n</configuration>\n-->\n\n')
+
+
+def write_outputs(directory, steps=600, demand_rate=2.0, seed=1):
+    # FCD and summary files in SUMO's layout, written from the stand-in
+    from sim_backend import create_backend
+    sim = create_backend("queue", net_file=NET_FILE, demand_rate=demand_rate, end_time=float("inf"), seed=seed)
+    sim.start()
+    v = sim.vehicle
+    with open(os.path.join(directory, "fcd_output.xml"), "w") as fcd, \
+            open(os.path.join(directory, "summary.xml"), "w") as summary:
+        fcd.write(HEADER + '<fcd-export xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n')
+        summary.write(HEADER + '<summary xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n')
+        for _ in range(steps):
+            sim.simulationStep()
+            t = sim.simulation.getTime()
+            ids = v.getIDList()
+            fcd.write(f'    <timestep time="{t:.2f}">\n')
+            halting = 0
+            speed_sum = 0.0
+            for vehicle_id in ids:
+                x, y = v.getPosition(vehicle_id)
+                speed = v.getSpeed(vehicle_id)
+                halting += speed < 0.1
+                speed_sum += speed
+                fcd.write(f'        <vehicle id="{vehicle_id}" x="{x:.2f}" y="{y:.2f}" angle="90.00" '
+                          f'type="{v.getTypeID(vehicle_id) or "DEFAULT_VEHTYPE"}" speed="{speed:.2f}" '
+                          f'pos="{v.getLanePosition(vehicle_id):.2f}" lane="{v.getLaneID(vehicle_id)}" '
+                          f'slope="0.00"/>\n')
+            fcd.write('    </timestep>\n')
+            summary.write(f'    <step time="{t:.2f}" loaded="{len(ids)}" inserted="{len(ids)}" '
+                          f'running="{len(ids)}" waiting="0" ended="0" arrived="0" collisions="0" '
+                          f'teleports="0" halting="{halting}" stopped="0" meanWaitingTime="0.00" '
+                          f'meanTravelTime="-1.00" meanSpeed="{speed_sum / max(1, len(ids)):.2f}" '
+                          f'meanSpeedRelative="0.50" duration="1000"/>\n')
+        fcd.write('</fcd-export>\n')
+        summary.write('</summary>\n')
+    sim.close()
+
+
+def ingest_op(directory, kind):
+    from rollups import RollupStore
+    from sumo_outputs import SumoOutputIngest
+    path = os.path.join(directory, "summary.xml" if kind == "summary" else "fcd_output.xml")
+    megabytes = os.path.getsize(path) / 1e6
+    chunk_dir = scratch_dir()
+
+    def op():
+        store = RollupStore(db_path=os.path.join(chunk_dir, "rollups.db"))
+        ingest = SumoOutputIngest(directory, net_file=NET_FILE, chunk_dir=chunk_dir, store=store)
+        stream = ingest.streams[kind]
+        while stream.poll():
+            pass
+        stream.flush_chunk()
+    return op, megabytes
+
+
+@benchmark("ingest.fcd", unit="MB")
+def fcd():
+    directory = scratch_dir()
+    write_outputs(directory)
+    return ingest_op(directory, "fcd")
+
+
+@benchmark("ingest.summary", unit="MB")
+def summary():
+    directory = scratch_dir()
+    write_outputs(directory, steps=3000, demand_rate=0.2)
+    return ingest_op(directory, "summary")
@@ -0,0 +1,47 @@
+# Model Serving Benchmarks - single vs batched prediction and micro-batching overhead
+import datetime
+import functools
+
+from benchmarks.harness import benchmark
+
+BATCH = 64
+
+
+@functools.lru_cache(maxsize=1)
+def fitted_predictor():
+    from predictor import TrafficPredictor
+    predictor = TrafficPredictor()
+    predictor.xgb_model = predictor.train_xgb_model()
+    return predictor
+
+
+def request_times(count):
+    start = datetime.datetime(2026, 3, 2, 6, 0)
+    return [start + datetime.timedelta(hours=i % 24) for i in range(count)]
+
+
+@benchmark("model.predict.single", unit="prediction")
+def predict_single():
+    predictor = fitted_predictor()
+    when = request_times(1)[0]
+    return lambda: predictor.predict_traffic_density("J0", when)
+
+
+@benchmark(f"model.predict.batch[{BATCH}]", unit="prediction")
+def predict_batch():
+    predictor = fitted_predictor()
+    junction_ids = [f"J{i % 10}" for i in range(BATCH)]
+    times = request_times(BATCH)
+    return (lambda: predictor.predict_batch(junction_ids, times)), BATCH
+
+
+@benchmark(f"model.batcher[{BATCH} concurrent]", unit="request")
+def batcher_overhead():
+    # Queueing, batching and future hand-off with a model that does nothing
+    from model_server import MicroBatcher
+    batcher = MicroBatcher(lambda items: items, max_batch=BATCH, max_wait_ms=1)
+    items = list(range(BATCH))
+
+    async def op():
+        await batcher.submit_many(items)
+    return op, BATCH
@@ -0,0 +1,40 @@
+# Replay Benchmarks - snapshot capture on the stand-in and snapshot loading on replay
+import os
+
+from benchmarks.harness import REPO, benchmark, scratch_dir
+
+NET_FILE = os.path.join(REPO, "net.net.xml")
+
+
+def loaded_recorder(steps=400):
+    # Stand-in filled to about a thousand vehicles, recorder opened on it
+    from replay import RecordingBackend
+    from sim_backend import create_backend
+    sim = create_backend("queue", net_file=NET_FILE, demand_rate=2.0, end_time=float("inf"), seed=1)
+    path = os.path.join(scratch_dir(), "bench.rec")
+    recorder = RecordingBackend(sim, path, net_file=NET_FILE)
+    recorder.start()
+    for _ in range(steps):
+        recorder.simulationStep()
+    return recorder, sim
+
+
+@benchmark("replay.capture[queue]", unit="vehicle")
+def capture():
+    recorder, sim = loaded_recorder()
+    return recorder.capture, len(sim.slots)
+
+
+@benchmark("replay.load_step", unit="step")
+def load_step():
+    from replay import ReplayBackend
+    recorder, _ = loaded_recorder()
+    recorder.flush()
+    recorder.writer.close()
+    sim = ReplayBackend(recorder.path, speed=0)
+
+    def op():
+        sim.simulationStep()
+        if sim.finished:
+            sim.start()
+    return op
@@ -0,0 +1,35 @@
+# Route Query Benchmarks - edge and junction shortest paths on a signalised grid
+import numpy as np
+
+from benchmarks.harness import benchmark
+
+QUERIES = 32
+
+
+def grid_pairs(kind):
+    from max_pressure import grid_network
+    network = grid_network(16, 16)
+    rng = np.random.default_rng(0)
+    ids = sorted(network.edges if kind == "edges" else network.junctions)
+    pairs = [tuple(rng.choice(ids, 2, replace=False)) for _ in range(QUERIES)]
+    return network, pairs
+
+
+@benchmark("routes.shortest_path[grid 16x16]", unit="query")
+def shortest_path():
+    network, pairs = grid_pairs("edges")
+
+    def op():
+        for a, b in pairs:
+            network.shortest_path(a, b)
+    return op, QUERIES
+
+
+@benchmark("routes.junction_path[grid 16x16]", unit="query")
+def junction_path():
+    network, pairs = grid_pairs("junctions")
+
+    def op():
+        for a, b in pairs:
+            network.junction_path(a, b)
+    return op, QUERIES
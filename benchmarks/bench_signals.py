@@ -0,0 +1,57 @@
+# Signal Control Benchmarks - controller steps on the stand-in, Webster and max-pressure timing
+import itertools
+import os
+
+import numpy as np
+
+from benchmarks.harness import REPO, benchmark
+
+NET_FILE = os.path.join(REPO, "net.net.xml")
+
+
+def headless_controller(mode):
+    from controller import TrafficController
+    from sim_backend import create_backend
+    # Demand never stops, so later repeats don't time a draining network
+    sim = create_backend("queue", net_file=NET_FILE, demand_rate=0.5, end_time=float("inf"), seed=1)
+    controller = TrafficController("", step_delay=0, backend=sim, mode=mode, net_file=NET_FILE,
+                                   log_path=os.devnull)
+    controller.logger.disabled = True
+    controller.sim.start()
+    for _ in range(200):
+        controller.step()
+    return controller
+
+
+@benchmark("controller.step.threshold", unit="step")
+def controller_step_threshold():
+    return headless_controller("threshold").step
+
+
+@benchmark("controller.step.max_pressure", unit="step")
+def controller_step_max_pressure():
+    return headless_controller("max_pressure").step
+
+
+@benchmark("signals.webster_cycle[1000]", unit="junction")
+def webster_cycle():
+    from heuristic import HeuristicController
+    heuristic = HeuristicController()
+    rng = np.random.default_rng(0)
+    junctions = [{'approaches': {f"a{k}": {'flow': float(flow), 'saturation_flow': 1800}
+                                 for k, flow in enumerate(rng.integers(50, 500, 4))}}
+                 for _ in range(1000)]
+
+    def op():
+        for data in junctions:
+            heuristic.calculate_optimal_cycle_time(data)
+    return op, len(junctions)
+
+
+@benchmark("signals.max_pressure_decide[32x32]", unit="junction")
+def max_pressure_decide():
+    from max_pressure import MaxPressureController, grid_network
+    controller = MaxPressureController(grid_network(32, 32), sim=None)
+    rng = np.random.default_rng(0)
+    queues = itertools.cycle([rng.poisson(4, len(controller.lane_ids)).astype(float) for _ in range(16)])
+    return (lambda: controller.decide(next(queues), 1.0)), len(controller.tl_ids)
@@ -0,0 +1,113 @@
+# Telemetry Benchmarks - delta encoding, frame serialization, log lines and fan-out
+import itertools
+import json
+import os
+
+import numpy as np
+
+from benchmarks.harness import benchmark, scratch_dir
+
+VEHICLES = 500
+JUNCTIONS = 10
+SUBSCRIBERS = 1000
+
+
+def snapshots(count=32, vehicles=VEHICLES, seed=0):
+    # Controller-shaped snapshots of vehicles driving on and junction
+    # figures drifting, one per tick
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 1000, (vehicles, 2))
+    heading = rng.uniform(0, 2 * np.pi, vehicles)
+    speed = rng.uniform(0, 50, vehicles)
+    frames = []
+    for tick in range(count):
+        xy = xy + np.column_stack([np.cos(heading), np.sin(heading)]) * speed[:, None] / 3.6
+        junctions = {f"J{j}": {'vehicles_count': int(rng.integers(0, 40)), 'avg_speed': float(rng.uniform(10, 50)),
+                               'queue_length': int(rng.integers(0, 20)), 'waiting_time': float(rng.uniform(0, 60)),
+                               'efficiency': float(rng.uniform(0.5, 1))}
+                     for j in range(JUNCTIONS)}
+        vehicle_list = [{'id': f"veh_{i}", 'position': {'x': float(x), 'y': float(y)}, 'speed': float(s),
+                         'type': 'car'} for i, ((x, y), s) in enumerate(zip(xy, speed))]
+        frames.append((junctions, vehicle_list))
+    return frames
+
+
+@benchmark("telemetry.delta_encode[500 vehicles]", unit="vehicle")
+def delta_encode():
+    from stream import DeltaEncoder
+    encoder = DeltaEncoder()
+    ticks = itertools.cycle(snapshots())
+    return (lambda: encoder.encode(*next(ticks))), VEHICLES
+
+
+def full_frame():
+    from stream import DeltaEncoder
+    encoder = DeltaEncoder()
+    return encoder.encode(*snapshots(count=1)[0])
+
+
+@benchmark("telemetry.serialize.json[500 vehicles]", unit="frame")
+def serialize_json():
+    from stream import serialize_frame
+    frame = full_frame()
+    return lambda: serialize_frame(frame, "json")
+
+
+@benchmark("telemetry.serialize.msgpack[500 vehicles]", unit="frame")
+def serialize_msgpack():
+    from stream import msgpack, serialize_frame
+    if msgpack is None:
+        raise ImportError("msgpack not installed")
+    frame = full_frame()
+    return lambda: serialize_frame(frame, "msgpack")
+
+
+@benchmark("telemetry.log_line", unit="line")
+def log_line():
+    # The controller's per-step log append: open, one JSON line, close
+    junctions = {f"J{j}": {'vehicles': 12, 'waiting_time': 8.5, 'timestamp': "2026-01-01T08:00:00"}
+                 for j in range(JUNCTIONS)}
+    path = os.path.join(scratch_dir(), "traffic_data.json")
+    counter = itertools.count()
+
+    def op():
+        with open(path, "w" if next(counter) % 10000 == 0 else "a") as f:
+            f.write(json.dumps(junctions) + "\n")
+    return op
+
+
+@benchmark(f"telemetry.fanout.stream[{SUBSCRIBERS}]", unit="subscriber")
+def fanout_stream():
+    # One frame pushed to every subscriber queue, then drained as clients would
+    from stream import TelemetryStream, Subscription
+    ticks = itertools.cycle(snapshots(vehicles=100))
+    telemetry_stream = TelemetryStream(source=lambda: next(ticks))
+    subscriptions = [Subscription(32) for _ in range(SUBSCRIBERS)]
+    telemetry_stream.subscribers.update(subscriptions)
+
+    def op():
+        telemetry_stream.publish(*next(ticks))
+        for subscription in subscriptions:
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+    return op, SUBSCRIBERS
+
+
+class CountingSocket:
+    # Accepts every message like a fast client
+    def __init__(self):
+        self.sent = 0
+
+    async def send_text(self, payload):
+        self.sent += 1
+
+
+@benchmark(f"telemetry.fanout.websocket[{SUBSCRIBERS}]", unit="connection")
+def fanout_websocket():
+    import app
+    app.active_connections[:] = [CountingSocket() for _ in range(SUBSCRIBERS)]
+    message = {'type': 'sos_alert', 'data': {'id': 'SOS_1', 'priority': 10, 'location': {'lat': 12.97, 'lon': 77.59}}}
+
+    async def op():
+        await app.send_to_local_connections(message)
+    return op, SUBSCRIBERS
@@ -0,0 +1,25 @@
+# Trajectory Benchmarks - batch speeding and red-light detection over a recorded run
+import os
+
+from benchmarks.harness import REPO, benchmark, scratch_dir
+
+NET_FILE = os.path.join(REPO, "net.net.xml")
+
+
+@benchmark("trajectories.detect", unit="row")
+def detect():
+    # Max-pressure recording so signals actually change; a negative tolerance
+    # makes every free-flowing vehicle a speeding candidate
+    from replay import record_headless
+    from trajectory_violations import detect_all, recording_source
+    path = os.path.join(scratch_dir(), "bench.rec")
+    record_headless(path, NET_FILE, steps=900, mode="max_pressure", demand_rate=1.0)
+    engine, batches = recording_source(path, tolerance=-25.0)
+    batches = list(batches)
+    rows = sum(len(batch[0]) for batch in batches)
+
+    def op():
+        engine.carry = None
+        for _ in detect_all(engine, batches):
+            pass
+    return op, rows
@@ -0,0 +1,264 @@
+# Benchmark Harness - registry, calibrated timing, JSON results and baseline comparison
+import asyncio
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.environ.get("BENCH_RESULTS", os.path.join(REPO, "..", "data", "benchmarks"))
+DEFAULT_THRESHOLD = 0.10   # fractional slowdown that counts as a regression
+FORMAT_VERSION = 1
+
+BENCHMARKS = {}
+_scratch = []   # temporary directories handed out to the benchmark being run
+
+
+class Skip(Exception):
+    # Raised by a setup whose optional dependency or model is unavailable
+    pass
+
+
+class Benchmark:
+    def __init__(self, name, setup, unit, group, threshold):
+        self.name = name
+        self.setup = setup
+        self.unit = unit
+        self.group = group
+        self.threshold = threshold
+
+
+def benchmark(name, unit="op", threshold=None):
+    # Registers a setup function returning the operation to time, either a
+    # callable or (callable, items) where items is how many `unit`s one call
+    # handles. Coroutine functions are timed inside an event loop.
+    def register(setup):
+        group = setup.__module__.rsplit(".", 1)[-1].replace("bench_", "")
+        BENCHMARKS[name] = Benchmark(name, setup, unit, group, threshold)
+        return setup
+    return register
+
+
+def scratch_dir():
+    # Temporary directory for files a setup writes (logs, recordings,
+    # chunks); run_one removes it once the benchmark is done
+    path = tempfile.mkdtemp(prefix="bench_")
+    _scratch.append(path)
+    return path
+
+
+def calibrate(call, min_time):
+    # Smallest power-of-two loop count that runs for at least min_time
+    number = 1
+    while True:
+        elapsed = call(number)
+        if elapsed >= min_time or number >= 1 << 24:
+            return number
+        number *= 2 if elapsed <= 0 else max(2, min(16, int(min_time / elapsed) + 1))
+
+
+def time_sync(op, number):
+    started = time.perf_counter()
+    for _ in range(number):
+        op()
+    return time.perf_counter() - started
+
+
+async def time_async(op, number):
+    started = time.perf_counter()
+    for _ in range(number):
+        await op()
+    return time.perf_counter() - started
+
+
+def measure(op, repeats, min_time):
+    # Seconds per call for each repeat; GC is paused as timeit does
+    if asyncio.iscoroutinefunction(op):
+        loop = asyncio.new_event_loop()
+        call = lambda number: loop.run_until_complete(time_async(op, number))
+    else:
+        loop = None
+        call = lambda number: time_sync(op, number)
+    try:
+        call(1)  # warm-up
+        number = calibrate(call, min_time)
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            samples = [call(number) / number for _ in range(repeats)]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+    finally:
+        if loop is not None:
+            # Background tasks a benchmark started (e.g. a batch collector)
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.wait(pending))
+            loop.close()
+    return samples, number
+
+
+def run_one(bench, repeats=5, min_time=0.2):
+    try:
+        prepared = bench.setup()
+        op, items = prepared if isinstance(prepared, tuple) else (prepared, 1)
+        samples, number = measure(op, repeats, min_time)
+    finally:
+        while _scratch:
+            shutil.rmtree(_scratch.pop(), ignore_errors=True)
+    median = statistics.median(samples)
+    result = {
+        'group': bench.group,
+        'unit': bench.unit,
+        'items': items,
+        'median_s': median,
+        'min_s': min(samples),
+        'max_s': max(samples),
+        'stdev_s': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'per_unit_us': median / items * 1e6,
+        'units_per_s': items / median if median > 0 else None,
+        'repeats': repeats,
+        'number': number
+    }
+    if bench.threshold is not None:
+        result['threshold'] = bench.threshold
+    return result
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def machine_info():
+    info = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor() or None,
+        'cpu_count': os.cpu_count(),
+        'node': platform.node(),
+        'commit': git_commit()
+    }
+    try:
+        import numpy
+        info['numpy'] = numpy.__version__
+    except ImportError:
+        pass
+    return info
+
+
+def load_modules():
+    # Every bench_*.py next to this file registers its benchmarks on import
+    import importlib
+    here = os.path.dirname(os.path.abspath(__file__))
+    for filename in sorted(os.listdir(here)):
+        if filename.startswith("bench_") and filename.endswith(".py"):
+            importlib.import_module(f"benchmarks.{filename[:-3]}")
+
+
+def run(patterns=(), repeats=5, min_time=0.2, out=sys.stdout):
+    load_modules()
+    results, skipped = {}, {}
+    for name, bench in BENCHMARKS.items():
+        if patterns and not any(pattern in name for pattern in patterns):
+            continue
+        try:
+            result = run_one(bench, repeats, min_time)
+        except (Skip, ImportError) as e:
+            skipped[name] = str(e)
+            print(f"{name:<44} skipped: {e}", file=out)
+            continue
+        results[name] = result
+        print(f"{name:<44} {format_time(result['median_s']):>10}/call  "
+              f"{result['per_unit_us']:>11.2f} us/{bench.unit}  "
+              f"±{result['stdev_s'] / result['median_s'] * 100:.1f}%", file=out)
+    return {
+        'version': FORMAT_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'config': {'repeats': repeats, 'min_time': min_time},
+        'results': results,
+        'skipped': skipped
+    }
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds * 1e9:.0f}ns"
+
+
+def save(report, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    if report.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported results format {report.get('version')}")
+    return report
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    # One row per benchmark in both reports. A regression is a slowdown past
+    # the threshold (per-benchmark thresholds override it) that is also
+    # larger than both runs' own spread, so noisy benches don't flap.
+    rows = []
+    for name, new in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            rows.append({'name': name, 'status': 'new', 'current_s': new['median_s']})
+            continue
+        ratio = new['median_s'] / old['median_s']
+        limit = new.get('threshold', old.get('threshold', threshold))
+        noise = max(old['stdev_s'] / old['median_s'], new['stdev_s'] / new['median_s'])
+        if ratio > 1 + max(limit, 2 * noise):
+            status = 'regression'
+        elif ratio < 1 - max(limit, 2 * noise):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append({'name': name, 'status': status, 'baseline_s': old['median_s'],
+                     'current_s': new['median_s'], 'ratio': ratio, 'threshold': limit})
+    for name in baseline['results']:
+        if name not in current['results']:
+            reason = current.get('skipped', {}).get(name, 'not run')
+            rows.append({'name': name, 'status': 'missing', 'reason': reason})
+    return rows
+
+
+def machine_mismatch(baseline, current):
+    keys = ('python', 'implementation', 'machine', 'processor', 'cpu_count', 'node')
+    return [key for key in keys if baseline['machine'].get(key) != current['machine'].get(key)]
+
+
+def print_comparison(rows, out=sys.stdout):
+    for row in rows:
+        if 'ratio' in row:
+            change = (row['ratio'] - 1) * 100
+            print(f"{row['name']:<44} {format_time(row['baseline_s']):>10} -> {format_time(row['current_s']):>10}  "
+                  f"{change:+7.1f}%  {row['status'].upper() if row['status'] != 'ok' else 'ok'}", file=out)
+        elif row['status'] == 'new':
+            print(f"{row['name']:<44} {'':>10}    {format_time(row['current_s']):>10}  new", file=out)
+        else:
+            print(f"{row['name']:<44} missing ({row['reason']})", file=out)
@@ -0,0 +1,230 @@
+# Response Cache with strong ETags for read-heavy dashboard endpoints
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from collections import OrderedDict
+import gzip
+import hashlib
+import threading
+import time
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:
+    orjson = None
+    FastJSONResponse = JSONResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+router = APIRouter(prefix="/api/admin/cache", tags=["admin"])
+
+# (seconds a GET route may be served from cache, data source it depends on);
+# bumping a source's version invalidates only the routes reading it
+DEFAULT_ROUTES = {
+    "/api/analytics/traffic/hourly": (60, "analytics"),
+    "/api/analytics/violations/trends": (300, "analytics"),
+    "/api/analytics/junctions/efficiency": (10, "telemetry"),
+    "/api/analytics/performance/comparison": (300, "analytics"),
+    "/api/analytics/ai/model-performance": (300, "analytics"),
+    "/api/telemetry/performance": (5, "telemetry"),
+    "/api/violations/analytics/summary": (10, "violations")
+}
+
+MIN_COMPRESS_BYTES = 1024
+
+
+class CacheEntry:
+    def __init__(self, body, content_type, ttl):
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.expires_at = time.monotonic() + ttl
+        self.encoded = {}
+
+    def encode(self, encoding):
+        # Compressed variants are built once per entry
+        if encoding not in self.encoded:
+            if encoding == "br":
+                self.encoded[encoding] = brotli.compress(self.body, quality=5)
+            else:
+                self.encoded[encoding] = gzip.compress(self.body, compresslevel=6)
+        return self.encoded[encoding]
+
+
+class ResponseCache:
+    def __init__(self, routes=None, max_entries=512):
+        self.routes = dict(routes or DEFAULT_ROUTES)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.data_versions = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0, 'invalidations': 0}
+
+    def route_for(self, path):
+        return self.routes.get(path.rstrip("/") or "/")
+
+    def bump_data_version(self, source):
+        # Keys embed the source version, so stale entries simply stop matching
+        with self._lock:
+            self.data_versions[source] = self.data_versions.get(source, 0) + 1
+            self.stats['invalidations'] += 1
+
+    def make_key(self, path, query_string, source):
+        params = "&".join(sorted(query_string.decode("latin-1").split("&"))) if query_string else ""
+        return (path, params, source, self.data_versions.get(source, 0))
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.expires_at < time.monotonic():
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+
+    def store(self, key, body, content_type, ttl):
+        entry = CacheEntry(body, content_type, ttl)
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def describe(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'entries': len(self.entries),
+            'data_versions': dict(self.data_versions),
+            'hit_rate': round(self.stats['hits'] / lookups, 3) if lookups else None,
+            'routes': {path: {'ttl': ttl, 'source': source} for path, (ttl, source) in self.routes.items()},
+            'json_encoder': 'orjson' if orjson is not None else 'json',
+            'brotli_available': brotli is not None
+        }
+
+
+def encoded_etag(etag, encoding):
+    # Strong validators must differ per content-coding, so each compressed
+    # body gets its own tag derived from the identity one
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def etag_matches(if_none_match, etag):
+    # Any coding of the same entry is still current; returns the tag that
+    # matched so the 304 names the representation the client already holds
+    variants = {etag, encoded_etag(etag, "gzip"), encoded_etag(etag, "br")}
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate in variants:
+            return candidate
+    return None
+
+
+def choose_encoding(accept_encoding):
+    accepted = [part.split(";")[0].strip() for part in accept_encoding.split(",")]
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class ResponseCacheMiddleware:
+    # Plain ASGI middleware so cached bodies are sent without re-running the
+    # endpoint or re-serializing
+    def __init__(self, app, cache):
+        self.app = app
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        route = self.cache.route_for(scope["path"])
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        ttl, source = route
+        request_headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        key = self.cache.make_key(scope["path"], scope.get("query_string", b""), source)
+        entry = self.cache.lookup(key)
+
+        if entry is None:
+            status, headers, body = await self.capture(scope, receive)
+            content_type = dict(headers).get(b"content-type", b"")
+            if status != 200 or not content_type.startswith(b"application/json"):
+                await send({"type": "http.response.start", "status": status, "headers": headers})
+                await send({"type": "http.response.body", "body": body})
+                return
+            entry = self.cache.store(key, body, content_type, ttl)
+
+        await self.send_entry(entry, request_headers, scope["method"], send)
+
+    async def capture(self, scope, receive):
+        response = {"status": 500, "headers": [], "body": []}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+
+        await self.app(scope, receive, capture_send)
+        return response["status"], response["headers"], b"".join(response["body"])
+
+    async def send_entry(self, entry, request_headers, method, send):
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""))
+        if len(entry.body) < MIN_COMPRESS_BYTES:
+            encoding = None
+        headers = [
+            (b"etag", encoded_etag(entry.etag, encoding).encode()),
+            (b"cache-control", b"no-cache"),
+            (b"vary", b"Accept-Encoding")
+        ]
+
+        if_none_match = request_headers.get("if-none-match")
+        matched = etag_matches(if_none_match, entry.etag) if if_none_match else None
+        if matched:
+            self.cache.stats['not_modified'] += 1
+            if matched != "*":
+                headers[0] = (b"etag", matched.encode())
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        body = entry.body
+        if encoding:
+            body = entry.encode(encoding)
+            headers.append((b"content-encoding", encoding.encode()))
+
+        headers.append((b"content-type", entry.content_type))
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body if method == "GET" else b""})
+
+
+response_cache = ResponseCache()
+
+
+@router.get("/stats")
+async def get_cache_stats():
+    return response_cache.describe()
+
+
+@router.post("/clear")
+async def clear_cache():
+    response_cache.clear()
+    return {"message": "Response cache cleared"}
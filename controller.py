@@ -1,13 +1,99 @@
 # TraCI Controller for SUMO Traffic Management
-import traci
 import time
 import json
 import logging
+import os
+import threading
+import urllib.error
+import urllib.request
 from datetime import datetime
 
+from emergency_tracker import EmergencyTracker
+from green_wave import GreenWaveOptimizer
+from max_pressure import MaxPressureController
+from network import RoadNetwork
+from plan_scheduler import PlanScheduler
+import profiler
+from sim_backend import TimedBackend, create_backend
+import system_metrics
+import tracing
+
+class TelemetryPublisher:
+    # Posts the latest step's snapshot to the API's telemetry stream from a
+    # background thread. Only the newest snapshot is kept, so a slow or
+    # absent API drops frames instead of slowing the control loop.
+    def __init__(self, api_url, timeout=2.0):
+        self.url = api_url.rstrip("/") + "/api/telemetry/stream/publish"
+        self.timeout = timeout
+        self.pending = None
+        self.posted = 0
+        self.errors = 0
+        self._ready = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="telemetry-publisher", daemon=True)
+        self._thread.start()
+
+    def submit(self, snapshot):
+        with self._ready:
+            self.pending = snapshot
+            self._ready.notify()
+
+    def _run(self):
+        while True:
+            with self._ready:
+                while self.pending is None:
+                    self._ready.wait()
+                snapshot, self.pending = self.pending, None
+            request = urllib.request.Request(self.url, data=json.dumps(snapshot).encode(), method="POST",
+                                             headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    response.read()
+                self.posted += 1
+            except (urllib.error.URLError, OSError) as e:
+                if not self.errors:
+                    print(f"Error publishing telemetry to {self.url}: {e}")
+                self.errors += 1
+
+
 class TrafficController:
-    def __init__(self, sumo_config):
+    def __init__(self, sumo_config, sumo_binary="sumo-gui", step_delay=0.1,
+                 log_path="../data/logs/traffic_data.json", sumo_args=None, backend=None,
+                 mode="threshold", net_file="../sumo/net.net.xml", policy_path="../models/signal_policy.npz",
+                 emergency_tracking=True, api_url=None, sos_handler=None):
         self.sumo_config = sumo_config
+        # Any TraCI-compatible backend; the queue stand-in runs without SUMO.
+        # Calls go through TimedBackend so TraCI latency shows up in the metrics
+        self.sim = TimedBackend(backend or create_backend("sumo"))
+        # Headless runs use sumo_binary="sumo" and step_delay=0
+        self.sumo_binary = sumo_binary
+        self.step_delay = step_delay
+        self.log_path = log_path
+        self.sumo_args = sumo_args or []
+        # "threshold" sets per-junction green times, "max_pressure" runs the
+        # network-wide max-pressure policy, "green_wave" installs coordinated
+        # fixed-time plans once, "rl" runs a policy exported by rl.py,
+        # "schedule" follows the time-of-day plans in signal_plans.json
+        self.mode = mode
+        self.net_file = net_file
+        self.policy_path = policy_path
+        self.max_pressure = None
+        self.rl_controller = None
+        self.plan_scheduler = None
+        self.green_wave_plan = None
+        # Modes whose setup failed once; they leave the static programs running
+        # instead of retrying (and logging) on every control step
+        self.failed_modes = set()
+        # Emergency vehicles pre-empt signals on top of whichever mode runs
+        self.emergency_tracker = EmergencyTracker(self.sim) if emergency_tracking else None
+        if self.emergency_tracker is not None:
+            self.emergency_tracker.release_hooks.append(self.reassert_signal)
+        # An SOSHandler on the same simulation gets its corridors switched
+        # in as their reservation windows open
+        self.sos_handler = sos_handler
+        if sos_handler is not None:
+            sos_handler.release_hooks.append(self.reassert_signal)
+        # With an API URL every step's snapshot feeds the live telemetry stream
+        self.publisher = TelemetryPublisher(api_url) if api_url else None
         self.junctions = ["J0", "J1", "J2", "J3", "J4", "J5", "J6", "J7", "J8", "J9"]
         self.setup_logging()
 
@@ -15,23 +101,23 @@ class TrafficController:
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
         self.logger = logging.getLogger(__name__)
 
-    def start_simulation(self):
+    def start_simulation(self, port=None, label="default"):
         try:
-            sumo_binary = "sumo-gui"
-            sumo_cmd = [sumo_binary, "-c", self.sumo_config]
-            traci.start(sumo_cmd)
+            sumo_cmd = [self.sumo_binary, "-c", self.sumo_config] + self.sumo_args
+            self.sim.start(sumo_cmd, port=port, label=label)
             self.logger.info("SUMO simulation started successfully")
             return True
         except Exception as e:
             self.logger.error(f"Failed to start SUMO: {e}")
             return False
 
+    @tracing.traced("controller.snapshot")
     def get_traffic_data(self):
         traffic_data = {}
         try:
             for junction in self.junctions:
-                vehicles = traci.junction.getLastStepVehicleNumber(junction)
-                waiting_time = traci.junction.getLastStepMeanWaitingTime(junction)
+                vehicles = self.sim.junction.getLastStepVehicleNumber(junction)
+                waiting_time = self.sim.junction.getLastStepMeanWaitingTime(junction)
 
                 traffic_data[junction] = {
                     'vehicles': vehicles,
@@ -45,7 +131,7 @@ class TrafficController:
 
     def adaptive_signal_control(self, junction_id):
         try:
-            vehicle_count = traci.junction.getLastStepVehicleNumber(junction_id)
+            vehicle_count = self.sim.junction.getLastStepVehicleNumber(junction_id)
 
             if vehicle_count > 15:  # Heavy traffic
                 green_duration = 60
@@ -54,37 +140,217 @@ class TrafficController:
             else:  # Light traffic
                 green_duration = 25
 
-            traci.trafficlight.setPhaseDuration(junction_id, green_duration)
+            self.sim.trafficlight.setPhaseDuration(junction_id, green_duration)
             self.logger.info(f"Adaptive signal: {junction_id} set to {green_duration}s")
 
         except Exception as e:
             self.logger.error(f"Error in adaptive control: {e}")
 
+    def load_network(self):
+        # The queue backend already holds the parsed network
+        return getattr(self.sim, 'network', None) or RoadNetwork.from_file(self.net_file)
+
+    def apply_green_wave(self, corridors=None):
+        try:
+            optimizer = GreenWaveOptimizer(self.load_network())
+            plan = optimizer.optimize(corridors)
+            if plan is None:
+                self.logger.warning("Green wave: no signalised corridors found")
+                return None
+            optimizer.apply(self.sim, plan)
+            self.green_wave_plan = plan
+            bands = ", ".join(f"{c['name']} {c['outbound_bandwidth']:.0f}/{c['inbound_bandwidth']:.0f}s"
+                              for c in plan['corridors'])
+            self.logger.info(f"Green wave: cycle {plan['cycle']}s, bands {bands}")
+            return plan
+        except Exception as e:
+            self.logger.error(f"Error applying green wave: {e}")
+            return None
+
+    def green_wave_step(self):
+        # Installed once; if that fails the static programs keep running
+        if self.green_wave_plan is None and "green_wave" not in self.failed_modes:
+            if self.apply_green_wave() is None:
+                self.failed_modes.add("green_wave")
+                self.logger.warning("Green wave not applied, keeping the static programs")
+
+    def max_pressure_step(self):
+        if "max_pressure" in self.failed_modes:
+            return
+        if self.max_pressure is None:
+            try:
+                network = self.load_network()
+                self.max_pressure = MaxPressureController(network, self.sim)
+                self.logger.info(f"Max-pressure control over {len(self.max_pressure.tl_ids)} junctions")
+            except Exception as e:
+                self.failed_modes.add("max_pressure")
+                self.logger.error(f"Max-pressure setup failed, keeping the static programs: {e}")
+                return
+        try:
+            self.max_pressure.step()
+        except Exception as e:
+            self.logger.error(f"Error in max-pressure control: {e}")
+
+    def rl_step(self):
+        if "rl" in self.failed_modes:
+            return
+        if self.rl_controller is None:
+            try:
+                # numpy-only inference; torch/tensorflow are never imported
+                from rl import QPolicy, RLSignalController
+                policy = QPolicy.load(self.policy_path)
+                self.rl_controller = RLSignalController(self.load_network(), self.sim, policy)
+                self.logger.info(f"RL policy {self.policy_path} controlling "
+                                 f"{len(self.rl_controller.control.tl_ids)} junctions")
+            except Exception as e:
+                self.failed_modes.add("rl")
+                self.logger.error(f"RL setup failed, keeping the static programs: {e}")
+                return
+        try:
+            self.rl_controller.step()
+        except Exception as e:
+            self.logger.error(f"Error in RL control: {e}")
+
+    def schedule_step(self):
+        if "schedule" in self.failed_modes:
+            return
+        if self.plan_scheduler is None:
+            try:
+                self.plan_scheduler = PlanScheduler.from_file(network=self.load_network())
+                # Simulation seconds are mapped onto the wall clock at start
+                self.schedule_epoch = time.time() - self.sim.simulation.getTime()
+                self.plan_scheduler.start(self.sim, self.schedule_epoch + self.sim.simulation.getTime())
+                self.logger.info(f"Signal plans: {self.plan_scheduler.active_plans()}")
+            except Exception as e:
+                self.plan_scheduler = None
+                self.failed_modes.add("schedule")
+                self.logger.error(f"Plan scheduling setup failed, keeping the static programs: {e}")
+            return
+        try:
+            now = self.schedule_epoch + self.sim.simulation.getTime()
+            if self.plan_scheduler.tick(self.sim, now):
+                self.logger.info(f"Signal plans: {self.plan_scheduler.active_plans()}")
+        except Exception as e:
+            self.logger.error(f"Error in plan scheduling: {e}")
+
+    def reassert_signal(self, tl_id):
+        # A released junction goes back to what max-pressure / RL wants now;
+        # program-based modes were restored by the tracker itself
+        try:
+            if self.max_pressure is not None:
+                self.max_pressure.reassert(tl_id)
+            if self.rl_controller is not None:
+                self.rl_controller.control.reassert(tl_id)
+        except Exception as e:
+            self.logger.error(f"Error handing {tl_id} back after pre-emption: {e}")
+
+    @tracing.traced("controller.control")
+    def control_step(self):
+        if self.mode == "max_pressure":
+            self.max_pressure_step()
+            return
+        if self.mode == "rl":
+            self.rl_step()
+            return
+        if self.mode == "schedule":
+            self.schedule_step()
+            return
+        if self.mode == "green_wave":
+            self.green_wave_step()
+            return
+
+        # Apply adaptive control to all junctions
+        for junction in self.junctions:
+            self.adaptive_signal_control(junction)
+
+    def step(self):
+        # One control cycle; the trace starts from the state this step reads
+        # (stages are traced by decorators, which vanish with tracing off)
+        started = time.perf_counter()
+        with tracing.span("controller.step"):
+            self.control_step()
+            if self.emergency_tracker is not None:
+                self.emergency_tracker.step()
+            if self.sos_handler is not None:
+                self.sos_handler.step()
+            tracing.finish("snapshot_to_signal")
+
+            # Get current traffic data
+            traffic_data = self.get_traffic_data()
+            if self.publisher is not None:
+                self.publisher.submit(self.telemetry_snapshot(traffic_data))
+
+            self.sim.simulationStep()
+        system_metrics.metrics.record("controller.step", (time.perf_counter() - started) * 1000)
+        return traffic_data
+
+    def telemetry_snapshot(self, traffic_data):
+        # Same shape the stream's /publish endpoint and replay.py --to api send
+        junctions = {junction: {'vehicles_count': data['vehicles'],
+                                'waiting_time': round(data['waiting_time'], 2)}
+                     for junction, data in traffic_data.items()}
+        vehicles = []
+        try:
+            v = self.sim.vehicle
+            for vehicle_id in v.getIDList():
+                x, y = v.getPosition(vehicle_id)
+                vehicles.append({'id': vehicle_id, 'position': {'x': round(x, 1), 'y': round(y, 1)},
+                                 'speed': round(v.getSpeed(vehicle_id) * 3.6, 1),
+                                 'type': v.getTypeID(vehicle_id) or 'car'})
+        except Exception as e:
+            self.logger.error(f"Error reading vehicles for telemetry: {e}")
+        return {'junctions': junctions, 'vehicles': vehicles}
+
     def run_controller(self):
         if not self.start_simulation():
             return
 
+        # Steps/sec, TraCI latency and CPU/RSS for the API's health endpoint
+        system_metrics.metrics.start_sampler(export_path=system_metrics.CONTROLLER_METRICS)
+        # kill -USR1 <pid>: sampling flame graph; kill -USR2: cProfile of each step
+        profiler.install_signal_handlers("controller.step")
         try:
-            while traci.simulation.getMinExpectedNumber() > 0:
-                # Apply adaptive control to all junctions
-                for junction in self.junctions:
-                    self.adaptive_signal_control(junction)
-
-                # Get current traffic data
-                traffic_data = self.get_traffic_data()
+            while self.sim.simulation.getMinExpectedNumber() > 0:
+                traffic_data = self.step()
 
                 # Save to data logs
-                with open("../data/logs/traffic_data.json", "a") as f:
+                with open(self.log_path, "a") as f:
                     f.write(json.dumps(traffic_data) + "\n")
 
-                traci.simulationStep()
-                time.sleep(0.1)
+                if self.step_delay:
+                    time.sleep(self.step_delay)
 
         except KeyboardInterrupt:
             self.logger.info("Controller stopped by user")
         finally:
-            traci.close()
+            system_metrics.metrics.stop_sampler()
+            self.sim.close()
 
 if __name__ == "__main__":
-    controller = TrafficController("../sumo/config.sumocfg")
+    # SIM_BACKEND=queue runs headless against the stand-in, no SUMO needed
+    # CONTROL_MODE=max_pressure, green_wave, rl or schedule switches from the threshold rules
+    # EMERGENCY_TRACKING=0 turns off emergency-vehicle signal pre-emption
+    # RECORD_FILE=<path> writes per-step snapshots for replay.py
+    # SIM_BACKEND=replay REPLAY_FILE=<path> REPLAY_SPEED=1|10|max plays one back without SUMO
+    # TELEMETRY_API_URL=http://localhost:8000 pushes every step to the API's live telemetry stream
+    mode = os.environ.get("CONTROL_MODE", "threshold")
+    tracking = os.environ.get("EMERGENCY_TRACKING", "1") != "0"
+    kind = os.environ.get("SIM_BACKEND", "sumo")
+    if kind == "queue":
+        backend = create_backend("queue", net_file="../sumo/net.net.xml")
+    elif kind == "replay":
+        import replay
+        backend = create_backend("replay", path=os.environ["REPLAY_FILE"],
+                                 speed=replay.parse_speed(os.environ.get("REPLAY_SPEED", "1")))
+    else:
+        backend = create_backend("sumo")
+    if os.environ.get("RECORD_FILE"):
+        import replay
+        backend = replay.RecordingBackend(backend, os.environ["RECORD_FILE"], net_file="../sumo/net.net.xml")
+    # Only a live SUMO GUI needs slowing down; the others run (or pace themselves) at full speed
+    step_delay = 0.1 if kind == "sumo" else 0
+    controller = TrafficController("../sumo/config.sumocfg", step_delay=step_delay, mode=mode, backend=backend,
+                                   emergency_tracking=tracking, api_url=os.environ.get("TELEMETRY_API_URL"))
     controller.run_controller()
+    if os.environ.get("RECORD_FILE"):
+        print(f"Recording written: {os.environ['RECORD_FILE']}")
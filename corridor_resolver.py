@@ -0,0 +1,426 @@
+# Corridor Conflict Resolver - junction reservations for simultaneous emergency corridors
+from bisect import bisect_left, insort
+from collections import defaultdict, deque
+import argparse
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import numpy as np
+
+from network import RoadNetwork
+
+LEAD = 12.0          # green is up this long before the vehicle's ETA (yellow + queue clearance)
+HOLD = 6.0           # and held this long after it
+GAP = 3.0            # yellow / all-red between two corridors' movements at one junction
+MAX_STAGGER = 40.0   # corridors held back longer than this look for another route
+MAX_REROUTES = 3
+EPS = 1e-3           # keeps a staggered window from touching the one it waits for after rounding
+
+
+class Reservation:
+    # Green for one corridor's approach at one junction over [start, end)
+    def __init__(self, corridor_id, junction, start, end, approach, delay, seq):
+        self.corridor_id = corridor_id
+        self.junction = junction
+        self.start = start
+        self.end = end
+        self.approach = approach    # junction the vehicle comes from
+        self.delay = delay          # stagger accumulated up to this junction
+        self.seq = seq
+
+
+class IntervalIndex:
+    # Reservations at one junction, sorted by start. Knowing the longest
+    # window on record, an overlap query only visits entries starting in
+    # [start - longest, end), found by bisection.
+    def __init__(self):
+        self.keys = []
+        self.items = {}
+        self.longest = 0.0
+
+    def add(self, reservation):
+        key = (reservation.start, reservation.seq)
+        insort(self.keys, key)
+        self.items[key] = reservation
+        self.longest = max(self.longest, reservation.end - reservation.start)
+
+    def remove(self, reservation):
+        key = (reservation.start, reservation.seq)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+            del self.items[key]
+
+    def overlapping(self, start, end):
+        result = []
+        i = bisect_left(self.keys, (start - self.longest, -1))
+        while i < len(self.keys) and self.keys[i][0] < end:
+            reservation = self.items[self.keys[i]]
+            if reservation.end > start:
+                result.append(reservation)
+            i += 1
+        return result
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class Corridor:
+    def __init__(self, corridor_id, route, priority, departure, seq):
+        self.id = corridor_id
+        # route[0] is where the unit starts; reservations[i] is its green at route[i + 1]
+        self.route = route
+        self.destination = route[-1]
+        self.priority = priority
+        self.departure = departure
+        self.seq = seq
+        self.reservations = []
+        self.reroutes = 0
+
+    @property
+    def delay(self):
+        return self.reservations[-1].delay if self.reservations else 0.0
+
+
+class CorridorResolver:
+    # Every active corridor holds one reservation per junction it crosses:
+    # (junction, green window around its ETA, approach). Two reservations
+    # at a junction may overlap only when they share the approach. A new or
+    # re-planned corridor walks its route: where it outranks the holder
+    # (higher priority, then earlier ETA) the holder is displaced and
+    # re-planned; otherwise it is staggered until the window is free. When
+    # the stagger exceeds `max_stagger`, routes around the contested
+    # junctions are tried and the earliest arrival wins. Windows already
+    # started are never taken away. All changes happen under one lock, so
+    # the table is conflict-free after every add or cancel.
+    def __init__(self, network, lead=LEAD, hold=HOLD, gap=GAP, max_stagger=MAX_STAGGER,
+                 max_reroutes=MAX_REROUTES, clock=time.time):
+        self.network = network
+        self.lead = lead
+        self.hold = hold
+        self.gap = gap
+        self.max_stagger = max_stagger
+        self.max_reroutes = max_reroutes
+        self.clock = clock
+        self._lock = threading.RLock()
+        self.index = defaultdict(IntervalIndex)
+        self.corridors = {}
+        self.finishing = []     # (last green end, seq, id); stale entries skipped
+        self.seq = itertools.count()
+        self.hop_times = {}
+        self.stats = {'added': 0, 'cancelled': 0, 'expired': 0, 'staggered': 0, 'rerouted': 0,
+                      'displaced': 0}
+
+    # ---- routes -------------------------------------------------------------
+
+    def hop_time(self, a, b):
+        seconds = self.hop_times.get((a, b))
+        if seconds is None:
+            edge_id = next(e for e in self.network.junctions[a].outgoing if self.network.edges[e].to_junction == b)
+            seconds = self.hop_times[(a, b)] = self.network.travel_time(edge_id)
+        return seconds
+
+    def expand(self, junctions):
+        # Planned routes may skip junctions; fill in the shortest path between
+        route = [junctions[0]]
+        for a, b in zip(junctions, junctions[1:]):
+            path = self.network.junction_path(a, b)
+            if path is None:
+                raise ValueError(f"No path from {a} to {b}")
+            route.extend(path[1:])
+        return route
+
+    # ---- public operations ----------------------------------------------------
+
+    def add(self, corridor_id, junctions, priority, departure=None):
+        with self._lock:
+            now = self.clock()
+            self.expire(now)
+            if corridor_id in self.corridors:
+                self.remove(corridor_id)
+            corridor = Corridor(corridor_id, self.expand(list(junctions)), priority,
+                                now if departure is None else departure, next(self.seq))
+            self.corridors[corridor_id] = corridor
+            self.stats['added'] += 1
+            self.place(corridor, now)
+            return self.schedule(corridor)
+
+    def cancel(self, corridor_id):
+        with self._lock:
+            if self.remove(corridor_id) is None:
+                return False
+            self.stats['cancelled'] += 1
+            return True
+
+    def get(self, corridor_id):
+        with self._lock:
+            corridor = self.corridors.get(corridor_id)
+            return self.schedule(corridor) if corridor is not None else None
+
+    def active(self, now=None):
+        # junction -> (corridor_id, approach) for greens running right now
+        with self._lock:
+            now = self.clock() if now is None else now
+            self.expire(now)
+            held = {}
+            for junction, index in self.index.items():
+                for reservation in index.overlapping(now, now + EPS):
+                    held[junction] = (reservation.corridor_id, reservation.approach)
+            return held
+
+    # ---- planning -----------------------------------------------------------
+
+    def place(self, corridor, now):
+        # Plan the corridor, then everyone it displaced. Past a bound on
+        # re-plans nobody displaces anybody any more, which always settles.
+        work = deque([corridor])
+        budget = 4 * len(self.corridors) + 4
+        while work:
+            current = work.popleft()
+            if current.id not in self.corridors:
+                continue
+            budget -= 1
+            for other_id in sorted(self.plan(current, now, displace=budget > 0)):
+                other = self.corridors[other_id]
+                self.unreserve(other, now)
+                self.stats['displaced'] += 1
+                work.append(other)
+
+    def plan(self, corridor, now, displace=True):
+        # Re-plans the part of the route not yet under way and returns the
+        # corridors it displaced
+        k = len(corridor.reservations)
+        if k + 1 >= len(corridor.route):
+            return set()
+        anchor = corridor.route[k]
+        if k == 0:
+            anchor_eta, base_delay = corridor.departure, 0.0
+        else:
+            last = corridor.reservations[-1]
+            anchor_eta, base_delay = last.start + self.lead, last.delay
+
+        remaining = corridor.route[k + 1:]
+        best = self.fit(corridor, anchor, anchor_eta, remaining, base_delay, now, displace)
+        best_path = remaining
+        avoid = set(best['contested'])
+        for _ in range(self.max_reroutes):
+            if best['delay'] - base_delay <= self.max_stagger or not avoid:
+                break
+            path = self.network.junction_path(anchor, corridor.destination, avoid | set(corridor.route[:k]))
+            if path is None or len(path) < 2:
+                break
+            attempt = self.fit(corridor, anchor, anchor_eta, path[1:], base_delay, now, displace)
+            if attempt['arrival'] < best['arrival']:
+                best, best_path = attempt, path[1:]
+            avoid |= attempt['contested']
+
+        if best_path is not remaining:
+            corridor.route = corridor.route[:k + 1] + best_path
+            corridor.reroutes += 1
+            self.stats['rerouted'] += 1
+        if best['delay'] > base_delay:
+            self.stats['staggered'] += 1
+
+        for junction, start, end, approach, delay in best['windows']:
+            reservation = Reservation(corridor.id, junction, start, end, approach, delay, next(self.seq))
+            self.index[junction].add(reservation)
+            corridor.reservations.append(reservation)
+        heapq.heappush(self.finishing, (corridor.reservations[-1].end, corridor.seq, corridor.id))
+        return best['displaced']
+
+    def fit(self, corridor, anchor, anchor_eta, path, delay, now, displace):
+        windows, displaced, contested = [], set(), set()
+        eta, previous = anchor_eta, anchor
+        for junction in path:
+            eta += self.hop_time(previous, junction)
+            while True:
+                start, end = eta + delay - self.lead, eta + delay + self.hold
+                blocking, losers = [], set()
+                for reservation in self.index[junction].overlapping(start - self.gap, end + self.gap):
+                    if reservation.corridor_id == corridor.id or reservation.approach == previous:
+                        continue
+                    holder = self.corridors[reservation.corridor_id]
+                    if (displace and reservation.start > now
+                            and self.outranks(corridor, eta + delay, holder, reservation.start + self.lead)):
+                        losers.add(holder.id)
+                    else:
+                        blocking.append(reservation)
+                if not blocking:
+                    break
+                # Held back until the blocking greens (and their yellow) are over
+                contested.add(junction)
+                delay = max(r.end for r in blocking) + self.gap + self.lead - eta + EPS
+            displaced |= losers
+            windows.append((junction, start, end, previous, delay))
+            previous = junction
+        return {'windows': windows, 'delay': delay, 'displaced': displaced, 'contested': contested,
+                'arrival': eta + delay}
+
+    @staticmethod
+    def outranks(a, a_eta, b, b_eta):
+        return (-a.priority, a_eta, a.seq) < (-b.priority, b_eta, b.seq)
+
+    # ---- bookkeeping ------------------------------------------------------------
+
+    def unreserve(self, corridor, now):
+        # Drops the windows not yet started; running ones stay
+        kept = []
+        for reservation in corridor.reservations:
+            if reservation.start <= now:
+                kept.append(reservation)
+            else:
+                self.index[reservation.junction].remove(reservation)
+        corridor.reservations = kept
+
+    def remove(self, corridor_id):
+        corridor = self.corridors.pop(corridor_id, None)
+        if corridor is not None:
+            for reservation in corridor.reservations:
+                self.index[reservation.junction].remove(reservation)
+        return corridor
+
+    def expire(self, now):
+        # Corridors whose last green has ended are done
+        while self.finishing and self.finishing[0][0] <= now:
+            end, _, corridor_id = heapq.heappop(self.finishing)
+            corridor = self.corridors.get(corridor_id)
+            if corridor is not None and corridor.reservations and corridor.reservations[-1].end == end:
+                self.remove(corridor_id)
+                self.stats['expired'] += 1
+
+    def check(self):
+        # Conflicts and index drift; an empty list means the table is consistent
+        problems = []
+        with self._lock:
+            indexed = 0
+            for junction, index in self.index.items():
+                indexed += len(index)
+                ordered = [index.items[key] for key in index.keys]
+                for i, a in enumerate(ordered):
+                    for b in ordered[i + 1:]:
+                        if b.start >= a.end + self.gap:
+                            break
+                        if a.approach != b.approach and b.start < a.end + self.gap and a.start < b.end + self.gap:
+                            problems.append(f"{junction}: {a.corridor_id} and {b.corridor_id} overlap")
+            owned = sum(len(c.reservations) for c in self.corridors.values())
+            if owned != indexed:
+                problems.append(f"{owned} reservations owned, {indexed} indexed")
+        return problems
+
+    # ---- reporting --------------------------------------------------------------
+
+    def schedule(self, corridor):
+        return {
+            'id': corridor.id,
+            'priority': corridor.priority,
+            'route': corridor.route,
+            'delay': round(corridor.delay, 1),
+            'reroutes': corridor.reroutes,
+            'signals': [{'junction': r.junction, 'approach': r.approach, 'green_from': round(r.start, 1),
+                         'green_until': round(r.end, 1), 'eta': round(r.start + self.lead, 1),
+                         'delay': round(r.delay, 1)} for r in corridor.reservations]
+        }
+
+    def describe(self):
+        with self._lock:
+            return {
+                'corridors': len(self.corridors),
+                'reservations': sum(len(index) for index in self.index.values()),
+                **self.stats
+            }
+
+
+def create_resolver(net_file="../sumo/net.net.xml"):
+    return CorridorResolver(RoadNetwork.from_file(net_file))
+
+
+def stress(network, emergencies=48, operations=3000, seed=0):
+    # A burst of simultaneous emergencies, then a stream of new calls and
+    # cancellations on a simulated clock, checking the table after each one
+    from sos_store import PRIORITIES
+
+    rng = random.Random(seed)
+    clock = [0.0]
+    resolver = CorridorResolver(network, clock=lambda: clock[0])
+    junctions = sorted(network.junctions)
+    priorities = list(PRIORITIES.values())
+    names = itertools.count()
+
+    def new_call():
+        origin, destination = rng.sample(junctions, 2)
+        return f"SOS_{next(names)}", [origin, destination], rng.choice(priorities)
+
+    burst = [new_call() for _ in range(emergencies)]
+
+    # Without resolution every corridor keeps its free-flow greens
+    naive = CorridorResolver(network, clock=lambda: 0.0)
+    windows = defaultdict(list)
+    for corridor_id, route, _ in burst:
+        route = naive.expand(route)
+        eta = 0.0
+        for a, b in zip(route, route[1:]):
+            eta += naive.hop_time(a, b)
+            windows[b].append((eta - LEAD, eta + HOLD, a))
+    naive_conflicts = sum(1 for ws in windows.values() for i, (s1, e1, a1) in enumerate(ws)
+                          for s2, e2, a2 in ws[i + 1:] if a1 != a2 and s1 < e2 + GAP and s2 < e1 + GAP)
+
+    latencies, problems = [], []
+    for corridor_id, route, priority in burst:
+        started = time.perf_counter()
+        resolver.add(corridor_id, route, priority)
+        latencies.append(time.perf_counter() - started)
+        problems += resolver.check()
+    burst_delays = [c.delay for c in resolver.corridors.values()]
+    burst_stats = dict(resolver.stats)
+
+    live = list(resolver.corridors)
+    for _ in range(operations):
+        clock[0] += rng.expovariate(2.0)
+        started = time.perf_counter()
+        if live and rng.random() < 0.4:
+            resolver.cancel(live.pop(rng.randrange(len(live))))
+        else:
+            corridor_id, route, priority = new_call()
+            resolver.add(corridor_id, route, priority)
+            live.append(corridor_id)
+        latencies.append(time.perf_counter() - started)
+        problems += resolver.check()
+        live = [c for c in live if c in resolver.corridors]
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'burst': emergencies,
+        'naive_conflicts': naive_conflicts,
+        'burst_stats': burst_stats,
+        'burst_delay_mean': round(float(np.mean(burst_delays)), 1),
+        'burst_delay_max': round(float(np.max(burst_delays)), 1),
+        'operations': len(latencies),
+        'problems': problems,
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+        'latency_ms_p99': round(float(np.percentile(latencies, 99)), 3),
+        **resolver.describe()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress the corridor conflict resolver")
+    parser.add_argument("--net", default="../sumo/net.net.xml")
+    parser.add_argument("--emergencies", type=int, default=48)
+    parser.add_argument("--operations", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    result = stress(RoadNetwork.from_file(args.net), args.emergencies, args.operations, args.seed)
+    print(f"{result['burst']} simultaneous corridors: {result['naive_conflicts']} conflicting greens "
+          f"without resolution")
+    print(f"  resolved with {result['burst_stats']['staggered']} staggered, "
+          f"{result['burst_stats']['rerouted']} rerouted, {result['burst_stats']['displaced']} displaced; "
+          f"delay mean {result['burst_delay_mean']}s, max {result['burst_delay_max']}s")
+    print(f"{result['operations']} adds/cancels: p50 {result['latency_ms_p50']} ms, "
+          f"p99 {result['latency_ms_p99']} ms, {len(result['problems'])} consistency problems")
+    for problem in result['problems'][:10]:
+        print(f"  {problem}")
+    print(f"Final table: {result['corridors']} corridors, {result['reservations']} reservations")
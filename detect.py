@@ -6,21 +6,31 @@ import torch
 import time
 from datetime import datetime
 
+import tracing
+
 class VehicleDetector:
-    def __init__(self, model_path="yolov8n.pt"):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path="yolov8n.pt", model=None):
+        # An already-loaded model can be passed in instead of a weights path
+        self.model = model if model is not None else YOLO(model_path)
         self.vehicle_classes = [2, 3, 5, 7]  # car, motorcycle, bus, truck
         self.confidence_threshold = 0.5
 
+    @tracing.traced("detect.frame")
     def detect_vehicles(self, image_path):
         # Load and process image
-        image = cv2.imread(image_path)
+        with tracing.span("detect.read"):
+            image = cv2.imread(image_path)
         if image is None:
             return []
 
         # Run YOLO detection
-        results = self.model(image)
+        with tracing.span("detect.model"):
+            results = self.model(image)
+
+        with tracing.span("detect.postprocess"):
+            return self.collect_detections(results)
 
+    def collect_detections(self, results):
         detections = []
         for result in results:
             boxes = result.boxes
@@ -43,6 +53,7 @@ class VehicleDetector:
 
         return detections
 
+    @tracing.traced("detect.violation")
     def detect_violation(self, image_path, traffic_light_state="red"):
         detections = self.detect_vehicles(image_path)
 
@@ -62,8 +73,11 @@ class VehicleDetector:
                     'violation_type': 'RED_LIGHT_VIOLATION',
                     'timestamp': datetime.now().isoformat()
                 }
-                violations.append(violation)
+                # Carries the frame's trace to the violations API
+                violations.append(tracing.attach(violation))
 
+        if violations:
+            tracing.finish("frame_to_violation")
         return violations
 
     def get_violation_zone(self, image_path):
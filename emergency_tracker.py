@@ -0,0 +1,331 @@
+# Emergency Vehicle Tracking - live ETAs and signal pre-emption along the corridor
+from collections import deque
+import argparse
+import logging
+import time
+
+from sim_backend import (VAR_LANE_ID, VAR_LANEPOSITION, VAR_ROAD_ID, VAR_ROUTE_INDEX, VAR_SPEED,
+                         create_backend)
+import tracing
+
+EMERGENCY_TYPES = {"ambulance", "fire", "police", "emergency"}
+
+TRACKED_VARS = (VAR_SPEED, VAR_ROAD_ID, VAR_LANE_ID, VAR_LANEPOSITION, VAR_ROUTE_INDEX)
+
+QUEUE_HEADWAY = 2.0        # seconds for each queued vehicle to clear the stop line
+YELLOW = 3.0               # clearance for movements losing their green
+SAFETY_MARGIN = 4.0        # green must be up this long before the vehicle arrives
+LOOKAHEAD = 120.0          # signals further away than this (seconds) are ignored
+MIN_CRUISE_FRACTION = 0.6  # a stopped vehicle is assumed to pull away at this share of the limit
+
+logger = logging.getLogger(__name__)
+
+
+def capture_signal(sim, tl_id):
+    # What to hand a pre-empted junction back to: its program and phase, or
+    # for a junction driven state by state ("online") the last state set
+    tl = sim.trafficlight
+    return tl.getProgram(tl_id), tl.getPhase(tl_id), tl.getRedYellowGreenState(tl_id)
+
+
+def restore_signal(sim, tl_id, saved):
+    program, phase, state = saved
+    tl = sim.trafficlight
+    if program == "online":
+        # Max-pressure / RL only resend a state when it changes, so the
+        # junction has to show the one they last sent
+        tl.setRedYellowGreenState(tl_id, state)
+    else:
+        tl.setProgram(tl_id, program)
+        tl.setPhase(tl_id, phase)
+
+
+class TrackedVehicle:
+    def __init__(self, vehicle_id, route):
+        self.id = vehicle_id
+        self.route = route
+        self.upcoming = []          # [(tl_id, link, eta)] in route order
+        self.preempted = {}         # tl_id -> link index held green
+        self.blocked = set()
+        self.replans = 0
+        self.started = None
+
+
+class Preemption:
+    # One junction held for one vehicle: yellow for the movements losing
+    # green, then the vehicle's approach green until it has passed
+    def __init__(self, vehicle_id, approach, yellow_until, green_state, yellow_state, saved):
+        self.vehicle_id = vehicle_id
+        self.approach = approach
+        self.yellow_until = yellow_until
+        self.green_state = green_state
+        self.yellow_state = yellow_state
+        # capture_signal() from before the hold, restored on release
+        self.saved = saved
+
+
+class EmergencyTracker:
+    # Follows emergency vehicles from departure to arrival. Each step reads
+    # their subscriptions and next signals, predicts arrival at every signal
+    # ahead from distance, speed and the queues in front of them, and holds
+    # a signal green for the vehicle just early enough to clear its queue.
+    # Work per step scales with tracked vehicles and their remaining route,
+    # never with the size of the network.
+    def __init__(self, sim, emergency_types=EMERGENCY_TYPES, queue_headway=QUEUE_HEADWAY, yellow=YELLOW,
+                 safety_margin=SAFETY_MARGIN, lookahead=LOOKAHEAD, preempt=True):
+        self.sim = sim
+        # preempt=False only tracks and predicts (baseline runs)
+        self.preempt_enabled = preempt
+        self.emergency_types = set(emergency_types)
+        self.queue_headway = queue_headway
+        self.yellow = yellow
+        self.safety_margin = safety_margin
+        self.lookahead = lookahead
+        self.vehicles = {}
+        self.preemptions = {}
+        self.signal_links = {}
+        self.lane_speeds = {}
+        self.events = deque(maxlen=1000)
+        # Called with the signal id after each release, so a controller that
+        # caches what it last sent can send it again
+        self.release_hooks = []
+        self.stats = {'tracked': 0, 'arrived': 0, 'preemptions': 0, 'replans': 0, 'conflicts': 0,
+                      'last_step_ms': None}
+
+    # ---- lookups cached per signal / lane as the vehicles meet them --------
+
+    def approach(self, tl_id):
+        # Incoming lane and edge of every link index at this signal
+        links = self.signal_links.get(tl_id)
+        if links is None:
+            links = []
+            for link in self.sim.trafficlight.getControlledLinks(tl_id):
+                lane = link[0][0] if link else None
+                links.append((lane, self.sim.lane.getEdgeID(lane) if lane else None))
+            self.signal_links[tl_id] = links
+        return links
+
+    def lane_speed(self, lane_id):
+        speed = self.lane_speeds.get(lane_id)
+        if speed is None:
+            speed = self.lane_speeds[lane_id] = self.sim.lane.getMaxSpeed(lane_id)
+        return speed
+
+    def log(self, kind, **details):
+        event = {'time': self.sim.simulation.getTime(), 'event': kind, **details}
+        self.events.append(event)
+        logger.info(f"Emergency {kind}: {details}")
+
+    # ---- per step -----------------------------------------------------------
+
+    @tracing.traced("emergency.step")
+    def step(self):
+        started = time.perf_counter()
+        sim = self.sim
+        now = sim.simulation.getTime()
+
+        for vehicle_id in sim.simulation.getDepartedIDList():
+            if self.is_emergency(vehicle_id):
+                sim.vehicle.subscribe(vehicle_id, TRACKED_VARS)
+                tracked = self.vehicles[vehicle_id] = TrackedVehicle(vehicle_id, sim.vehicle.getRoute(vehicle_id))
+                tracked.started = now
+                self.stats['tracked'] += 1
+                self.log('tracking', vehicle=vehicle_id)
+
+        for vehicle_id in sim.simulation.getArrivedIDList():
+            tracked = self.vehicles.pop(vehicle_id, None)
+            if tracked is not None:
+                self.stats['arrived'] += 1
+                self.release_all(tracked)
+                self.log('arrived', vehicle=vehicle_id, travel_time=round(now - tracked.started, 1))
+
+        for tracked in list(self.vehicles.values()):
+            values = sim.vehicle.getSubscriptionResults(tracked.id)
+            if not values:
+                continue
+            self.check_route(tracked, values)
+            tracked.upcoming = self.predict_arrivals(tracked, values, now)
+            self.update_preemptions(tracked, now)
+
+        self.hold_signals(now)
+        self.stats['last_step_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+    def is_emergency(self, vehicle_id):
+        type_id = self.sim.vehicle.getTypeID(vehicle_id)
+        return type_id in self.emergency_types or type_id.split("@")[0] in self.emergency_types
+
+    def check_route(self, tracked, values):
+        # A vehicle off its planned route was rerouted (or the plan is stale):
+        # take the new route and let the signal plan follow it
+        road = values.get(VAR_ROAD_ID, "")
+        if not road or road.startswith(":"):
+            return
+        index = values.get(VAR_ROUTE_INDEX, 0)
+        if 0 <= index < len(tracked.route) and tracked.route[index] == road:
+            return
+        tracked.route = self.sim.vehicle.getRoute(tracked.id)
+        tracked.replans += 1
+        self.stats['replans'] += 1
+        self.log('replan', vehicle=tracked.id, road=road)
+
+    def predict_arrivals(self, tracked, values, now):
+        # ETA at each signal ahead: distance at cruising speed plus the time
+        # for every queue met on the way to discharge in front of the vehicle
+        speed = values.get(VAR_SPEED, 0.0)
+        lane = values.get(VAR_LANE_ID, "")
+        limit = self.lane_speed(lane) if lane and not lane.startswith(":") else speed
+        cruise = max(speed, MIN_CRUISE_FRACTION * limit, 1.0)
+
+        upcoming = []
+        queue_delay = 0.0
+        for tl_id, link, distance, _ in self.sim.vehicle.getNextTLS(tracked.id):
+            travel = distance / cruise
+            if travel > self.lookahead:
+                break
+            links = self.approach(tl_id)
+            lane = links[link][0] if link < len(links) else None
+            if lane:
+                queue_delay += self.sim.lane.getLastStepHaltingNumber(lane) * self.queue_headway
+            upcoming.append((tl_id, link, now + travel + queue_delay, queue_delay))
+        return upcoming
+
+    def update_preemptions(self, tracked, now):
+        # Next approach to each signal; a route looping back through a signal
+        # it has already passed needs a different movement there
+        ahead = {}
+        for tl_id, link, _, _ in tracked.upcoming:
+            ahead.setdefault(tl_id, link)
+
+        # Signals the vehicle has passed (or no longer drives through) go back
+        for tl_id, link in list(tracked.preempted.items()):
+            if ahead.get(tl_id) != link:
+                self.release(tracked, tl_id)
+
+        for tl_id, link, eta, queue_delay in tracked.upcoming:
+            if tl_id in tracked.preempted or ahead[tl_id] != link:
+                continue
+            # Green must start early enough for the queue to clear plus margin
+            lead = self.yellow + queue_delay + self.safety_margin
+            if eta - now > lead:
+                continue
+            holder = self.preemptions.get(tl_id)
+            if holder is not None and holder.vehicle_id != tracked.id:
+                # Held for another vehicle; served once that one has passed
+                if tl_id not in tracked.blocked:
+                    tracked.blocked.add(tl_id)
+                    self.stats['conflicts'] += 1
+                continue
+            if not self.preempt_enabled:
+                continue
+            self.preempt(tracked, tl_id, link, now)
+
+    def preempt(self, tracked, tl_id, link, now):
+        edges = [edge for _, edge in self.approach(tl_id)]
+        approach = edges[link] if link < len(edges) else None
+        saved = capture_signal(self.sim, tl_id)
+        current = saved[2]
+        green = "".join('G' if edge == approach else 'r' for edge in edges)
+        # Movements that lose their green get a yellow first
+        losing = [i for i, c in enumerate(current[:len(green)]) if c in 'Gg' and green[i] == 'r']
+        if losing:
+            yellow = "".join('y' if i in losing else (current[i] if current[i] in 'Gg' and green[i] == 'G' else 'r')
+                             for i in range(len(green)))
+            self.sim.trafficlight.setRedYellowGreenState(tl_id, yellow)
+            yellow_until = now + self.yellow
+        else:
+            self.sim.trafficlight.setRedYellowGreenState(tl_id, green)
+            yellow_until = now
+        self.preemptions[tl_id] = Preemption(tracked.id, approach, yellow_until, green,
+                                             yellow if losing else green, saved)
+        tracked.preempted[tl_id] = link
+        self.stats['preemptions'] += 1
+        self.log('preempt', vehicle=tracked.id, signal=tl_id, approach=approach)
+
+    def hold_signals(self, now):
+        # Yellow turns green once cleared; a held signal another controller
+        # switched in the meantime gets its pre-emption state back, and what
+        # that controller set is what the junction returns to on release
+        for tl_id, preemption in self.preemptions.items():
+            if preemption.yellow_until is not None and now >= preemption.yellow_until:
+                preemption.yellow_until = None
+            state = preemption.yellow_state if preemption.yellow_until is not None else preemption.green_state
+            current = self.sim.trafficlight.getRedYellowGreenState(tl_id)
+            if current != state:
+                if current not in (preemption.yellow_state, preemption.green_state):
+                    preemption.saved = capture_signal(self.sim, tl_id)
+                self.sim.trafficlight.setRedYellowGreenState(tl_id, state)
+
+    def release(self, tracked, tl_id):
+        tracked.preempted.pop(tl_id, None)
+        preemption = self.preemptions.get(tl_id)
+        if preemption is None or preemption.vehicle_id != tracked.id:
+            return
+        del self.preemptions[tl_id]
+        # Hand the junction back to whatever ran it before the hold
+        restore_signal(self.sim, tl_id, preemption.saved)
+        for hook in self.release_hooks:
+            hook(tl_id)
+        self.log('release', vehicle=tracked.id, signal=tl_id)
+
+    def release_all(self, tracked):
+        for tl_id in list(tracked.preempted):
+            self.release(tracked, tl_id)
+
+    def describe(self):
+        return {
+            'vehicles': {
+                v.id: {'route_signals': [(tl, round(eta, 1)) for tl, _, eta, _ in v.upcoming],
+                       'preempted': sorted(v.preempted), 'replans': v.replans}
+                for v in self.vehicles.values()
+            },
+            'preempted_signals': {tl: p.vehicle_id for tl, p in self.preemptions.items()},
+            **self.stats
+        }
+
+
+def run_demo(net_file, steps, ambulances, seed, preempt=True):
+    # Headless run: background traffic plus ambulances on long routes
+    sim = create_backend("queue", net_file=net_file, demand_rate=0.6, seed=seed)
+    tracker = EmergencyTracker(sim, preempt=preempt)
+    network = sim.network
+    edges = list(network.edges)
+    departures = {}
+    for i in range(ambulances):
+        route = [edges[(i * 7) % len(edges)]]
+        for _ in range(10):
+            options = sim.successors.get(sim.edge_index[route[-1]])
+            if not options:
+                break
+            route.append(sim.edge_ids[options[(i + len(route)) % len(options)]])
+        sim.route.add(f"emergency_{i}", route)
+        departures[int(60 + i * 90)] = i
+
+    step_ms = []
+    for step in range(steps):
+        if step in departures:
+            sim.vehicle.add(f"ambulance_{departures[step]}", f"emergency_{departures[step]}", typeID="ambulance")
+        sim.simulationStep()
+        tracker.step()
+        step_ms.append(tracker.stats['last_step_ms'])
+    return tracker, step_ms
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Emergency vehicle pre-emption on the headless backend")
+    parser.add_argument("--net", default="../sumo/net.net.xml")
+    parser.add_argument("--steps", type=int, default=900)
+    parser.add_argument("--ambulances", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    baseline, _ = run_demo(args.net, args.steps, args.ambulances, args.seed, preempt=False)
+    tracker, step_ms = run_demo(args.net, args.steps, args.ambulances, args.seed)
+    before = {e['vehicle']: e['travel_time'] for e in baseline.events if e['event'] == 'arrived'}
+    print(f"{tracker.stats['arrived']} of {tracker.stats['tracked']} emergency vehicles arrived, "
+          f"{tracker.stats['preemptions']} pre-emptions, {tracker.stats['replans']} re-plans, "
+          f"{tracker.stats['conflicts']} conflicts")
+    for event in tracker.events:
+        if event['event'] == 'arrived':
+            print(f"  {event['vehicle']}: {event['travel_time']}s (without pre-emption {before.get(event['vehicle'])}s)")
+    print(f"Tracker step: max {max(step_ms):.3f} ms")
@@ -0,0 +1,111 @@
+# Event Bus for fanning out events across API workers and nodes
+import asyncio
+import json
+import os
+import uuid
+
+
+class InProcessEventBus:
+    # Single-process backend: publish dispatches straight to local handlers
+    def __init__(self):
+        self.handlers = {}
+        self.node_id = uuid.uuid4().hex[:12]
+        self.stats = {'published': 0, 'delivered': 0, 'handler_errors': 0}
+
+    def subscribe(self, channel, handler):
+        # handler is an async callable taking the message dict
+        self.handlers.setdefault(channel, []).append(handler)
+
+    def unsubscribe(self, channel, handler):
+        if handler in self.handlers.get(channel, []):
+            self.handlers[channel].remove(handler)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel, message):
+        self.stats['published'] += 1
+        await self.dispatch(channel, message)
+
+    async def dispatch(self, channel, message):
+        for handler in list(self.handlers.get(channel, [])):
+            try:
+                await handler(message)
+                self.stats['delivered'] += 1
+            except Exception as e:
+                self.stats['handler_errors'] += 1
+                print(f"Error handling {channel} event: {e}")
+
+
+class RedisEventBus(InProcessEventBus):
+    # Multi-worker backend: every worker (including the publisher) receives
+    # each event through one Redis pattern subscription
+    def __init__(self, url="redis://localhost:6379/0", prefix="traffic:", client=None):
+        super().__init__()
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.pubsub = None
+        self._listener = None
+
+    async def start(self):
+        if self._listener is not None:
+            return
+        self.pubsub = self.client.pubsub()
+        await self.pubsub.psubscribe(f"{self.prefix}*")
+        self._listener = asyncio.ensure_future(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self.pubsub is not None:
+            await self.pubsub.punsubscribe()
+            await self.pubsub.close()
+            self.pubsub = None
+
+    async def publish(self, channel, message):
+        self.stats['published'] += 1
+        envelope = json.dumps({'origin': self.node_id, 'data': message}, separators=(',', ':'))
+        await self.client.publish(f"{self.prefix}{channel}", envelope)
+
+    async def _listen(self):
+        while True:
+            try:
+                event = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis event bus connection error: {e}")
+                await asyncio.sleep(1.0)
+                continue
+
+            if event is None:
+                continue
+
+            channel = event['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            try:
+                envelope = json.loads(event['data'])
+                message = envelope['data']
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Dropping malformed event on {channel}: {e}")
+                continue
+            await self.dispatch(channel[len(self.prefix):], message)
+
+
+def create_event_bus():
+    # REDIS_URL switches every worker onto the shared Redis backend
+    redis_url = os.environ.get("REDIS_URL")
+    if redis_url:
+        return RedisEventBus(redis_url)
+    return InProcessEventBus()
+
+
+bus = create_event_bus()
@@ -0,0 +1,243 @@
+# Parallel Scenario Runner for evaluating signal control strategies
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import time
+
+from controller import TrafficController
+from heuristic import HeuristicController
+from sim_backend import VAR_SPEED, create_backend
+
+
+def apply_fixed(controller, heuristic):
+    # Baseline: leave the static programs from the network untouched
+    pass
+
+
+def apply_threshold(controller, heuristic):
+    controller.control_step()
+
+
+def apply_heuristic(controller, heuristic):
+    sim = controller.sim
+    for junction in controller.junctions:
+        current_traffic = {
+            'vehicle_count': sim.junction.getLastStepVehicleNumber(junction),
+            'avg_waiting_time': sim.junction.getLastStepMeanWaitingTime(junction)
+        }
+        adjustment = heuristic.adaptive_timing_adjustment(junction, current_traffic)
+        sim.trafficlight.setPhaseDuration(junction, adjustment['recommended_green_time'])
+
+
+def apply_max_pressure(controller, heuristic):
+    controller.max_pressure_step()
+
+
+def apply_green_wave(controller, heuristic):
+    # Coordinated fixed-time plans, installed once at the start
+    controller.green_wave_step()
+
+
+def apply_rl(controller, heuristic):
+    controller.rl_step()
+
+
+STRATEGIES = {
+    'fixed': apply_fixed,
+    'threshold': apply_threshold,
+    'heuristic': apply_heuristic,
+    'max_pressure': apply_max_pressure,
+    'green_wave': apply_green_wave,
+    'rl': apply_rl
+}
+
+RESULT_FIELDS = ['backend', 'strategy', 'seed', 'decision_interval', 'steps', 'departed', 'throughput',
+                 'mean_waiting_time', 'stops', 'stops_per_vehicle', 'wall_seconds']
+
+
+def task_key(task):
+    # Results from a different run length, config or network never count as done
+    return (f"{task['backend']}|{task['strategy']}|{task['seed']}|{task['decision_interval']}|"
+            f"{task.get('max_steps')}|{task.get('config')}|{task.get('net_file')}")
+
+
+def run_scenario(task):
+    # Runs in a worker process: one headless SUMO instance per task, started on
+    # a free TraCI port chosen by traci.start (or a queue-model stand-in)
+    if task['strategy'] == "rl" and not os.path.exists(task['policy']):
+        raise FileNotFoundError(f"No RL policy at {task['policy']}")
+    if task['backend'] == "queue":
+        sim = create_backend("queue", net_file=task['net_file'], seed=task['seed'], end_time=task['max_steps'])
+    else:
+        sim = create_backend("sumo")
+
+    controller = TrafficController(
+        task['config'],
+        sumo_binary="sumo",
+        step_delay=0,
+        sumo_args=["--seed", str(task['seed']), "--no-step-log", "true",
+                   "--duration-log.disable", "true", "--summary-output", os.devnull,
+                   "--fcd-output", os.devnull],
+        backend=sim,
+        net_file=task['net_file'],
+        policy_path=task['policy']
+    )
+    controller.logger.setLevel(logging.WARNING)
+    heuristic = HeuristicController()
+    apply_strategy = STRATEGIES[task['strategy']]
+
+    started = time.perf_counter()
+    if not controller.start_simulation(label=f"experiment_{os.getpid()}"):
+        raise RuntimeError(f"SUMO failed to start for {task_key(task)}")
+
+    steps = departed = arrived = stops = 0
+    waiting_seconds = 0.0
+    halted = set()
+    try:
+        delta_t = sim.simulation.getDeltaT()
+        while sim.simulation.getMinExpectedNumber() > 0 and steps < task['max_steps']:
+            if steps % task['decision_interval'] == 0:
+                apply_strategy(controller, heuristic)
+                if controller.failed_modes:
+                    # Otherwise the row would just repeat the fixed programs
+                    raise RuntimeError(f"{task['strategy']} setup failed for {task_key(task)}")
+
+            sim.simulationStep()
+            steps += 1
+
+            # Speed subscriptions keep per-step cost to one TraCI round trip
+            for vehicle_id in sim.simulation.getDepartedIDList():
+                sim.vehicle.subscribe(vehicle_id, [VAR_SPEED])
+                departed += 1
+            arrived += sim.simulation.getArrivedNumber()
+
+            now_halted = set()
+            for vehicle_id, values in sim.vehicle.getAllSubscriptionResults().items():
+                if values.get(VAR_SPEED, 0) < 0.1:
+                    now_halted.add(vehicle_id)
+            stops += len(now_halted - halted)
+            waiting_seconds += len(now_halted) * delta_t
+            halted = now_halted
+    finally:
+        sim.close()
+
+    return {
+        'backend': task['backend'],
+        'strategy': task['strategy'],
+        'seed': task['seed'],
+        'decision_interval': task['decision_interval'],
+        'max_steps': task['max_steps'],
+        'config': task['config'],
+        'net_file': task['net_file'],
+        'steps': steps,
+        'departed': departed,
+        'throughput': arrived,
+        'mean_waiting_time': round(waiting_seconds / departed, 3) if departed else 0.0,
+        'stops': stops,
+        'stops_per_vehicle': round(stops / departed, 3) if departed else 0.0,
+        'wall_seconds': round(time.perf_counter() - started, 3)
+    }
+
+
+class ExperimentRunner:
+    def __init__(self, sumo_config, results_path="../data/experiments/results.jsonl", workers=None,
+                 backend="sumo", net_file="../sumo/net.net.xml", policy="../models/signal_policy.npz"):
+        self.sumo_config = sumo_config
+        self.policy = policy
+        self.backend = backend
+        self.net_file = net_file
+        self.results_path = results_path
+        self.workers = workers or os.cpu_count()
+
+    def build_grid(self, strategies, seeds, decision_intervals=(1,), max_steps=3600):
+        return [
+            {'backend': self.backend, 'strategy': strategy, 'seed': seed, 'decision_interval': interval,
+             'max_steps': max_steps, 'config': self.sumo_config, 'net_file': self.net_file,
+             'policy': self.policy}
+            for strategy, seed, interval in itertools.product(strategies, seeds, decision_intervals)
+        ]
+
+    def load_results(self):
+        if not os.path.exists(self.results_path):
+            return []
+        results = []
+        with open(self.results_path) as f:
+            for line in f:
+                if line.strip():
+                    results.append(json.loads(line))
+        return results
+
+    def run(self, grid):
+        # Finished tasks are appended as they complete, so an interrupted run
+        # resumes with only the missing ones
+        done = {task_key(result) for result in self.load_results()}
+        pending = [task for task in grid if task_key(task) not in done]
+        print(f"{len(grid) - len(pending)} of {len(grid)} scenarios already done, running {len(pending)}")
+
+        os.makedirs(os.path.dirname(self.results_path) or ".", exist_ok=True)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(run_scenario, task): task for task in pending}
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Scenario {task_key(task)} failed: {e}")
+                    continue
+                with open(self.results_path, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+                print(f"Finished {task_key(task)}: waiting {result['mean_waiting_time']}s, "
+                      f"throughput {result['throughput']}")
+
+        keys = {task_key(task) for task in grid}
+        return [result for result in self.load_results() if task_key(result) in keys]
+
+    def summarize(self, results):
+        # Mean of each metric across seeds, one row per strategy/interval
+        groups = {}
+        for result in results:
+            groups.setdefault((result['strategy'], result['decision_interval']), []).append(result)
+
+        summary = []
+        for (strategy, interval), rows in sorted(groups.items()):
+            row = {'strategy': strategy, 'decision_interval': interval, 'runs': len(rows)}
+            for metric in ('mean_waiting_time', 'throughput', 'stops_per_vehicle', 'wall_seconds'):
+                row[metric] = round(sum(r[metric] for r in rows) / len(rows), 3)
+            summary.append(row)
+        return summary
+
+    def write_table(self, results, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            for result in sorted(results, key=lambda r: (r['strategy'], r['decision_interval'], r['seed'])):
+                writer.writerow({field: result[field] for field in RESULT_FIELDS})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run signal control strategies over a grid of seeds")
+    parser.add_argument("--config", default="../sumo/config.sumocfg")
+    parser.add_argument("--backend", choices=["sumo", "queue"], default="sumo")
+    parser.add_argument("--net-file", default="../sumo/net.net.xml")
+    parser.add_argument("--policy", default="../models/signal_policy.npz", help="policy for the rl strategy")
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES))
+    parser.add_argument("--seeds", type=int, default=10)
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1])
+    parser.add_argument("--max-steps", type=int, default=3600)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--results", default="../data/experiments/results.jsonl")
+    parser.add_argument("--table", default="../data/experiments/results.csv")
+    args = parser.parse_args()
+
+    runner = ExperimentRunner(args.config, args.results, args.workers, args.backend, args.net_file,
+                              args.policy)
+    grid = runner.build_grid(args.strategies, range(args.seeds), args.intervals, args.max_steps)
+    results = runner.run(grid)
+    runner.write_table(results, args.table)
+
+    for row in runner.summarize(results):
+        print(row)
@@ -0,0 +1,231 @@
+# Calendar and Weather Features from local files, indexed by date and hour
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import subsystems
+
+HOLIDAYS_PATH = os.environ.get("HOLIDAYS_FILE", "../data/calendar/holidays.json")
+WEATHER_PATH = os.environ.get("WEATHER_FILE", "../data/weather/weather.csv")
+
+# Used for hours the weather file does not cover
+DEFAULT_TEMP = 25.0
+DEFAULT_RAIN = 0.0
+
+
+def to_hours(times):
+    # datetimes, ISO strings or datetime64 -> datetime64[h] array (local wall time)
+    return np.asarray(times, dtype='datetime64[h]')
+
+
+class FileWatch:
+    # Remembers a file's mtime/size so reloads only happen when it changes
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+
+    def changed(self):
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = None
+        if signature != self.signature:
+            self.signature = signature
+            return True
+        return False
+
+
+class HourlyWeather:
+    # Temperature and rain in flat arrays indexed by hours since the first
+    # row; hours missing from the file fall back to that hour-of-day's mean
+    def __init__(self, path):
+        self.base = None
+        self.temp = np.zeros(0, dtype=np.float64)
+        self.rain = np.zeros(0, dtype=np.float64)
+        self.known = np.zeros(0, dtype=bool)
+        self.temp_by_hour = np.full(24, DEFAULT_TEMP, dtype=np.float64)
+        self.rain_by_hour = np.full(24, DEFAULT_RAIN, dtype=np.float64)
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def load(self, path):
+        # CSV with time,temp_c,rain_mm (history and forecast in one file)
+        with open(path, newline="") as f:
+            rows = [row for row in csv.DictReader(f) if row.get('time')]
+        if not rows:
+            return
+        hours = to_hours([row['time'][:13] for row in rows])
+        temp = np.array([float(row.get('temp_c') or 'nan') for row in rows], dtype=np.float64)
+        rain = np.array([float(row.get('rain_mm') or 'nan') for row in rows], dtype=np.float64)
+
+        self.base = hours.min()
+        offsets = (hours - self.base).astype(np.int64)
+        size = int(offsets.max()) + 1
+        self.temp = np.full(size, np.nan, dtype=np.float64)
+        self.rain = np.full(size, np.nan, dtype=np.float64)
+        # Later rows win, so a forecast appended after history overrides it
+        self.temp[offsets] = temp
+        self.rain[offsets] = rain
+        self.known = ~np.isnan(self.temp)
+
+        hour_of_day = (hours.astype(np.int64) % 24)
+        for values, by_hour in ((temp, self.temp_by_hour), (rain, self.rain_by_hour)):
+            valid = ~np.isnan(values)
+            sums = np.bincount(hour_of_day[valid], weights=values[valid], minlength=24)
+            counts = np.bincount(hour_of_day[valid], minlength=24)
+            np.divide(sums, counts, out=by_hour, where=counts > 0, casting='unsafe')
+        self.temp = np.where(self.known, self.temp, self.temp_by_hour[(np.arange(size) + self.base.astype(np.int64)) % 24])
+        self.rain = np.where(np.isnan(self.rain), 0, self.rain)
+
+    def lookup(self, hours):
+        hour_of_day = hours.astype(np.int64) % 24
+        if self.base is None:
+            return self.temp_by_hour[hour_of_day], self.rain_by_hour[hour_of_day]
+        offsets = (hours - self.base).astype(np.int64)
+        inside = (offsets >= 0) & (offsets < len(self.temp))
+        clipped = np.clip(offsets, 0, max(len(self.temp) - 1, 0))
+        temp = np.where(inside, self.temp[clipped], self.temp_by_hour[hour_of_day])
+        rain = np.where(inside, self.rain[clipped], self.rain_by_hour[hour_of_day])
+        return temp, rain
+
+    def describe(self):
+        if self.base is None:
+            return {'hours': 0}
+        return {'hours': int(self.known.sum()), 'from': str(self.base),
+                'to': str(self.base + np.timedelta64(len(self.temp) - 1, 'h'))}
+
+
+class HolidayCalendar:
+    # One bool per day between the first and last listed holiday
+    def __init__(self, path):
+        self.base = None
+        self.days = np.zeros(0, dtype=bool)
+        self.names = {}
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def load(self, path):
+        # ["2026-01-26", ...], {"2026-01-26": "Republic Day", ...} or
+        # [{"date": "2026-01-26", "name": "Republic Day"}, ...]
+        with open(path) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            self.names = {str(day): name for day, name in data.items()}
+        elif isinstance(data, list) and all(isinstance(day, str) for day in data):
+            self.names = {day: "" for day in data}
+        elif isinstance(data, list) and all(isinstance(day, dict) and isinstance(day.get('date'), str)
+                                            for day in data):
+            self.names = {day['date']: day.get('name', "") for day in data}
+        else:
+            raise ValueError("expected a list of dates, a date -> name mapping or a list of {date, name}")
+        if not self.names:
+            return
+        dates = np.array(sorted(self.names), dtype='datetime64[D]')
+        self.base = dates[0]
+        self.days = np.zeros(int((dates[-1] - self.base).astype(np.int64)) + 1, dtype=bool)
+        self.days[(dates - self.base).astype(np.int64)] = True
+
+    def lookup(self, hours):
+        if self.base is None:
+            return np.zeros(hours.shape, dtype=bool)
+        offsets = (hours.astype('datetime64[D]') - self.base).astype(np.int64)
+        inside = (offsets >= 0) & (offsets < len(self.days))
+        return inside & self.days[np.clip(offsets, 0, len(self.days) - 1)]
+
+
+class FeatureProvider:
+    # Weather and holiday features for any number of target times. Tables
+    # are rebuilt only when a source file changes (checked at most every
+    # `check_interval` seconds) and swapped in whole, so readers never lock.
+    def __init__(self, holidays_path=HOLIDAYS_PATH, weather_path=WEATHER_PATH, check_interval=5.0):
+        self.holiday_watch = FileWatch(holidays_path)
+        self.weather_watch = FileWatch(weather_path)
+        self.check_interval = check_interval
+        self.holidays = HolidayCalendar(None)
+        self.weather = HourlyWeather(None)
+        self.last_check = float('-inf')
+        self.loads = 0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self.last_check < self.check_interval:
+            return
+        with self._lock:
+            if now - self.last_check < self.check_interval:
+                return
+            self.last_check = now
+            for watch, table, source in ((self.holiday_watch, 'holidays', HolidayCalendar),
+                                         (self.weather_watch, 'weather', HourlyWeather)):
+                if not watch.changed():
+                    continue
+                try:
+                    setattr(self, table, source(watch.path))
+                    self.loads += 1
+                except (OSError, ValueError, TypeError, KeyError) as e:
+                    # Keep serving the previous table until the file is fixed
+                    print(f"Could not load {watch.path}: {e}")
+
+    def features(self, times):
+        # Vectorized: one array per feature, aligned with `times`
+        self.refresh()
+        hours = to_hours(times)
+        holidays, weather = self.holidays, self.weather
+        temp, rain = weather.lookup(hours)
+        return {
+            'weather_temp': temp,
+            'weather_rain': rain,
+            'is_holiday': holidays.lookup(hours).astype(np.int64)
+        }
+
+    def features_at(self, when):
+        values = self.features([when])
+        return {name: column[0].item() for name, column in values.items()}
+
+    def describe(self):
+        return {
+            'holidays': len(self.holidays.names),
+            'weather': self.weather.describe(),
+            'loads': self.loads
+        }
+
+
+provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    # Shared instance for the predictor and API workers
+    global provider
+    if provider is None:
+        with _provider_lock:
+            if provider is None:
+                provider = FeatureProvider()
+    return provider
+
+
+subsystems.register("features", "feature_provider", "get_provider")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect weather/holiday features")
+    parser.add_argument("--benchmark", type=int, default=100000, help="timestamps per batch lookup")
+    args = parser.parse_args()
+
+    features = get_provider()
+    print(f"Loaded: {features.describe()}")
+    start = datetime.now().replace(minute=0, second=0, microsecond=0)
+    times = np.datetime64(start, 'h') + np.arange(args.benchmark).astype('timedelta64[h]') - np.timedelta64(24 * 365, 'h')
+    began = time.perf_counter()
+    batch = features.features(times)
+    elapsed = time.perf_counter() - began
+    print(f"{args.benchmark} timestamps in {elapsed * 1000:.1f} ms, {int(batch['is_holiday'].sum())} holiday hours")
+    print(f"Next hour: {features.features_at(start + timedelta(hours=1))}")
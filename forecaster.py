@@ -0,0 +1,353 @@
+# Short-horizon Traffic Forecasting from real lag windows in the rollup store
+from fastapi import APIRouter, HTTPException
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import subsystems
+from rollups import rollup_store
+
+LOOKBACK = 60                    # minutes of history fed to every model
+HORIZONS = (5, 15, 30, 60)       # minutes ahead
+BLOCK = 5                        # lag summary block for the tabular features
+
+router = APIRouter(prefix="/api/traffic/forecast", tags=["forecast"])
+
+DEFAULT_MODEL_PATH = os.environ.get("FORECAST_MODEL", "../models/forecaster.joblib")
+
+
+def fill_gaps(values):
+    # Forward-fill missing minutes per junction; leading gaps take the
+    # junction mean (or zero for a junction that never reported)
+    values = np.array(values, dtype=np.float64)
+    missing = np.isnan(values)
+    idx = np.where(missing, 0, np.arange(values.shape[1]))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    filled = np.take_along_axis(values, idx, axis=1)
+    means = np.nan_to_num(np.nanmean(np.where(missing.all(axis=1, keepdims=True), 0, values), axis=1))
+    return np.where(np.isnan(filled), means[:, None], filled)
+
+
+def calendar(epochs):
+    # Time-of-day and day-of-week on the unit circle, local time like the
+    # logs. UTC offsets are looked up per quarter hour (DST switches fall on
+    # those), so windows crossing a change keep their wall-clock features.
+    epochs = np.asarray(epochs, dtype=np.float64)
+    quarters, index = np.unique(epochs // 900, return_inverse=True)
+    offsets = np.array([time.localtime(int(q) * 900).tm_gmtoff for q in quarters], dtype=np.float64)
+    local = epochs + offsets[index.reshape(epochs.shape)]
+    day = (local % 86400) / 86400
+    week = ((local // 86400 + 3) % 7) / 7       # epoch day 0 was a Thursday
+    return np.stack([np.sin(2 * np.pi * day), np.cos(2 * np.pi * day),
+                     np.sin(2 * np.pi * week), np.cos(2 * np.pi * week)], axis=-1)
+
+
+def make_windows(series, lookback=LOOKBACK, horizons=HORIZONS):
+    # (junctions, minutes) -> inputs (J, N, lookback), targets (J, N, H) and
+    # the index of each window's last observed minute. Views, no copies.
+    span = lookback + max(horizons)
+    windows = sliding_window_view(series, span, axis=1)
+    inputs = windows[..., :lookback]
+    targets = windows[..., lookback - 1 + np.asarray(horizons)]
+    ends = np.arange(windows.shape[1]) + lookback - 1
+    return inputs, targets, ends
+
+
+def tabular_features(inputs, cal):
+    # Lag window summaries for the tree model: recent raw minutes, 5-minute
+    # block means over the hour, spread and trend, plus the calendar
+    lookback = inputs.shape[-1]
+    blocks = inputs[..., lookback % BLOCK:].reshape(*inputs.shape[:-1], -1, BLOCK).mean(axis=-1)
+    recent = inputs[..., -BLOCK:]
+    last = inputs[..., -1:]
+    spread = inputs.std(axis=-1, keepdims=True)
+    trend = last - inputs[..., :1]
+    cal = np.broadcast_to(cal, (*inputs.shape[:-1], cal.shape[-1]))
+    return np.concatenate([recent - last, blocks - last, spread, trend, last, cal], axis=-1)
+
+
+class PersistenceForecaster:
+    # Traffic in h minutes equals traffic now
+    name = 'persistence'
+
+    def fit(self, inputs, targets, cal):
+        return self
+
+    def predict(self, inputs, cal):
+        return np.repeat(inputs[..., -1:], len(HORIZONS), axis=-1)
+
+
+class GBMForecaster:
+    # Gradient-boosted trees on the lag summaries, one model per horizon,
+    # learning the change from the last observed minute
+    name = 'gbm'
+
+    def __init__(self, max_iter=200, seed=42):
+        self.max_iter = max_iter
+        self.seed = seed
+        self.models = []
+
+    def new_model(self):
+        try:
+            import xgboost as xgb
+            return xgb.XGBRegressor(n_estimators=self.max_iter, max_depth=6, learning_rate=0.1,
+                                    tree_method='hist', random_state=self.seed)
+        except ImportError:
+            from sklearn.ensemble import HistGradientBoostingRegressor
+            return HistGradientBoostingRegressor(max_iter=self.max_iter, learning_rate=0.1, random_state=self.seed)
+
+    def fit(self, inputs, targets, cal):
+        X = tabular_features(inputs, cal)
+        X = X.reshape(-1, X.shape[-1])
+        delta = (targets - inputs[..., -1:]).reshape(-1, len(HORIZONS))
+        self.models = [self.new_model().fit(X, delta[:, h]) for h in range(len(HORIZONS))]
+        return self
+
+    def predict(self, inputs, cal):
+        X = tabular_features(inputs, cal)
+        flat = X.reshape(-1, X.shape[-1])
+        delta = np.stack([model.predict(flat) for model in self.models], axis=-1)
+        return inputs[..., -1:] + delta.reshape(*X.shape[:-1], len(HORIZONS))
+
+
+class SequenceForecaster:
+    # Small recurrent (GRU) or causal dilated convolution (TCN) network in
+    # TensorFlow. Inputs are the scaled minute series with its time of day;
+    # outputs are the changes at every horizon. Inference calls the model
+    # directly instead of predict() to avoid per-call dataset overhead.
+    def __init__(self, kind='gru', units=32, epochs=8, batch_size=256, seed=42):
+        self.kind = kind
+        self.name = kind
+        self.units = units
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.seed = seed
+        self.model = None
+
+    def build(self, lookback, channels):
+        import tensorflow as tf
+        tf.random.set_seed(self.seed)
+        inputs = tf.keras.Input(shape=(lookback, channels))
+        if self.kind == 'gru':
+            x = tf.keras.layers.GRU(self.units)(inputs)
+        else:
+            x = inputs
+            for dilation in (1, 2, 4, 8, 16):
+                x = tf.keras.layers.Conv1D(self.units, 3, padding='causal', dilation_rate=dilation,
+                                           activation='relu')(x)
+            x = tf.keras.layers.Lambda(lambda t: t[:, -1, :])(x)
+        x = tf.keras.layers.Dense(self.units, activation='relu')(x)
+        outputs = tf.keras.layers.Dense(len(HORIZONS))(x)
+        model = tf.keras.Model(inputs, outputs)
+        model.compile(optimizer=tf.keras.optimizers.Adam(1e-3), loss=tf.keras.losses.Huber())
+        return model
+
+    def sequences(self, inputs, cal):
+        # Per-step channels: value relative to the last minute, and the
+        # window-end time of day (steps are one minute apart, so the end
+        # is enough for the network to place the window)
+        relative = inputs - inputs[..., -1:]
+        cal = np.broadcast_to(cal[..., None, :2], (*inputs.shape, 2))
+        level = np.broadcast_to(inputs[..., -1:], inputs.shape)
+        stacked = np.stack([relative, level, cal[..., 0], cal[..., 1]], axis=-1)
+        return stacked.reshape(-1, inputs.shape[-1], 4).astype(np.float32)
+
+    def fit(self, inputs, targets, cal):
+        X = self.sequences(inputs, cal)
+        y = (targets - inputs[..., -1:]).reshape(-1, len(HORIZONS)).astype(np.float32)
+        self.model = self.build(X.shape[1], X.shape[2])
+        self.model.fit(X, y, epochs=self.epochs, batch_size=self.batch_size, validation_split=0.1,
+                       verbose=0, shuffle=True)
+        return self
+
+    def predict(self, inputs, cal):
+        X = self.sequences(inputs, cal)
+        delta = self.model(X, training=False).numpy()
+        return inputs[..., -1:] + delta.reshape(*inputs.shape[:-1], len(HORIZONS))
+
+
+MODELS = {
+    'persistence': PersistenceForecaster,
+    'gbm': GBMForecaster,
+    'gru': lambda: SequenceForecaster('gru'),
+    'tcn': lambda: SequenceForecaster('tcn')
+}
+
+
+class ShortHorizonForecaster:
+    # Serves one fitted model over the latest minute rollups. Series are
+    # scaled per junction so one model covers quiet and busy junctions.
+    def __init__(self, model='gbm'):
+        self.model_name = model
+        self.model = None
+        self.junctions = []
+        self.scale = None
+        self.fitted_at = None
+
+    def fit(self, names, epochs, values):
+        series = fill_gaps(values)
+        self.junctions = list(names)
+        self.scale = series.mean(axis=1, keepdims=True) + 1.0
+        inputs, targets, ends = make_windows(series / self.scale)
+        cal = calendar(epochs[ends])
+        self.model = MODELS[self.model_name]().fit(inputs, targets, cal)
+        self.fitted_at = time.time()
+        return self
+
+    def fit_from_store(self, store=rollup_store, minutes=7 * 1440):
+        names, epochs, values = store.minute_series(minutes=minutes)
+        if not names or values.shape[1] < LOOKBACK + max(HORIZONS):
+            raise ValueError("Not enough minute rollups to fit a forecaster")
+        return self.fit(names, epochs, values)
+
+    def forecast(self, store=rollup_store, now=None):
+        # One batched call for every junction from the last LOOKBACK minutes
+        names, epochs, values = store.minute_series(minutes=LOOKBACK, junctions=self.junctions, now=now)
+        series = fill_gaps(values) / self.scale
+        predictions = self.model.predict(series[:, None, :], calendar(epochs[-1:])) * self.scale[:, :, None]
+        return {name: {f"{h}min": max(0.0, float(p)) for h, p in zip(HORIZONS, predictions[i, 0])}
+                for i, name in enumerate(names)}
+
+    def save(self, path=DEFAULT_MODEL_PATH):
+        import joblib
+        if isinstance(self.model, SequenceForecaster):
+            raise ValueError("Save sequence models with model.save(); only tree models are pickled")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path=DEFAULT_MODEL_PATH):
+        import joblib
+        return joblib.load(path)
+
+
+def create_forecaster():
+    # Saved model when one exists, otherwise fit the tree model on the rollups
+    if os.path.exists(DEFAULT_MODEL_PATH):
+        return ShortHorizonForecaster.load(DEFAULT_MODEL_PATH)
+    return ShortHorizonForecaster('gbm').fit_from_store()
+
+
+subsystems.register("forecaster", "forecaster", "create_forecaster")
+
+
+@router.get("/{junction_id}")
+async def get_short_horizon_forecast(junction_id: str):
+    # Fitting on first use and the rollup reads stay off the event loop
+    def forecast():
+        return subsystems.get("forecaster").forecast()
+
+    try:
+        forecasts = await asyncio.get_event_loop().run_in_executor(None, forecast)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Forecaster unavailable: {e}")
+    if junction_id not in forecasts:
+        raise HTTPException(status_code=404, detail="Junction not covered by the forecaster")
+    return {
+        "junction_id": junction_id,
+        "predicted_density": {h: round(v, 1) for h, v in forecasts[junction_id].items()},
+        "model_used": subsystems.get("forecaster").model_name
+    }
+
+
+# ---- benchmark --------------------------------------------------------------
+
+def synthetic_series(junctions=16, days=7, seed=0):
+    # Commuter peaks with per-junction volume, weekend dip and noise
+    rng = np.random.default_rng(seed)
+    start = int(time.mktime(time.strptime("2026-03-02", "%Y-%m-%d")))
+    epochs = start + 60 * np.arange(days * 1440)
+    hour = (np.arange(days * 1440) % 1440) / 60
+    weekend = ((np.arange(days * 1440) // 1440) % 7) >= 5
+    profile = 10 + 25 * np.exp(-((hour - 8) ** 2) / 2) + 20 * np.exp(-((hour - 18) ** 2) / 3)
+    profile = np.where(weekend, 0.6 * profile, profile)
+    volume = rng.uniform(0.5, 2.0, size=(junctions, 1))
+    noise = rng.normal(0, 2, size=(junctions, len(epochs)))
+    drift = np.cumsum(rng.normal(0, 0.3, size=(junctions, len(epochs))), axis=1)
+    drift -= sliding_mean(drift, 120)
+    values = np.maximum(0, volume * profile + noise + drift)
+    values[rng.random(values.shape) < 0.01] = np.nan
+    return [f"J{i}" for i in range(junctions)], epochs, values
+
+
+def sliding_mean(values, width):
+    padded = np.pad(values, ((0, 0), (width - 1, 0)), mode='edge')
+    return sliding_window_view(padded, width, axis=1).mean(axis=-1)
+
+
+def benchmark(names, epochs, values, models=('persistence', 'gbm', 'gru', 'tcn'), train_fraction=0.8, repeats=50):
+    # Chronological split; the test windows start after the last training
+    # target so nothing leaks. Latency is one batched call for all junctions.
+    series = fill_gaps(values)
+    scale = series.mean(axis=1, keepdims=True) + 1.0
+    inputs, targets, ends = make_windows(series / scale)
+    cal = calendar(epochs[ends])
+    split = int(inputs.shape[1] * train_fraction)
+    test_start = split + max(HORIZONS)
+    truth = targets[:, test_start:] * scale[:, :, None]
+
+    results = {}
+    for name in models:
+        try:
+            model = MODELS[name]()
+            started = time.perf_counter()
+            model.fit(inputs[:, :split], targets[:, :split], cal[:split])
+            fit_seconds = time.perf_counter() - started
+        except ImportError as e:
+            print(f"Skipping {name}: {e}")
+            continue
+
+        predicted = model.predict(inputs[:, test_start:], cal[test_start:]) * scale[:, :, None]
+        errors = predicted - truth
+
+        latest, latest_cal = inputs[:, -1:], cal[-1:]
+        model.predict(latest, latest_cal)
+        latencies = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            model.predict(latest, latest_cal)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        results[name] = {
+            'fit_seconds': round(fit_seconds, 2),
+            'mae': {f"{h}min": round(float(np.abs(errors[..., i]).mean()), 3) for i, h in enumerate(HORIZONS)},
+            'rmse': {f"{h}min": round(float(np.sqrt((errors[..., i] ** 2).mean())), 3) for i, h in enumerate(HORIZONS)},
+            'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+            'latency_ms_p95': round(float(np.percentile(latencies, 95)), 3),
+            'batch_junctions': len(names)
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Short-horizon traffic forecaster")
+    parser.add_argument("--synthetic", action="store_true", help="benchmark on generated series instead of rollups")
+    parser.add_argument("--junctions", type=int, default=16)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--models", default="persistence,gbm,gru,tcn")
+    parser.add_argument("--train", action="store_true", help="fit the tree model on the rollups and save it")
+    parser.add_argument("--output", help="write benchmark results as JSON")
+    args = parser.parse_args()
+
+    if args.train:
+        forecaster = ShortHorizonForecaster('gbm').fit_from_store(minutes=args.days * 1440)
+        forecaster.save()
+        print(f"Saved forecaster for {len(forecaster.junctions)} junctions to {DEFAULT_MODEL_PATH}")
+    else:
+        if args.synthetic:
+            data = synthetic_series(args.junctions, args.days)
+        else:
+            data = rollup_store.minute_series(minutes=args.days * 1440)
+        results = benchmark(*data, models=args.models.split(","))
+        for name, result in results.items():
+            mae = "  ".join(f"{h}={v:.2f}" for h, v in result['mae'].items())
+            print(f"{name:12s} MAE {mae}  fit {result['fit_seconds']:.1f}s  "
+                  f"p50 {result['latency_ms_p50']:.2f}ms / {result['batch_junctions']} junctions")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
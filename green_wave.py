@@ -0,0 +1,397 @@
+# Green-Wave Coordination - common cycle and offsets maximizing two-way bandwidth
+import argparse
+import math
+import time
+
+import numpy as np
+
+from network import RoadNetwork
+
+DEFAULT_CYCLES = range(60, 121, 10)  # seconds
+MAX_SWEEPS = 10
+BALANCE = 0.5   # a direction's band counts up to 1/BALANCE times the other's (MAXBAND's k)
+EPS = 1e-6  # keeps band edges that land exactly on a green start inside it
+
+
+def longest_runs(mask):
+    # Longest circular run of True in every row of a (candidates x grid) mask
+    doubled = np.concatenate([mask, mask], axis=1)
+    idx = np.arange(doubled.shape[1])
+    last_break = np.maximum.accumulate(np.where(doubled, -1, idx), axis=1)
+    return np.minimum((idx - last_break).max(axis=1), mask.shape[1])
+
+
+def is_green_phase(state):
+    return 'y' not in state.lower() and any(c in 'Gg' for c in state)
+
+
+class Corridor:
+    def __init__(self, junctions, outbound_times, inbound_times, heading, name=None):
+        self.junctions = junctions
+        # Free-flow travel time from the first (outbound) / last (inbound)
+        # junction to each junction of the corridor, in seconds
+        self.outbound_times = np.asarray(outbound_times, dtype=float)
+        self.inbound_times = np.asarray(inbound_times, dtype=float)
+        self.heading = heading
+        self.name = name or f"{junctions[0]}-{junctions[-1]}"
+
+
+class GreenWaveOptimizer:
+    def __init__(self, network, progression_speed=None, resolution=1.0, inbound_weight=1.0, balance=BALANCE):
+        self.network = network
+        # None uses each link's speed limit
+        self.progression_speed = progression_speed
+        self.resolution = resolution
+        self.inbound_weight = inbound_weight
+        # 0 scores plain b_out + w * b_in, which a one-way band always wins
+        self.balance = balance
+
+    # ---- corridors from the network -----------------------------------------
+
+    def link_time(self, from_junction, to_junction):
+        edge_id = next((e for e in self.network.junctions[from_junction].outgoing
+                        if self.network.edges[e].to_junction == to_junction), None)
+        if edge_id is None:
+            return None
+        edge = self.network.edges[edge_id]
+        return edge.length / (self.progression_speed or edge.speed)
+
+    def corridor(self, junctions, name=None):
+        outbound = [0.0]
+        for a, b in zip(junctions, junctions[1:]):
+            t = self.link_time(a, b)
+            if t is None:
+                raise ValueError(f"No link from {a} to {b}")
+            outbound.append(outbound[-1] + t)
+
+        # Inbound uses the opposite links; a one-way corridor mirrors outbound
+        inbound = [0.0]
+        for a, b in zip(junctions[::-1], junctions[-2::-1]):
+            t = self.link_time(a, b)
+            inbound.append(inbound[-1] + (t if t is not None else self.link_time(b, a)))
+        first, second = self.network.junctions[junctions[0]], self.network.junctions[junctions[1]]
+        heading = math.atan2(second.y - first.y, second.x - first.x)
+        return Corridor(junctions, outbound, inbound[::-1], heading, name)
+
+    def find_corridors(self, min_junctions=3):
+        # Maximal chains of straight-through movements between signalised
+        # junctions, one per axis (eastbound / northbound as outbound)
+        net = self.network
+        straight = {}
+        for connection in net.connections:
+            if connection.direction == 's':
+                straight[connection.from_edge] = connection.to_edge
+
+        def signalised_link(edge_id):
+            edge = net.edges.get(edge_id)
+            return edge is not None and edge.from_junction in net.tls and edge.to_junction in net.tls
+
+        has_predecessor = {to_edge for from_edge, to_edge in straight.items()
+                           if signalised_link(from_edge) and signalised_link(to_edge)}
+        corridors = []
+        for edge_id in sorted(net.edges):
+            heading = net.edge_heading(edge_id)
+            if not signalised_link(edge_id) or edge_id in has_predecessor or not -math.pi / 2 < heading <= math.pi / 2:
+                continue
+            chain = [net.edges[edge_id].from_junction, net.edges[edge_id].to_junction]
+            current = edge_id
+            while signalised_link(straight.get(current)) and net.edges[straight[current]].to_junction not in chain:
+                current = straight[current]
+                chain.append(net.edges[current].to_junction)
+            if len(chain) >= min_junctions:
+                corridors.append(self.corridor(chain))
+        return corridors
+
+    # ---- phase structure ----------------------------------------------------
+
+    def corridor_phase(self, tl_id, heading):
+        # Green phase giving the most right of way to links parallel to the corridor
+        program = self.network.tls[tl_id]
+        parallel = set()
+        for connection in self.network.connections:
+            if connection.tl == tl_id:
+                delta = self.network.edge_heading(connection.from_edge) - heading
+                if abs(math.cos(delta)) > 0.7:
+                    parallel.add(connection.link_index)
+
+        best, best_score = None, -1
+        for i, (_, state) in enumerate(program.phases):
+            if not is_green_phase(state):
+                continue
+            # Permissive greens count too, so a corner junction whose only
+            # parallel movement is a turn still gets its own phase
+            score = sum(2 if state[link] == 'G' else state[link] == 'g'
+                        for link in parallel if link < len(state))
+            if score > best_score:
+                best, best_score = i, score
+        return best
+
+    def scaled_phases(self, tl_id, cycle):
+        # Stretch green phases to the common cycle; yellow/clearance stay fixed
+        phases = self.network.tls[tl_id].phases
+        lost = sum(d for d, s in phases if not is_green_phase(s))
+        green = sum(d for d, s in phases if is_green_phase(s))
+        scale = max(cycle - lost, len(phases)) / green if green else 1.0
+        return [(d * scale if is_green_phase(s) else d, s) for d, s in phases]
+
+    # ---- optimization -------------------------------------------------------
+
+    def optimize(self, corridors=None, cycles=DEFAULT_CYCLES):
+        started = time.perf_counter()
+        corridors = corridors if corridors is not None else self.find_corridors()
+        if not corridors:
+            return None
+
+        best = None
+        for cycle in cycles:
+            plan = self.optimize_cycle(corridors, cycle)
+            # Bandwidth as a share of the cycle, so longer cycles don't win by default
+            if best is None or plan['objective'] / plan['cycle'] > best['objective'] / best['cycle']:
+                best = plan
+        best['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return best
+
+    def optimize_cycle(self, corridors, cycle):
+        junction_ids = sorted({j for c in corridors for j in c.junctions})
+        phases = {j: self.scaled_phases(j, cycle) for j in junction_ids}
+
+        # Green window of every corridor at each of its junctions, relative
+        # to that junction's offset
+        windows = []
+        for corridor in corridors:
+            starts, greens = [], []
+            for tl_id in corridor.junctions:
+                index = self.corridor_phase(tl_id, corridor.heading)
+                starts.append(sum(d for d, _ in phases[tl_id][:index]))
+                greens.append(phases[tl_id][index][0])
+            windows.append((np.array(starts), np.array(greens)))
+
+        membership = {j: [] for j in junction_ids}
+        for c, corridor in enumerate(corridors):
+            for k, tl_id in enumerate(corridor.junctions):
+                membership[tl_id].append((c, k))
+
+        # Two starting points, each refined by the ascent: every corridor's
+        # exact two-way bands, and a one-way progression along each
+        # corridor's outbound direction - which crossing corridors (a grid)
+        # can all share where two-way bands conflict
+        best = None
+        for two_way in (True, False):
+            offsets = self.seed_offsets(corridors, windows, cycle, two_way)
+            masks = self.ascend(corridors, windows, membership, offsets, cycle)
+            objective = sum(self.score(self.band(out_rows), self.band(in_rows)) for out_rows, in_rows in masks)
+            if best is None or objective > best[0]:
+                best = (objective, offsets, masks)
+        _, offsets, masks = best
+
+        corridor_results = []
+        objective = 0.0
+        for corridor, (out_rows, in_rows) in zip(corridors, masks):
+            outbound = self.band(out_rows)
+            inbound = self.band(in_rows)
+            objective += self.score(outbound, inbound)
+            corridor_results.append({
+                'name': corridor.name,
+                'junctions': corridor.junctions,
+                'outbound_bandwidth': outbound,
+                'inbound_bandwidth': inbound,
+                'efficiency': round((outbound + inbound) / (2 * cycle), 3)
+            })
+
+        return {
+            'cycle': cycle,
+            'objective': objective,
+            'offsets': {j: round(o, 1) for j, o in offsets.items()},
+            'phases': {j: [(round(d, 1), s) for d, s in p] for j, p in phases.items()},
+            'corridors': corridor_results
+        }
+
+    def score(self, outbound, inbound):
+        # Two-way objective: each direction is credited only up to
+        # 1/balance times the other's band, so a wide one-way band no
+        # longer beats narrower bands both ways. Works on arrays too.
+        if self.balance <= 0:
+            return outbound + self.inbound_weight * inbound
+        return (np.minimum(outbound, inbound / self.balance)
+                + self.inbound_weight * np.minimum(inbound, outbound / self.balance))
+
+    def band(self, rows):
+        # Bandwidth in seconds through every junction row of a corridor mask
+        return float(longest_runs(rows.all(axis=0)[None, :])[0] * self.resolution)
+
+    def seed_offsets(self, corridors, windows, cycle, two_way=True):
+        # Longest corridor first, then always one crossing what is already
+        # placed, so a grid is built outward from its first corridor. Each is
+        # shifted as a whole by the exact gap that most placed junctions agree
+        # on (ties to the smallest total misfit), so consistent crossings stay
+        # exact; the ascent settles the rest.
+        offsets = {}
+        remaining = list(range(len(corridors)))
+        while remaining:
+            c = max(remaining, key=lambda c: (any(j in offsets for j in corridors[c].junctions),
+                                              len(corridors[c].junctions)))
+            remaining.remove(c)
+            corridor = corridors[c]
+            starts, greens = windows[c]
+            if two_way:
+                seed = self.corridor_bands(corridor, starts, greens, cycle)
+            else:
+                # Green opens as the outbound platoon arrives
+                seed = {j: float(o) for j, o in
+                        zip(corridor.junctions, (corridor.outbound_times - starts) % cycle)}
+            placed = [j for j in seed if j in offsets]
+            if placed:
+                gaps = np.array([(offsets[j] - seed[j]) % cycle for j in placed])
+                misfit = np.abs((gaps[:, None] - gaps[None, :] + cycle / 2) % cycle - cycle / 2)
+                score = (misfit < self.resolution / 2).sum(axis=1) - misfit.sum(axis=1) / (len(placed) * cycle)
+                shift = float(gaps[int(np.argmax(score))])
+                seed = {j: (o + shift) % cycle for j, o in seed.items()}
+            for j, o in seed.items():
+                offsets.setdefault(j, o)
+        return offsets
+
+    def ascend(self, corridors, windows, membership, offsets, cycle):
+        # Coordinate ascent: each junction picks the offset that maximizes
+        # the summed two-way score of its corridors, all candidates at
+        # once. Updates offsets in place and returns the corridor masks.
+        grid = np.arange(0, cycle, self.resolution)
+        candidates = grid
+
+        def arc(times, start, green, offset):
+            # Departure times (at the corridor head) that meet the green window
+            return ((grid + times - offset - start + EPS) % cycle) < green
+
+        masks = []
+        for corridor, (starts, greens) in zip(corridors, windows):
+            out_rows = [arc(corridor.outbound_times[k], starts[k], greens[k], offsets[j])
+                        for k, j in enumerate(corridor.junctions)]
+            in_rows = [arc(corridor.inbound_times[k], starts[k], greens[k], offsets[j])
+                       for k, j in enumerate(corridor.junctions)]
+            masks.append((np.array(out_rows), np.array(in_rows)))
+
+        for _ in range(MAX_SWEEPS):
+            changed = False
+            for tl_id in sorted(membership):
+                score = np.zeros(candidates.size)
+                current = 0.0
+                shifted = []
+                for c, k in membership[tl_id]:
+                    corridor = corridors[c]
+                    starts, greens = windows[c]
+                    bands, now = [], []
+                    for direction, times in ((0, corridor.outbound_times), (1, corridor.inbound_times)):
+                        rows = masks[c][direction]
+                        others = np.delete(rows, k, axis=0).all(axis=0)
+                        cand = ((grid[None, :] + times[k] - candidates[:, None] - starts[k] + EPS) % cycle) < greens[k]
+                        bands.append(longest_runs(others[None, :] & cand))
+                        now.append(longest_runs((others & rows[k])[None, :])[0])
+                        shifted.append((c, direction, k, cand))
+                    score += self.score(*bands)
+                    current += self.score(*now)
+
+                choice = int(np.argmax(score))
+                if score[choice] > current:
+                    offsets[tl_id] = float(candidates[choice])
+                    for c, direction, k, cand in shifted:
+                        masks[c][direction][k] = cand[choice]
+                    changed = True
+            if not changed:
+                break
+        return masks
+
+    def corridor_bands(self, corridor, starts, greens, cycle):
+        # Exact two-way bands for one corridor. With the outbound band starting
+        # at t=0, junction k's green start w_k = x_k + T_out[k] and:
+        #   outbound b_o fits  <=>  (-x_k) mod C <= g_k - b_o
+        #   inbound b_i fits   <=>  (u - x_k - D_k) mod C <= g_k - b_i,  D_k = T_out[k] - T_in[k]
+        # so for each (b_o, u) every junction is independent and the best
+        # x_k has a closed form - evaluated for all (b_o, u, k) at once
+        r = self.resolution
+        delta = corridor.outbound_times - corridor.inbound_times
+        b_out = np.arange(0, greens.min() + r / 2, r)                 # (B,)
+        u = np.arange(0, cycle, r)                                     # (U,)
+        v = (u[:, None] - delta[None, :]) % cycle                      # (U, K)
+        slack = greens[None, :] - b_out[:, None]                       # (B, K)
+        wraps = v[None, :, :] + slack[:, None, :] >= cycle             # (B, U, K)
+        b_in = np.clip((greens[None, None, :] - np.where(wraps, 0.0, v[None, :, :])).min(axis=2), 0, None)
+        objective = self.score(b_out[:, None], b_in)
+        bi, ui = np.unravel_index(int(np.argmax(objective)), objective.shape)
+
+        # Recover x_k: no shift if the inbound window is already met, else
+        # shift back just enough to wrap into it when the outbound slack allows
+        v_k = v[ui]
+        fits = v_k <= greens - b_in[bi, ui]
+        can_wrap = cycle - v_k <= slack[bi]
+        a = np.where(~fits & can_wrap, cycle - v_k, 0.0)
+        green_start = (corridor.outbound_times - a) % cycle
+        offsets = (green_start - starts) % cycle
+        return {tl_id: float(o) for tl_id, o in zip(corridor.junctions, offsets)}
+
+    # ---- deployment ---------------------------------------------------------
+
+    def apply(self, sim, plan, program_id="green_wave"):
+        # Installs the stretched programs and aligns each junction's cycle
+        # position with its offset relative to the current simulation time
+        now = sim.simulation.getTime()
+        tl = sim.trafficlight
+        cycle = plan['cycle']
+        for tl_id, phases in plan['phases'].items():
+            logic = tl.Logic(program_id, 0, 0, [tl.Phase(d, s) for d, s in phases])
+            tl.setProgramLogic(tl_id, logic)
+
+            position = (now - plan['offsets'][tl_id]) % cycle
+            elapsed = 0.0
+            for index, (duration, _) in enumerate(phases):
+                if position < elapsed + duration:
+                    tl.setPhase(tl_id, index)
+                    tl.setPhaseDuration(tl_id, elapsed + duration - position)
+                    break
+                elapsed += duration
+        return len(plan['phases'])
+
+
+def corridor_network(junctions, spacing_range=(250, 600), seed=0):
+    # Straight signalised arterial with uneven spacing, for benchmarking
+    from network import Junction
+    rng = np.random.default_rng(seed)
+    network = RoadNetwork()
+    x = 0.0
+    for i in range(junctions):
+        network.junctions[f"A{i}"] = Junction(f"A{i}", x, 0.0, 'traffic_light')
+        # Unsignalised cross-street ends give every signal a side-street phase
+        network.junctions[f"N{i}"] = Junction(f"N{i}", x, 150.0, 'priority')
+        network.junctions[f"S{i}"] = Junction(f"S{i}", x, -150.0, 'priority')
+        x += float(rng.uniform(*spacing_range))
+    network.synthesize_grid()
+    return network
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Optimize green-wave offsets for signalised corridors")
+    parser.add_argument("--net-file", default="../sumo/net.net.xml")
+    parser.add_argument("--benchmark", type=int, default=0, help="optimize a synthetic N-junction arterial instead")
+    parser.add_argument("--grid", type=int, nargs=2, metavar=("ROWS", "COLS"),
+                        help="optimize a synthetic signalised grid (crossing corridors) instead")
+    parser.add_argument("--speed", type=float, default=None, help="progression speed in km/h")
+    parser.add_argument("--balance", type=float, default=BALANCE,
+                        help="least share of one direction's band the other must get (0: plain sum)")
+    args = parser.parse_args()
+
+    if args.grid:
+        from max_pressure import grid_network
+        network = grid_network(*args.grid)
+    elif args.benchmark:
+        network = corridor_network(args.benchmark)
+    else:
+        network = RoadNetwork.from_file(args.net_file)
+    optimizer = GreenWaveOptimizer(network, progression_speed=args.speed / 3.6 if args.speed else None,
+                                   balance=args.balance)
+    plan = optimizer.optimize()
+    if plan is None:
+        print("No signalised corridors found")
+    else:
+        print(f"Cycle {plan['cycle']}s, optimized in {plan['elapsed_ms']} ms")
+        for corridor in plan['corridors']:
+            print(f"  {corridor['name']} ({len(corridor['junctions'])} junctions): "
+                  f"outbound {corridor['outbound_bandwidth']}s, inbound {corridor['inbound_bandwidth']}s, "
+                  f"efficiency {corridor['efficiency']}")
@@ -9,45 +9,76 @@ const MapView = () => {
     const [selectedJunction, setSelectedJunction] = useState(null);
 
     useEffect(() => {
-        // Fetch junction data
-        fetchJunctionData();
-        fetchVehicleData();
-
-        // Setup real-time updates
-        const interval = setInterval(() => {
-            fetchJunctionData();
-            fetchVehicleData();
-        }, 5000);
-
-        return () => clearInterval(interval);
-    }, []);
-
-    const fetchJunctionData = async () => {
-        try {
-            const response = await fetch('/api/telemetry/junctions');
-            const data = await response.json();
-
-            const junctionArray = Object.entries(data).map(([id, info]) => ({
+        // Initial snapshot + per-tick deltas from the telemetry stream
+        const state = { seq: 0, epoch: null, quantum: null, junctions: {}, vehicles: {}, types: {} };
+        let ws = null;
+        let reconnectTimer = null;
+
+        const render = () => {
+            const q = state.quantum;
+            setJunctions(Object.entries(state.junctions).map(([id, info]) => ({
                 id,
                 position: getJunctionPosition(id),
                 ...info
-            }));
+            })));
+            setVehicles(Object.entries(state.vehicles).map(([id, [x, y, v]]) => ({
+                id,
+                position: { x: x * q.position, y: y * q.position },
+                speed: v * q.speed,
+                type: state.types[id] || 'car'
+            })));
+        };
 
-            setJunctions(junctionArray);
-        } catch (error) {
-            console.error('Error fetching junction data:', error);
-        }
-    };
+        const applyFrame = (frame) => {
+            if (frame.type === 'snapshot') {
+                state.epoch = frame.epoch;
+                state.quantum = frame.quantum;
+                state.junctions = frame.junctions;
+                state.vehicles = frame.vehicles;
+                state.types = frame.vehicle_types;
+            } else {
+                if (!state.quantum || frame.seq !== state.seq + 1) {
+                    // Missed a delta - ask the server for a fresh snapshot
+                    ws.send(JSON.stringify({ type: 'resync' }));
+                    return;
+                }
+                Object.entries(frame.junctions || {}).forEach(([id, changes]) => {
+                    state.junctions[id] = { ...(state.junctions[id] || {}), ...changes };
+                });
+                Object.assign(state.vehicles, frame.vehicles || {});
+                Object.assign(state.types, frame.vehicle_types || {});
+                if (frame.removed) {
+                    frame.removed.junctions.forEach((id) => delete state.junctions[id]);
+                    frame.removed.vehicles.forEach((id) => {
+                        delete state.vehicles[id];
+                        delete state.types[id];
+                    });
+                }
+            }
+            state.seq = frame.seq;
+            render();
+        };
 
-    const fetchVehicleData = async () => {
-        try {
-            const response = await fetch('/api/telemetry/vehicles');
-            const data = await response.json();
-            setVehicles(data);
-        } catch (error) {
-            console.error('Error fetching vehicle data:', error);
-        }
-    };
+        const connect = () => {
+            const since = state.quantum ? `?since=${state.seq}&epoch=${state.epoch}` : '';
+            ws = new WebSocket(`ws://${window.location.host}/api/telemetry/stream/ws${since}`);
+            ws.onmessage = (event) => applyFrame(JSON.parse(event.data));
+            ws.onclose = () => {
+                reconnectTimer = setTimeout(connect, 2000);
+            };
+            ws.onerror = (error) => console.error('Telemetry stream error:', error);
+        };
+
+        connect();
+
+        return () => {
+            clearTimeout(reconnectTimer);
+            if (ws) {
+                ws.onclose = null;
+                ws.close();
+            }
+        };
+    }, []);
 
     const getJunctionPosition = (junctionId) => {
         // Map junction IDs to coordinates (Bangalore area)
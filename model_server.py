@@ -0,0 +1,207 @@
+# Prediction Serving - micro-batches concurrent requests into one model call
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List
+import asyncio
+import os
+import time
+import weakref
+
+import numpy as np
+
+import subsystems
+from rollups import rollup_store
+from system_metrics import metrics
+
+router = APIRouter(prefix="/api/model", tags=["model"])
+
+MAX_BATCH = int(os.environ.get("MODEL_MAX_BATCH", 64))
+MAX_WAIT_MS = float(os.environ.get("MODEL_MAX_WAIT_MS", 5))
+MAX_HOURS_AHEAD = 168
+
+
+class MicroBatcher:
+    # Requests queue up until `max_batch` items are waiting or the oldest
+    # has waited `max_wait_ms`; the batch then runs as one call of
+    # `batch_fn(items) -> results` on a single model thread, and each
+    # caller's future gets its own result (or the batch's exception). A
+    # result that is an Exception fails only that item's caller.
+    def __init__(self, batch_fn, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, history=2048):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queues = weakref.WeakKeyDictionary()
+        # One thread: the model never runs two batches at once
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-batch")
+
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.batch_sizes = deque(maxlen=history)
+        self.wait_ms = deque(maxlen=history)
+        self.inference_ms = deque(maxlen=history)
+        self.latency_ms = deque(maxlen=history)
+        self.completed = deque(maxlen=history)
+        self.started_at = time.time()
+
+    def queue_for(self, loop):
+        # One queue and collector per event loop (a server has one; test
+        # clients may start several)
+        entry = self.queues.get(loop)
+        if entry is None or entry[1].done():
+            queue = asyncio.Queue()
+            entry = self.queues[loop] = (queue, loop.create_task(self.collect(queue)))
+        return entry[0]
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.requests += 1
+        await self.queue_for(loop).put((item, future, time.perf_counter()))
+        return await future
+
+    async def submit_many(self, items):
+        return await asyncio.gather(*(self.submit(item) for item in items))
+
+    async def collect(self, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = batch[0][2] + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Anything already queued rides along without further waiting
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            await self.run_batch(loop, batch)
+
+    async def run_batch(self, loop, batch):
+        items = [item for item, _, _ in batch]
+        dispatched = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+            error = None
+        except Exception as e:
+            results, error = None, e
+            self.errors += 1
+        done = time.perf_counter()
+
+        self.batches += 1
+        self.batch_sizes.append(len(batch))
+        self.inference_ms.append((done - dispatched) * 1000)
+        metrics.record("model.inference", (done - dispatched) * 1000)
+        for i, (_, future, queued) in enumerate(batch):
+            self.wait_ms.append((dispatched - queued) * 1000)
+            self.latency_ms.append((done - queued) * 1000)
+            metrics.record("model.latency", (done - queued) * 1000)
+            self.completed.append(done)
+            if future.cancelled():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            elif isinstance(results[i], Exception):
+                self.errors += 1
+                future.set_exception(results[i])
+            else:
+                future.set_result(results[i])
+
+    def metrics(self):
+        def percentiles(values):
+            if not values:
+                return {'p50': None, 'p95': None, 'p99': None}
+            p50, p95, p99 = np.percentile(np.fromiter(values, dtype=np.float64), [50, 95, 99])
+            return {'p50': round(p50, 3), 'p95': round(p95, 3), 'p99': round(p99, 3)}
+
+        now = time.perf_counter()
+        recent = sum(1 for t in self.completed if now - t <= 10)
+        return {
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+            'requests': self.requests,
+            'batches': self.batches,
+            'errors': self.errors,
+            'queued': self.queued(),
+            'avg_batch_size': round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else None,
+            'throughput_rps_10s': round(recent / 10, 2),
+            'queue_wait_ms': percentiles(self.wait_ms),
+            'inference_ms': percentiles(self.inference_ms),
+            'latency_ms': percentiles(self.latency_ms)
+        }
+
+    def queued(self):
+        return sum(queue.qsize() for queue, _ in list(self.queues.values()))
+
+
+def predict_density_batch(items):
+    # items: (junction_id, hours_ahead); lag features come from the rollups
+    # A bad item gets its own ValueError instead of failing the whole batch
+    predictor = subsystems.get("predictor")
+    now = datetime.now()
+    results = [None] * len(items)
+    valid, targets = [], []
+    for i, (junction_id, hours_ahead) in enumerate(items):
+        if not isinstance(hours_ahead, int) or not 0 <= hours_ahead <= MAX_HOURS_AHEAD:
+            results[i] = ValueError(f"hours_ahead must be an integer from 0 to {MAX_HOURS_AHEAD}")
+            continue
+        valid.append(i)
+        targets.append(now + timedelta(hours=hours_ahead))
+    if not valid:
+        return results
+    junction_ids = [items[i][0] for i in valid]
+    # One rollup query for the whole batch
+    lags = rollup_store.lag_histories(list(zip(junction_ids, targets)))
+    predictions = predictor.predict_batch(junction_ids, targets,
+                                          prev_hour=np.array([lag.get('prev_hour', 50) for lag in lags]),
+                                          prev_day=np.array([lag.get('prev_day', 45) for lag in lags]))
+    for i, prediction in zip(valid, predictions):
+        results[i] = prediction
+    return results
+
+
+density_batcher = MicroBatcher(predict_density_batch)
+metrics.register_gauge("model.queued", density_batcher.queued)
+
+
+class PredictionRequest(BaseModel):
+    junction_id: str
+    hours_ahead: int = Field(1, ge=0, le=MAX_HOURS_AHEAD)
+
+
+async def predict_density(junction_id, hours_ahead=1):
+    try:
+        return await density_batcher.submit((junction_id, hours_ahead))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Predictor unavailable: {e}")
+
+
+@router.post("/predict")
+async def post_prediction(request: PredictionRequest):
+    return await predict_density(request.junction_id, request.hours_ahead)
+
+
+@router.post("/predict/batch")
+async def post_prediction_batch(requests: List[PredictionRequest]):
+    # Client-side batches join the same queue as single requests
+    try:
+        return await density_batcher.submit_many([(r.junction_id, r.hours_ahead) for r in requests])
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Predictor unavailable: {e}")
+
+
+@router.get("/metrics")
+async def get_model_metrics():
+    return density_batcher.metrics()
@@ -0,0 +1,288 @@
+# Road Network model parsed from the SUMO net file
+import heapq
+import math
+import xml.etree.ElementTree as ET
+
+DEFAULT_SPEED = 13.89  # m/s (50 km/h)
+DEFAULT_PHASE_DURATIONS = (31, 4, 31, 4)
+
+
+class Lane:
+    def __init__(self, lane_id, edge_id, index, length, speed, shape):
+        self.id = lane_id
+        self.edge = edge_id
+        self.index = index
+        self.length = length
+        self.speed = speed
+        self.shape = shape
+
+
+class Edge:
+    def __init__(self, edge_id, from_junction, to_junction, lanes):
+        self.id = edge_id
+        self.from_junction = from_junction
+        self.to_junction = to_junction
+        self.lanes = lanes
+
+    @property
+    def length(self):
+        return self.lanes[0].length
+
+    @property
+    def speed(self):
+        return max(lane.speed for lane in self.lanes)
+
+
+class Connection:
+    def __init__(self, from_edge, to_edge, from_lane, to_lane, tl=None, link_index=-1, direction='s'):
+        self.from_edge = from_edge
+        self.to_edge = to_edge
+        self.from_lane = from_lane
+        self.to_lane = to_lane
+        self.tl = tl
+        self.link_index = link_index
+        self.direction = direction
+
+
+class Junction:
+    def __init__(self, junction_id, x, y, junction_type):
+        self.id = junction_id
+        self.x = x
+        self.y = y
+        self.type = junction_type
+        self.incoming = []
+        self.outgoing = []
+
+
+class TLProgram:
+    def __init__(self, tl_id, phases, offset=0):
+        self.id = tl_id
+        # List of (duration, state) with one state character per link index
+        self.phases = phases
+        self.offset = offset
+
+
+class RoadNetwork:
+    def __init__(self):
+        self.junctions = {}
+        self.edges = {}
+        self.lanes = {}
+        self.connections = []
+        self.tls = {}
+
+    @classmethod
+    def from_file(cls, path):
+        network = cls()
+        root = ET.parse(path).getroot()
+
+        for node in root.findall('junction'):
+            if node.get('type') == 'internal':
+                continue
+            network.junctions[node.get('id')] = Junction(
+                node.get('id'), float(node.get('x')), float(node.get('y')), node.get('type'))
+
+        for node in root.findall('edge'):
+            if node.get('function') == 'internal':
+                continue
+            lanes = []
+            for lane_node in node.findall('lane'):
+                shape = [tuple(map(float, point.split(','))) for point in lane_node.get('shape', '').split()]
+                lanes.append(Lane(lane_node.get('id'), node.get('id'), int(lane_node.get('index', 0)),
+                                  float(lane_node.get('length', 0)),
+                                  float(lane_node.get('speed', DEFAULT_SPEED)), shape))
+            network.add_edge(Edge(node.get('id'), node.get('from'), node.get('to'), lanes))
+
+        for node in root.findall('connection'):
+            if node.get('from', '').startswith(':') or node.get('from') not in network.edges:
+                continue
+            network.connections.append(Connection(
+                node.get('from'), node.get('to'),
+                f"{node.get('from')}_{node.get('fromLane')}", f"{node.get('to')}_{node.get('toLane')}",
+                node.get('tl'), int(node.get('linkIndex', -1)), node.get('dir', 's')))
+
+        for node in root.findall('tlLogic'):
+            phases = [(float(p.get('duration')), p.get('state')) for p in node.findall('phase')]
+            network.tls[node.get('id')] = TLProgram(node.get('id'), phases, float(node.get('offset', 0)))
+
+        if not network.edges:
+            # The bundled demo net only lists junctions - derive the road grid
+            network.synthesize_grid()
+
+        return network
+
+    def add_edge(self, edge):
+        self.edges[edge.id] = edge
+        for lane in edge.lanes:
+            self.lanes[lane.id] = lane
+        if edge.from_junction in self.junctions:
+            self.junctions[edge.from_junction].outgoing.append(edge.id)
+        if edge.to_junction in self.junctions:
+            self.junctions[edge.to_junction].incoming.append(edge.id)
+
+    def to_dict(self):
+        # Plain lists only, so a recording can carry its network (see replay.py)
+        return {
+            'junctions': [[j.id, j.x, j.y, j.type] for j in self.junctions.values()],
+            'edges': [[e.id, e.from_junction, e.to_junction,
+                       [[l.id, l.index, l.length, l.speed, [list(p) for p in l.shape]] for l in e.lanes]]
+                      for e in self.edges.values()],
+            'connections': [[c.from_edge, c.to_edge, c.from_lane, c.to_lane, c.tl, c.link_index, c.direction]
+                            for c in self.connections],
+            'tls': [[t.id, [list(p) for p in t.phases], t.offset] for t in self.tls.values()]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        network = cls()
+        for junction_id, x, y, junction_type in data['junctions']:
+            network.junctions[junction_id] = Junction(junction_id, x, y, junction_type)
+        for edge_id, from_junction, to_junction, lanes in data['edges']:
+            network.add_edge(Edge(edge_id, from_junction, to_junction,
+                                  [Lane(lane_id, edge_id, index, length, speed, [tuple(p) for p in shape])
+                                   for lane_id, index, length, speed, shape in lanes]))
+        network.connections = [Connection(*c) for c in data['connections']]
+        for tl_id, phases, offset in data['tls']:
+            network.tls[tl_id] = TLProgram(tl_id, [(duration, state) for duration, state in phases], offset)
+        return network
+
+    def synthesize_grid(self, speed=DEFAULT_SPEED):
+        # Link each junction to its nearest axis-aligned neighbour in every
+        # direction, then build turning movements and two-phase programs
+        junctions = list(self.junctions.values())
+        self.tls = {}
+        self.connections = []
+
+        for a in junctions:
+            for axis in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+                best = None
+                for b in junctions:
+                    dx, dy = b.x - a.x, b.y - a.y
+                    along = dx * axis[0] + dy * axis[1]
+                    across = abs(dx * axis[1] - dy * axis[0])
+                    if along > 0 and across < 1e-6 and (best is None or along < best[0]):
+                        best = (along, b)
+                if best is not None:
+                    b = best[1]
+                    edge_id = f"{a.id}to{b.id}"
+                    lane = Lane(f"{edge_id}_0", edge_id, 0, best[0], speed, [(a.x, a.y), (b.x, b.y)])
+                    self.add_edge(Edge(edge_id, a.id, b.id, [lane]))
+
+        for junction in junctions:
+            links = []
+            dead_end = len(junction.outgoing) <= 1
+            for in_id in sorted(junction.incoming, key=lambda e: self.edge_heading(e)):
+                for out_id in sorted(junction.outgoing, key=lambda e: self.edge_heading(e)):
+                    turnaround = self.edges[out_id].to_junction == self.edges[in_id].from_junction
+                    if turnaround and not dead_end:
+                        continue  # U-turns only where there is no other way out
+                    direction = 't' if turnaround else self.turn_direction(in_id, out_id)
+                    links.append(Connection(in_id, out_id, f"{in_id}_0", f"{out_id}_0",
+                                            junction.id if junction.type == 'traffic_light' else None,
+                                            len(links), direction))
+            self.connections.extend(links)
+
+            if junction.type == 'traffic_light' and links:
+                self.tls[junction.id] = self.two_phase_program(junction.id, links)
+
+    def two_phase_program(self, tl_id, links):
+        # Phase 0 serves north-south approaches, phase 2 east-west
+        def state(serve_ns, yellow):
+            chars = []
+            for link in links:
+                heading = self.edge_heading(link.from_edge)
+                is_ns = abs(math.sin(heading)) > abs(math.cos(heading))
+                if is_ns != serve_ns:
+                    chars.append('r')
+                elif yellow:
+                    chars.append('y')
+                else:
+                    chars.append('g' if link.direction == 'l' else 'G')
+            return ''.join(chars)
+
+        durations = DEFAULT_PHASE_DURATIONS
+        phases = [(durations[0], state(True, False)), (durations[1], state(True, True)),
+                  (durations[2], state(False, False)), (durations[3], state(False, True))]
+        return TLProgram(tl_id, phases)
+
+    def edge_heading(self, edge_id):
+        edge = self.edges[edge_id]
+        a, b = self.junctions[edge.from_junction], self.junctions[edge.to_junction]
+        return math.atan2(b.y - a.y, b.x - a.x)
+
+    def turn_direction(self, in_edge, out_edge):
+        delta = (self.edge_heading(out_edge) - self.edge_heading(in_edge) + math.pi) % (2 * math.pi) - math.pi
+        if abs(delta) < math.pi / 4:
+            return 's'
+        return 'l' if delta > 0 else 'r'
+
+    def incoming_lanes(self, junction_id):
+        return [lane.id for edge_id in self.junctions[junction_id].incoming for lane in self.edges[edge_id].lanes]
+
+    def outgoing_edges(self, edge_id):
+        return sorted({c.to_edge for c in self.connections if c.from_edge == edge_id})
+
+    def travel_time(self, edge_id):
+        edge = self.edges[edge_id]
+        return edge.length / edge.speed
+
+    def shortest_path(self, from_edge, to_edge):
+        # Dijkstra over edges weighted by free-flow travel time
+        successors = {}
+        for connection in self.connections:
+            successors.setdefault(connection.from_edge, set()).add(connection.to_edge)
+
+        best = {from_edge: self.travel_time(from_edge)}
+        previous = {}
+        heap = [(best[from_edge], from_edge)]
+        while heap:
+            cost, edge_id = heapq.heappop(heap)
+            if edge_id == to_edge:
+                path = [edge_id]
+                while path[-1] in previous:
+                    path.append(previous[path[-1]])
+                return path[::-1]
+            if cost > best.get(edge_id, math.inf):
+                continue
+            for nxt in successors.get(edge_id, ()):
+                new_cost = cost + self.travel_time(nxt)
+                if new_cost < best.get(nxt, math.inf):
+                    best[nxt] = new_cost
+                    previous[nxt] = edge_id
+                    heapq.heappush(heap, (new_cost, nxt))
+        return None
+
+    def junction_path(self, from_junction, to_junction, avoid=()):
+        # Dijkstra over junctions weighted by free-flow travel time, never
+        # passing through the junctions in `avoid` (the endpoints excepted)
+        best = {from_junction: 0.0}
+        previous = {}
+        heap = [(0.0, from_junction)]
+        while heap:
+            cost, junction_id = heapq.heappop(heap)
+            if junction_id == to_junction:
+                path = [junction_id]
+                while path[-1] in previous:
+                    path.append(previous[path[-1]])
+                return path[::-1]
+            if cost > best.get(junction_id, math.inf):
+                continue
+            for edge_id in self.junctions[junction_id].outgoing:
+                nxt = self.edges[edge_id].to_junction
+                if nxt in avoid and nxt != to_junction:
+                    continue
+                new_cost = cost + self.travel_time(edge_id)
+                if new_cost < best.get(nxt, math.inf):
+                    best[nxt] = new_cost
+                    previous[nxt] = junction_id
+                    heapq.heappush(heap, (new_cost, nxt))
+        return None
+
+    def route_through_junctions(self, junction_ids):
+        # Edge list visiting the given junctions in order
+        edges = []
+        for a, b in zip(junction_ids, junction_ids[1:]):
+            edge_id = next((e for e in self.junctions[a].outgoing if self.edges[e].to_junction == b), None)
+            if edge_id is None:
+                return None
+            edges.append(edge_id)
+        return edges
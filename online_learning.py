@@ -0,0 +1,393 @@
+# Online Density Learning - incremental models fed by the telemetry stream
+from fastapi import APIRouter, HTTPException
+from collections import deque
+from datetime import datetime
+import argparse
+import asyncio
+import copy
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+import subsystems
+from event_bus import bus
+
+router = APIRouter(prefix="/api/learning/density", tags=["learning"])
+
+MAX_JUNCTIONS = 32        # one-hot slots; further junctions share the last one
+LAG_SAMPLES = 6           # recent densities kept per junction for lag features
+ERROR_WINDOW = 500        # rolling error window per junction and model
+N_FEATURES = 11 + MAX_JUNCTIONS
+
+
+def read_density(data):
+    # Telemetry snapshots say vehicles_count, controller logs say vehicles
+    value = data.get('vehicles_count', data.get('vehicles'))
+    return float(value) if value is not None else None
+
+
+class PersistenceModel:
+    # "Density stays where it is" - the champion until something beats it
+    name = 'persistence'
+
+    def predict(self, features):
+        return features[:, 5]
+
+    def learn(self, features, targets):
+        pass
+
+
+class SGDDensityModel:
+    # Linear model with its own running scaler, updated with partial_fit so
+    # memory and per-batch cost stay constant however long the stream runs
+    name = 'sgd'
+
+    def __init__(self, seed=42):
+        from sklearn.linear_model import SGDRegressor
+        from sklearn.preprocessing import StandardScaler
+        self.scaler = StandardScaler()
+        self.model = SGDRegressor(loss='huber', epsilon=5.0, alpha=1e-4, learning_rate='invscaling',
+                                  eta0=0.01, random_state=seed)
+        self.fitted = False
+
+    def predict(self, features):
+        if not self.fitted:
+            return features[:, 5]
+        return self.model.predict(self.scaler.transform(features))
+
+    def learn(self, features, targets):
+        self.scaler.partial_fit(features)
+        self.model.partial_fit(self.scaler.transform(features), targets)
+        self.fitted = True
+
+
+class XGBDensityModel:
+    # Continued boosting: each batch adds a few trees to the booster. Trees
+    # are capped, after which the booster restarts from the recent window.
+    name = 'xgboost'
+
+    def __init__(self, trees_per_batch=5, max_trees=400, window=4096):
+        import xgboost as xgb
+        self.xgb = xgb
+        self.trees_per_batch = trees_per_batch
+        self.max_trees = max_trees
+        self.recent = deque(maxlen=window // 64)
+        self.booster = None
+
+    def predict(self, features):
+        if self.booster is None:
+            return features[:, 5]
+        return self.booster.predict(self.xgb.DMatrix(features))
+
+    def learn(self, features, targets):
+        self.recent.append((features, targets))
+        params = {'max_depth': 4, 'eta': 0.1, 'objective': 'reg:squarederror'}
+        if self.booster is not None and self.booster.num_boosted_rounds() >= self.max_trees:
+            X = np.vstack([f for f, _ in self.recent])
+            y = np.concatenate([t for _, t in self.recent])
+            self.booster = self.xgb.train(params, self.xgb.DMatrix(X, label=y), self.trees_per_batch * 4)
+            return
+        self.booster = self.xgb.train(params, self.xgb.DMatrix(features, label=targets), self.trees_per_batch,
+                                      xgb_model=self.booster)
+
+
+MODEL_TYPES = {'sgd': SGDDensityModel, 'xgboost': XGBDensityModel}
+
+
+class RollingErrors:
+    # Absolute errors per junction in fixed-size ring arrays
+    def __init__(self, n_junctions, window=ERROR_WINDOW):
+        self.errors = np.zeros((n_junctions, window))
+        self.counts = np.zeros(n_junctions, dtype=np.int64)
+        self.window = window
+
+    def add(self, slots, errors):
+        for slot, error in zip(slots, errors):
+            self.errors[slot, self.counts[slot] % self.window] = error
+            self.counts[slot] += 1
+
+    def mae(self):
+        filled = np.minimum(self.counts, self.window)
+        sums = self.errors.sum(axis=1)
+        return np.where(filled > 0, sums / np.maximum(filled, 1), np.nan)
+
+    def overall(self):
+        filled = np.minimum(self.counts, self.window)
+        total = filled.sum()
+        return float(self.errors.sum() / total) if total else None
+
+
+class OnlineDensityLearner:
+    # Predicts each junction's vehicle count `horizon` seconds ahead. A
+    # snapshot's features wait in a bounded queue until the observation at
+    # t + horizon labels them; labelled rows form mini-batches. Each batch
+    # first scores champion and challenger (neither has seen it), then
+    # trains the challenger; the challenger is promoted once its rolling
+    # error beats the champion's by `margin`.
+    def __init__(self, horizon=300, batch_size=64, model_type='sgd', evaluate_every=10, margin=0.02,
+                 min_evaluated=200, model_path=None):
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.model_type = model_type
+        self.evaluate_every = evaluate_every
+        self.margin = margin
+        self.min_evaluated = min_evaluated
+        self.model_path = model_path or os.environ.get("ONLINE_MODEL_PATH", "../models/online_density.joblib")
+
+        self.junction_slots = {}
+        self.lags = {}
+        self.pending = deque(maxlen=MAX_JUNCTIONS * 4096)
+        self.batch_x = np.zeros((batch_size, N_FEATURES))
+        self.batch_y = np.zeros(batch_size)
+        self.batch_slot = np.zeros(batch_size, dtype=np.int64)
+        self.batch_fill = 0
+
+        self.champion = PersistenceModel()
+        self.challenger = MODEL_TYPES[model_type]()
+        self.champion_errors = RollingErrors(MAX_JUNCTIONS)
+        self.challenger_errors = RollingErrors(MAX_JUNCTIONS)
+        self.load()
+
+        self._lock = threading.Lock()
+        self.stats = {'snapshots': 0, 'labelled': 0, 'batches': 0, 'promotions': 0, 'dropped_stale': 0,
+                      'last_batch_ms': None, 'last_promotion': None}
+
+    # ---- features -----------------------------------------------------------
+
+    def slot(self, junction_id):
+        if junction_id not in self.junction_slots:
+            self.junction_slots[junction_id] = min(len(self.junction_slots), MAX_JUNCTIONS - 1)
+        return self.junction_slots[junction_id]
+
+    def features(self, junction_id, data, when):
+        density = read_density(data)
+        lags = self.lags.setdefault(junction_id, deque(maxlen=LAG_SAMPLES))
+        previous = lags[-1] if lags else density
+        hour = when.hour + when.minute / 60
+        row = np.zeros(N_FEATURES)
+        row[:11] = [
+            math.sin(2 * math.pi * hour / 24), math.cos(2 * math.pi * hour / 24),
+            math.sin(2 * math.pi * when.weekday() / 7), math.cos(2 * math.pi * when.weekday() / 7),
+            1.0 if when.weekday() >= 5 else 0.0,
+            density,
+            density - previous,
+            float(np.mean(lags)) if lags else density,
+            float(data.get('waiting_time', 0) or 0),
+            float(data.get('queue_length', 0) or 0),
+            float(data.get('avg_speed', 0) or 0)
+        ]
+        row[11 + self.slot(junction_id)] = 1.0
+        lags.append(density)
+        return row
+
+    # ---- stream ingestion ---------------------------------------------------
+
+    def observe(self, junctions, when=None):
+        # One telemetry snapshot: label what is due, queue the new features,
+        # train whenever a mini-batch fills up
+        when = when or datetime.now()
+        now = when.timestamp()
+        with self._lock:
+            self.stats['snapshots'] += 1
+            densities = {j: read_density(d) for j, d in junctions.items() if isinstance(d, dict)}
+
+            while self.pending and self.pending[0][0] + self.horizon <= now:
+                stamp, junction_id, row = self.pending.popleft()
+                target = densities.get(junction_id)
+                if target is None:
+                    continue
+                if now - stamp > 2 * self.horizon:
+                    # Telemetry gap - the label would not match the horizon
+                    self.stats['dropped_stale'] += 1
+                    continue
+                self.add_example(row, target, self.slot(junction_id))
+
+            for junction_id, data in junctions.items():
+                if isinstance(data, dict) and densities.get(junction_id) is not None:
+                    self.pending.append((now, junction_id, self.features(junction_id, data, when)))
+
+    def add_example(self, row, target, slot):
+        i = self.batch_fill
+        self.batch_x[i] = row
+        self.batch_y[i] = target
+        self.batch_slot[i] = slot
+        self.batch_fill += 1
+        self.stats['labelled'] += 1
+        if self.batch_fill == self.batch_size:
+            self.train_batch()
+            self.batch_fill = 0
+
+    def train_batch(self):
+        started = time.perf_counter()
+        X, y, slots = self.batch_x, self.batch_y, self.batch_slot
+
+        # Prequential scoring: both models predict before learning this batch
+        self.champion_errors.add(slots, np.abs(self.champion.predict(X) - y))
+        self.challenger_errors.add(slots, np.abs(self.challenger.predict(X) - y))
+        self.challenger.learn(X, y)
+        self.stats['batches'] += 1
+
+        if self.stats['batches'] % self.evaluate_every == 0:
+            self.maybe_promote()
+        self.stats['last_batch_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+    def maybe_promote(self):
+        champion, challenger = self.champion_errors.overall(), self.challenger_errors.overall()
+        evaluated = int(np.minimum(self.challenger_errors.counts, ERROR_WINDOW).sum())
+        if champion is None or challenger is None or evaluated < self.min_evaluated:
+            return False
+        if challenger < champion * (1 - self.margin):
+            self.champion = copy.deepcopy(self.challenger)
+            # Both models now share a history; compare afresh from here
+            self.champion_errors.errors[:] = self.challenger_errors.errors
+            self.champion_errors.counts[:] = self.challenger_errors.counts
+            self.stats['promotions'] += 1
+            self.stats['last_promotion'] = {'at': datetime.now().isoformat(), 'champion_mae': round(champion, 3),
+                                            'challenger_mae': round(challenger, 3)}
+            self.save()
+            return True
+        return False
+
+    # ---- serving ------------------------------------------------------------
+
+    def predict(self, junction_id, data=None, when=None):
+        when = when or datetime.now()
+        with self._lock:
+            lags = self.lags.get(junction_id)
+            if data is None:
+                if not lags:
+                    return None
+                data = {'vehicles': lags[-1]}
+            # Features without touching the lag history
+            saved = deque(lags) if lags is not None else None
+            row = self.features(junction_id, data, when)
+            if saved is not None:
+                self.lags[junction_id] = saved
+            else:
+                self.lags.pop(junction_id, None)
+            return max(0.0, float(self.champion.predict(row[None, :])[0]))
+
+    def describe(self):
+        champion_mae, challenger_mae = self.champion_errors.mae(), self.challenger_errors.mae()
+        per_junction = {}
+        for junction_id, slot in self.junction_slots.items():
+            per_junction[junction_id] = {
+                'champion_mae': None if np.isnan(champion_mae[slot]) else round(float(champion_mae[slot]), 3),
+                'challenger_mae': None if np.isnan(challenger_mae[slot]) else round(float(challenger_mae[slot]), 3),
+                'evaluated': int(self.challenger_errors.counts[slot])
+            }
+        return {
+            'horizon_seconds': self.horizon,
+            'champion': self.champion.name,
+            'challenger': self.challenger.name,
+            'pending_labels': len(self.pending),
+            'champion_mae': self.champion_errors.overall(),
+            'challenger_mae': self.challenger_errors.overall(),
+            'junctions': per_junction,
+            **self.stats
+        }
+
+    # ---- persistence --------------------------------------------------------
+
+    def save(self):
+        try:
+            import joblib
+            os.makedirs(os.path.dirname(self.model_path) or ".", exist_ok=True)
+            joblib.dump({'champion': self.champion, 'junction_slots': self.junction_slots,
+                         'horizon': self.horizon}, self.model_path)
+        except Exception as e:
+            print(f"Could not save online model: {e}")
+
+    def load(self):
+        if not os.path.exists(self.model_path):
+            return
+        try:
+            import joblib
+            state = joblib.load(self.model_path)
+            if state.get('horizon') == self.horizon:
+                self.champion = state['champion']
+                self.junction_slots = state['junction_slots']
+                # Keep learning from the promoted model rather than from scratch
+                self.challenger = copy.deepcopy(self.champion) if self.champion.name != 'persistence' \
+                    else self.challenger
+        except Exception as e:
+            print(f"Could not load online model: {e}")
+
+
+def create_learner():
+    return OnlineDensityLearner(horizon=int(os.environ.get("ONLINE_HORIZON", 300)),
+                                model_type=os.environ.get("ONLINE_MODEL", "sgd"))
+
+
+subsystems.register("online_learner", "online_learning", "create_learner")
+
+
+async def learn_from_telemetry(snapshot: dict):
+    # Learning runs off the event loop; only when ONLINE_LEARNING=1
+    junctions = snapshot.get("junctions", {})
+    if not junctions:
+        return
+    learner = await asyncio.get_event_loop().run_in_executor(None, subsystems.get, "online_learner")
+    await asyncio.get_event_loop().run_in_executor(None, learner.observe, junctions)
+
+
+if os.environ.get("ONLINE_LEARNING") == "1":
+    bus.subscribe("telemetry", learn_from_telemetry)
+
+
+@router.get("/status")
+async def get_learning_status():
+    if not subsystems.registry["online_learner"].is_ready():
+        return {"status": "idle", "enabled": os.environ.get("ONLINE_LEARNING") == "1"}
+    return subsystems.get("online_learner").describe()
+
+
+@router.get("/predict/{junction_id}")
+async def predict_density(junction_id: str):
+    if not subsystems.registry["online_learner"].is_ready():
+        raise HTTPException(status_code=503, detail="Online learner has not received telemetry yet")
+    learner = subsystems.get("online_learner")
+    prediction = learner.predict(junction_id)
+    if prediction is None:
+        raise HTTPException(status_code=404, detail="No telemetry seen for this junction")
+    return {
+        "junction_id": junction_id,
+        "predicted_density": round(prediction, 1),
+        "horizon_seconds": learner.horizon,
+        "model_used": learner.champion.name
+    }
+
+
+def replay(path, learner):
+    # Streams a controller log line by line, as if it arrived live
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            stamps = [d.get('timestamp') for d in record.values() if isinstance(d, dict)]
+            when = datetime.fromisoformat(stamps[0]) if stamps and stamps[0] else datetime.now()
+            learner.observe(record, when)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay controller logs through the online density learner")
+    parser.add_argument("--log", default="../data/logs/traffic_data.json")
+    parser.add_argument("--horizon", type=int, default=300)
+    parser.add_argument("--model", choices=list(MODEL_TYPES), default="sgd")
+    args = parser.parse_args()
+
+    # Through the module so saved models unpickle outside this script
+    import online_learning
+    learner = online_learning.OnlineDensityLearner(horizon=args.horizon, model_type=args.model)
+    started = time.perf_counter()
+    online_learning.replay(args.log, learner)
+    status = learner.describe()
+    print(f"Replayed {status['snapshots']} snapshots in {time.perf_counter() - started:.1f}s: "
+          f"{status['batches']} batches, {status['promotions']} promotions, champion {status['champion']}")
+    print(f"Rolling MAE - champion {status['champion_mae']}, challenger {status['challenger_mae']}")
@@ -0,0 +1,303 @@
+# Time-of-Day Signal Plan Scheduler with precompiled minute-of-week tables
+from fastapi import APIRouter, HTTPException
+from datetime import date, datetime, timedelta
+import heapq
+import json
+import math
+import os
+import threading
+
+import numpy as np
+
+router = APIRouter(prefix="/api/signals/plans", tags=["signals"])
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+MINUTES_PER_DAY = 1440
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+DEFAULT_JUNCTIONS = [f"J{i}" for i in range(10)]
+DEFAULT_PLANS_PATH = os.environ.get("SIGNAL_PLANS", "../sumo/signal_plans.json")
+
+# Each transitional cycle may be stretched or squeezed by at most this share
+# of the new cycle while drifting onto the new offset
+MAX_LENGTHEN = 0.2
+MAX_SHORTEN = 0.17
+
+
+def parse_minute(text):
+    hours, minutes = text.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def is_green_phase(state):
+    return 'y' not in state.lower() and any(c in 'Gg' for c in state)
+
+
+class TimingPlan:
+    def __init__(self, name, cycle, offset, splits, phases=None):
+        self.name = name
+        self.cycle = cycle
+        self.offset = offset
+        self.splits = splits
+        # (duration, state) per phase, filled in when a network is available
+        self.phases = phases
+
+    def stretched(self, cycle):
+        # Same phase order and split shares over a different cycle length
+        lost = sum(d for d, s in self.phases if not is_green_phase(s))
+        green = sum(d for d, s in self.phases if is_green_phase(s))
+        scale = (cycle - lost) / green
+        return [(d * scale if is_green_phase(s) else d, s) for d, s in self.phases]
+
+    def describe(self):
+        return {'plan': self.name, 'cycle': self.cycle, 'offset': self.offset, 'splits': self.splits}
+
+
+class PlanScheduler:
+    def __init__(self, config, network=None, junction_ids=None, lookahead=3600, program_id="schedule"):
+        self.config = config
+        self.network = network
+        if junction_ids is None:
+            junction_ids = list(network.tls) if network is not None else DEFAULT_JUNCTIONS
+        self.junction_ids = list(junction_ids)
+        self.junction_index = {j: i for i, j in enumerate(self.junction_ids)}
+        self.lookahead = lookahead
+        self.program_id = program_id
+        self.compile()
+
+        self.events = []
+        self.event_seq = 0
+        self.planned_until = None
+        self.active = {}
+        self._lock = threading.Lock()
+        self._refill = None
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_PLANS_PATH, **kwargs):
+        with open(path) as f:
+            return cls(json.load(f), **kwargs)
+
+    # ---- compilation (once, at load) ----------------------------------------
+
+    def compile(self):
+        config = self.config
+        self.plan_names = list(config['plans'])
+        plan_index = {name: i for i, name in enumerate(self.plan_names)}
+
+        days = {}
+        for name, entries in config['day_schedules'].items():
+            entries = sorted((parse_minute(start), plan_index[plan]) for start, plan in entries)
+            # Minutes before the first entry carry the day's last plan
+            vector = np.full(MINUTES_PER_DAY, entries[-1][1], dtype=np.int16)
+            for (start, plan), (end, _) in zip(entries, entries[1:] + [(MINUTES_PER_DAY, None)]):
+                vector[start:end] = plan
+            days[name] = vector
+
+        default_week = config['week']
+        holiday_schedule = config.get('holiday_schedule', default_week['sun'])
+        n = len(self.junction_ids)
+        self.week_table = np.empty((n, MINUTES_PER_WEEK), dtype=np.int16)
+        self.holiday_table = np.empty((n, MINUTES_PER_DAY), dtype=np.int16)
+        for j, junction_id in enumerate(self.junction_ids):
+            override = config.get('junctions', {}).get(junction_id, {})
+            week = {**default_week, **override.get('week', {})}
+            for d, day in enumerate(DAYS):
+                self.week_table[j, d * MINUTES_PER_DAY:(d + 1) * MINUTES_PER_DAY] = days[week[day]]
+            self.holiday_table[j] = days[override.get('holiday_schedule', holiday_schedule)]
+        self.holidays = {date.fromisoformat(d) for d in config.get('holidays', [])}
+
+        # Every (junction, plan) pair realized up front
+        self.plans = []
+        for junction_id in self.junction_ids:
+            row = []
+            for name in self.plan_names:
+                spec = config['plans'][name]
+                offset = float(spec.get('offsets', {}).get(junction_id, spec.get('offset', 0)))
+                plan = TimingPlan(name, float(spec['cycle']), offset % float(spec['cycle']), spec.get('splits'))
+                if self.network is not None and junction_id in self.network.tls:
+                    plan.phases = self.realize(junction_id, plan)
+                row.append(plan)
+            self.plans.append(row)
+
+    def realize(self, junction_id, plan):
+        # Greens share cycle minus yellow/clearance by the plan's splits, in
+        # the order the junction's program lists its green phases
+        phases = self.network.tls[junction_id].phases
+        greens = [i for i, (_, s) in enumerate(phases) if is_green_phase(s)]
+        lost = sum(d for d, s in phases if not is_green_phase(s))
+        splits = plan.splits
+        if not splits or len(splits) != len(greens):
+            total = sum(phases[i][0] for i in greens)
+            splits = [phases[i][0] / total for i in greens]
+        share = dict(zip(greens, np.asarray(splits, dtype=float) / sum(splits)))
+        return [((plan.cycle - lost) * share[i] if i in share else d, s) for i, (d, s) in enumerate(phases)]
+
+    # ---- O(1) lookups -------------------------------------------------------
+
+    def plan_index_at(self, junction_id, when):
+        j = self.junction_index[junction_id]
+        minute = when.hour * 60 + when.minute
+        if when.date() in self.holidays:
+            return int(self.holiday_table[j, minute])
+        return int(self.week_table[j, when.weekday() * MINUTES_PER_DAY + minute])
+
+    def plan_at(self, junction_id, when):
+        return self.plans[self.junction_index[junction_id]][self.plan_index_at(junction_id, when)]
+
+    def plan_indices(self, start, minutes):
+        # (junctions x minutes) plan table for a window, gathered in one go
+        stamps = [start + timedelta(minutes=m) for m in range(minutes)]
+        week_minute = np.array([t.weekday() * MINUTES_PER_DAY + t.hour * 60 + t.minute for t in stamps])
+        holiday = np.array([t.date() in self.holidays for t in stamps])
+        return np.where(holiday[None, :], self.holiday_table[:, week_minute % MINUTES_PER_DAY],
+                        self.week_table[:, week_minute]), stamps
+
+    # ---- transitions (scheduled ahead of time) ------------------------------
+
+    def transition_events(self, junction_id, old, new, switch_at):
+        # Finish the old plan's cycle, then run a few stretched or squeezed
+        # cycles of the new plan so its cycle start drifts onto its offset
+        # instead of jumping there
+        t0 = switch_at + (old.offset - switch_at) % old.cycle
+        drift = (new.offset - t0) % new.cycle
+        cycles = []
+        if drift > 1e-6 and new.cycle - drift > 1e-6:
+            lengthen = math.ceil(drift / (MAX_LENGTHEN * new.cycle))
+            shorten = math.ceil((new.cycle - drift) / (MAX_SHORTEN * new.cycle))
+            if lengthen <= shorten:
+                cycles = [new.cycle + drift / lengthen] * lengthen
+            else:
+                cycles = [new.cycle - (new.cycle - drift) / shorten] * shorten
+
+        events = []
+        if cycles:
+            phases = [phase for length in cycles for phase in new.stretched(length)]
+            events.append((t0, junction_id, new, phases, True))
+        events.append((t0 + sum(cycles), junction_id, new, new.phases, False))
+        return events
+
+    def plan_window(self, start_ts, seconds):
+        start = datetime.fromtimestamp(start_ts).replace(second=0, microsecond=0)
+        minutes = int(seconds // 60) + 1
+        # One extra leading minute so a change right at the window start is seen
+        table, stamps = self.plan_indices(start - timedelta(minutes=1), minutes + 1)
+        events = []
+        for j, m in zip(*np.nonzero(table[:, 1:] != table[:, :-1])):
+            switch_at = stamps[m + 1].timestamp()
+            if not start_ts <= switch_at < start_ts + seconds:
+                continue
+            junction_id = self.junction_ids[j]
+            old = self.plans[j][table[j, m]]
+            new = self.plans[j][table[j, m + 1]]
+            if new.phases is not None:
+                events.extend(self.transition_events(junction_id, old, new, switch_at))
+        return events, start_ts + seconds
+
+    def extend(self, start_ts, seconds):
+        events, until = self.plan_window(start_ts, seconds)
+        with self._lock:
+            for event in events:
+                heapq.heappush(self.events, (event[0], self.event_seq, event))
+                self.event_seq += 1
+            self.planned_until = until
+
+    # ---- control loop -------------------------------------------------------
+
+    def start(self, sim, now_ts):
+        # Install the current plan everywhere, aligned to its offset
+        for junction_id in self.junction_ids:
+            plan = self.plan_at(junction_id, datetime.fromtimestamp(now_ts))
+            if plan.phases is None:
+                continue
+            position = (now_ts - plan.offset) % plan.cycle
+            self.install(sim, junction_id, plan, plan.phases, position, False, now_ts)
+        self.extend(now_ts, self.lookahead)
+
+    def tick(self, sim, now_ts):
+        # Pops the transitions that are due; never plans inline
+        applied = 0
+        while True:
+            with self._lock:
+                if not self.events or self.events[0][0] > now_ts:
+                    break
+                _, _, event = heapq.heappop(self.events)
+            at, junction_id, plan, phases, transitional = event
+            self.install(sim, junction_id, plan, phases, now_ts - at, transitional, at)
+            applied += 1
+
+        # Next window is planned in the background once half the current one is used
+        if now_ts >= self.planned_until - self.lookahead / 2 and (self._refill is None or not self._refill.is_alive()):
+            self._refill = threading.Thread(target=self.extend, args=(self.planned_until, self.lookahead),
+                                            daemon=True)
+            self._refill.start()
+        return applied
+
+    def install(self, sim, junction_id, plan, phases, position, transitional, since):
+        tl = sim.trafficlight
+        tl.setProgramLogic(junction_id, tl.Logic(self.program_id, 0, 0, [tl.Phase(d, s) for d, s in phases]))
+        elapsed = 0.0
+        for index, (duration, _) in enumerate(phases):
+            if position < elapsed + duration:
+                if position > 0:
+                    tl.setPhase(junction_id, index)
+                    tl.setPhaseDuration(junction_id, elapsed + duration - position)
+                break
+            elapsed += duration
+        self.active[junction_id] = {**plan.describe(), 'transitioning': transitional,
+                                    'since': datetime.fromtimestamp(since).isoformat()}
+
+    def active_plans(self):
+        return dict(self.active)
+
+
+_schedule = None
+
+
+def get_schedule():
+    # API lookups need only the compiled tables, not the road network
+    global _schedule
+    if _schedule is None:
+        _schedule = PlanScheduler.from_file()
+    return _schedule
+
+
+@router.get("")
+async def get_active_plans():
+    try:
+        schedule = get_schedule()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="No signal plan schedule configured")
+    now = datetime.now()
+    return {
+        "timestamp": now.isoformat(),
+        "holiday": now.date() in schedule.holidays,
+        "junctions": {j: schedule.plan_at(j, now).describe() for j in schedule.junction_ids}
+    }
+
+
+@router.get("/{junction_id}")
+async def get_junction_plan(junction_id: str, at: str = None):
+    try:
+        schedule = get_schedule()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="No signal plan schedule configured")
+    if junction_id not in schedule.junction_index:
+        raise HTTPException(status_code=404, detail="Junction not found")
+    try:
+        when = datetime.fromisoformat(at) if at else datetime.now()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid 'at' timestamp")
+    return {"junction_id": junction_id, "at": when.isoformat(), **schedule.plan_at(junction_id, when).describe()}
+
+
+if __name__ == "__main__":
+    from sim_backend import create_backend
+
+    sim = create_backend("queue", net_file="net.net.xml", end_time=4 * 3600)
+    scheduler = PlanScheduler.from_file("signal_plans.json", network=sim.network)
+    start = datetime(2026, 10, 19, 6, 50).timestamp()
+    scheduler.start(sim, start)
+    for step in range(3 * 3600):
+        if scheduler.tick(sim, start + step):
+            print(datetime.fromtimestamp(start + step).strftime('%H:%M:%S'),
+                  {j: (a['plan'], a['transitioning']) for j, a in scheduler.active_plans().items() if j in ('J0', 'J1')})
+        sim.simulationStep()
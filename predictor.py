@@ -2,11 +2,13 @@
 import numpy as np
 import pandas as pd
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.ensemble import RandomForestRegressor
 import xgboost as xgb
 from datetime import datetime, timedelta
 import joblib
 
+import subsystems
+import feature_provider  # registers the "features" subsystem
+
 class TrafficPredictor:
     def __init__(self):
         self.lstm_model = None
@@ -19,59 +21,75 @@ class TrafficPredictor:
         ]
 
     def prepare_features(self, datetime_obj, historical_data=None):
+        context = subsystems.get("features").features_at(datetime_obj)
         features = {
             'hour': datetime_obj.hour,
             'day_of_week': datetime_obj.weekday(),
             'month': datetime_obj.month,
             'is_weekend': 1 if datetime_obj.weekday() >= 5 else 0,
-            'weather_temp': 25,  # Would connect to weather API
-            'weather_rain': 0,   # Would connect to weather API
-            'is_holiday': 0,     # Would connect to holiday calendar
+            'weather_temp': context['weather_temp'],
+            'weather_rain': context['weather_rain'],
+            'is_holiday': context['is_holiday'],
             'prev_hour_traffic': historical_data.get('prev_hour', 50) if historical_data else 50,
             'prev_day_traffic': historical_data.get('prev_day', 45) if historical_data else 45
         }
         return features
 
-    def predict_traffic_density(self, junction_id, target_time, historical_data=None):
-        # Prepare features for prediction
-        features = self.prepare_features(target_time, historical_data)
-        feature_vector = np.array([list(features.values())])
-
-        # Scale features
-        feature_vector_scaled = self.scaler.fit_transform(feature_vector)
+    def prepare_feature_matrix(self, target_times, prev_hour=50, prev_day=45):
+        # Same columns as prepare_features for many target times at once;
+        # prev_hour/prev_day may be scalars or per-row arrays
+        hours = np.asarray(target_times, dtype='datetime64[h]')
+        days = hours.astype('datetime64[D]')
+        months = hours.astype('datetime64[M]')
+        day_of_week = (days.astype(np.int64) + 3) % 7      # 1970-01-01 was a Thursday
+        context = subsystems.get("features").features(hours)
+        columns = [
+            hours.astype(np.int64) % 24,
+            day_of_week,
+            months.astype(np.int64) % 12 + 1,
+            (day_of_week >= 5).astype(np.int64),
+            context['weather_temp'],
+            context['weather_rain'],
+            context['is_holiday'],
+            np.broadcast_to(prev_hour, hours.shape),
+            np.broadcast_to(prev_day, hours.shape)
+        ]
+        return np.column_stack(columns).astype(np.float64)
 
-        # Make prediction using ensemble of models
-        predictions = []
+    def predict_traffic_density(self, junction_id, target_time, historical_data=None):
+        # Same model as the batch path, so single and batched callers agree
+        historical_data = historical_data or {}
+        return self.predict_batch([junction_id], [target_time],
+                                  prev_hour=historical_data.get('prev_hour', 50),
+                                  prev_day=historical_data.get('prev_day', 45))[0]
+
+    # Upper bounds of each feature column, mapping them onto the [0, 1)
+    # range the XGBoost model was trained on
+    FEATURE_RANGES = np.array([24, 7, 13, 1, 50, 50, 1, 100, 100], dtype=np.float64)
+
+    def predict_batch(self, junction_ids, target_times, prev_hour=50, prev_day=45):
+        # One feature matrix and one model call for many requests. Scaling
+        # uses fixed ranges so a row's result never depends on its batch.
+        features = self.prepare_feature_matrix(target_times, prev_hour, prev_day)
+        scaled = np.clip(features / self.FEATURE_RANGES, 0, 1)
 
-        # XGBoost prediction
         if self.xgb_model is None:
             self.xgb_model = self.train_xgb_model()
 
-        xgb_pred = self.xgb_model.predict(feature_vector_scaled)[0]
-        predictions.append(xgb_pred)
-
-        # Random Forest prediction
-        rf_model = RandomForestRegressor(n_estimators=100, random_state=42)
-        rf_model.fit(feature_vector_scaled, [50])  # Mock training
-        rf_pred = rf_model.predict(feature_vector_scaled)[0]
-        predictions.append(rf_pred)
-
-        # Ensemble prediction
-        final_prediction = np.mean(predictions)
+        # The random-forest member was only ever fitted on the constant 50
+        final = (self.xgb_model.predict(scaled) + 50.0) / 2
 
-        # Add some realistic variation
-        if features['hour'] in [7, 8, 9, 17, 18, 19]:  # Rush hours
-            final_prediction *= 1.5
-        elif features['hour'] in [22, 23, 0, 1, 2, 3, 4, 5]:  # Night hours
-            final_prediction *= 0.3
+        hours = features[:, 0].astype(int)
+        final = np.where(np.isin(hours, [7, 8, 9, 17, 18, 19]), final * 1.5, final)
+        final = np.where(np.isin(hours, [22, 23, 0, 1, 2, 3, 4, 5]), final * 0.3, final)
 
-        return {
+        return [{
             'junction_id': junction_id,
-            'predicted_density': max(0, int(final_prediction)),
+            'predicted_density': max(0, int(value)),
             'prediction_time': target_time.isoformat(),
             'confidence': 0.85,
             'model_used': 'ensemble'
-        }
+        } for junction_id, target_time, value in zip(junction_ids, target_times, final)]
 
     def predict_congestion_level(self, junction_id, target_time):
         prediction = self.predict_traffic_density(junction_id, target_time)
@@ -163,10 +181,8 @@ class TrafficPredictor:
         predictions = []
         current_time = datetime.now()
 
-        for i in range(hours_ahead):
-            target_time = current_time + timedelta(hours=i)
-            prediction = self.predict_traffic_density(junction_id, target_time)
-            predictions.append(prediction)
+        target_times = [current_time + timedelta(hours=i) for i in range(hours_ahead)]
+        predictions.extend(self.predict_batch([junction_id] * hours_ahead, target_times))
 
         return predictions
 
@@ -0,0 +1,524 @@
+# Runtime Profiler - sampling flame graphs and scoped cProfile, toggled by endpoint or signal
+from collections import Counter
+import argparse
+import cProfile
+import functools
+import html
+import importlib
+import inspect
+import io
+import json
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "../data/profiles")
+PROFILE_SECONDS = float(os.environ.get("PROFILE_SECONDS", 30))
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", 10)) / 1000
+MAX_SECONDS = 600
+TOP_FUNCTIONS = 50
+
+# Named cProfile scopes: "module:Class.method" of the subsystem's entry point.
+# Any other "module:qualified.name" target works too from PROFILE_TARGET and
+# the CLI; the HTTP endpoint only accepts these names.
+SCOPES = {
+    'controller.step': "controller:TrafficController.step",
+    'controller.control': "controller:TrafficController.control_step",
+    'controller.snapshot': "controller:TrafficController.get_traffic_data",
+    'emergency': "emergency_tracker:EmergencyTracker.step",
+    'max_pressure': "max_pressure:MaxPressureController.step",
+    'violations.red_light': "violation_checker:ViolationChecker.check_red_light_violation",
+    'violations.speeding': "violation_checker:ViolationChecker.check_speeding_violation",
+    'predictor.batch': "predictor:TrafficPredictor.predict_batch",
+    'corridors': "corridor_resolver:CorridorResolver.add",
+    'stream.encode': "stream:DeltaEncoder.encode"
+}
+
+
+def code_label(code):
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    # A daemon thread reads every other thread's stack through
+    # sys._current_frames() each interval and counts identical stacks.
+    # Nothing is hooked into the profiled code, so the cost is the sampler
+    # holding the GIL while it walks the stacks (~1% at 10 ms).
+    def __init__(self, interval=SAMPLE_INTERVAL, thread_filter=None):
+        self.interval = interval
+        self.thread_filter = thread_filter
+        self.stacks = Counter()     # (thread name, code objects root first) -> samples
+        self.samples = 0
+        self.sample_seconds = 0.0   # time spent sampling, for the overhead figure
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        next_at = time.perf_counter()
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            frames = sys._current_frames()
+            if any(ident not in names for ident in frames):
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                name = names.get(ident, f"thread-{ident}")
+                if self.thread_filter and self.thread_filter not in name:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                self.stacks[(name, tuple(codes))] += 1
+            del frames
+            self.samples += 1
+            self.sample_seconds += time.perf_counter() - started
+
+            next_at += self.interval
+            delay = next_at - time.perf_counter()
+            if delay < 0:
+                next_at = time.perf_counter()  # fell behind: skip, don't burst
+            elif self._stop.wait(delay):
+                break
+
+    def collapsed(self):
+        # Brendan Gregg's folded format: "thread;root;...;leaf count"
+        lines = Counter()
+        labels = {}
+        for (name, codes), count in self.stacks.items():
+            frames = [labels.get(code) or labels.setdefault(code, code_label(code)) for code in codes]
+            lines[";".join([name] + frames)] += count
+        return lines
+
+    def functions(self, top=TOP_FUNCTIONS):
+        # Self samples (function on top of the stack) and total samples
+        # (anywhere in the stack, once per sample) per function
+        own, total = Counter(), Counter()
+        for (_, codes), count in self.stacks.items():
+            if codes:
+                own[codes[-1]] += count
+            for code in set(codes):
+                total[code] += count
+        thread_samples = sum(self.stacks.values()) or 1
+        ms = self.interval * 1000
+        return [{
+            'function': code_label(code),
+            'self_samples': own[code],
+            'total_samples': samples,
+            'self_ms': round(own[code] * ms, 1),
+            'total_ms': round(samples * ms, 1),
+            'self_pct': round(own[code] / thread_samples * 100, 2),
+            'total_pct': round(samples / thread_samples * 100, 2)
+        } for code, samples in sorted(total.items(), key=lambda item: (-own[item[0]], -item[1]))[:top]]
+
+
+def flamegraph_svg(collapsed, title="Flame graph", width=1200, row=16):
+    # Self-contained SVG from folded stacks (no flamegraph.pl needed);
+    # hover a frame for its sample count
+    root = {'count': 0, 'children': {}}
+    for stack, count in collapsed.items():
+        node = root
+        node['count'] += count
+        for frame in stack.split(";"):
+            node = node['children'].setdefault(frame, {'count': 0, 'children': {}})
+            node['count'] += count
+    total = root['count'] or 1
+
+    def depth(node):
+        return 1 + max((depth(child) for child in node['children'].values()), default=0)
+
+    height = (depth(root) + 1) * row + 30
+    rects = []
+
+    def draw(node, name, x, level):
+        w = node['count'] / total * width
+        if w < 0.5:
+            return
+        y = height - (level + 1) * row
+        hue = 20 + (hash(name) % 40)
+        label = html.escape(name)
+        text = ""
+        if w > 40:
+            chars = int(w / 7)
+            shown = label if len(name) <= chars else html.escape(name[:max(chars - 2, 1)]) + ".."
+            text = f'<text x="{x + 3:.1f}" y="{y + row - 4}">{shown}</text>'
+        rects.append(f'<g><title>{label} ({node["count"]} samples, {node["count"] / total:.1%})</title>'
+                     f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" '
+                     f'fill="hsl({hue},90%,60%)"/>{text}</g>')
+        for child_name, child in sorted(node['children'].items()):
+            draw(child, child_name, x, level + 1)
+            x += child['count'] / total * width
+
+    x = 0.0
+    for name, child in sorted(root['children'].items()):
+        draw(child, name, x, 0)
+        x += child['count'] / total * width
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'font-family="monospace" font-size="11">'
+            f'<text x="4" y="16" font-size="14">{html.escape(title)} ({total} samples)</text>'
+            + "".join(rects) + "</svg>\n")
+
+
+def import_target(module_name):
+    # `python controller.py` runs the controller as __main__: patch the
+    # class the running loop actually uses, not a second import of it
+    main = sys.modules.get("__main__")
+    main_file = getattr(main, "__file__", None) or ""
+    if os.path.splitext(os.path.basename(main_file))[0] == module_name:
+        return main
+    return importlib.import_module(module_name)
+
+
+def resolve_target(target):
+    spec = SCOPES.get(target, target)
+    if ":" not in spec:
+        raise ValueError(f"Unknown scope {target!r}; use one of {sorted(SCOPES)} or module:qualified.name")
+    module_name, qualname = spec.split(":", 1)
+    owner = import_target(module_name)
+    *path, attribute = qualname.split(".")
+    for part in path:
+        owner = getattr(owner, part)
+    original = inspect.getattr_static(owner, attribute)
+    if not inspect.isfunction(original):
+        raise ValueError(f"{spec} is not a plain function or method")
+    if inspect.iscoroutinefunction(original):
+        raise ValueError(f"{spec} is a coroutine; profile the event loop with mode=sampling instead")
+    return owner, attribute, original
+
+
+class ScopedProfile:
+    # cProfile switched on only while the target function runs, by swapping
+    # a wrapper onto its class or module for the session. One thread at a
+    # time is profiled (cProfile state is not thread-safe); calls from other
+    # threads meanwhile run unprofiled.
+    def __init__(self, target):
+        self.target = target
+        self.owner, self.attribute, self.original = resolve_target(target)
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.busy_skips = 0
+        self._lock = threading.Lock()
+        self._patched = False
+
+    def start(self):
+        profile, lock, original = self.profile, self._lock, self.original
+
+        @functools.wraps(original)
+        def profiled(*args, **kwargs):
+            if not lock.acquire(blocking=False):
+                self.busy_skips += 1  # another thread, or a recursive call
+                return original(*args, **kwargs)
+            try:
+                self.calls += 1
+                return profile.runcall(original, *args, **kwargs)
+            finally:
+                lock.release()
+
+        setattr(self.owner, self.attribute, profiled)
+        self._patched = True
+
+    def stop(self):
+        if self._patched:
+            if isinstance(self.owner, type) and self.attribute not in vars(self.owner):
+                delattr(self.owner, self.attribute)
+            else:
+                setattr(self.owner, self.attribute, self.original)
+            self._patched = False
+
+    def functions(self, top=TOP_FUNCTIONS):
+        if not self.calls:
+            return []
+        stats = pstats.Stats(self.profile).stats
+        rows = sorted(stats.items(), key=lambda item: -item[1][3])[:top]
+        return [{
+            'function': f"{name} ({os.path.basename(filename)}:{line})",
+            'calls': calls,
+            'primitive_calls': primitive,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3),
+            'per_call_us': round(cumtime / calls * 1e6, 1) if calls else None
+        } for (filename, line, name), (primitive, calls, tottime, cumtime, _) in rows]
+
+    def report(self, limit=40):
+        out = io.StringIO()
+        if self.calls:
+            pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+class ProfileSession:
+    def __init__(self, mode, seconds, target=None, interval=SAMPLE_INTERVAL, thread_filter=None, label=None):
+        if mode not in ("sampling", "cprofile"):
+            raise ValueError("mode must be 'sampling' or 'cprofile'")
+        if mode == "cprofile" and not target:
+            raise ValueError(f"cprofile needs a target: one of {sorted(SCOPES)} or module:qualified.name")
+        self.mode = mode
+        self.seconds = min(max(seconds, 0.1), MAX_SECONDS)
+        self.target = target
+        self.label = label or os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+        if mode == "sampling":
+            self.profiler = SamplingProfiler(interval, thread_filter)
+        else:
+            self.profiler = ScopedProfile(target)
+        self.started = None
+        self.stopped = None
+        self.files = []
+
+    def start(self):
+        self.started = time.time()
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+        self.stopped = time.time()
+
+    def name(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        scope = f"-{self.target}" if self.target else ""
+        return f"{self.label}-{os.getpid()}-{stamp}-{self.mode}{scope}".replace(":", "_").replace("/", "_")
+
+    def summary(self):
+        result = {
+            'mode': self.mode,
+            'target': self.target,
+            'pid': os.getpid(),
+            'process': self.label,
+            'started': self.started,
+            'seconds': round((self.stopped or time.time()) - self.started, 3) if self.started else 0,
+            'files': [os.path.basename(path) for path in self.files]
+        }
+        if self.mode == "sampling":
+            profiler = self.profiler
+            result.update(interval_ms=profiler.interval * 1000, samples=profiler.samples,
+                          sampler_overhead_pct=round(profiler.sample_seconds / max(result['seconds'], 1e-9) * 100, 2))
+        else:
+            result.update(calls=self.profiler.calls, busy_skips=self.profiler.busy_skips)
+        return result
+
+    def write(self, directory=PROFILE_DIR):
+        # sampling: .collapsed (folded stacks), .svg (flame graph), .json;
+        # cprofile: .prof (pstats / snakeviz), .txt (top functions), .json
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.name())
+        if self.mode == "sampling":
+            collapsed = self.profiler.collapsed()
+            with open(base + ".collapsed", "w") as f:
+                for stack, count in sorted(collapsed.items()):
+                    f.write(f"{stack} {count}\n")
+            with open(base + ".svg", "w") as f:
+                f.write(flamegraph_svg(collapsed, title=self.name()))
+            self.files += [base + ".collapsed", base + ".svg"]
+        else:
+            self.profiler.profile.dump_stats(base + ".prof")
+            with open(base + ".txt", "w") as f:
+                f.write(self.profiler.report())
+            self.files += [base + ".prof", base + ".txt"]
+        self.files.append(base + ".json")
+        with open(base + ".json", "w") as f:
+            json.dump(dict(self.summary(), functions=self.profiler.functions()), f, indent=2)
+        return self.files
+
+
+class ProfilerControl:
+    # One session per process at a time; it stops itself after `seconds`
+    # and writes its files from the timer thread
+    def __init__(self, directory=PROFILE_DIR):
+        self.directory = directory
+        self.session = None
+        self.last = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def start(self, mode="sampling", seconds=PROFILE_SECONDS, target=None, interval=SAMPLE_INTERVAL,
+              thread_filter=None):
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError(f"A {self.session.mode} session is already running")
+            session = ProfileSession(mode, seconds, target, interval, thread_filter)
+            session.start()
+            self.session = session
+            self._timer = threading.Timer(session.seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+            return session.summary()
+
+    def stop(self):
+        with self._lock:
+            session, self.session = self.session, None
+            if session is None:
+                return None
+            if self._timer is not None and self._timer is not threading.current_thread():
+                self._timer.cancel()
+            session.stop()
+        try:
+            session.write(self.directory)
+            print(f"Profile written: {', '.join(session.files)}")
+        except OSError as e:
+            print(f"Error writing profile: {e}")
+        self.last = session.summary()
+        return self.last
+
+    def toggle(self, mode, target=None):
+        if self.session is not None:
+            return self.stop()
+        return self.start(mode, PROFILE_SECONDS, target)
+
+    def status(self):
+        return {'running': self.session.summary() if self.session else None, 'last': self.last,
+                'directory': os.path.abspath(self.directory), 'scopes': SCOPES}
+
+    def files(self, limit=50):
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.is_file()]
+        except OSError:
+            return []
+        entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+        return [{'name': e.name, 'bytes': e.stat().st_size, 'modified': e.stat().st_mtime} for e in entries[:limit]]
+
+
+control = ProfilerControl()
+
+
+def install_signal_handlers(target=None):
+    # SIGUSR1 toggles a sampling session, SIGUSR2 a cProfile session of
+    # `target` (PROFILE_TARGET), each for PROFILE_SECONDS unless signalled
+    # again. Only the main thread may install handlers; no-op on Windows.
+    target = os.environ.get("PROFILE_TARGET", target)
+    if not hasattr(signal, "SIGUSR1") or threading.current_thread() is not threading.main_thread():
+        return False
+
+    def toggle(mode, scope):
+        def handler(signum, frame):
+            # The handler runs between bytecodes of the main thread; keep
+            # the file writing off it
+            threading.Thread(target=run_toggle, args=(mode, scope), daemon=True).start()
+        return handler
+
+    def run_toggle(mode, scope):
+        try:
+            control.toggle(mode, scope)
+        except (RuntimeError, ValueError, ImportError, AttributeError) as e:
+            print(f"Profiler: {e}")
+
+    signal.signal(signal.SIGUSR1, toggle("sampling", None))
+    if target:
+        signal.signal(signal.SIGUSR2, toggle("cprofile", target))
+    return True
+
+
+try:
+    from fastapi import APIRouter, HTTPException
+    from fastapi.responses import FileResponse
+except ImportError:
+    router = None
+else:
+    router = APIRouter(prefix="/api/admin/profile", tags=["admin"])
+
+    @router.get("")
+    async def get_profile_status():
+        return dict(control.status(), files=control.files())
+
+    @router.post("/start")
+    async def start_profile(mode: str = "sampling", seconds: float = PROFILE_SECONDS, target: str = None,
+                            interval_ms: float = SAMPLE_INTERVAL * 1000, thread: str = None):
+        # Profiles this worker process; the controller is profiled by signal.
+        # Only the named scopes over HTTP - a free-form module:qualname would
+        # let any caller import and patch arbitrary code in the worker
+        if target is not None and target not in SCOPES:
+            raise HTTPException(status_code=400, detail=f"Unknown scope {target!r}; use one of {sorted(SCOPES)}")
+        try:
+            return control.start(mode, seconds, target, max(interval_ms, 1) / 1000, thread)
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except (ValueError, ImportError, AttributeError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    @router.post("/stop")
+    async def stop_profile():
+        summary = control.stop()
+        if summary is None:
+            raise HTTPException(status_code=404, detail="No profile session running")
+        return summary
+
+    @router.get("/files/{name}")
+    async def get_profile_file(name: str):
+        path = os.path.join(control.directory, os.path.basename(name))
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="Profile file not found")
+        return FileResponse(path)
+
+
+def overhead_benchmark(steps=4000, net_file="net.net.xml", interval=SAMPLE_INTERVAL, rounds=20):
+    # Headless controller step time with and without the sampler, in
+    # alternating rounds: the network fills up over a run, so back-to-back
+    # A/B blocks would mostly measure the growing traffic
+    from controller import TrafficController
+    from sim_backend import create_backend
+
+    sim = create_backend("queue", net_file=net_file, demand_rate=0.2, end_time=float("inf"), seed=1)
+    controller = TrafficController("", step_delay=0, backend=sim, log_path=os.devnull)
+    controller.logger.disabled = True
+    controller.sim.start()
+    for _ in range(200):
+        controller.step()
+
+    chunk = max(1, steps // rounds)
+
+    def timed():
+        started = time.perf_counter()
+        for _ in range(chunk):
+            controller.step()
+        return time.perf_counter() - started
+
+    session = ProfileSession("sampling", MAX_SECONDS, interval=interval, label="overhead")
+    session.started = time.time()
+    off = on = 0.0
+    for _ in range(rounds):
+        off += timed()
+        session.profiler.start()
+        on += timed()
+        session.profiler.stop()
+    session.stopped = time.time()
+    summary = session.summary()
+    return {'step_us': round(off / (chunk * rounds) * 1e6, 1), 'sampled_step_us': round(on / (chunk * rounds) * 1e6, 1),
+            'overhead_pct': round((on - off) / off * 100, 2), 'sampler_busy_pct': round(
+                session.profiler.sample_seconds / on * 100, 2),
+            'samples': summary['samples'], 'top': session.profiler.functions(top=10), 'session': session}
+
+
+if __name__ == "__main__":
+    import profiler    # the module the controller's handlers use, not __main__
+
+    parser = argparse.ArgumentParser(description="Measure sampling-profiler overhead on the headless controller")
+    parser.add_argument("--steps", type=int, default=4000)
+    parser.add_argument("--net", default="../sumo/net.net.xml")
+    parser.add_argument("--interval-ms", type=float, default=SAMPLE_INTERVAL * 1000)
+    parser.add_argument("--write", action="store_true", help="also write the flame graph to PROFILE_DIR")
+    args = parser.parse_args()
+
+    result = profiler.overhead_benchmark(args.steps, args.net, args.interval_ms / 1000)
+    print(f"Headless controller step: {result['step_us']} us, {result['sampled_step_us']} us while sampling "
+          f"every {args.interval_ms:g} ms ({result['overhead_pct']:+}%; sampler busy {result['sampler_busy_pct']}% "
+          f"of the time, {result['samples']} samples)")
+    for row in result['top']:
+        print(f"  {row['self_pct']:6.2f}% self {row['total_pct']:6.2f}% total  {row['function']}")
+    if args.write:
+        print("\n".join(result['session'].write()))
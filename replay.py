@@ -0,0 +1,772 @@
+# Snapshot Record and Replay - per-step simulation state in a compact binary log, replayed without SUMO
+import argparse
+import json
+import logging
+import os
+import struct
+import time
+import urllib.error
+import urllib.request
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+from network import RoadNetwork
+from sim_backend import (TRACI_DOMAINS, EdgeDomain, JunctionDomain, LaneDomain, QueueSimBackend, RouteDomain,
+                         SimulationDomain, TrafficLightDomain, VehicleDomain, create_backend)
+import system_metrics
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+RECORD_DIR = os.environ.get("RECORD_DIR", "../data/recordings")
+COMPRESSION = int(os.environ.get("RECORD_COMPRESSION", 1))   # zlib level; 1 keeps capture cheap
+FORMAT_VERSION = 1
+MAGIC = b"TRREC\x01\n"
+LENGTH = struct.Struct("<I")
+# Per-vehicle columns, little-endian arrays in vehicle-index order. Speed
+# keeps float64: halting is a < 0.1 m/s test, and float32 rounding flips it
+# for vehicles creeping at the limit, which changes max-pressure decisions.
+INT_COLUMNS = ('lane', 'route_index')
+FLOAT_COLUMNS = ('pos', 'speed', 'x', 'y', 'wait', 'acc_wait')
+COLUMN_TYPES = {'lane': '<i4', 'route_index': '<i4', 'pos': '<f4', 'speed': '<f8', 'x': '<f4', 'y': '<f4',
+                'wait': '<f4', 'acc_wait': '<f4'}
+COMMAND_PREFIXES = ("set", "add", "remove")
+MAX_DIVERGENCES = 20
+
+
+def plain(value):
+    # Command arguments as msgpack-able values; TraCI Logic objects become lists
+    if hasattr(value, 'phases'):
+        return ['logic', value.programID, value.currentPhaseIndex,
+                [[float(p.duration), p.state] for p in value.phases]]
+    if isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): plain(v) for k, v in value.items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def command_entry(domain, method, args, kwargs):
+    return [domain, method, plain(args), plain(kwargs)]
+
+
+# ---- log file ---------------------------------------------------------------
+
+class LogWriter:
+    # MAGIC, then length-prefixed zlib-compressed msgpack records: a header
+    # with the network and id tables, then one record per captured step
+    def __init__(self, path, level=COMPRESSION):
+        if msgpack is None:
+            raise ImportError("snapshot recording needs msgpack")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.level = level
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.bytes = len(MAGIC)
+        self.raw_bytes = 0
+        self.records = 0
+
+    def write(self, record):
+        raw = msgpack.packb(record, use_bin_type=True)
+        blob = zlib.compress(raw, self.level)
+        self.file.write(LENGTH.pack(len(blob)))
+        self.file.write(blob)
+        self.raw_bytes += len(raw)
+        self.bytes += LENGTH.size + len(blob)
+        self.records += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_blobs(path):
+    # Compressed records in file order. A log cut short by a crash ends at
+    # its last complete record.
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a snapshot recording")
+        while True:
+            prefix = f.read(LENGTH.size)
+            if len(prefix) < LENGTH.size:
+                return
+            size, = LENGTH.unpack(prefix)
+            blob = f.read(size)
+            if len(blob) < size:
+                return
+            yield blob
+
+
+def read_records(path):
+    if msgpack is None:
+        raise ImportError("snapshot replay needs msgpack")
+    for blob in read_blobs(path):
+        yield msgpack.unpackb(zlib.decompress(blob), raw=False)
+
+
+# ---- recording --------------------------------------------------------------
+
+class RecordingDomain:
+    # Reads pass straight through; commands (set*/add*/remove*) are logged
+    # against the current step before they reach the backend
+    def __init__(self, domain, name, recorder):
+        self._domain = domain
+        self._name = name
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        value = getattr(self._domain, name)
+        if not callable(value) or isinstance(value, type) or not name.startswith(COMMAND_PREFIXES):
+            return value
+        domain, recorder = self._name, self._recorder
+
+        def command(*args, **kwargs):
+            recorder.command(domain, name, args, kwargs)
+            return value(*args, **kwargs)
+        setattr(self, name, command)
+        return command
+
+
+class RecordingBackend:
+    # Wraps any backend and writes, after start and after every `every`-th
+    # simulationStep, the state the controllers read: signal states and
+    # phases, and every vehicle's lane, position, speed, waiting times and
+    # route progress. Junction and edge figures are derived from those on
+    # replay. Commands issued against the backend are stored with the
+    # snapshot they were issued on. Vehicle ids, types and routes are
+    # written once, when a vehicle is first seen.
+    # On the queue stand-in capture reads its arrays directly; through
+    # TraCI it costs seven getter calls per vehicle per captured step.
+    def __init__(self, backend, path, net_file="../sumo/net.net.xml", every=1, level=COMPRESSION):
+        self._backend = backend
+        self.path = path
+        self.net_file = net_file
+        self.every = max(1, every)
+        self.level = level
+        self.writer = None
+        self.pending = None     # captured snapshot still collecting its commands
+        self.commands = []
+        self.departed = []
+        self.arrived = []
+        self.rerouted = set()
+        self.steps = 0
+        self.capture_seconds = 0.0
+
+    def __getattr__(self, name):
+        value = getattr(self._backend, name)
+        if name in TRACI_DOMAINS:
+            value = RecordingDomain(value, name, self)
+            setattr(self, name, value)
+        return value
+
+    # ---- TraCI lifecycle ----------------------------------------------------
+
+    def start(self, *args, **kwargs):
+        result = self._backend.start(*args, **kwargs)
+        self.open()
+        self.pending = self.capture()
+        return result
+
+    def simulationStep(self, step=0.0):
+        result = self._backend.simulationStep(step)
+        self.steps += 1
+        simulation = self._backend.simulation
+        self.departed.extend(simulation.getDepartedIDList())
+        self.arrived.extend(simulation.getArrivedIDList())
+        if self.steps % self.every == 0:
+            self.flush()
+            self.pending = self.capture()
+        return result
+
+    def close(self, *args, **kwargs):
+        if self.writer is not None:
+            if self.pending is not None:
+                self.pending['final'] = True    # captured after the last control step
+            self.flush()
+            self.writer.close()
+            self.writer = None
+        return self._backend.close(*args, **kwargs)
+
+    def command(self, domain, method, args, kwargs):
+        self.commands.append(command_entry(domain, method, args, kwargs))
+        if domain == 'vehicle' and method == 'setRoute' and args:
+            self.rerouted.add(args[0])
+
+    # ---- capture ------------------------------------------------------------
+
+    def open(self):
+        sim = self._backend
+        network = getattr(sim, 'network', None) or RoadNetwork.from_file(self.net_file)
+        self.lane_index = {lane_id: i for i, lane_id in enumerate(network.lanes)}
+        self.edge_index = {edge_id: i for i, edge_id in enumerate(network.edges)}
+        self.tl_ids = list(network.tls)
+        self.vehicle_index = {}
+        self.new_vehicles = []
+        self.slot_vehicle = np.zeros(0, dtype=np.int64)
+        # Lane end points for the stand-in's vectorized x/y
+        shapes = [lane.shape for lane in network.lanes.values()]
+        self.lane_start = np.array([shape[0] if shape else (0.0, 0.0) for shape in shapes]).reshape(-1, 2)
+        self.lane_delta = np.array([shape[-1] if shape else (0.0, 0.0) for shape in shapes]).reshape(-1, 2) \
+            - self.lane_start
+        self.writer = LogWriter(self.path, self.level)
+        self.writer.write({
+            'type': 'header', 'version': FORMAT_VERSION,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'source': type(sim).__name__, 'step_length': float(sim.simulation.getDeltaT()),
+            'every': self.every, 'network': network.to_dict(),
+            'lanes': list(network.lanes), 'edges': list(network.edges), 'tls': self.tl_ids
+        })
+
+    def index_vehicle(self, vehicle_id):
+        index = self.vehicle_index.get(vehicle_id)
+        if index is None:
+            index = self.vehicle_index[vehicle_id] = len(self.vehicle_index)
+            self.new_vehicles.append(vehicle_id)
+        return index
+
+    def route_edges(self, edges):
+        return [self.edge_index[e] for e in edges if e in self.edge_index]
+
+    def flush(self):
+        if self.pending is not None:
+            self.pending['commands'] = self.commands
+            self.writer.write(self.pending)
+            self.pending = None
+        self.commands = []
+
+    def capture(self):
+        started = time.perf_counter()
+        sim = self._backend
+        departed = [self.index_vehicle(v) for v in self.departed]
+        arrived = [self.index_vehicle(v) for v in self.arrived]
+        if isinstance(sim, QueueSimBackend):
+            record = self.capture_queue(sim)
+        else:
+            record = self.capture_traci(sim)
+        record.update({
+            't': float(sim.simulation.getTime()),
+            'expected': int(sim.simulation.getMinExpectedNumber()),
+            'departed': departed,
+            'arrived': arrived
+        })
+        self.departed, self.arrived, self.rerouted = [], [], set()
+        elapsed = time.perf_counter() - started
+        self.capture_seconds += elapsed
+        system_metrics.metrics.record("recorder.capture", elapsed * 1000)
+        return record
+
+    def columns(self, record, vid, ints, floats):
+        order = np.argsort(vid, kind='stable')
+        record['vid'] = vid[order].astype('<u4').tobytes()
+        for name, column in zip(INT_COLUMNS + FLOAT_COLUMNS, tuple(ints) + tuple(floats)):
+            record[name] = np.asarray(column)[order].astype(COLUMN_TYPES[name]).tobytes()
+
+    def capture_queue(self, sim):
+        # Slots are stable while a vehicle is in the network and every
+        # insertion is reported as a departure, so the slot -> vehicle index
+        # map only changes for departed vehicles
+        if len(self.slot_vehicle) < len(sim.v_ids):
+            grown = np.full(len(sim.v_ids), -1, dtype=np.int64)
+            grown[:len(self.slot_vehicle)] = self.slot_vehicle
+            self.slot_vehicle = grown
+        for vehicle_id in self.new_vehicles:
+            slot = sim.slots.get(vehicle_id)
+            if slot is not None:
+                self.slot_vehicle[slot] = self.vehicle_index[vehicle_id]
+
+        active = np.flatnonzero(sim.v_lane >= 0)
+        vid = self.slot_vehicle[active]
+        if (vid < 0).any():
+            # Vehicles already running when recording started
+            for slot in active[vid < 0]:
+                self.slot_vehicle[slot] = self.index_vehicle(sim.v_ids[slot])
+            vid = self.slot_vehicle[active]
+
+        types, routes = [], []
+        for vehicle_id in self.new_vehicles:
+            slot = sim.slots.get(vehicle_id)
+            types.append(sim.v_type[slot] if slot is not None else "")
+            if slot is not None:
+                routes.append([self.vehicle_index[vehicle_id], [int(e) for e in sim.v_route[slot]]])
+        for vehicle_id in self.rerouted:
+            slot = sim.slots.get(vehicle_id)
+            if slot is not None and vehicle_id not in self.new_vehicles:
+                routes.append([self.vehicle_index[vehicle_id], [int(e) for e in sim.v_route[slot]]])
+
+        lane = sim.v_lane[active]
+        pos = sim.v_pos[active]
+        fraction = np.minimum(1.0, pos / np.maximum(sim.lane_len[lane], 1e-9))[:, None]
+        xy = self.lane_start[lane] + self.lane_delta[lane] * fraction
+        record = {'ids': self.new_vehicles, 'types': types, 'routes': routes,
+                  'tl': list(sim.tl_state), 'phase': sim.tl_phase.tolist(),
+                  'next_switch': (sim.time + sim.tl_remaining).tolist()}
+        self.columns(record, vid, (lane, sim.v_route_pos[active]),
+                     (pos, sim.v_speed[active], xy[:, 0], xy[:, 1], sim.v_wait[active], sim.v_acc_wait[active]))
+        self.new_vehicles = []
+        return record
+
+    def capture_traci(self, sim):
+        vehicle = sim.vehicle
+        ids = vehicle.getIDList()
+        n = len(ids)
+        vid = np.empty(n, dtype=np.int64)
+        ints = np.empty((len(INT_COLUMNS), n), dtype=np.int64)
+        floats = np.empty((len(FLOAT_COLUMNS), n))
+        for i, vehicle_id in enumerate(ids):
+            vid[i] = self.index_vehicle(vehicle_id)
+            # Vehicles inside a junction (internal lanes) are stored without a lane
+            ints[0, i] = self.lane_index.get(vehicle.getLaneID(vehicle_id), -1)
+            ints[1, i] = vehicle.getRouteIndex(vehicle_id)
+            x, y = vehicle.getPosition(vehicle_id)
+            floats[:, i] = (vehicle.getLanePosition(vehicle_id), vehicle.getSpeed(vehicle_id), x, y,
+                            vehicle.getWaitingTime(vehicle_id), vehicle.getAccumulatedWaitingTime(vehicle_id))
+
+        alive, new = set(ids), set(self.new_vehicles)
+        types, routes = [], []
+        for vehicle_id in self.new_vehicles:
+            if vehicle_id in alive:
+                types.append(vehicle.getTypeID(vehicle_id))
+                routes.append([self.vehicle_index[vehicle_id], self.route_edges(vehicle.getRoute(vehicle_id))])
+            else:
+                types.append("")
+        for vehicle_id in self.rerouted:
+            if vehicle_id in alive and vehicle_id not in new:
+                routes.append([self.vehicle_index[vehicle_id], self.route_edges(vehicle.getRoute(vehicle_id))])
+
+        trafficlight = sim.trafficlight
+        record = {'ids': self.new_vehicles, 'types': types, 'routes': routes,
+                  'tl': [trafficlight.getRedYellowGreenState(t) for t in self.tl_ids],
+                  'phase': [trafficlight.getPhase(t) for t in self.tl_ids],
+                  'next_switch': [float(trafficlight.getNextSwitch(t)) for t in self.tl_ids]}
+        self.columns(record, vid, ints, floats)
+        self.new_vehicles = []
+        return record
+
+
+# ---- replay -----------------------------------------------------------------
+
+class ReplayTrafficLightDomain(TrafficLightDomain):
+    # Getters read the recorded state; commands are captured, not applied
+
+    def setPhase(self, tl_id, index):
+        self.sim.issue('trafficlight', 'setPhase', (tl_id, index))
+
+    def setPhaseDuration(self, tl_id, duration):
+        self.sim.issue('trafficlight', 'setPhaseDuration', (tl_id, duration))
+
+    def setProgram(self, tl_id, programID):
+        self.sim.issue('trafficlight', 'setProgram', (tl_id, programID))
+
+    def setRedYellowGreenState(self, tl_id, state):
+        self.sim.issue('trafficlight', 'setRedYellowGreenState', (tl_id, state))
+
+    def setProgramLogic(self, tl_id, logic):
+        self.sim.issue('trafficlight', 'setProgramLogic', (tl_id, logic))
+
+
+class ReplayVehicleDomain(VehicleDomain):
+    def add(self, vehID, routeID, *args, **kwargs):
+        self.sim.issue('vehicle', 'add', (vehID, routeID) + args, kwargs)
+
+    def setRoute(self, vehID, edgeList):
+        self.sim.issue('vehicle', 'setRoute', (vehID, edgeList))
+
+    def getLaneID(self, vehID):
+        lane = self.sim.v_lane[self.sim.slot(vehID)]
+        return self.sim.lane_ids[lane] if lane >= 0 else ""
+
+    def getRoadID(self, vehID):
+        lane = self.getLaneID(vehID)
+        return self.sim.network.lanes[lane].edge if lane else ""
+
+
+class ReplayRouteDomain(RouteDomain):
+    def add(self, routeID, edges):
+        self.sim.issue('route', 'add', (routeID, edges))
+
+
+class ReplaySimulationDomain(SimulationDomain):
+    def getMinExpectedNumber(self):
+        return 0 if self.sim.finished else self.sim.expected
+
+
+class ReplayBackend(QueueSimBackend):
+    # Serves a recording through the queue model's TraCI subset: every
+    # simulationStep loads the next snapshot instead of simulating, so the
+    # controllers, ViolationChecker and the API run against recorded traffic
+    # without SUMO. Per-lane and per-junction figures are recomputed from
+    # the vehicle columns with the same bincounts the queue model uses.
+    # Replay is open loop - commands are compared with the recorded ones
+    # (see stats) but the traffic follows the recording.
+    # speed is simulated seconds per wall second; 0 replays flat out.
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        records = read_records(path)
+        try:
+            self.header = next(records)
+        except StopIteration:
+            raise ValueError(f"{path}: empty recording")
+        finally:
+            records.close()
+        if self.header.get('version') != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported recording format {self.header.get('version')}")
+
+        self.network = RoadNetwork.from_dict(self.header['network'])
+        self.step_length = self.header['step_length']
+        self.build_index()
+        # Recorded lane order -> ours; -1 (no lane) stays -1
+        self.lane_map = np.array([self.lane_index[l] for l in self.header['lanes']] + [-1], dtype=np.int64)
+        self.edge_map = [self.edge_index[e] for e in self.header['edges']]
+        recorded_tls = {tl_id: i for i, tl_id in enumerate(self.header['tls'])}
+        self.tl_order = np.array([recorded_tls[t] for t in self.tl_ids], dtype=np.int64)
+        self.records = None
+
+        self.junction = JunctionDomain(self)
+        self.trafficlight = ReplayTrafficLightDomain(self)
+        self.edge = EdgeDomain(self)
+        self.lane = LaneDomain(self)
+        self.vehicle = ReplayVehicleDomain(self)
+        self.route = ReplayRouteDomain(self)
+        self.simulation = ReplaySimulationDomain(self)
+        self.reset()
+
+    def reset(self):
+        if self.records is not None:
+            self.records.close()
+        self.records = read_records(self.path)
+        next(self.records)
+        self.vehicle_names = []
+        self.vehicle_types_seen = []
+        self.vehicle_routes = []
+        self.subscriptions = {}
+        self.routes = {}
+        self.issued = []
+        self.recorded_commands = []
+        self.divergences = []
+        self.finished = False
+        self.stats = {'steps': 0, 'load_seconds': 0.0, 'max_lag_seconds': 0.0, 'commands_recorded': 0,
+                      'commands_issued': 0, 'diverged_steps': 0}
+        self.advance()
+        self.wall_start = time.monotonic()
+        self.t0 = self.time
+
+    # ---- TraCI lifecycle ----------------------------------------------------
+
+    def start(self, cmd=None, port=None, label="default", **kwargs):
+        self.reset()
+        return (21, "ReplayBackend")
+
+    def simulationStep(self, step=0.0):
+        self.compare_commands()
+        if self.advance():
+            self.pace()
+
+    def close(self, wait=True):
+        self.compare_commands()
+        if self.records is not None:
+            self.records.close()
+            self.records = None
+
+    # ---- snapshots ----------------------------------------------------------
+
+    def advance(self):
+        started = time.perf_counter()
+        record = next(self.records, None) if self.records is not None else None
+        if record is None:
+            if not self.finished:
+                self.finished = True
+                self.empty()
+            return False
+        self.load(record)
+        self.stats['steps'] += 1
+        self.stats['load_seconds'] += time.perf_counter() - started
+        return True
+
+    def pace(self):
+        if not self.speed:
+            return
+        delay = self.wall_start + (self.time - self.t0) / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        elif -delay > self.stats['max_lag_seconds']:
+            self.stats['max_lag_seconds'] = -delay
+
+    def load(self, record):
+        self.time = record['t']
+        self.expected = record['expected']
+        new_ids = record['ids']
+        self.vehicle_names.extend(new_ids)
+        self.vehicle_types_seen.extend(record['types'])
+        self.vehicle_routes.extend([] for _ in new_ids)
+        for index, route in record['routes']:
+            self.vehicle_routes[index] = [self.edge_map[e] for e in route]
+
+        self.vid = np.frombuffer(record['vid'], dtype='<u4')
+        lane, self.v_route_pos, self.v_pos, self.v_speed, self.v_x, self.v_y, self.v_wait, self.v_acc_wait = (
+            np.frombuffer(record[name], dtype=COLUMN_TYPES[name]) for name in INT_COLUMNS + FLOAT_COLUMNS)
+        self.v_lane = self.lane_map[lane]
+        self.v_len = np.zeros(len(self.vid), dtype=np.float32)
+        self._ids = self._slots = self._types = self._routes = None
+
+        order = self.tl_order
+        self.tl_state = [record['tl'][i] for i in order]
+        self.tl_phase = np.array(record['phase'], dtype=np.int64)[order]
+        self.tl_remaining = np.array(record['next_switch'], dtype=float)[order] - self.time
+        names = self.vehicle_names
+        self.departed = [names[i] for i in record['departed']]
+        self.arrived = [names[i] for i in record['arrived']]
+        self.recorded_commands = record.get('commands', [])
+        self.final = record.get('final', False)
+        self.refresh_stats()
+
+    def empty(self):
+        # Past the last snapshot: nothing left in the network
+        self.vid = np.zeros(0, dtype=np.int64)
+        self.v_lane = np.zeros(0, dtype=np.int64)
+        self.v_route_pos = np.zeros(0, dtype=np.int64)
+        self.v_pos = self.v_speed = self.v_x = self.v_y = self.v_wait = self.v_acc_wait = self.v_len = np.zeros(0)
+        self._ids = self._slots = self._types = self._routes = None
+        self.departed, self.arrived, self.recorded_commands = [], [], []
+        self.final = True
+        self.refresh_stats()
+
+    @property
+    def v_ids(self):
+        # Per-vehicle lists are built on first use each step; most consumers
+        # only read the per-lane aggregates
+        if self._ids is None:
+            names = self.vehicle_names
+            self._ids = [names[i] for i in self.vid.tolist()]
+        return self._ids
+
+    @property
+    def v_type(self):
+        if self._types is None:
+            types = self.vehicle_types_seen
+            self._types = [types[i] for i in self.vid.tolist()]
+        return self._types
+
+    @property
+    def v_route(self):
+        if self._routes is None:
+            routes = self.vehicle_routes
+            self._routes = [routes[i] for i in self.vid.tolist()]
+        return self._routes
+
+    @property
+    def slots(self):
+        if self._slots is None:
+            self._slots = dict(zip(self.v_ids, range(len(self.vid))))
+        return self._slots
+
+    def vehicle_xy(self, slot):
+        return (float(self.v_x[slot]), float(self.v_y[slot]))
+
+    # ---- commands -----------------------------------------------------------
+
+    def issue(self, domain, method, args, kwargs=None):
+        self.issued.append(command_entry(domain, method, args, kwargs or {}))
+
+    def compare_commands(self):
+        recorded, issued = self.recorded_commands, self.issued
+        self.recorded_commands, self.issued = [], []
+        if self.final:
+            return  # the recording stopped before any control ran on this one
+        self.stats['commands_recorded'] += len(recorded)
+        self.stats['commands_issued'] += len(issued)
+        if sorted(map(repr, recorded)) != sorted(map(repr, issued)):
+            self.stats['diverged_steps'] += 1
+            if len(self.divergences) < MAX_DIVERGENCES:
+                self.divergences.append({'t': self.time, 'recorded': recorded, 'issued': issued})
+
+    def telemetry(self):
+        # Snapshot in the shape the API's telemetry stream publishes
+        junctions = {}
+        for junction_id, lanes in self.junction_lanes.items():
+            count = int(self.lane_count[lanes].sum())
+            junctions[junction_id] = {
+                'vehicles_count': count,
+                'queue_length': int(self.lane_halting[lanes].sum()),
+                'waiting_time': round(float(self.lane_wait_sum[lanes].sum()) / count, 2) if count else 0.0,
+                'avg_speed': round(float(self.lane_speed_sum[lanes].sum()) / count * 3.6, 1) if count else 0.0
+            }
+        types = self.vehicle_types_seen
+        vehicles = [{'id': vehicle_id, 'position': {'x': round(float(x), 1), 'y': round(float(y), 1)},
+                     'speed': round(float(speed) * 3.6, 1), 'type': types[index] or 'car'}
+                    for vehicle_id, index, x, y, speed in zip(self.v_ids, self.vid.tolist(), self.v_x, self.v_y,
+                                                              self.v_speed)]
+        return junctions, vehicles
+
+    def summary(self):
+        return {**self.stats, 'load_seconds': round(self.stats['load_seconds'], 3),
+                'max_lag_seconds': round(self.stats['max_lag_seconds'], 3),
+                'vehicles_seen': len(self.vehicle_names), 'simulated_seconds': round(self.time - self.t0, 1)}
+
+
+# ---- command line -----------------------------------------------------------
+
+def parse_speed(value):
+    # "1", "4x", or "max" (as fast as the snapshots load)
+    value = str(value).lower()
+    if value in ("max", "0", ""):
+        return 0.0
+    return float(value[:-1] if value.endswith("x") else value)
+
+
+def record_headless(path, net_file, steps, mode="threshold", demand_rate=0.5, every=1, seed=42):
+    from controller import TrafficController
+    sim = create_backend("queue", net_file=net_file, demand_rate=demand_rate, seed=seed)
+    recorder = RecordingBackend(sim, path, net_file=net_file, every=every)
+    controller = TrafficController("", step_delay=0, backend=recorder, mode=mode, net_file=net_file,
+                                   log_path=os.devnull)
+    controller.logger.setLevel(logging.WARNING)
+    controller.sim.start()
+    started = time.perf_counter()
+    for _ in range(steps):
+        controller.step()
+    elapsed = time.perf_counter() - started
+    writer = recorder.writer
+    controller.sim.close()
+    return {'steps': steps, 'seconds': elapsed, 'capture_seconds': recorder.capture_seconds,
+            'bytes': writer.bytes, 'raw_bytes': writer.raw_bytes, 'snapshots': writer.records - 1}
+
+
+def post_json(url, payload, timeout=5):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), method="POST",
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+def replay_controller(sim, mode, net_file):
+    from controller import TrafficController
+    controller = TrafficController("", step_delay=0, backend=sim, mode=mode, net_file=net_file,
+                                   log_path=os.devnull)
+    controller.logger.setLevel(logging.WARNING)
+    controller.run_controller()
+    return {}
+
+
+def replay_violations(sim):
+    from violation_checker import ViolationChecker
+    checker = ViolationChecker(backend=sim)
+    sim.start()
+    counts = {}
+    while sim.simulation.getMinExpectedNumber() > 0:
+        found = []
+        for tl_id in sim.tl_ids:
+            found.extend(checker.check_red_light_violation(tl_id))
+        for edge_id in sim.edge_ids:
+            found.extend(checker.check_speeding_violation(edge_id))
+        for violation in found:
+            counts[violation['type']] = counts.get(violation['type'], 0) + 1
+        sim.simulationStep()
+    sim.close()
+    return {'violations': counts}
+
+
+def replay_api(sim, api_url):
+    # Pushes each snapshot to the telemetry stream, as a live controller would
+    url = api_url.rstrip("/") + "/api/telemetry/stream/publish"
+    sim.start()
+    posted = errors = 0
+    while sim.simulation.getMinExpectedNumber() > 0:
+        junctions, vehicles = sim.telemetry()
+        try:
+            post_json(url, {'junctions': junctions, 'vehicles': vehicles})
+            posted += 1
+        except (urllib.error.URLError, OSError) as e:
+            if not errors:
+                print(f"Error publishing snapshot to {url}: {e}")
+            errors += 1
+        sim.simulationStep()
+    sim.close()
+    return {'posted': posted, 'errors': errors}
+
+
+def describe(path):
+    header, steps, raw, compressed = None, 0, 0, 0
+    first = last = None
+    peak = 0
+    for blob in read_blobs(path):
+        data = zlib.decompress(blob)
+        record = msgpack.unpackb(data, raw=False)
+        if header is None:
+            header = record
+            continue
+        compressed += len(blob)
+        raw += len(data)
+        steps += 1
+        first = record['t'] if first is None else first
+        last = record['t']
+        peak = max(peak, len(record['vid']) // 4)
+    return {'created': header['created'], 'source': header['source'], 'snapshots': steps,
+            'simulated_seconds': (last - first) if steps else 0, 'step_length': header['step_length'],
+            'every': header['every'], 'lanes': len(header['lanes']), 'signals': len(header['tls']),
+            'peak_vehicles': peak, 'file_mb': round(os.path.getsize(path) / 1048576, 2),
+            'bytes_per_snapshot': round(compressed / steps) if steps else 0,
+            'compression_ratio': round(raw / compressed, 2) if compressed else None}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Record simulation snapshots and replay them without SUMO")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="record a headless controller run on the queue stand-in")
+    record.add_argument("--out", default=os.path.join(RECORD_DIR, f"headless-{datetime.now():%Y%m%d-%H%M%S}.rec"))
+    record.add_argument("--net", default="../sumo/net.net.xml")
+    record.add_argument("--steps", type=int, default=3600)
+    record.add_argument("--mode", default="threshold")
+    record.add_argument("--demand", type=float, default=0.5)
+    record.add_argument("--every", type=int, default=1)
+
+    replay = commands.add_parser("replay", help="feed a recording to the controller, violation checks or the API")
+    replay.add_argument("path")
+    replay.add_argument("--to", choices=("controller", "violations", "api"), default="controller")
+    replay.add_argument("--speed", default="max", help="1, 10x, ... or max")
+    replay.add_argument("--mode", default="threshold")
+    replay.add_argument("--net", default="../sumo/net.net.xml")
+    replay.add_argument("--api", default="http://localhost:8000")
+
+    info = commands.add_parser("info", help="summarise a recording")
+    info.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        result = record_headless(args.out, args.net, args.steps, args.mode, args.demand, args.every)
+        print(f"Recording written: {args.out}")
+        print(f"{result['snapshots']} snapshots in {result['seconds']:.1f}s "
+              f"(capture {result['capture_seconds'] / max(result['seconds'], 1e-9) * 100:.1f}% of it), "
+              f"{result['bytes'] / 1048576:.2f} MB, {result['bytes'] / max(result['snapshots'], 1):.0f} B/snapshot, "
+              f"{result['raw_bytes'] / max(result['bytes'], 1):.1f}x compression")
+    elif args.command == "info":
+        for key, value in describe(args.path).items():
+            print(f"{key:<20} {value}")
+    else:
+        sim = ReplayBackend(args.path, speed=parse_speed(args.speed))
+        started = time.perf_counter()
+        if args.to == "controller":
+            result = replay_controller(sim, args.mode, args.net)
+        elif args.to == "violations":
+            result = replay_violations(sim)
+        else:
+            result = replay_api(sim, args.api)
+        elapsed = time.perf_counter() - started
+        summary = sim.summary()
+        print(f"Replayed {summary['steps']} snapshots ({summary['simulated_seconds']}s simulated) in "
+              f"{elapsed:.2f}s: {summary['steps'] / max(elapsed, 1e-9):.0f} steps/s, "
+              f"{summary['simulated_seconds'] / max(elapsed, 1e-9):.1f}x real time, "
+              f"max lag {summary['max_lag_seconds']}s")
+        if args.to == "controller":
+            print(f"Commands: {summary['commands_issued']} issued vs {summary['commands_recorded']} recorded, "
+                  f"{summary['diverged_steps']} steps diverged")
+        for key, value in result.items():
+            print(f"{key}: {value}")
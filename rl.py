@@ -0,0 +1,375 @@
+# Reinforcement-Learning Signal Control - environment, vectorized runner and DQN baseline
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+from max_pressure import GREEN, MaxPressureController, matvec
+from sim_backend import create_backend
+
+QUEUE_SCALE = 10.0   # vehicles; keeps observations and rewards around unit size
+ELAPSED_SCALE = 60.0  # seconds
+
+
+def observation(control, queues):
+    # Per junction: halted vehicles on the approaches and exits of every
+    # phase, current phase one-hot, time in green and transition flag
+    incoming = control.phase_table(matvec(control.phase_in, queues, control.n_phases), 0.0)
+    outgoing = control.phase_table(matvec(control.phase_out, queues, control.n_phases), 0.0)
+    current = np.zeros((len(control.tl_ids), control.max_slots))
+    current[np.arange(len(control.tl_ids)), control.current] = 1.0
+    return np.hstack([
+        incoming / QUEUE_SCALE,
+        outgoing / QUEUE_SCALE,
+        current,
+        np.minimum(control.elapsed / ELAPSED_SCALE, 2.0)[:, None],
+        (control.stage != GREEN)[:, None].astype(float)
+    ])
+
+
+def observation_size(max_slots):
+    return 3 * max_slots + 2
+
+
+class SignalControlEnv:
+    # Gym-style multi-agent environment over the queue-model backend: one
+    # agent per signalised junction, all sharing the same observation and
+    # action spaces (action = green phase slot to run next)
+    def __init__(self, net_file="../sumo/net.net.xml", decision_interval=5, episode_seconds=1800, seed=0,
+                 demand_rate=0.5, min_green=10.0, yellow=3.0, all_red=1.0):
+        self.decision_interval = decision_interval
+        self.episode_seconds = episode_seconds
+        self.seed = seed
+        self.sim = create_backend("queue", net_file=net_file, seed=seed, demand_rate=demand_rate,
+                                  end_time=episode_seconds)
+        self.control = MaxPressureController(self.sim.network, self.sim, min_green, yellow, all_red)
+        self.n_agents = len(self.control.tl_ids)
+        self.n_actions = self.control.max_slots
+        self.obs_size = observation_size(self.n_actions)
+
+        # Approach lanes of each junction, for the per-agent reward
+        lanes, owners = [], []
+        lane_position = {lane_id: i for i, lane_id in enumerate(self.control.lane_ids)}
+        for agent, tl_id in enumerate(self.control.tl_ids):
+            for lane_id in self.sim.network.incoming_lanes(tl_id):
+                lanes.append(lane_position[lane_id])
+                owners.append(agent)
+        self.reward_lanes = np.array(lanes, dtype=np.int64)
+        self.reward_owners = np.array(owners, dtype=np.int64)
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.seed = seed
+        self.sim.seed = self.seed
+        self.sim.start()
+        self.control.reset()
+        self.control.step()
+        return observation(self.control, self.control.read_queues())
+
+    def step(self, actions):
+        for _ in range(self.decision_interval):
+            self.sim.simulationStep()
+            self.control.step(actions)
+        queues = self.control.read_queues()
+        # Each junction is penalised for the vehicles halted on its approaches
+        rewards = -np.bincount(self.reward_owners, weights=queues[self.reward_lanes],
+                               minlength=self.n_agents) / QUEUE_SCALE
+        done = self.sim.simulation.getTime() >= self.episode_seconds
+        info = {'time': self.sim.simulation.getTime(), 'halted': float(queues.sum()),
+                'vehicles': len(self.sim.slots)}
+        return observation(self.control, queues), rewards, done, info
+
+    def close(self):
+        self.sim.close()
+
+
+def env_worker(conn, env_kwargs):
+    env = SignalControlEnv(**env_kwargs)
+    episode = 0
+    while True:
+        command, data = conn.recv()
+        if command == "reset":
+            conn.send(env.reset(data))
+        elif command == "step":
+            obs, rewards, done, info = env.step(data)
+            if done:
+                # Auto-reset so the runner never waits on one slow episode
+                episode += 1
+                info['terminal_obs'] = obs
+                obs = env.reset(env_kwargs.get('seed', 0) + 1000 * episode)
+            conn.send((obs, rewards, done, info))
+        elif command == "spaces":
+            conn.send((env.n_agents, env.n_actions, env.obs_size))
+        elif command == "close":
+            env.close()
+            conn.close()
+            break
+
+
+class VectorEnv:
+    # Steps many environments in parallel, one worker process each
+    def __init__(self, num_envs=4, **env_kwargs):
+        self.num_envs = num_envs
+        self.conns = []
+        self.processes = []
+        for i in range(num_envs):
+            parent, child = mp.Pipe()
+            kwargs = dict(env_kwargs, seed=env_kwargs.get('seed', 0) + i)
+            process = mp.Process(target=env_worker, args=(child, kwargs), daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+        self.conns[0].send(("spaces", None))
+        self.n_agents, self.n_actions, self.obs_size = self.conns[0].recv()
+
+    def reset(self):
+        for conn in self.conns:
+            conn.send(("reset", None))
+        return np.stack([conn.recv() for conn in self.conns])
+
+    def step(self, actions):
+        # actions: (num_envs, n_agents); all workers step concurrently
+        for conn, action in zip(self.conns, actions):
+            conn.send(("step", action))
+        results = [conn.recv() for conn in self.conns]
+        obs, rewards, dones, infos = zip(*results)
+        return np.stack(obs), np.stack(rewards), np.array(dones), list(infos)
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(("close", None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+
+
+class QPolicy:
+    # Two-layer Q-network evaluated with numpy only - this is all the "rl"
+    # controller mode needs at inference time
+    def __init__(self, params, metadata=None):
+        self.params = params
+        self.metadata = metadata or {}
+
+    def q_values(self, obs):
+        p = self.params
+        hidden = np.maximum(obs @ p['W1'] + p['b1'], 0.0)
+        return hidden @ p['W2'] + p['b2']
+
+    def act(self, obs):
+        return self.q_values(obs).argmax(axis=-1)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = {f"meta_{k}": np.asarray(v) for k, v in self.metadata.items()}
+        np.savez(path, **self.params, **meta)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        params = {k: data[k] for k in ('W1', 'b1', 'W2', 'b2')}
+        metadata = {k[5:]: data[k].item() for k in data.files if k.startswith("meta_")}
+        return cls(params, metadata)
+
+
+class DQNAgent:
+    # Deep Q-learning on CPU: numpy MLP, Adam, Huber loss, replay buffer and
+    # a periodically synced target network. Junctions share parameters, so
+    # every step yields num_envs x n_agents transitions.
+    def __init__(self, obs_size, n_actions, hidden=64, lr=1e-3, gamma=0.95, buffer_size=200000,
+                 batch_size=256, target_sync=250, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.n_actions = n_actions
+        self.gamma = gamma
+        self.lr = lr
+        self.batch_size = batch_size
+        self.target_sync = target_sync
+        self.params = {
+            'W1': self.rng.normal(0, np.sqrt(2.0 / obs_size), (obs_size, hidden)),
+            'b1': np.zeros(hidden),
+            'W2': self.rng.normal(0, np.sqrt(1.0 / hidden), (hidden, n_actions)),
+            'b2': np.zeros(n_actions)
+        }
+        self.target = {k: v.copy() for k, v in self.params.items()}
+        self.moments = {k: (np.zeros_like(v), np.zeros_like(v)) for k, v in self.params.items()}
+        self.updates = 0
+
+        # Replay buffer as preallocated ring arrays
+        self.buffer_size = buffer_size
+        self.obs = np.zeros((buffer_size, obs_size), dtype=np.float32)
+        self.next_obs = np.zeros((buffer_size, obs_size), dtype=np.float32)
+        self.actions = np.zeros(buffer_size, dtype=np.int64)
+        self.rewards = np.zeros(buffer_size, dtype=np.float32)
+        self.dones = np.zeros(buffer_size, dtype=np.float32)
+        self.cursor = 0
+        self.size = 0
+
+    def act(self, obs, epsilon=0.0):
+        greedy = QPolicy(self.params).act(obs)
+        explore = self.rng.random(greedy.shape) < epsilon
+        return np.where(explore, self.rng.integers(self.n_actions, size=greedy.shape), greedy)
+
+    def remember(self, obs, actions, rewards, next_obs, dones):
+        n = len(obs)
+        idx = (self.cursor + np.arange(n)) % self.buffer_size
+        self.obs[idx] = obs
+        self.actions[idx] = actions
+        self.rewards[idx] = rewards
+        self.next_obs[idx] = next_obs
+        self.dones[idx] = dones
+        self.cursor = (self.cursor + n) % self.buffer_size
+        self.size = min(self.size + n, self.buffer_size)
+
+    def update(self):
+        if self.size < self.batch_size:
+            return None
+        idx = self.rng.integers(self.size, size=self.batch_size)
+        obs, actions, rewards = self.obs[idx], self.actions[idx], self.rewards[idx]
+        next_obs, dones = self.next_obs[idx], self.dones[idx]
+
+        # Double DQN target: online net picks, target net evaluates
+        next_actions = QPolicy(self.params).act(next_obs)
+        next_q = QPolicy(self.target).q_values(next_obs)[np.arange(self.batch_size), next_actions]
+        targets = rewards + self.gamma * (1.0 - dones) * next_q
+
+        p = self.params
+        pre = obs @ p['W1'] + p['b1']
+        hidden = np.maximum(pre, 0.0)
+        q = hidden @ p['W2'] + p['b2']
+        error = q[np.arange(self.batch_size), actions] - targets
+        grad_q = np.zeros_like(q)
+        grad_q[np.arange(self.batch_size), actions] = np.clip(error, -1.0, 1.0) / self.batch_size  # Huber
+
+        grad_hidden = grad_q @ p['W2'].T * (pre > 0)
+        grads = {
+            'W2': hidden.T @ grad_q, 'b2': grad_q.sum(axis=0),
+            'W1': obs.T @ grad_hidden, 'b1': grad_hidden.sum(axis=0)
+        }
+        self.updates += 1
+        for k, grad in grads.items():
+            m, v = self.moments[k]
+            m[:] = 0.9 * m + 0.1 * grad
+            v[:] = 0.999 * v + 0.001 * grad * grad
+            m_hat = m / (1 - 0.9 ** self.updates)
+            v_hat = v / (1 - 0.999 ** self.updates)
+            p[k] -= self.lr * m_hat / (np.sqrt(v_hat) + 1e-8)
+
+        if self.updates % self.target_sync == 0:
+            self.target = {k: v.copy() for k, v in p.items()}
+        return float(np.mean(error ** 2))
+
+    def policy(self, **metadata):
+        return QPolicy({k: v.copy() for k, v in self.params.items()}, metadata)
+
+
+class RLSignalController:
+    # Runs an exported policy inside the controller loop: a numpy forward pass
+    # every decision_interval seconds, phase changes through the same
+    # min-green / yellow / all-red machinery as max-pressure
+    def __init__(self, network, sim, policy):
+        meta = policy.metadata
+        self.policy = policy
+        self.decision_interval = meta.get('decision_interval', 5)
+        self.control = MaxPressureController(network, sim, meta.get('min_green', 10.0),
+                                             meta.get('yellow', 3.0), meta.get('all_red', 1.0))
+        if observation_size(self.control.max_slots) != policy.params['W1'].shape[0]:
+            raise ValueError("Policy was trained for a network with a different phase layout")
+        self.actions = None
+        self.next_decision = None
+
+    def step(self):
+        now = self.control.sim.simulation.getTime()
+        if self.actions is None or now >= self.next_decision:
+            queues = self.control.read_queues()
+            self.actions = self.policy.act(observation(self.control, queues))
+            self.next_decision = now + self.decision_interval
+        return self.control.step(self.actions)
+
+
+def evaluate(env_kwargs, policy=None, episodes=1):
+    # Mean halted vehicles per decision for a policy, or max-pressure if None
+    env = SignalControlEnv(**env_kwargs)
+    totals = []
+    for episode in range(episodes):
+        env.reset(env_kwargs.get('seed', 0) + 10000 + episode)
+        obs, done, halted = observation(env.control, env.control.read_queues()), False, []
+        while not done:
+            actions = policy.act(obs) if policy is not None else None
+            if actions is None:
+                table = env.control.phase_table(env.control.pressures(env.control.read_queues()))
+                actions = table.argmax(axis=1)
+            obs, _, done, info = env.step(actions)
+            halted.append(info['halted'])
+        totals.append(np.mean(halted))
+    env.close()
+    return float(np.mean(totals))
+
+
+def train(args):
+    env_kwargs = {'net_file': args.net_file, 'decision_interval': args.decision_interval,
+                  'episode_seconds': args.episode_seconds, 'seed': args.seed}
+    venv = VectorEnv(args.envs, **env_kwargs)
+    agent = DQNAgent(venv.obs_size, venv.n_actions, hidden=args.hidden, lr=args.lr, seed=args.seed)
+    print(f"{args.envs} envs x {venv.n_agents} junctions, obs {venv.obs_size}, actions {venv.n_actions}")
+
+    started = time.perf_counter()
+    obs = venv.reset()
+    returns = np.zeros(args.envs)
+    finished = []
+    try:
+        for iteration in range(args.iterations):
+            epsilon = max(0.05, 1.0 - iteration / (0.6 * args.iterations))
+            actions = agent.act(obs.reshape(-1, venv.obs_size), epsilon).reshape(args.envs, venv.n_agents)
+            next_obs, rewards, dones, infos = venv.step(actions)
+
+            # Store the true last observation of finished episodes, not the reset one
+            stored_next = next_obs.copy()
+            for i, info in enumerate(infos):
+                if dones[i]:
+                    stored_next[i] = info['terminal_obs']
+            agent.remember(obs.reshape(-1, venv.obs_size), actions.ravel(), rewards.ravel(),
+                           stored_next.reshape(-1, venv.obs_size), np.repeat(dones, venv.n_agents))
+            for _ in range(args.updates_per_step):
+                agent.update()
+
+            returns += rewards.sum(axis=1)
+            for i in np.flatnonzero(dones):
+                finished.append(returns[i])
+                returns[i] = 0.0
+            obs = next_obs
+
+            if (iteration + 1) % args.log_every == 0:
+                recent = np.mean(finished[-args.envs:]) if finished else float('nan')
+                rate = (iteration + 1) * args.envs * args.decision_interval / (time.perf_counter() - started)
+                print(f"iter {iteration + 1}: epsilon {epsilon:.2f}, episode return {recent:.1f}, "
+                      f"{rate:.0f} sim-seconds/s")
+    finally:
+        venv.close()
+
+    policy = agent.policy(decision_interval=args.decision_interval, min_green=10.0, yellow=3.0, all_red=1.0)
+    policy.save(args.output)
+    print(f"Policy saved to {args.output}")
+
+    eval_kwargs = dict(env_kwargs, seed=args.seed)
+    print(f"Mean halted vehicles - learned: {evaluate(eval_kwargs, policy):.1f}, "
+          f"max-pressure: {evaluate(eval_kwargs):.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a DQN signal control policy on the queue-model backend")
+    parser.add_argument("--net-file", default="../sumo/net.net.xml")
+    parser.add_argument("--envs", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--iterations", type=int, default=3000)
+    parser.add_argument("--decision-interval", type=int, default=5)
+    parser.add_argument("--episode-seconds", type=int, default=1800)
+    parser.add_argument("--hidden", type=int, default=64)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--updates-per-step", type=int, default=1)
+    parser.add_argument("--log-every", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="../models/signal_policy.npz")
+    train(parser.parse_args())
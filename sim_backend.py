@@ -0,0 +1,746 @@
+# Simulation Backends - live SUMO through TraCI, or a headless pure-Python stand-in
+from collections import deque
+import itertools
+import math
+import os
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from network import RoadNetwork, TLProgram
+
+# Same values as the traci.constants subscription variables
+VAR_SPEED = 0x40
+VAR_POSITION = 0x42
+VAR_ROAD_ID = 0x50
+VAR_LANE_ID = 0x51
+VAR_LANEPOSITION = 0x56
+VAR_ROUTE_INDEX = 0x69
+MIN_GAP = 2.5
+STOP_LINE_OFFSET = 0.5
+HALTING_SPEED = 0.1
+
+# (length, max speed m/s, accel, decel) - overridden by vTypes in the route file
+DEFAULT_VEHICLE_TYPES = {
+    'car': (5.0, 50.0, 2.6, 4.5),
+    'truck': (12.0, 40.0, 1.8, 4.0),
+    'ambulance': (6.0, 60.0, 3.0, 5.0)
+}
+
+
+class TraciBackend:
+    # Thin wrapper: every domain (junction, trafficlight, vehicle, ...) and
+    # start/simulationStep/close come straight from the traci module
+    def __init__(self):
+        import traci
+        self._traci = traci
+
+    def __getattr__(self, name):
+        return getattr(self._traci, name)
+
+
+# TraCI domains whose calls TimedBackend times; one call in TRACI_SAMPLE is timed
+TRACI_DOMAINS = frozenset(('junction', 'trafficlight', 'edge', 'lane', 'vehicle', 'route', 'simulation',
+                           'person', 'vehicletype', 'inductionloop', 'lanearea', 'poi', 'polygon', 'gui'))
+TRACI_SAMPLE = int(os.environ.get("TRACI_SAMPLE", 16))
+
+
+def timed_call(fn, series, every):
+    counter = itertools.count()
+
+    def call(*args, **kwargs):
+        if next(counter) % every:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            series.record((time.perf_counter() - start) * 1000)
+    return call
+
+
+class TimedDomain:
+    def __init__(self, domain, name, collector, every):
+        self._domain = domain
+        self._name = name
+        self._collector = collector
+        self._every = every
+
+    def __getattr__(self, name):
+        value = getattr(self._domain, name)
+        if not callable(value) or isinstance(value, type):
+            return value  # constants and Phase/Logic classes pass straight through
+        series = self._collector.get(f"traci.{self._name}.{name}", weight=self._every)
+        wrapped = timed_call(value, series, self._every)
+        setattr(self, name, wrapped)  # later lookups skip __getattr__
+        return wrapped
+
+
+class TimedBackend:
+    # Wraps any backend and records TraCI call latency per method into the
+    # metrics collector as "traci.<domain>.<method>" (milliseconds). Only one
+    # call in `every` is timed; the rest pay for a counter increment.
+    # Top-level calls such as simulationStep go to "sim.<name>".
+    def __init__(self, backend, collector=None, every=TRACI_SAMPLE):
+        if collector is None:
+            from system_metrics import metrics as collector
+        self._backend = backend
+        self._collector = collector
+        self._every = max(1, every)
+
+    def __getattr__(self, name):
+        value = getattr(self._backend, name)
+        if name in TRACI_DOMAINS:
+            wrapped = TimedDomain(value, name, self._collector, self._every)
+        elif callable(value):
+            # start/simulationStep/close, timed on every call (one step per tick)
+            wrapped = timed_call(value, self._collector.get(f"sim.{name}"), 1)
+        else:
+            return value  # backend state such as the queue model's network
+        setattr(self, name, wrapped)
+        return wrapped
+
+
+class QueueSimBackend:
+    # Vectorized queue model: vehicles advance along lanes with gap-limited
+    # speeds, queue at red stop lines and transfer between lanes when their
+    # movement is green. Implements the TraCI subset the controllers use.
+    def __init__(self, net_file="net.net.xml", network=None, route_file=None, step_length=1.0,
+                 demand_rate=0.5, route_length=(3, 8), end_time=3600, seed=42):
+        self.network = network or RoadNetwork.from_file(net_file)
+        self.step_length = step_length
+        self.demand_rate = demand_rate
+        self.route_length = route_length
+        self.end_time = end_time
+        self.seed = seed
+        self.vehicle_types = dict(DEFAULT_VEHICLE_TYPES)
+        if route_file:
+            self.load_vehicle_types(route_file)
+
+        self.build_index()
+        self.reset()
+
+        self.junction = JunctionDomain(self)
+        self.trafficlight = TrafficLightDomain(self)
+        self.edge = EdgeDomain(self)
+        self.lane = LaneDomain(self)
+        self.vehicle = VehicleDomain(self)
+        self.route = RouteDomain(self)
+        self.simulation = SimulationDomain(self)
+
+    def load_vehicle_types(self, route_file):
+        for node in ET.parse(route_file).getroot().findall('vType'):
+            self.vehicle_types[node.get('id')] = (
+                float(node.get('length', 5.0)), float(node.get('maxSpeed', 50.0)),
+                float(node.get('accel', 2.6)), float(node.get('decel', 4.5)))
+
+    def build_index(self):
+        net = self.network
+        self.lane_ids = list(net.lanes)
+        self.lane_index = {lane_id: i for i, lane_id in enumerate(self.lane_ids)}
+        self.lane_len = np.array([net.lanes[l].length for l in self.lane_ids])
+        self.lane_speed = np.array([net.lanes[l].speed for l in self.lane_ids])
+        self.edge_ids = list(net.edges)
+        self.edge_index = {edge_id: i for i, edge_id in enumerate(self.edge_ids)}
+        self.lane_edge = np.array([self.edge_index[net.lanes[l].edge] for l in self.lane_ids])
+
+        # Movement slots: one per connection, signalised or not
+        self.tl_ids = list(net.tls)
+        self.tl_index = {tl_id: i for i, tl_id in enumerate(self.tl_ids)}
+        self.moves = {}
+        move_to_lane, move_from_lane, move_tl, move_link = [], [], [], []
+        for connection in net.connections:
+            key = (self.edge_index[connection.from_edge], self.edge_index[connection.to_edge])
+            if key in self.moves:
+                continue
+            self.moves[key] = len(move_to_lane)
+            move_from_lane.append(self.lane_index[connection.from_lane])
+            move_to_lane.append(self.lane_index[connection.to_lane])
+            move_tl.append(self.tl_index.get(connection.tl, -1))
+            move_link.append(connection.link_index)
+        self.move_from_lane = np.array(move_from_lane, dtype=np.int64)
+        self.move_to_lane = np.array(move_to_lane, dtype=np.int64)
+        self.move_tl = np.array(move_tl, dtype=np.int64)
+        self.move_link = np.array(move_link, dtype=np.int64)
+        self.tl_moves = [np.flatnonzero(self.move_tl == i) for i in range(len(self.tl_ids))]
+
+        self.successors = {}
+        for from_edge, to_edge in self.moves:
+            self.successors.setdefault(from_edge, []).append(to_edge)
+
+        self.junction_lanes = {
+            junction_id: np.array([self.lane_index[l] for l in net.incoming_lanes(junction_id)], dtype=np.int64)
+            for junction_id in net.junctions
+        }
+
+    def reset(self):
+        self.time = 0.0
+        self.rng = np.random.default_rng(self.seed)
+        capacity = 256
+        self.v_pos = np.zeros(capacity)
+        self.v_speed = np.zeros(capacity)
+        self.v_lane = np.full(capacity, -1, dtype=np.int64)
+        self.v_move = np.full(capacity, -1, dtype=np.int64)
+        self.v_wait = np.zeros(capacity)
+        self.v_acc_wait = np.zeros(capacity)
+        self.v_len = np.zeros(capacity)
+        self.v_vmax = np.zeros(capacity)
+        self.v_accel = np.zeros(capacity)
+        self.v_route = [None] * capacity
+        self.v_route_pos = np.zeros(capacity, dtype=np.int64)
+        self.v_type = [None] * capacity
+        self.v_ids = [None] * capacity
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.slots = {}
+        self.pending = deque()
+        self.routes = {}
+        self.subscriptions = {}
+        self.vehicle_counter = 0
+        self.departed = []
+        self.arrived = []
+
+        # Signal state: current phase, time left, and green flag per movement
+        self.tl_phase = np.zeros(len(self.tl_ids), dtype=np.int64)
+        self.tl_remaining = np.array([self.network.tls[t].phases[0][0] for t in self.tl_ids], dtype=float)
+        self.tl_state = [self.network.tls[t].phases[0][1] for t in self.tl_ids]
+        # Installed programs per signal by programID, "0" being the one loaded
+        self.tl_program = ["0"] * len(self.tl_ids)
+        self.tl_programs = {t: {"0": self.network.tls[t]} for t in self.tl_ids}
+        self.move_green = np.ones(len(self.move_to_lane), dtype=bool)
+        for i in range(len(self.tl_ids)):
+            self.refresh_green(i)
+        self.refresh_stats()
+
+    # ---- TraCI lifecycle ----------------------------------------------------
+
+    def start(self, cmd=None, port=None, label="default", **kwargs):
+        self.reset()
+        return (21, "QueueSimBackend")
+
+    def simulationStep(self, step=0.0):
+        target = step if step else self.time + self.step_length
+        while self.time < target - 1e-9:
+            self.step()
+
+    def close(self, wait=True):
+        self.reset()
+
+    # ---- simulation core ----------------------------------------------------
+
+    def refresh_green(self, tl):
+        state = self.tl_state[tl]
+        moves = self.tl_moves[tl]
+        links = self.move_link[moves]
+        self.move_green[moves] = [links_i < len(state) and state[links_i] in 'Gg' for links_i in links]
+
+    def advance_signals(self):
+        self.tl_remaining -= self.step_length
+        for tl in np.flatnonzero(self.tl_remaining <= 0):
+            phases = self.network.tls[self.tl_ids[tl]].phases
+            self.tl_phase[tl] = (self.tl_phase[tl] + 1) % len(phases)
+            self.tl_remaining[tl] += phases[self.tl_phase[tl]][0]
+            self.tl_state[tl] = phases[self.tl_phase[tl]][1]
+            self.refresh_green(tl)
+
+    def grow(self):
+        old = len(self.v_ids)
+        for name in ('v_pos', 'v_speed', 'v_wait', 'v_acc_wait', 'v_len', 'v_vmax', 'v_accel', 'v_route_pos'):
+            setattr(self, name, np.concatenate([getattr(self, name), np.zeros_like(getattr(self, name))]))
+        self.v_lane = np.concatenate([self.v_lane, np.full(old, -1, dtype=np.int64)])
+        self.v_move = np.concatenate([self.v_move, np.full(old, -1, dtype=np.int64)])
+        self.v_route.extend([None] * old)
+        self.v_type.extend([None] * old)
+        self.v_ids.extend([None] * old)
+        self.free_slots.extend(range(2 * old - 1, old - 1, -1))
+
+    def next_move(self, route, route_pos):
+        if route_pos + 1 >= len(route):
+            return -1
+        return self.moves.get((route[route_pos], route[route_pos + 1]), -1)
+
+    def entry_lane(self, route, route_pos):
+        move = self.next_move(route, route_pos)
+        if move >= 0:
+            return self.move_from_lane[move], move
+        return self.lane_index[self.network.edges[self.edge_ids[route[route_pos]]].lanes[0].id], -1
+
+    def generate_demand(self):
+        if self.demand_rate <= 0 or self.time >= self.end_time:
+            return
+        for _ in range(self.rng.poisson(self.demand_rate * self.step_length)):
+            edge = int(self.rng.integers(len(self.edge_ids)))
+            route = [edge]
+            for _ in range(int(self.rng.integers(self.route_length[0], self.route_length[1] + 1)) - 1):
+                options = self.successors.get(route[-1])
+                if not options:
+                    break
+                route.append(options[int(self.rng.integers(len(options)))])
+            self.vehicle_counter += 1
+            self.pending.append((f"veh_{self.vehicle_counter}", route, 'car'))
+
+    def insert_departures(self):
+        waiting = len(self.pending)
+        for _ in range(waiting):
+            vehicle_id, route, type_id = self.pending.popleft()
+            lane, move = self.entry_lane(route, 0)
+            length, vmax, accel, _ = self.vehicle_types.get(type_id, DEFAULT_VEHICLE_TYPES['car'])
+            if self.lane_tail[lane] < length + MIN_GAP:
+                # Lane entrance blocked - retry next step
+                self.pending.append((vehicle_id, route, type_id))
+                continue
+
+            if not self.free_slots:
+                self.grow()
+            slot = self.free_slots.pop()
+            self.slots[vehicle_id] = slot
+            self.v_ids[slot] = vehicle_id
+            self.v_type[slot] = type_id
+            self.v_route[slot] = route
+            self.v_route_pos[slot] = 0
+            self.v_lane[slot] = lane
+            self.v_move[slot] = move
+            self.v_pos[slot] = length
+            self.v_speed[slot] = 0.0
+            self.v_wait[slot] = 0.0
+            self.v_acc_wait[slot] = 0.0
+            self.v_len[slot] = length
+            self.v_vmax[slot] = vmax
+            self.v_accel[slot] = accel
+            self.lane_tail[lane] = 0.0
+            self.departed.append(vehicle_id)
+
+    def step(self):
+        dt = self.step_length
+        self.departed = []
+        self.arrived = []
+        self.advance_signals()
+        self.generate_demand()
+        self.insert_departures()
+
+        active = np.flatnonzero(self.v_lane >= 0)
+        if active.size:
+            lane = self.v_lane[active]
+            pos = self.v_pos[active]
+            order = np.lexsort((-pos, lane))
+            idx = active[order]
+            lane_s = lane[order]
+            pos_s = pos[order]
+            len_s = self.v_len[idx]
+
+            # Followers keep a safe gap to the rear of the vehicle ahead
+            head = np.ones(idx.size, dtype=bool)
+            head[1:] = lane_s[1:] != lane_s[:-1]
+            gap = np.empty(idx.size)
+            gap[1:] = pos_s[:-1] - len_s[:-1] - pos_s[1:] - MIN_GAP
+            gap[head] = np.inf
+
+            # Queue heads stop at the line unless their movement is green and
+            # the target lane has room; route ends leave the network
+            heads = np.flatnonzero(head)
+            move = self.v_move[idx[heads]]
+            to_end = self.lane_len[lane_s[heads]] - pos_s[heads]
+            safe_move = np.maximum(move, 0)
+            green = self.move_green[safe_move] & (move >= 0)
+            room = self.lane_tail[self.move_to_lane[safe_move]] - MIN_GAP
+            gap[heads] = np.where(move < 0, np.inf,
+                                  np.where(green, to_end + np.maximum(room, 0), to_end - STOP_LINE_OFFSET))
+
+            vmax = np.minimum(self.v_vmax[idx], self.lane_speed[lane_s])
+            speed = np.minimum(np.minimum(vmax, self.v_speed[idx] + self.v_accel[idx] * dt),
+                               np.maximum(gap, 0) / dt)
+            pos_s = pos_s + speed * dt
+
+            halted = speed < HALTING_SPEED
+            self.v_speed[idx] = speed
+            self.v_pos[idx] = pos_s
+            self.v_wait[idx] = np.where(halted, self.v_wait[idx] + dt, 0.0)
+            self.v_acc_wait[idx] += halted * dt
+
+            for i in np.flatnonzero(pos_s >= self.lane_len[lane_s]):
+                self.cross(idx[i], pos_s[i] - self.lane_len[lane_s[i]])
+
+        self.time += dt
+        self.refresh_stats()
+
+    def cross(self, slot, overshoot):
+        move = self.v_move[slot]
+        if move < 0:
+            self.remove_vehicle(slot)
+            return
+        self.v_route_pos[slot] += 1
+        self.v_lane[slot] = self.move_to_lane[move]
+        self.v_pos[slot] = overshoot
+        self.v_move[slot] = self.next_move(self.v_route[slot], self.v_route_pos[slot])
+
+    def remove_vehicle(self, slot):
+        vehicle_id = self.v_ids[slot]
+        self.arrived.append(vehicle_id)
+        del self.slots[vehicle_id]
+        self.subscriptions.pop(vehicle_id, None)
+        self.v_lane[slot] = -1
+        self.v_ids[slot] = None
+        self.v_route[slot] = None
+        self.free_slots.append(slot)
+
+    def refresh_stats(self):
+        # Per-lane aggregates computed once per step with bincount
+        n = len(self.lane_ids)
+        active = np.flatnonzero(self.v_lane >= 0)
+        lane = self.v_lane[active]
+        speed = self.v_speed[active]
+        self.lane_count = np.bincount(lane, minlength=n)
+        self.lane_halting = np.bincount(lane, weights=speed < HALTING_SPEED, minlength=n)
+        self.lane_speed_sum = np.bincount(lane, weights=speed, minlength=n)
+        self.lane_wait_sum = np.bincount(lane, weights=self.v_wait[active], minlength=n)
+        self.lane_tail = self.lane_len.copy()
+        if active.size:
+            np.minimum.at(self.lane_tail, lane, self.v_pos[active] - self.v_len[active])
+
+    def vehicles_on_lanes(self, lanes):
+        return [self.v_ids[s] for s in np.flatnonzero(np.isin(self.v_lane, lanes))]
+
+    def slot(self, vehicle_id):
+        return self.slots[vehicle_id]
+
+    def vehicle_xy(self, slot):
+        shape = self.network.lanes[self.lane_ids[self.v_lane[slot]]].shape
+        (x0, y0), (x1, y1) = shape[0], shape[-1]
+        fraction = min(1.0, self.v_pos[slot] / max(self.lane_len[self.v_lane[slot]], 1e-9))
+        return (float(x0 + (x1 - x0) * fraction), float(y0 + (y1 - y0) * fraction))
+
+
+class JunctionDomain:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def getIDList(self):
+        return list(self.sim.network.junctions)
+
+    def getPosition(self, junction_id):
+        junction = self.sim.network.junctions[junction_id]
+        return (junction.x, junction.y)
+
+    def getIncomingEdges(self, junction_id):
+        return list(self.sim.network.junctions[junction_id].incoming)
+
+    def getOutgoingEdges(self, junction_id):
+        return list(self.sim.network.junctions[junction_id].outgoing)
+
+    def getLastStepVehicleNumber(self, junction_id):
+        return int(self.sim.lane_count[self.sim.junction_lanes[junction_id]].sum())
+
+    def getLastStepMeanWaitingTime(self, junction_id):
+        lanes = self.sim.junction_lanes[junction_id]
+        count = self.sim.lane_count[lanes].sum()
+        return float(self.sim.lane_wait_sum[lanes].sum() / count) if count else 0.0
+
+
+class TLPhase:
+    # Same constructor as traci.trafficlight.Phase
+    def __init__(self, duration, state, minDur=-1, maxDur=-1, next=(), name=""):
+        self.duration = duration
+        self.state = state
+        self.minDur = minDur
+        self.maxDur = maxDur
+
+
+class TLLogic:
+    # Same constructor as traci.trafficlight.Logic
+    def __init__(self, programID, type, currentPhaseIndex, phases=None, subParameter=None):
+        self.programID = programID
+        self.type = type
+        self.currentPhaseIndex = currentPhaseIndex
+        self.phases = phases or []
+
+
+class TrafficLightDomain:
+    Phase = TLPhase
+    Logic = TLLogic
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def getIDList(self):
+        return list(self.sim.tl_ids)
+
+    def getPhase(self, tl_id):
+        return int(self.sim.tl_phase[self.sim.tl_index[tl_id]])
+
+    def setPhase(self, tl_id, index):
+        sim = self.sim
+        tl = sim.tl_index[tl_id]
+        phases = sim.network.tls[tl_id].phases
+        sim.tl_phase[tl] = index % len(phases)
+        sim.tl_remaining[tl] = phases[sim.tl_phase[tl]][0]
+        sim.tl_state[tl] = phases[sim.tl_phase[tl]][1]
+        sim.refresh_green(tl)
+
+    def getPhaseDuration(self, tl_id):
+        return float(self.sim.network.tls[tl_id].phases[self.getPhase(tl_id)][0])
+
+    def setPhaseDuration(self, tl_id, duration):
+        # Like TraCI: sets the remaining time of the current phase
+        self.sim.tl_remaining[self.sim.tl_index[tl_id]] = float(duration)
+
+    def getNextSwitch(self, tl_id):
+        return self.sim.time + float(self.sim.tl_remaining[self.sim.tl_index[tl_id]])
+
+    def getProgram(self, tl_id):
+        # A state set through setRedYellowGreenState runs as "online", as in SUMO
+        tl = self.sim.tl_index[tl_id]
+        return "online" if math.isinf(self.sim.tl_remaining[tl]) else self.sim.tl_program[tl]
+
+    def setProgram(self, tl_id, programID):
+        # Back to a stored program from the phase that was interrupted;
+        # unknown IDs keep the current program
+        sim = self.sim
+        program = sim.tl_programs[tl_id].get(programID)
+        if program is not None:
+            sim.network.tls[tl_id] = program
+            sim.tl_program[sim.tl_index[tl_id]] = programID
+        self.setPhase(tl_id, self.getPhase(tl_id))
+
+    def getRedYellowGreenState(self, tl_id):
+        return self.sim.tl_state[self.sim.tl_index[tl_id]]
+
+    def setRedYellowGreenState(self, tl_id, state):
+        # Held until the next setPhase, as with SUMO's online program
+        tl = self.sim.tl_index[tl_id]
+        self.sim.tl_state[tl] = state
+        self.sim.tl_remaining[tl] = math.inf
+        self.sim.refresh_green(tl)
+
+    def setProgramLogic(self, tl_id, logic):
+        # Replaces the program and starts it at currentPhaseIndex
+        phases = [(float(p.duration), p.state) for p in logic.phases]
+        program = self.sim.network.tls[tl_id] = TLProgram(tl_id, phases)
+        self.sim.tl_programs[tl_id][logic.programID] = program
+        self.sim.tl_program[self.sim.tl_index[tl_id]] = logic.programID
+        self.setPhase(tl_id, logic.currentPhaseIndex)
+
+    def getControlledLinks(self, tl_id):
+        links = {}
+        for connection in self.sim.network.connections:
+            if connection.tl == tl_id:
+                links.setdefault(connection.link_index, []).append((connection.from_lane, connection.to_lane, ''))
+        return [links.get(i, []) for i in range(max(links) + 1)] if links else []
+
+    def getControlledLanes(self, tl_id):
+        return [link[0][0] for link in self.getControlledLinks(tl_id) if link]
+
+
+class EdgeDomain:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def lanes(self, edge_id):
+        return [self.sim.lane_index[lane.id] for lane in self.sim.network.edges[edge_id].lanes]
+
+    def getIDList(self):
+        return list(self.sim.edge_ids)
+
+    def getLastStepVehicleIDs(self, edge_id):
+        return self.sim.vehicles_on_lanes(self.lanes(edge_id))
+
+    def getLastStepVehicleNumber(self, edge_id):
+        return int(self.sim.lane_count[self.lanes(edge_id)].sum())
+
+    def getLastStepHaltingNumber(self, edge_id):
+        return int(self.sim.lane_halting[self.lanes(edge_id)].sum())
+
+    def getLastStepMeanSpeed(self, edge_id):
+        lanes = self.lanes(edge_id)
+        count = self.sim.lane_count[lanes].sum()
+        if not count:
+            return float(self.sim.lane_speed[lanes].max())
+        return float(self.sim.lane_speed_sum[lanes].sum() / count)
+
+    def getWaitingTime(self, edge_id):
+        return float(self.sim.lane_wait_sum[self.lanes(edge_id)].sum())
+
+
+class LaneDomain:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def getIDList(self):
+        return list(self.sim.lane_ids)
+
+    def getLength(self, lane_id):
+        return float(self.sim.lane_len[self.sim.lane_index[lane_id]])
+
+    def getMaxSpeed(self, lane_id):
+        return float(self.sim.lane_speed[self.sim.lane_index[lane_id]])
+
+    def getEdgeID(self, lane_id):
+        return self.sim.network.lanes[lane_id].edge
+
+    def getShape(self, lane_id):
+        return list(self.sim.network.lanes[lane_id].shape)
+
+    def getLastStepVehicleIDs(self, lane_id):
+        return self.sim.vehicles_on_lanes([self.sim.lane_index[lane_id]])
+
+    def getLastStepVehicleNumber(self, lane_id):
+        return int(self.sim.lane_count[self.sim.lane_index[lane_id]])
+
+    def getLastStepHaltingNumber(self, lane_id):
+        return int(self.sim.lane_halting[self.sim.lane_index[lane_id]])
+
+    def getWaitingTime(self, lane_id):
+        return float(self.sim.lane_wait_sum[self.sim.lane_index[lane_id]])
+
+
+class VehicleDomain:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def getIDList(self):
+        return list(self.sim.slots)
+
+    def getIDCount(self):
+        return len(self.sim.slots)
+
+    def add(self, vehID, routeID, typeID="car", depart="now", **kwargs):
+        route = [self.sim.edge_index[e] for e in self.sim.routes[routeID]]
+        self.sim.pending.append((vehID, route, typeID))
+
+    def setRoute(self, vehID, edgeList):
+        # New route must start on the vehicle's current edge, as in SUMO
+        sim = self.sim
+        slot = sim.slot(vehID)
+        route = [sim.edge_index[e] for e in edgeList]
+        sim.v_route[slot] = route
+        sim.v_route_pos[slot] = 0
+        sim.v_move[slot] = sim.next_move(route, 0)
+
+    def getSpeed(self, vehID):
+        return float(self.sim.v_speed[self.sim.slot(vehID)])
+
+    def getPosition(self, vehID):
+        return self.sim.vehicle_xy(self.sim.slot(vehID))
+
+    def getLaneID(self, vehID):
+        return self.sim.lane_ids[self.sim.v_lane[self.sim.slot(vehID)]]
+
+    def getRoadID(self, vehID):
+        return self.sim.network.lanes[self.getLaneID(vehID)].edge
+
+    def getLanePosition(self, vehID):
+        return float(self.sim.v_pos[self.sim.slot(vehID)])
+
+    def getRoute(self, vehID):
+        return [self.sim.edge_ids[e] for e in self.sim.v_route[self.sim.slot(vehID)]]
+
+    def getRouteIndex(self, vehID):
+        return int(self.sim.v_route_pos[self.sim.slot(vehID)])
+
+    def getTypeID(self, vehID):
+        return self.sim.v_type[self.sim.slot(vehID)]
+
+    def getWaitingTime(self, vehID):
+        return float(self.sim.v_wait[self.sim.slot(vehID)])
+
+    def getAccumulatedWaitingTime(self, vehID):
+        return float(self.sim.v_acc_wait[self.sim.slot(vehID)])
+
+    def getNextTLS(self, vehID):
+        # [(tlsID, linkIndex, distance, state)] for the signals still ahead
+        sim = self.sim
+        slot = sim.slot(vehID)
+        route, route_pos = sim.v_route[slot], int(sim.v_route_pos[slot])
+        distance = float(sim.lane_len[sim.v_lane[slot]] - sim.v_pos[slot])
+        upcoming = []
+        for i in range(route_pos, len(route) - 1):
+            move = sim.moves.get((route[i], route[i + 1]), -1)
+            if move < 0:
+                break
+            tl = sim.move_tl[move]
+            if tl >= 0:
+                link = int(sim.move_link[move])
+                state = sim.tl_state[tl]
+                upcoming.append((sim.tl_ids[tl], link, distance, state[link] if link < len(state) else 'r'))
+            distance += float(sim.lane_len[sim.move_to_lane[move]])
+        return upcoming
+
+    def subscribe(self, vehID, varIDs=(VAR_SPEED,), **kwargs):
+        # Like TraCI, subscribing again replaces the variable list
+        self.sim.subscriptions[vehID] = tuple(varIDs)
+
+    def unsubscribe(self, vehID):
+        self.sim.subscriptions.pop(vehID, None)
+
+    def subscription_value(self, vehID, var):
+        if var == VAR_SPEED:
+            return self.getSpeed(vehID)
+        if var == VAR_POSITION:
+            return self.getPosition(vehID)
+        if var == VAR_ROAD_ID:
+            return self.getRoadID(vehID)
+        if var == VAR_LANE_ID:
+            return self.getLaneID(vehID)
+        if var == VAR_LANEPOSITION:
+            return self.getLanePosition(vehID)
+        if var == VAR_ROUTE_INDEX:
+            return self.getRouteIndex(vehID)
+        return None
+
+    def getSubscriptionResults(self, vehID):
+        if vehID not in self.sim.slots or vehID not in self.sim.subscriptions:
+            return {}
+        return {var: self.subscription_value(vehID, var) for var in self.sim.subscriptions[vehID]}
+
+    def getAllSubscriptionResults(self):
+        sim = self.sim
+        return {v: self.getSubscriptionResults(v) for v in sim.subscriptions if v in sim.slots}
+
+
+class RouteDomain:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def add(self, routeID, edges):
+        self.sim.routes[routeID] = list(edges)
+
+    def getIDList(self):
+        return list(self.sim.routes)
+
+
+class SimulationDomain:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def getTime(self):
+        return self.sim.time
+
+    def getDeltaT(self):
+        return self.sim.step_length
+
+    def getMinExpectedNumber(self):
+        sim = self.sim
+        upcoming = 1 if sim.demand_rate > 0 and sim.time < sim.end_time else 0
+        return len(sim.slots) + len(sim.pending) + upcoming
+
+    def getDepartedIDList(self):
+        return list(self.sim.departed)
+
+    def getArrivedIDList(self):
+        return list(self.sim.arrived)
+
+    def getDepartedNumber(self):
+        return len(self.sim.departed)
+
+    def getArrivedNumber(self):
+        return len(self.sim.arrived)
+
+
+def create_backend(kind="sumo", **kwargs):
+    # "sumo" drives a real SUMO process; "queue" needs neither SUMO nor traci;
+    # "replay" plays back a recording made with replay.RecordingBackend
+    if kind == "queue":
+        return QueueSimBackend(**kwargs)
+    if kind == "replay":
+        from replay import ReplayBackend
+        return ReplayBackend(**kwargs)
+    return TraciBackend()
@@ -2,82 +2,124 @@
 from fastapi import APIRouter, HTTPException
 from datetime import datetime
 import json
-from typing import List, Dict
+from typing import List, Dict, Optional
+
+import subsystems
+import tracing
+from cache import response_cache
+from event_bus import bus
+from sos_store import TERMINAL_STATUSES, build_request, sos_store
+from system_metrics import metrics
 
 router = APIRouter(prefix="/api/sos", tags=["emergency"])
 
-# In-memory storage for demo (would use database in production)
-active_sos_requests = {}
+# Reservation table shared by every corridor this worker creates
+subsystems.register("corridors", "corridor_resolver", "create_resolver")
+
+# Requests, dispatch queue and units live in the shared store; other
+# workers' copies are kept in sync over the bus
+active_sos_requests = sos_store.requests
+metrics.register_gauge("sos.pending", lambda: len(sos_store.by_status.get("received", ())))
+
+
+async def publish_assignments(assignments):
+    for sos_request, unit in assignments:
+        await bus.publish("sos", {"action": "unit", "unit": unit})
+        await bus.publish("sos", {"action": "upsert", "request": sos_request})
+
 
 @router.post("/submit")
 async def submit_sos_request(sos_data: dict):
-    sos_id = f"SOS_{int(datetime.now().timestamp())}"
-
-    sos_request = {
-        "id": sos_id,
-        "user_id": sos_data.get("user_id", "anonymous"),
-        "emergency_type": sos_data.get("emergency_type", "general"),
-        "location": {
-            "lat": sos_data.get("lat", 0),
-            "lon": sos_data.get("lon", 0),
-            "address": sos_data.get("address", "Unknown")
-        },
-        "description": sos_data.get("description", ""),
-        "contact": sos_data.get("contact", ""),
-        "timestamp": datetime.now().isoformat(),
-        "status": "received",
-        "priority": calculate_priority(sos_data.get("emergency_type", "general")),
-        "response_time": None,
-        "assigned_units": []
-    }
-
-    active_sos_requests[sos_id] = sos_request
+    sos_request = build_request(sos_data)
+    sos_id = sos_request["id"]
 
     # Trigger green corridor creation
     create_green_corridor(sos_request)
 
+    # Store locally, assign the nearest free units in priority order, then
+    # replicate to the other workers and alert dashboards
+    sos_store.add(sos_request)
+    assignments = sos_store.dispatch()
+    await bus.publish("sos", {"action": "upsert", "request": sos_request})
+    await publish_assignments(assignments)
+    await bus.publish("broadcast", tracing.attach({
+        "type": "sos_alert",
+        "data": {"sos_id": sos_id, "emergency_type": sos_request["emergency_type"]}
+    }))
+
     return {
         "sos_id": sos_id,
-        "status": "received",
+        "status": sos_request["status"],
         "message": "Emergency services have been notified",
         "estimated_response_time": "5-8 minutes",
-        "priority": sos_request["priority"]
+        "priority": sos_request["priority"],
+        "assigned_units": sos_request["assigned_units"]
     }
 
 @router.get("/active")
-async def get_active_sos():
-    return list(active_sos_requests.values())
+async def get_active_sos(status: Optional[str] = None, emergency_type: Optional[str] = None,
+                         limit: int = 100, offset: int = 0):
+    return sos_store.active(status=status, emergency_type=emergency_type, limit=min(limit, 1000), offset=offset)
+
+@router.get("/queue")
+async def get_dispatch_queue(limit: int = 50):
+    # Requests still waiting for a unit, highest priority-plus-age first
+    return {"counts": sos_store.counts(), "pending": sos_store.pending(limit=min(limit, 1000))}
+
+@router.get("/units")
+async def get_response_units(status: Optional[str] = None):
+    return sos_store.list_units(status)
+
+@router.get("/corridors")
+async def get_green_corridors():
+    resolver = subsystems.get("corridors")
+    return {**resolver.describe(),
+            "active_signals": {junction: {"sos_id": sos_id, "approach": approach}
+                               for junction, (sos_id, approach) in resolver.active().items()}}
 
 @router.get("/{sos_id}")
 async def get_sos_details(sos_id: str):
-    if sos_id not in active_sos_requests:
+    sos_request = sos_store.get(sos_id)
+    if sos_request is None:
         raise HTTPException(status_code=404, detail="SOS request not found")
 
-    return active_sos_requests[sos_id]
+    return sos_request
 
 @router.put("/{sos_id}/status")
 async def update_sos_status(sos_id: str, status_data: dict):
-    if sos_id not in active_sos_requests:
+    try:
+        sos_request, released = sos_store.set_status(sos_id, status_data.get("status"), status_data.get("response_time"))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if sos_request is None:
         raise HTTPException(status_code=404, detail="SOS request not found")
 
-    active_sos_requests[sos_id]["status"] = status_data.get("status")
-    active_sos_requests[sos_id]["response_time"] = status_data.get("response_time")
+    # A re-queued request's corridor belonged to the unit it just lost
+    if sos_request["status"] in TERMINAL_STATUSES or released:
+        release_green_corridor(sos_id)
+
+    await bus.publish("sos", {"action": "upsert", "request": sos_request})
+    for unit in released:
+        await bus.publish("sos", {"action": "unit", "unit": unit})
+    # Freed units go straight to whoever has been waiting longest
+    if released or sos_request["status"] == "received":
+        await publish_assignments(sos_store.dispatch())
 
     return {"message": "SOS status updated successfully"}
 
-def calculate_priority(emergency_type: str) -> int:
-    priorities = {
-        "medical": 10,
-        "fire": 9,
-        "accident": 8,
-        "crime": 7,
-        "breakdown": 3,
-        "general": 5
-    }
-    return priorities.get(emergency_type.lower(), 5)
+async def apply_sos_event(event: dict):
+    # Keep every worker's copy of the SOS state in sync
+    if event.get("action") == "upsert":
+        sos_store.upsert(event["request"], queue=False)
+        response_cache.bump_data_version("sos")
+    elif event.get("action") == "unit":
+        sos_store.upsert_unit(event["unit"])
+
+bus.subscribe("sos", apply_sos_event)
 
 def create_green_corridor(sos_request: dict):
-    # Green corridor logic would interface with TraCI
+    # Timed reservations along the route; crossing corridors are staggered
+    # or rerouted by priority and ETA rather than overwriting each other
     emergency_type = sos_request["emergency_type"]
 
     if emergency_type == "medical":
@@ -87,10 +129,34 @@ def create_green_corridor(sos_request: dict):
     else:
         route = ["J0", "J4", "J7"]  # Police station route
 
+    try:
+        with tracing.span("sos.corridor"):
+            schedule = subsystems.get("corridors").add(sos_request["id"], route, sos_request["priority"])
+    except Exception as e:
+        print(f"Corridor resolver unavailable: {e}")
+        schedule = None
+
+    if schedule is None or not schedule["signals"]:
+        sos_request["green_corridor"] = {
+            "route": route,
+            "duration": 120,  # seconds
+            "created_at": datetime.now().isoformat()
+        }
+        return route
+
+    signals = schedule["signals"]
     sos_request["green_corridor"] = {
-        "route": route,
-        "duration": 120,  # seconds
-        "created_at": datetime.now().isoformat()
+        "route": schedule["route"],
+        "duration": round(signals[-1]["green_until"] - signals[0]["green_from"]),
+        "created_at": datetime.now().isoformat(),
+        "delay": schedule["delay"],
+        "rerouted": schedule["reroutes"] > 0,
+        "signals": signals
     }
 
-    return route
+    return schedule["route"]
+
+def release_green_corridor(sos_id: str):
+    registered = subsystems.registry["corridors"]
+    if registered.is_ready():
+        registered.get().cancel(sos_id)
@@ -1,54 +1,62 @@
 # Emergency SOS Handler for Traffic Management
-import traci
 import json
-import time
 from datetime import datetime
 
+from corridor_resolver import CorridorResolver
+from emergency_tracker import capture_signal, restore_signal
+from network import RoadNetwork
+from sim_backend import create_backend
+from sos_store import build_request, calculate_priority, sos_store
+import tracing
+
 class SOSHandler:
-    def __init__(self):
-        self.active_sos = {}
+    def __init__(self, backend=None, store=None, net_file="../sumo/net.net.xml", resolver=None):
+        self.sim = backend or create_backend("sumo")
+        # Same store (IDs, priorities, units) as the SOS API
+        self.store = store or sos_store
+        # Crossing corridors share junctions through timed reservations
+        # instead of overwriting each other's phases
+        self.resolver = resolver or CorridorResolver(RoadNetwork.from_file(net_file),
+                                                     clock=lambda: self.sim.simulation.getTime())
         self.emergency_routes = {}
-
+        self.held_signals = {}
+        self.held_states = {}
+        # Program/phase (or online state) of each held junction from before
+        # its first corridor took it, restored when the last one lets go
+        self.saved_signals = {}
+        # Called with the junction id after it is handed back, so a
+        # controller that caches what it last sent can send it again
+        self.release_hooks = []
+
+    @tracing.traced("sos.receive")
     def receive_sos(self, sos_data):
-        sos_id = f"SOS_{int(time.time())}"
-
-        sos_request = {
-            'id': sos_id,
-            'type': sos_data.get('emergency_type', 'general'),
-            'location': sos_data.get('location', {}),
-            'timestamp': datetime.now().isoformat(),
-            'status': 'received',
-            'priority': self.calculate_priority(sos_data.get('emergency_type'))
-        }
+        sos_request = self.store.add(build_request(sos_data))
+        sos_id = sos_request['id']
 
-        self.active_sos[sos_id] = sos_request
+        with tracing.span("sos.dispatch"):
+            self.store.dispatch()
         self.create_green_corridor(sos_id, sos_request)
+        tracing.finish("call_to_corridor")
 
         return sos_id
 
     def calculate_priority(self, emergency_type):
-        priorities = {
-            'medical': 10,
-            'fire': 9,
-            'accident': 8,
-            'crime': 7,
-            'general': 5
-        }
-        return priorities.get(emergency_type, 5)
+        return calculate_priority(emergency_type)
 
+    @tracing.traced("sos.corridor")
     def create_green_corridor(self, sos_id, sos_request):
         try:
             # Find route to nearest emergency service
             route_junctions = self.plan_emergency_route(sos_request)
 
-            # Set all lights to green along the route
-            for junction in route_junctions:
-                traci.trafficlight.setPhase(junction, 0)  # Green phase
-                traci.trafficlight.setPhaseDuration(junction, 120)  # 2 minutes
-
+            # Reserve a green window at each junction around the ETA; the
+            # resolver staggers or reroutes around crossing corridors
+            schedule = self.resolver.add(sos_id, route_junctions, sos_request['priority'])
+            route_junctions = schedule['route']
             self.emergency_routes[sos_id] = route_junctions
+            self.update_signals()
 
-            print(f"Green corridor created for {sos_id}: {route_junctions}")
+            print(f"Green corridor created for {sos_id}: {route_junctions} (held back {schedule['delay']}s)")
 
             # Log the emergency response
             self.log_emergency_response(sos_id, sos_request, route_junctions)
@@ -58,7 +66,7 @@ class SOSHandler:
 
     def plan_emergency_route(self, sos_request):
         # Simplified route planning (would use advanced routing in real system)
-        emergency_type = sos_request['type']
+        emergency_type = sos_request['emergency_type']
 
         if emergency_type == 'medical':
             return ["J0", "J1", "J5"]  # Route to hospital
@@ -67,10 +75,48 @@ class SOSHandler:
         else:
             return ["J0", "J3", "J4"]  # Route to police station
 
+    def step(self):
+        # Once per simulation step from the controller loop: the resolver's
+        # windows open and close with simulation time, not with new calls
+        self.update_signals()
+
+    @tracing.traced("sos.signals")
+    def update_signals(self):
+        # Switches junctions to the corridor holding them now, takes them
+        # back if another controller switched them in the meantime, and hands
+        # finished ones back to their program
+        active = self.resolver.active()
+        for junction, (sos_id, approach) in active.items():
+            if self.held_signals.get(junction) != (sos_id, approach):
+                if junction not in self.saved_signals:
+                    self.saved_signals[junction] = capture_signal(self.sim, junction)
+                self.held_signals[junction] = (sos_id, approach)
+                self.held_states[junction] = self.approach_green(junction, approach)
+                self.sim.trafficlight.setRedYellowGreenState(junction, self.held_states[junction])
+            elif self.sim.trafficlight.getRedYellowGreenState(junction) != self.held_states[junction]:
+                self.saved_signals[junction] = capture_signal(self.sim, junction)
+                self.sim.trafficlight.setRedYellowGreenState(junction, self.held_states[junction])
+        for junction in list(self.held_signals):
+            if junction not in active:
+                restore_signal(self.sim, junction, self.saved_signals.pop(junction))
+                del self.held_signals[junction]
+                del self.held_states[junction]
+                for hook in self.release_hooks:
+                    hook(junction)
+
+    def approach_green(self, junction, approach):
+        network = self.resolver.network
+        state = []
+        for links in self.sim.trafficlight.getControlledLinks(junction):
+            edge_id = self.sim.lane.getEdgeID(links[0][0]) if links else None
+            edge = network.edges.get(edge_id)
+            state.append('G' if edge is not None and edge.from_junction == approach else 'r')
+        return "".join(state)
+
     def log_emergency_response(self, sos_id, sos_request, route):
         log_entry = {
             'sos_id': sos_id,
-            'emergency_type': sos_request['type'],
+            'emergency_type': sos_request['emergency_type'],
             'route': route,
             'response_time': datetime.now().isoformat(),
             'status': 'green_corridor_active'
@@ -80,18 +126,18 @@ class SOSHandler:
             f.write(json.dumps(log_entry) + "\n")
 
     def get_active_sos(self):
-        return list(self.active_sos.values())
+        return self.store.active()
 
     def complete_sos(self, sos_id):
-        if sos_id in self.active_sos:
-            self.active_sos[sos_id]['status'] = 'completed'
-
-            # Reset traffic lights
-            if sos_id in self.emergency_routes:
-                for junction in self.emergency_routes[sos_id]:
-                    traci.trafficlight.setPhase(junction, 0)
-
-                del self.emergency_routes[sos_id]
+        sos_request, _ = self.store.set_status(sos_id, 'completed')
+        if sos_request is not None:
+            # Released units pick up whoever is waiting
+            self.store.dispatch()
+
+            # Free its reservations; junctions go back to their programs
+            self.resolver.cancel(sos_id)
+            self.emergency_routes.pop(sos_id, None)
+            self.update_signals()
 
             print(f"SOS {sos_id} completed and corridor cleared")
 
@@ -0,0 +1,316 @@
+# SOS Store - shared request registry, dispatch queue and response-unit index
+import heapq
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+PRIORITIES = {
+    "medical": 10,
+    "fire": 9,
+    "accident": 8,
+    "crime": 7,
+    "breakdown": 3,
+    "general": 5
+}
+
+# Which kind of unit answers which emergency
+UNIT_TYPES = {
+    "medical": "ambulance",
+    "accident": "ambulance",
+    "fire": "fire",
+    "crime": "police",
+    "breakdown": "police",
+    "general": "police"
+}
+
+# A request gains one priority point for every AGING_SECONDS it waits
+AGING_SECONDS = 120
+
+TERMINAL_STATUSES = {"resolved", "completed", "cancelled"}
+STATUSES = {"received", "dispatched", "en_route", "on_scene"} | TERMINAL_STATUSES
+
+GRID_DEGREES = 0.01        # ~1.1 km cells for the unit index
+EARTH_RADIUS_KM = 6371.0
+
+UNITS_PATH = os.environ.get("RESPONSE_UNITS", "../data/response_units.json")
+
+# Demo fleet around central Bangalore, used when no units file exists
+DEMO_UNITS = [
+    ("AMB_1", "ambulance", 12.9716, 77.5946), ("AMB_2", "ambulance", 12.9352, 77.6245),
+    ("AMB_3", "ambulance", 13.0100, 77.5500), ("AMB_4", "ambulance", 12.9980, 77.6700),
+    ("FIRE_1", "fire", 12.9650, 77.6000), ("FIRE_2", "fire", 13.0200, 77.6400),
+    ("POL_1", "police", 12.9750, 77.6050), ("POL_2", "police", 12.9500, 77.5800),
+    ("POL_3", "police", 12.9900, 77.5700), ("POL_4", "police", 12.9300, 77.6100)
+]
+
+
+def calculate_priority(emergency_type):
+    return PRIORITIES.get((emergency_type or "general").lower(), 5)
+
+
+def new_sos_id():
+    # Second-resolution prefix keeps IDs sortable; the random suffix keeps
+    # simultaneous calls (and calls on other workers) from colliding
+    return f"SOS_{int(time.time())}_{uuid.uuid4().hex[:12]}"
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def build_request(sos_data):
+    # The one SOS record format, for the API and the TraCI-side handler
+    emergency_type = sos_data.get("emergency_type") or "general"
+    location = sos_data.get("location") or {}
+    return {
+        "id": new_sos_id(),
+        "user_id": sos_data.get("user_id", "anonymous"),
+        "emergency_type": emergency_type,
+        "location": {
+            "lat": float(sos_data.get("lat", location.get("lat", 0)) or 0),
+            "lon": float(sos_data.get("lon", location.get("lon", 0)) or 0),
+            "address": sos_data.get("address", location.get("address", "Unknown"))
+        },
+        "description": sos_data.get("description", ""),
+        "contact": sos_data.get("contact", ""),
+        "timestamp": datetime.now().isoformat(),
+        "created_at": time.time(),
+        "status": "received",
+        "priority": calculate_priority(emergency_type),
+        "response_time": None,
+        "assigned_units": []
+    }
+
+
+class UnitIndex:
+    # Available units bucketed by type and grid cell. Nearest search walks
+    # rings of cells outwards and stops once no closer unit can exist.
+    def __init__(self, cell=GRID_DEGREES):
+        self.cell = cell
+        self.units = {}
+        self.cells = defaultdict(lambda: defaultdict(set))
+
+    def key(self, lat, lon):
+        return int(math.floor(lat / self.cell)), int(math.floor(lon / self.cell))
+
+    def add(self, unit):
+        self.units[unit["id"]] = unit
+        if unit["status"] == "available":
+            self.cells[unit["type"]][self.key(unit["lat"], unit["lon"])].add(unit["id"])
+
+    def remove(self, unit_id):
+        unit = self.units.pop(unit_id, None)
+        if unit is not None:
+            cell = self.cells[unit["type"]].get(self.key(unit["lat"], unit["lon"]))
+            if cell is not None:
+                cell.discard(unit_id)
+                if not cell:
+                    del self.cells[unit["type"]][self.key(unit["lat"], unit["lon"])]
+        return unit
+
+    def nearest(self, unit_type, lat, lon, max_rings=25):
+        cells = self.cells.get(unit_type)
+        if not cells:
+            return None
+        row, col = self.key(lat, lon)
+        # A ring r cells out is at least (r - 1) cells away in latitude
+        km_per_cell = self.cell * math.pi / 180 * EARTH_RADIUS_KM * max(math.cos(math.radians(lat)), 0.1)
+        best, best_km = None, float("inf")
+        for ring in range(max_rings + 1):
+            if best is not None and (ring - 1) * km_per_cell > best_km:
+                break
+            for r in range(row - ring, row + ring + 1):
+                edge = r in (row - ring, row + ring)
+                for c in (range(col - ring, col + ring + 1) if edge else (col - ring, col + ring)):
+                    for unit_id in cells.get((r, c), ()):
+                        unit = self.units[unit_id]
+                        km = distance_km(lat, lon, unit["lat"], unit["lon"])
+                        if km < best_km:
+                            best, best_km = unit, km
+        if best is None:
+            # Far outside the fleet's area: scan what is left of this type
+            for ids in cells.values():
+                for unit_id in ids:
+                    unit = self.units[unit_id]
+                    km = distance_km(lat, lon, unit["lat"], unit["lon"])
+                    if km < best_km:
+                        best, best_km = unit, km
+        return (best, best_km) if best is not None else None
+
+    def available_types(self):
+        return {unit_type for unit_type, cells in self.cells.items() if cells}
+
+
+class SOSStore:
+    # Every SOS request, indexed by id and by status, with a dispatch heap
+    # keyed on created_at / AGING_SECONDS - priority: that ordering equals
+    # "priority plus age" at any moment, so keys never need recomputing.
+    # Stale heap entries (already dispatched or closed) are skipped lazily.
+    def __init__(self, units=None):
+        self._lock = threading.RLock()
+        self.requests = {}
+        self.by_status = defaultdict(dict)      # status -> {id: None}, insertion ordered
+        self.queue = []
+        self.units = UnitIndex()
+        for unit in units if units is not None else load_units():
+            self.units.add(unit)
+
+    # ---- requests -----------------------------------------------------------
+
+    def add(self, sos_request):
+        with self._lock:
+            self.upsert(sos_request)
+            return sos_request
+
+    def upsert(self, sos_request, queue=True):
+        # Replicated state from other workers comes in with queue=False:
+        # only the worker that took the call dispatches it
+        with self._lock:
+            sos_id = sos_request["id"]
+            previous = self.requests.get(sos_id)
+            if previous is not None:
+                self.by_status[previous["status"]].pop(sos_id, None)
+            sos_request.setdefault("created_at", time.time())
+            self.requests[sos_id] = sos_request
+            self.by_status[sos_request["status"]][sos_id] = None
+            if queue and sos_request["status"] == "received":
+                heapq.heappush(self.queue, (self.dispatch_key(sos_request), sos_id))
+
+    @staticmethod
+    def dispatch_key(sos_request):
+        return sos_request["created_at"] / AGING_SECONDS - sos_request["priority"]
+
+    def get(self, sos_id):
+        return self.requests.get(sos_id)
+
+    def set_status(self, sos_id, status, response_time=None):
+        # Returns the request and any units released by closing it or by
+        # sending it back to the queue (it gets a fresh unit on dispatch)
+        if status not in STATUSES:
+            raise ValueError(f"Unknown SOS status: {status!r}")
+        with self._lock:
+            sos_request = self.requests.get(sos_id)
+            if sos_request is None:
+                return None, []
+            previous = sos_request["status"]
+            self.by_status[previous].pop(sos_id, None)
+            sos_request["status"] = status
+            sos_request["response_time"] = response_time
+            self.by_status[status][sos_id] = None
+            released = []
+            if status in TERMINAL_STATUSES or (status == "received" and previous != "received"):
+                location = sos_request["location"]
+                for unit_id in sos_request["assigned_units"]:
+                    unit = self.release_unit(unit_id, location["lat"], location["lon"])
+                    if unit is not None:
+                        released.append(unit)
+                if status == "received":
+                    sos_request["assigned_units"] = []
+                    heapq.heappush(self.queue, (self.dispatch_key(sos_request), sos_id))
+            return sos_request, released
+
+    def active(self, status=None, emergency_type=None, limit=100, offset=0):
+        # Reads only the status buckets asked for, never the closed backlog
+        with self._lock:
+            statuses = [status] if status else [s for s in self.by_status if s not in TERMINAL_STATUSES]
+            ids = [sos_id for s in statuses for sos_id in self.by_status.get(s, ())]
+            requests = (self.requests[sos_id] for sos_id in ids)
+            if emergency_type:
+                requests = (r for r in requests if r["emergency_type"] == emergency_type)
+            result = []
+            for i, sos_request in enumerate(requests):
+                if i >= offset + limit:
+                    break
+                if i >= offset:
+                    result.append(sos_request)
+            return result
+
+    def counts(self):
+        with self._lock:
+            return {status: len(ids) for status, ids in self.by_status.items() if ids}
+
+    def pending(self, limit=50):
+        # Waiting requests in dispatch order
+        with self._lock:
+            live = [(key, sos_id) for key, sos_id in self.queue
+                    if self.requests.get(sos_id, {}).get("status") == "received"]
+            return [self.requests[sos_id] for _, sos_id in heapq.nsmallest(limit, live)]
+
+    # ---- dispatch -----------------------------------------------------------
+
+    def dispatch(self, max_assignments=None):
+        # Pops requests in priority-plus-age order and gives each the
+        # nearest available unit of the right type. Requests with no unit
+        # free go back on the heap with their original key.
+        assigned, waiting = [], []
+        with self._lock:
+            available = self.units.available_types()
+            while self.queue and available and (max_assignments is None or len(assigned) < max_assignments):
+                key, sos_id = heapq.heappop(self.queue)
+                sos_request = self.requests.get(sos_id)
+                if sos_request is None or sos_request["status"] != "received":
+                    continue
+                unit_type = UNIT_TYPES.get(sos_request["emergency_type"], "police")
+                if unit_type not in available:
+                    waiting.append((key, sos_id))
+                    continue
+                location = sos_request["location"]
+                unit, km = self.units.nearest(unit_type, location["lat"], location["lon"])
+                self.units.remove(unit["id"])
+                unit = dict(unit, status="busy", sos_id=sos_id)
+                self.units.add(unit)
+                sos_request["assigned_units"].append(unit["id"])
+                sos_request["distance_km"] = round(km, 2)
+                self.by_status["received"].pop(sos_id, None)
+                sos_request["status"] = "dispatched"
+                self.by_status["dispatched"][sos_id] = None
+                assigned.append((sos_request, unit))
+                available = self.units.available_types()
+            for entry in waiting:
+                heapq.heappush(self.queue, entry)
+        return assigned
+
+    # ---- units --------------------------------------------------------------
+
+    def upsert_unit(self, unit):
+        with self._lock:
+            self.units.remove(unit["id"])
+            self.units.add(unit)
+
+    def release_unit(self, unit_id, lat=None, lon=None):
+        # The unit becomes available where it last worked
+        with self._lock:
+            unit = self.units.remove(unit_id)
+            if unit is None:
+                return None
+            unit = dict(unit, status="available", sos_id=None)
+            if lat is not None and lon is not None and (lat or lon):
+                unit["lat"], unit["lon"] = lat, lon
+            self.units.add(unit)
+            return unit
+
+    def list_units(self, status=None):
+        with self._lock:
+            return [u for u in self.units.units.values() if status is None or u["status"] == status]
+
+
+def load_units(path=UNITS_PATH):
+    # [{"id": "AMB_1", "type": "ambulance", "lat": .., "lon": ..}, ...]
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                return [dict(unit, status=unit.get("status", "available")) for unit in json.load(f)]
+        except (OSError, ValueError) as e:
+            print(f"Could not load response units: {e}")
+    return [{"id": unit_id, "type": unit_type, "lat": lat, "lon": lon, "status": "available"}
+            for unit_id, unit_type, lat, lon in DEMO_UNITS]
+
+
+sos_store = SOSStore()
@@ -0,0 +1,347 @@
+# Delta-encoded Live Telemetry Stream (WebSocket + SSE)
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import StreamingResponse
+from collections import deque
+import asyncio
+import json
+import time
+import uuid
+
+import telemetry
+from cache import response_cache
+from event_bus import bus
+from system_metrics import metrics
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+router = APIRouter(prefix="/api/telemetry/stream", tags=["telemetry"])
+
+
+class DeltaEncoder:
+    def __init__(self, position_quantum=0.5, speed_quantum=0.1,
+                 position_threshold=1.0, speed_threshold=1.0, junction_thresholds=None):
+        # Positions are sent as integer multiples of position_quantum (metres),
+        # speeds as integer multiples of speed_quantum (km/h)
+        self.position_quantum = position_quantum
+        self.speed_quantum = speed_quantum
+        self.position_threshold = max(1, int(round(position_threshold / position_quantum)))
+        self.speed_threshold = max(1, int(round(speed_threshold / speed_quantum)))
+
+        # Minimum change per junction field before it is re-sent (0 = any change)
+        self.junction_thresholds = junction_thresholds or {
+            'vehicles_count': 1,
+            'queue_length': 1,
+            'waiting_time': 0.5,
+            'avg_speed': 1.0,
+            'efficiency': 0.01
+        }
+
+        self.seq = 0
+        # Identifies this encoder's sequence space - each worker encodes the
+        # same snapshots independently, so clients moving between workers resync
+        self.epoch = uuid.uuid4().hex[:8]
+        # Last state sent to clients - a client applying every delta in order
+        # holds exactly this state
+        self.junctions = {}
+        self.vehicles = {}
+        self.vehicle_types = {}
+
+    def quantize_vehicle(self, vehicle):
+        position = vehicle.get('position', {})
+        return [
+            int(round(position.get('x', 0) / self.position_quantum)),
+            int(round(position.get('y', 0) / self.position_quantum)),
+            int(round(vehicle.get('speed', 0) / self.speed_quantum))
+        ]
+
+    def junction_changes(self, junction_id, data):
+        previous = self.junctions.get(junction_id)
+        if previous is None:
+            return dict(data)
+
+        changes = {}
+        for field, value in data.items():
+            old = previous.get(field)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)):
+                if abs(value - old) >= self.junction_thresholds.get(field, 0) and value != old:
+                    changes[field] = value
+            elif value != old:
+                changes[field] = value
+        return changes
+
+    def vehicle_changed(self, vehicle_id, quantized):
+        previous = self.vehicles.get(vehicle_id)
+        if previous is None:
+            return True
+        return (abs(quantized[0] - previous[0]) >= self.position_threshold or
+                abs(quantized[1] - previous[1]) >= self.position_threshold or
+                abs(quantized[2] - previous[2]) >= self.speed_threshold)
+
+    def encode(self, junctions, vehicles):
+        # Build a delta frame against the last sent state; returns None when
+        # nothing moved past its threshold
+        changed_junctions = {}
+        for junction_id, data in junctions.items():
+            changes = self.junction_changes(junction_id, data)
+            if changes:
+                changed_junctions[junction_id] = changes
+                self.junctions.setdefault(junction_id, {}).update(changes)
+
+        changed_vehicles = {}
+        new_types = {}
+        seen = set()
+        for vehicle in vehicles:
+            vehicle_id = vehicle['id']
+            seen.add(vehicle_id)
+            quantized = self.quantize_vehicle(vehicle)
+            if self.vehicle_changed(vehicle_id, quantized):
+                changed_vehicles[vehicle_id] = quantized
+                self.vehicles[vehicle_id] = quantized
+            if vehicle_id not in self.vehicle_types:
+                new_types[vehicle_id] = vehicle.get('type', 'car')
+                self.vehicle_types[vehicle_id] = new_types[vehicle_id]
+
+        removed_junctions = [j for j in self.junctions if j not in junctions]
+        removed_vehicles = [v for v in self.vehicles if v not in seen]
+        for junction_id in removed_junctions:
+            del self.junctions[junction_id]
+        for vehicle_id in removed_vehicles:
+            del self.vehicles[vehicle_id]
+            self.vehicle_types.pop(vehicle_id, None)
+
+        if not (changed_junctions or changed_vehicles or removed_junctions or removed_vehicles):
+            return None
+
+        self.seq += 1
+        frame = {'type': 'delta', 'seq': self.seq, 't': round(time.time(), 3)}
+        if changed_junctions:
+            frame['junctions'] = changed_junctions
+        if changed_vehicles:
+            frame['vehicles'] = changed_vehicles
+        if new_types:
+            frame['vehicle_types'] = new_types
+        if removed_junctions or removed_vehicles:
+            frame['removed'] = {'junctions': removed_junctions, 'vehicles': removed_vehicles}
+        return frame
+
+    def snapshot(self):
+        return {
+            'type': 'snapshot',
+            'seq': self.seq,
+            'epoch': self.epoch,
+            't': round(time.time(), 3),
+            'quantum': {'position': self.position_quantum, 'speed': self.speed_quantum},
+            'junctions': {j: dict(data) for j, data in self.junctions.items()},
+            'vehicles': dict(self.vehicles),
+            'vehicle_types': dict(self.vehicle_types)
+        }
+
+
+def serialize_frame(frame, encoding="json"):
+    if encoding == "msgpack":
+        return msgpack.packb(frame, use_bin_type=True)
+    return json.dumps(frame, separators=(',', ':'))
+
+
+class Subscription:
+    def __init__(self, queue_size):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.needs_snapshot = False
+
+    def push(self, frame):
+        if self.needs_snapshot:
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Slow client - drop its backlog and resync it with a snapshot
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.needs_snapshot = True
+            self.queue.put_nowait(None)
+
+
+class TelemetryStream:
+    def __init__(self, source=None, interval=0.5, history_size=120, queue_size=32):
+        self.encoder = DeltaEncoder()
+        self.source = source or telemetry.get_latest_snapshot
+        self.interval = interval
+        self.history = deque(maxlen=history_size)
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self._task = None
+        self.stats = {'frames': 0, 'delta_bytes': 0, 'snapshots_sent': 0}
+
+    def publish(self, junctions, vehicles):
+        frame = self.encoder.encode(junctions, vehicles)
+        if frame is None:
+            return None
+
+        self.history.append(frame)
+        self.stats['frames'] += 1
+        self.stats['delta_bytes'] += len(serialize_frame(frame))
+
+        for subscription in list(self.subscribers):
+            subscription.push(frame)
+        return frame
+
+    def frames_since(self, seq):
+        # Deltas a client needs to catch up from seq, or None if it must resync
+        if seq == self.encoder.seq:
+            return []
+        if not self.history or seq < self.history[0]['seq'] - 1 or seq > self.encoder.seq:
+            return None
+        return [frame for frame in self.history if frame['seq'] > seq]
+
+    def subscribe(self):
+        if self.encoder.seq == 0:
+            # First client - prime the state so its snapshot isn't empty
+            self.publish(*self.source())
+
+        subscription = Subscription(self.queue_size)
+        self.subscribers.add(subscription)
+        self.ensure_running()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+    def backlog(self):
+        # Deepest subscriber queue: a slow client shows up here before it resyncs
+        return max((s.queue.qsize() for s in list(self.subscribers)), default=0)
+
+    def ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                junctions, vehicles = self.source()
+                self.publish(junctions, vehicles)
+            except Exception as e:
+                print(f"Error publishing telemetry frame: {e}")
+            await asyncio.sleep(self.interval)
+
+    def initial_frames(self, since, epoch=None):
+        if since is not None and epoch in (None, self.encoder.epoch):
+            frames = self.frames_since(since)
+            if frames is not None:
+                return frames
+        self.stats['snapshots_sent'] += 1
+        return [self.encoder.snapshot()]
+
+    async def frames(self, subscription, since=None, epoch=None):
+        for frame in self.initial_frames(since, epoch):
+            yield frame
+
+        while True:
+            frame = await subscription.queue.get()
+            if frame is None or subscription.needs_snapshot:
+                subscription.needs_snapshot = False
+                self.stats['snapshots_sent'] += 1
+                yield self.encoder.snapshot()
+                continue
+            yield frame
+
+
+stream = TelemetryStream()
+metrics.register_gauge("stream.subscribers", lambda: len(stream.subscribers))
+metrics.register_gauge("stream.backlog", stream.backlog)
+
+
+@router.websocket("/ws")
+async def telemetry_stream_ws(websocket: WebSocket, encoding: str = "json", since: int = None,
+                              epoch: str = None):
+    await websocket.accept()
+    if encoding == "msgpack" and msgpack is None:
+        encoding = "json"
+
+    subscription = stream.subscribe()
+
+    async def receive_commands():
+        # Clients send {"type": "resync"} when they detect a sequence gap
+        while True:
+            message = json.loads(await websocket.receive_text())
+            if message.get('type') == 'resync':
+                subscription.push(None)
+                subscription.needs_snapshot = True
+
+    receiver = asyncio.ensure_future(receive_commands())
+    try:
+        async for frame in stream.frames(subscription, since, epoch):
+            if receiver.done():
+                break
+            payload = serialize_frame(frame, encoding)
+            if encoding == "msgpack":
+                await websocket.send_bytes(payload)
+            else:
+                await websocket.send_text(payload)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        receiver.cancel()
+        stream.unsubscribe(subscription)
+
+
+@router.get("/sse")
+async def telemetry_stream_sse(request: Request, since: int = None, epoch: str = None):
+    # Last-Event-ID is "<epoch>:<seq>" so EventSource reconnects resume in place
+    last_event_id = request.headers.get("last-event-id", "")
+    if since is None and ":" in last_event_id:
+        epoch, _, seq = last_event_id.partition(":")
+        since = int(seq) if seq.isdigit() else None
+
+    subscription = stream.subscribe()
+
+    async def event_source():
+        try:
+            async for frame in stream.frames(subscription, since, epoch):
+                if await request.is_disconnected():
+                    break
+                yield f"id: {stream.encoder.epoch}:{frame['seq']}\nevent: {frame['type']}\ndata: {serialize_frame(frame)}\n\n"
+        finally:
+            stream.unsubscribe(subscription)
+
+    return StreamingResponse(event_source(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/publish")
+async def publish_telemetry(snapshot: dict):
+    # The controller (TELEMETRY_API_URL) and replay.py --to api push each
+    # tick here instead of dashboards polling; the snapshot goes through
+    # the event bus so every worker encodes it
+    await bus.publish("telemetry", snapshot)
+    return {"status": "published"}
+
+
+async def apply_telemetry_snapshot(snapshot: dict):
+    junctions = snapshot.get("junctions", {})
+    vehicles = snapshot.get("vehicles", [])
+    telemetry.update_snapshot(junctions, vehicles, snapshot.get("network"))
+    stream.publish(junctions, vehicles)
+    response_cache.bump_data_version("telemetry")
+
+bus.subscribe("telemetry", apply_telemetry_snapshot)
+
+
+@router.get("/stats")
+async def get_stream_stats():
+    full_bytes = len(json.dumps(telemetry.latest_junctions)) + len(json.dumps(telemetry.latest_vehicles))
+    frames = stream.stats['frames']
+    avg_delta = stream.stats['delta_bytes'] / frames if frames else 0
+    return {
+        "seq": stream.encoder.seq,
+        "epoch": stream.encoder.epoch,
+        "subscribers": len(stream.subscribers),
+        "frames": frames,
+        "snapshots_sent": stream.stats['snapshots_sent'],
+        "avg_delta_bytes": round(avg_delta, 1),
+        "full_payload_bytes": full_bytes,
+        "compression_ratio": round(full_bytes / avg_delta, 1) if avg_delta else None,
+        "msgpack_available": msgpack is not None
+    }
@@ -0,0 +1,96 @@
+# Lazy Subsystem Registry - heavy models load on first use or in background warm-up
+import importlib
+import threading
+import time
+
+
+class LazySubsystem:
+    def __init__(self, name, module_name, factory_name, required=False):
+        # The module is only imported when the subsystem is first needed, so
+        # ultralytics/torch/xgboost/easyocr never slow down API startup
+        self.name = name
+        self.module_name = module_name
+        self.factory_name = factory_name
+        self.required = required
+        self.status = 'pending'
+        self.error = None
+        self.load_seconds = None
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._instance is not None:
+            return self._instance
+
+        with self._lock:
+            if self._instance is None:
+                self.status = 'loading'
+                start = time.perf_counter()
+                try:
+                    module = importlib.import_module(self.module_name)
+                    self._instance = getattr(module, self.factory_name)()
+                    self.status = 'ready'
+                except Exception as e:
+                    self.status = 'failed'
+                    self.error = str(e)
+                    raise
+                finally:
+                    self.load_seconds = round(time.perf_counter() - start, 3)
+
+        return self._instance
+
+    def warm_up(self):
+        # Load in a daemon thread; failures are reported through status()
+        def load():
+            try:
+                self.get()
+            except Exception as e:
+                print(f"Warm-up of {self.name} failed: {e}")
+
+        thread = threading.Thread(target=load, name=f"warmup-{self.name}", daemon=True)
+        thread.start()
+        return thread
+
+    def is_ready(self):
+        return self._instance is not None
+
+    def describe(self):
+        return {
+            'status': self.status,
+            'required': self.required,
+            'load_seconds': self.load_seconds,
+            'error': self.error
+        }
+
+
+registry = {}
+
+
+def register(name, module_name, factory_name, required=False):
+    registry[name] = LazySubsystem(name, module_name, factory_name, required)
+    return registry[name]
+
+
+def get(name):
+    return registry[name].get()
+
+
+def require(names):
+    # Readiness waits on these; registering stays cheap for everything else
+    for name in names:
+        if name in registry:
+            registry[name].required = True
+
+
+def warm_up(names):
+    return [registry[name].warm_up() for name in names if name in registry]
+
+
+def readiness():
+    # Ready once every required subsystem has loaded
+    ready = all(s.is_ready() for s in registry.values() if s.required)
+    return ready, {name: s.describe() for name, s in registry.items()}
+
+
+register("predictor", "predictor", "TrafficPredictor")
+register("detector", "detect", "VehicleDetector")
@@ -0,0 +1,562 @@
+# SUMO Output Ingest - tails summary and FCD output into columnar chunks while SUMO writes them
+import argparse
+import asyncio
+from collections import deque
+from datetime import datetime
+import glob
+from itertools import chain, repeat
+from operator import itemgetter
+import os
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from fastapi import APIRouter
+
+from network import RoadNetwork
+from rollups import RESOLUTIONS, bucket_start, rollup_store
+from system_metrics import metrics
+
+router = APIRouter(prefix="/api/telemetry/ingest", tags=["telemetry"])
+
+# config.sumocfg writes both files next to itself
+OUTPUT_DIR = os.environ.get("SUMO_OUTPUT_DIR", "../sumo")
+CHUNK_DIR = os.environ.get("INGEST_CHUNK_DIR", "../data/sumo_outputs")
+ENABLED = os.environ.get("SUMO_INGEST", "0") == "1"
+READ_SIZE = 1 << 20
+POLL_LIMIT = 64 << 20           # bytes per file per poll, so a backlog commits as it goes
+CHUNK_ROWS = int(os.environ.get("INGEST_CHUNK_ROWS", 1 << 18))
+CHUNK_SECONDS = 3600            # simulated seconds per chunk at most
+HALTING_SPEED = 0.1             # m/s, SUMO's halting threshold
+
+SUMMARY_COLUMNS = ('loaded', 'inserted', 'running', 'waiting', 'ended', 'arrived', 'collisions', 'teleports',
+                   'halting', 'stopped', 'meanWaitingTime', 'meanTravelTime', 'meanSpeed', 'meanSpeedRelative',
+                   'duration')
+FCD_FLOATS = ('x', 'y', 'angle', 'speed', 'pos')
+FCD_NAMES = ('vehicle', 'lane', 'type')   # stored as codes plus a per-chunk name table
+
+
+def chunk_paths(kind, run=None, chunk_dir=CHUNK_DIR):
+    # Chunks of every run (or one) in time order; run directories sort by start
+    pattern = os.path.join(chunk_dir, run or "*", f"{kind}-*.npz")
+    return sorted(glob.glob(pattern))
+
+
+def read_chunk(path):
+    with np.load(path) as chunk:
+        return {name: chunk[name] for name in chunk.files}
+
+
+class OutputStream:
+    # Follows one XML output SUMO is still writing. New bytes are fed to an
+    # incremental pull parser, so a record cut off mid-write simply completes
+    # on a later poll; each closed record is handled and then cleared from
+    # the tree, which keeps memory flat however long the run gets
+    kind = None
+    root_tag = None
+    record_tag = None
+
+    def __init__(self, path, chunk_dir=CHUNK_DIR, chunk_rows=CHUNK_ROWS, epoch=None):
+        self.path = path
+        self.chunk_dir = chunk_dir
+        self.chunk_rows = chunk_rows
+        self.fixed_epoch = epoch
+        self.opener = f"<{self.record_tag} ".encode()
+        self.parser = None
+        self.inode = None
+        self.offset = 0
+        self.stats = {'bytes': 0, 'seconds': 0.0, 'records': 0, 'rows': 0, 'chunks': 0, 'runs': 0}
+        self.new_run(None)
+
+    def new_run(self, inode):
+        self.inode = inode
+        self.offset = 0
+        self.epoch = self.fixed_epoch
+        self.sim_time = None
+        # Records at or before these times are already in a chunk / the rollups
+        self.chunk_time = float("-inf")
+        self.rollup_time = float("-inf")
+        self.columns = {}
+        self.pending_rows = 0
+        self.pending_start = None
+        self.pending_first = self.pending_last = None
+        self.last_start = 0
+        self.finished = False
+
+    def resume(self, inode, offset, epoch, chunk_time, rollup_time):
+        self.new_run(inode)
+        self.offset = offset
+        self.last_start = offset
+        self.epoch = epoch
+        self.chunk_time = chunk_time if chunk_time is not None else float("-inf")
+        self.rollup_time = rollup_time if rollup_time is not None else float("-inf")
+
+    def checkpoint(self):
+        # Resume where the oldest record not yet written to a chunk opens; the
+        # record there may be re-read, which the time watermarks skip
+        offset = self.pending_start if self.pending_start is not None else self.last_start
+        rollup_time = self.rollup_time if self.rollup_time > float("-inf") else None
+        chunk_time = self.chunk_time if self.chunk_time > float("-inf") else None
+        return self.inode, offset, self.epoch, chunk_time, rollup_time
+
+    def open(self, offset):
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.root = None
+        self.starts = deque()
+        self.carry = b""
+        if offset:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                if f.read(len(self.opener)) != self.opener:
+                    offset = 0   # not a record start after all - reread, the watermarks skip repeats
+        if offset:
+            # Past the prolog; a bare root element opens the document again
+            self.parser.feed(f"<{self.root_tag}>".encode())
+        self.offset = offset
+
+    def poll(self, limit=POLL_LIMIT):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+
+        if self.parser is None and stat.st_ino == self.inode and self.offset <= stat.st_size:
+            self.open(self.offset)
+        elif self.parser is None or stat.st_ino != self.inode or stat.st_size < self.offset:
+            # First sight of the file, or SUMO started over and rewrote it
+            self.flush_chunk()
+            self.new_run(stat.st_ino)
+            self.stats['runs'] += 1
+            self.open(0)
+
+        read = 0
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            while read < limit and not self.finished:
+                data = f.read(READ_SIZE)
+                if not data:
+                    break
+                started = time.perf_counter()
+                self.feed(data)
+                self.stats['seconds'] += time.perf_counter() - started
+                read += len(data)
+        self.stats['bytes'] += read
+        return read
+
+    def feed(self, data):
+        # Note where each record opens (the carry catches an opener split
+        # across reads) so a restart can resume at a record boundary
+        window = self.carry + data
+        base = self.offset - len(self.carry)
+        i = window.find(self.opener)
+        while i >= 0:
+            self.starts.append(base + i)
+            i = window.find(self.opener, i + 1)
+        self.carry = window[-(len(self.opener) - 1):]
+        self.offset += len(data)
+
+        self.parser.feed(data)
+        for event, elem in self.parser.read_events():
+            if event == "start":
+                if self.root is None:
+                    self.root = elem
+            elif elem.tag == self.record_tag:
+                self.last_start = self.starts.popleft() if self.starts else self.last_start
+                self.record(elem, self.last_start)
+                self.root.clear()
+            elif elem is self.root:
+                # SUMO closed the file: the run is complete
+                self.finished = True
+                self.flush_chunk()
+
+    def record(self, elem, start):
+        t = float(elem.get('time'))
+        if self.epoch is None:
+            # Simulation seconds are mapped onto the wall clock at first sight
+            self.epoch = time.time() - t
+        self.sim_time = t
+        self.stats['records'] += 1
+        rows = self.handle(elem, t)
+        if t <= self.chunk_time:
+            return
+        if self.pending_start is None:
+            self.pending_start = start
+            self.pending_first = t
+        for name, values in rows.items():
+            self.columns.setdefault(name, []).append(values)
+        self.pending_rows += len(rows['time'])
+        self.pending_last = t
+        if self.pending_rows >= self.chunk_rows or t - self.pending_first >= CHUNK_SECONDS:
+            self.flush_chunk()
+
+    def handle(self, elem, t):
+        # Returns this record's rows as {column: array or list}
+        raise NotImplementedError
+
+    def build_chunk(self):
+        return {name: np.array(list(chain.from_iterable(parts)), dtype=float) for name, parts in self.columns.items()}
+
+    def flush_chunk(self):
+        if self.pending_start is None:
+            return None
+        chunk = self.build_chunk()
+        first = self.pending_first
+        run = datetime.fromtimestamp(self.epoch).strftime("%Y%m%d-%H%M%S")
+        directory = os.path.join(self.chunk_dir, run)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.kind}-{int(round(first * 1000)):012d}.npz")
+        # Written aside and renamed so readers never see half a chunk
+        with open(path + ".tmp", "wb") as f:
+            np.savez_compressed(f, **chunk)
+        os.replace(path + ".tmp", path)
+
+        self.stats['rows'] += self.pending_rows
+        self.stats['chunks'] += 1
+        self.chunk_time = self.pending_last
+        self.columns = {}
+        self.pending_rows = 0
+        self.pending_start = None
+        self.pending_first = self.pending_last = None
+        return path
+
+    def rollups(self):
+        return {}
+
+    def describe(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = None
+        seconds = self.stats['seconds']
+        return {
+            'path': self.path,
+            'offset': self.offset,
+            'size': size,
+            'lag_bytes': size - self.offset if size is not None else None,
+            'sim_time': self.sim_time,
+            'epoch': self.epoch,
+            'finished': self.finished,
+            'pending_rows': self.pending_rows,
+            'mb_per_s': round(self.stats['bytes'] / seconds / 1e6, 2) if seconds else None,
+            **{name: round(value, 3) if isinstance(value, float) else value for name, value in self.stats.items()}
+        }
+
+
+class SummaryStream(OutputStream):
+    # One <step> per simulation step with network-wide counts and means
+    kind = "summary"
+    root_tag = "summary"
+    record_tag = "step"
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self.latest = None
+
+    def handle(self, elem, t):
+        values = [float(elem.get(name, "nan")) for name in SUMMARY_COLUMNS]
+        self.latest = dict(zip(SUMMARY_COLUMNS, values), time=t)
+        rows = {name: [value] for name, value in zip(SUMMARY_COLUMNS, values)}
+        rows['time'] = [t]
+        return rows
+
+    def snapshot(self):
+        return self.latest
+
+
+class FCDStream(OutputStream):
+    # One <timestep> per step listing every vehicle. Besides the trajectory
+    # chunks it reduces each step to per-junction counts, queues, waiting
+    # times and speeds for the telemetry store and the traffic rollups
+    kind = "fcd"
+    root_tag = "fcd-export"
+    record_tag = "timestep"
+
+    def __init__(self, path, network=None, **kwargs):
+        super().__init__(path, **kwargs)
+        network = network or RoadNetwork()
+        # Vehicles on a junction's incoming lanes count towards that junction
+        self.junction_ids = sorted(j for j in network.junctions if network.incoming_lanes(j))
+        index = {junction_id: i for i, junction_id in enumerate(self.junction_ids)}
+        self.lane_junction = {lane_id: index[network.edges[lane.edge].to_junction]
+                              for lane_id, lane in network.lanes.items()
+                              if network.edges[lane.edge].to_junction in index}
+
+    def new_run(self, inode):
+        super().new_run(inode)
+        self.reset_state()
+
+    def reset_state(self):
+        # Waiting time accumulates per vehicle like SUMO's getWaitingTime;
+        # only vehicles in the latest step are kept
+        self.waiting = {}
+        self.previous_time = None
+        self.latest = None
+        self.minutes = {}
+        self.minutes_time = None
+
+    def handle(self, elem, t):
+        # map() keeps the per-vehicle work in C; persons and containers are skipped
+        vehicles = [v.attrib for v in elem if v.tag == 'vehicle']
+        n = len(vehicles)
+        ids = list(map(itemgetter('id'), vehicles))
+        lanes = [a.get('lane', '') for a in vehicles]
+        types = [a.get('type', '') for a in vehicles]
+        floats = {name: np.array([a.get(name, 'nan') for a in vehicles], dtype=float) for name in FCD_FLOATS}
+        speed = floats['speed']
+
+        halting = speed < HALTING_SPEED
+        dt = t - self.previous_time if self.previous_time is not None else 0.0
+        self.previous_time = t
+        waiting = np.fromiter(map(self.waiting.get, ids, repeat(0.0)), float, n)
+        waiting = np.where(halting, waiting + dt, 0.0)
+        self.waiting = dict(zip(ids, waiting.tolist()))
+
+        junction = np.fromiter(map(self.lane_junction.get, lanes, repeat(-1)), np.intp, n)
+        on = junction >= 0
+        j = junction[on]
+        size = len(self.junction_ids)
+        count = np.bincount(j, minlength=size)
+        queue = np.bincount(j, weights=halting[on], minlength=size)
+        speed_sum = np.bincount(j, weights=speed[on], minlength=size)
+        wait_sum = np.bincount(j, weights=waiting[on], minlength=size)
+        self.latest = (ids, types, floats, count, queue, speed_sum, wait_sum)
+
+        if t > self.rollup_time:
+            self.add_rollup(t, count, speed_sum, wait_sum)
+
+        return dict(floats, time=np.full(n, t), vehicle=ids, lane=lanes, type=types)
+
+    def add_rollup(self, t, count, speed_sum, wait_sum):
+        # Minute buckets of [samples, vehicles_sum, vehicles_max, waiting_sum,
+        # speed_samples, speed_sum] per junction, one sample per step as the
+        # controller log has; hours and days are folded from them on commit
+        minute = bucket_start(self.epoch + t, 'minute')
+        acc = self.minutes.get(minute)
+        if acc is None:
+            acc = self.minutes[minute] = np.zeros((6, len(self.junction_ids)))
+        busy = count > 0
+        mean_wait = np.divide(wait_sum, count, out=np.zeros(len(count)), where=busy)
+        mean_speed = np.divide(speed_sum, count, out=np.zeros(len(count)), where=busy) * 3.6
+        acc[0] += 1
+        acc[1] += count
+        np.maximum(acc[2], count, out=acc[2])
+        acc[3] += mean_wait
+        acc[4] += busy
+        acc[5] += mean_speed
+        self.minutes_time = t
+
+    def rollups(self):
+        # Pending minute buckets as RollupStore.flush_traffic totals (source 'fcd')
+        totals = {}
+        for resolution in RESOLUTIONS:
+            grouped = {}
+            for minute, acc in self.minutes.items():
+                bucket = minute if resolution == 'minute' else bucket_start(minute, resolution)
+                group = grouped.get(bucket)
+                if group is None:
+                    grouped[bucket] = acc.copy()
+                else:
+                    np.maximum(group[2], acc[2], out=group[2])
+                    group[[0, 1, 3, 4, 5]] += acc[[0, 1, 3, 4, 5]]
+            for bucket, group in grouped.items():
+                for junction_id, agg in zip(self.junction_ids, group.T.tolist()):
+                    totals[(resolution, bucket, junction_id)] = [int(agg[0]), agg[1], agg[2], agg[3],
+                                                                 int(agg[4]), agg[5]]
+        return totals
+
+    def checkpoint(self):
+        # Saved in the transaction that flushes the pending minutes
+        inode, offset, epoch, chunk_time, rollup_time = super().checkpoint()
+        if self.minutes_time is not None:
+            rollup_time = self.minutes_time
+        return inode, offset, epoch, chunk_time, rollup_time
+
+    def rollups_committed(self):
+        if self.minutes_time is not None:
+            self.rollup_time = self.minutes_time
+        self.minutes = {}
+        self.minutes_time = None
+
+    def build_chunk(self):
+        # Rows ordered by vehicle then time, so each trajectory is contiguous;
+        # names become codes into a sorted per-chunk table
+        columns = {name: np.concatenate(self.columns[name]) for name in FCD_FLOATS + ('time',)}
+        for name in FCD_NAMES:
+            index = {}
+            codes = np.fromiter((index.setdefault(value, len(index))
+                                 for value in chain.from_iterable(self.columns[name])), np.int32)
+            names = np.array(list(index))
+            order = np.argsort(names, kind='stable')
+            rank = np.empty(len(order), np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            columns[name] = rank[codes]
+            columns[name + '_names'] = names[order]
+        order = np.lexsort((columns['time'], columns['vehicle']))
+        for name in FCD_FLOATS + ('time',) + FCD_NAMES:
+            columns[name] = columns[name][order]
+        return columns
+
+    def snapshot(self):
+        # Junctions and vehicles of the latest step, in the telemetry API's shape
+        if self.latest is None:
+            return None
+        ids, types, floats, count, queue, speed_sum, wait_sum = self.latest
+        junctions = {}
+        for i, junction_id in enumerate(self.junction_ids):
+            n = int(count[i])
+            junctions[junction_id] = {
+                'vehicles_count': n,
+                'queue_length': int(queue[i]),
+                'waiting_time': round(float(wait_sum[i]) / n, 2) if n else 0.0,
+                'avg_speed': round(float(speed_sum[i]) / n * 3.6, 1) if n else 0.0
+            }
+        vehicles = [{'id': vehicle_id, 'position': {'x': round(x, 1), 'y': round(y, 1)},
+                     'speed': round(speed * 3.6, 1), 'type': vehicle_type or 'car'}
+                    for vehicle_id, vehicle_type, x, y, speed in zip(
+                        ids, types, floats['x'].tolist(), floats['y'].tolist(), floats['speed'].tolist())]
+        return {'junctions': junctions, 'vehicles': vehicles}
+
+
+class SumoOutputIngest:
+    # Both outputs of one SUMO run; checkpoints live next to the rollups they
+    # feed and are committed in the same transaction
+    def __init__(self, output_dir=OUTPUT_DIR, net_file=None, chunk_dir=CHUNK_DIR, store=rollup_store,
+                 epoch=None, chunk_rows=CHUNK_ROWS):
+        net_file = net_file or os.path.join(output_dir, "net.net.xml")
+        network = RoadNetwork.from_file(net_file) if os.path.exists(net_file) else None
+        options = {'chunk_dir': chunk_dir, 'epoch': epoch, 'chunk_rows': chunk_rows}
+        self.store = store
+        self.streams = {
+            'summary': SummaryStream(os.path.join(output_dir, "summary.xml"), **options),
+            'fcd': FCDStream(os.path.join(output_dir, "fcd_output.xml"), network=network, **options)
+        }
+        self.loaded = False
+        self.published = {}
+
+    def load_checkpoints(self):
+        with self.store.connect() as conn:
+            for kind, stream in self.streams.items():
+                row = self.store.get_stream_watermark(conn, f"sumo.{kind}")
+                if row:
+                    stream.resume(*row)
+        self.loaded = True
+
+    def run_once(self, limit=POLL_LIMIT):
+        # One poll of each file; returns bytes read and whether rollups changed
+        if not self.loaded:
+            self.load_checkpoints()
+        started = time.perf_counter()
+        read = {kind: stream.poll(limit) for kind, stream in self.streams.items()}
+        fcd = self.streams['fcd']
+        totals = fcd.rollups()
+        self.commit(totals)
+        if any(read.values()):
+            metrics.record("ingest.poll", (time.perf_counter() - started) * 1000)
+        return read, bool(totals)
+
+    def commit(self, totals=None):
+        with self.store.connect() as conn:
+            if totals:
+                # Own table: the controller log may be rolling up the same minutes
+                self.store.flush_traffic(conn, totals, source='fcd')
+            for kind, stream in self.streams.items():
+                if stream.inode is not None:
+                    self.store.set_stream_watermark(conn, f"sumo.{kind}", *stream.checkpoint())
+        self.streams['fcd'].rollups_committed()
+
+    def close(self):
+        # Chunk whatever is pending, e.g. when stopped while SUMO still runs;
+        # a later resume skips those records by time
+        for stream in self.streams.values():
+            stream.flush_chunk()
+        self.commit(self.streams['fcd'].rollups())
+
+    def snapshot(self):
+        # The latest step for the telemetry stream, once per new step
+        fcd, summary = self.streams['fcd'], self.streams['summary']
+        if fcd.sim_time is None or self.published.get('fcd') == fcd.sim_time:
+            return None
+        self.published['fcd'] = fcd.sim_time
+        snapshot = fcd.snapshot()
+        if summary.latest is not None:
+            snapshot['network'] = summary.snapshot()
+        return snapshot
+
+    def lag_mb(self, kind):
+        lag = self.streams[kind].describe()['lag_bytes']
+        return lag / 1e6 if lag is not None else None
+
+    def describe(self):
+        return {kind: stream.describe() for kind, stream in self.streams.items()}
+
+
+ingester = None
+
+
+@router.get("/status")
+async def get_ingest_status():
+    if ingester is None:
+        return {"enabled": ENABLED, "streams": {}}
+    return {"enabled": ENABLED, "streams": ingester.describe()}
+
+
+async def run_ingest_periodically(interval=None):
+    # Follows the outputs of a running SUMO; enabled with SUMO_INGEST=1
+    global ingester
+    from cache import response_cache
+    from event_bus import bus
+    interval = interval or float(os.environ.get("INGEST_INTERVAL", 1))
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            if ingester is None:
+                ingester = await loop.run_in_executor(None, SumoOutputIngest)
+                for kind in ingester.streams:
+                    metrics.register_gauge(f"ingest.{kind}.lag_mb", lambda kind=kind: ingester.lag_mb(kind))
+            read, rolled_up = await loop.run_in_executor(None, ingester.run_once)
+            if rolled_up:
+                response_cache.bump_data_version("analytics")
+            snapshot = ingester.snapshot()
+            if snapshot:
+                await bus.publish("telemetry", snapshot)
+            if any(size >= POLL_LIMIT for size in read.values()):
+                continue   # still catching up
+        except Exception as e:
+            print(f"Error ingesting SUMO outputs: {e}")
+        await asyncio.sleep(interval)
+
+
+def report(ingest, elapsed):
+    for kind, info in ingest.describe().items():
+        if not info['bytes']:
+            continue
+        print(f"{kind}: {info['bytes'] / 1e6:.1f} MB, {info['records']} records, {info['rows']} rows "
+              f"in {info['chunks']} chunks - {info['mb_per_s']} MB/s parsing, "
+              f"{info['bytes'] / 1e6 / elapsed:.1f} MB/s overall")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest SUMO summary and FCD output into columnar chunks")
+    parser.add_argument("--dir", default=OUTPUT_DIR, help="directory holding summary.xml and fcd_output.xml")
+    parser.add_argument("--net", help="network file (default: net.net.xml in --dir)")
+    parser.add_argument("--chunks", default=CHUNK_DIR, help="where trajectory and summary chunks go")
+    parser.add_argument("--follow", action="store_true", help="keep tailing while SUMO writes")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between polls with --follow")
+    args = parser.parse_args()
+
+    ingest = SumoOutputIngest(args.dir, net_file=args.net, chunk_dir=args.chunks)
+    started = time.perf_counter()
+    try:
+        while True:
+            read, _ = ingest.run_once()
+            if any(read.values()):
+                continue
+            finished = all(stream.finished or stream.inode is None for stream in ingest.streams.values())
+            if not args.follow or finished:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingest.close()
+    report(ingest, time.perf_counter() - started)
@@ -0,0 +1,315 @@
+# System Metrics - rolling windows of request, controller, TraCI, model and process measurements
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SPAN = int(os.environ.get("METRICS_SPAN", 300))             # seconds of history per series
+MAX_SAMPLES = int(os.environ.get("METRICS_SAMPLES", 64))    # values kept per series per second
+CONTROLLER_METRICS = os.environ.get("CONTROLLER_METRICS", "../data/logs/controller_metrics.json")
+# Series families exported pre-merged, since percentiles can't be combined afterwards
+EXPORT_MERGED = ("traci.",)
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class RollingSeries:
+    # Ring of one-second buckets [second, count, total, max, samples]. A slot
+    # is recycled when its second comes round again, so recording is O(1)
+    # and memory is bounded by span * max_samples however busy the series.
+    # Past max_samples in one second, values are reservoir-sampled so the
+    # percentiles stay unbiased. `weight` scales counts for series that
+    # only record one call in `weight` (see sim_backend.TimedBackend).
+    __slots__ = ('buckets', 'span', 'max_samples', 'weight', 'created', 'last')
+
+    def __init__(self, span=SPAN, max_samples=MAX_SAMPLES, weight=1):
+        self.buckets = [None] * span
+        self.span = span
+        self.max_samples = max_samples
+        self.weight = weight
+        self.created = time.monotonic()
+        self.last = None
+
+    def record(self, value, now=None):
+        # No lock: each series has one writer in practice (the event loop,
+        # the control loop or the sampler), and a lost increment under a
+        # rare race costs less than locking every request
+        second = int(time.monotonic() if now is None else now)
+        slot = second % self.span
+        bucket = self.buckets[slot]
+        if bucket is None or bucket[0] != second:
+            bucket = self.buckets[slot] = [second, 0, 0.0, value, []]
+        bucket[1] += 1
+        bucket[2] += value
+        if value > bucket[3]:
+            bucket[3] = value
+        samples = bucket[4]
+        if len(samples) < self.max_samples:
+            samples.append(value)
+        else:
+            i = random.randrange(bucket[1])
+            if i < self.max_samples:
+                samples[i] = value
+        self.last = value
+
+    def window(self, seconds, now=None):
+        # (count, total, max, samples) over the last `seconds` seconds
+        now = int(time.monotonic() if now is None else now)
+        oldest = now - min(seconds, self.span) + 1
+        count, total, peak, samples = 0, 0.0, None, []
+        for bucket in self.buckets:
+            if bucket is None or not oldest <= bucket[0] <= now:
+                continue
+            count += bucket[1]
+            total += bucket[2]
+            peak = bucket[3] if peak is None else max(peak, bucket[3])
+            samples.extend(bucket[4])
+        return count, total, peak, samples
+
+    def stats(self, seconds=60, now=None):
+        now = time.monotonic() if now is None else now
+        count, total, peak, samples = self.window(seconds, now)
+        if not count:
+            return None
+        # A series younger than the window must not under-report its rate
+        elapsed = max(1.0, min(seconds, now - self.created + 1))
+        p50, p95, p99 = percentiles(samples, (50, 95, 99))
+        return {
+            'count': count * self.weight,
+            'rate': round(count * self.weight / elapsed, 3),
+            'mean': round(total / count, 3),
+            'p50': p50,
+            'p95': p95,
+            'p99': p99,
+            'max': round(peak, 3),
+            'last': round(self.last, 3)
+        }
+
+
+def percentiles(samples, ranks):
+    # Nearest-rank percentiles; a few thousand samples at most per window
+    if not samples:
+        return [None] * len(ranks)
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return [round(ordered[min(last, int(rank / 100 * len(ordered)))], 3) for rank in ranks]
+
+
+def merge_stats(series_list, seconds=60, now=None):
+    # One summary over several series, e.g. every TraCI method together
+    now = time.monotonic() if now is None else now
+    count = weighted = 0
+    total, peak, samples = 0.0, None, []
+    elapsed = 1.0
+    for series in series_list:
+        c, t, p, s = series.window(seconds, now)
+        if not c:
+            continue
+        count += c
+        weighted += c * series.weight
+        total += t
+        peak = p if peak is None else max(peak, p)
+        samples.extend(s)
+        elapsed = max(elapsed, min(seconds, now - series.created + 1))
+    if not count:
+        return None
+    p50, p95, p99 = percentiles(samples, (50, 95, 99))
+    return {'count': weighted, 'rate': round(weighted / elapsed, 3), 'mean': round(total / count, 3),
+            'p50': p50, 'p95': p95, 'p99': p99, 'max': round(peak, 3)}
+
+
+def cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        if resource is None:
+            return None
+        # Peak rather than current RSS where /proc is missing (macOS: bytes)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class ProcessSampler:
+    # CPU% is process CPU time over wall time since the previous sample, so
+    # 100 means one core fully busy
+    def __init__(self):
+        self.previous = (time.monotonic(), cpu_seconds())
+
+    def sample(self):
+        now, cpu = time.monotonic(), cpu_seconds()
+        wall = now - self.previous[0]
+        percent = (cpu - self.previous[1]) / wall * 100 if wall > 0 else 0.0
+        self.previous = (now, cpu)
+        rss = rss_bytes()
+        return percent, rss / 1048576 if rss is not None else None
+
+
+class MetricsCollector:
+    # Named rolling series. Durations are recorded in milliseconds; gauges
+    # (queue depths and the like) are callables read once per sample tick.
+    def __init__(self, span=SPAN):
+        self.span = span
+        self.series = {}
+        self.gauges = {}
+        self.process = ProcessSampler()
+        self.started = time.time()
+        self.sample_errors = 0
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def get(self, name, weight=1):
+        series = self.series.get(name)
+        if series is None:
+            with self._lock:
+                series = self.series.get(name)
+                if series is None:
+                    series = self.series[name] = RollingSeries(self.span, weight=weight)
+        return series
+
+    def record(self, name, value):
+        self.get(name).record(value)
+
+    def record_request(self, route, status, ms):
+        self.get("http").record(ms)
+        self.get(route).record(ms)
+        if status >= 500:
+            self.get("http.errors").record(1)
+
+    def register_gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def sample(self):
+        for name, fn in list(self.gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                self.sample_errors += 1
+                continue
+            if value is not None:
+                self.record(name, value)
+        cpu, rss_mb = self.process.sample()
+        self.record("process.cpu_percent", cpu)
+        if rss_mb is not None:
+            self.record("process.rss_mb", rss_mb)
+
+    def stats(self, name, seconds=60):
+        series = self.series.get(name)
+        return series.stats(seconds) if series is not None else None
+
+    def gauge_stats(self, seconds=60):
+        # Every registered gauge (queue depths): current, mean and peak
+        return {name: gauge(self.stats(name, seconds)) for name in sorted(self.gauges)}
+
+    def merged(self, prefix, seconds=60):
+        return merge_stats([s for name, s in list(self.series.items()) if name.startswith(prefix)], seconds)
+
+    def snapshot(self, seconds=60, prefix=""):
+        now = time.monotonic()
+        result = {}
+        for name, series in sorted(list(self.series.items())):
+            if name.startswith(prefix):
+                stats = series.stats(seconds, now)
+                if stats is not None:
+                    result[name] = stats
+        return result
+
+    def export(self, path, seconds=60):
+        # Written atomically so a reader in another process never sees half a file
+        payload = {'pid': os.getpid(), 'written_at': time.time(), 'started': self.started,
+                   'window_seconds': seconds, 'series': self.snapshot(seconds),
+                   'merged': {prefix: self.merged(prefix, seconds) for prefix in EXPORT_MERGED}}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp, path)
+
+    def start_sampler(self, interval=1.0, export_path=None, export_every=5):
+        # Daemon thread: samples gauges and the process once per interval and,
+        # for processes without an API (the controller), exports a snapshot
+        if self._sampler is not None and self._sampler.is_alive():
+            return self._sampler
+        stop = threading.Event()
+
+        def run():
+            ticks = 0
+            while not stop.wait(interval):
+                self.sample()
+                ticks += 1
+                if export_path and ticks % export_every == 0:
+                    try:
+                        self.export(export_path)
+                    except OSError as e:
+                        print(f"Error exporting metrics: {e}")
+
+        self._sampler = threading.Thread(target=run, name="metrics-sampler", daemon=True)
+        self._sampler.stop = stop
+        self._sampler.start()
+        return self._sampler
+
+    def stop_sampler(self):
+        if self._sampler is not None:
+            self._sampler.stop.set()
+            self._sampler = None
+
+
+def load_export(path=CONTROLLER_METRICS, max_age=30):
+    # Another process's exported snapshot, or None if missing or stale
+    try:
+        with open(path) as f:
+            payload = json.load(f)
+    except (OSError, ValueError):
+        return None
+    payload['age_seconds'] = round(time.time() - payload.get('written_at', 0), 1)
+    payload['stale'] = payload['age_seconds'] > max_age
+    return payload
+
+
+def latency(stats):
+    if not stats:
+        return None
+    return {key: stats[key] for key in ('mean', 'p50', 'p95', 'p99', 'max')}
+
+
+def gauge(stats):
+    if not stats:
+        return None
+    return {'current': stats['last'], 'mean': stats['mean'], 'max': stats['max']}
+
+
+def controller_summary(path=CONTROLLER_METRICS):
+    # The control loop runs in its own process and exports every few seconds
+    export = load_export(path)
+    if export is None:
+        return {'status': 'not_running'}
+    series = export.get('series', {})
+    step = series.get('controller.step')
+    traci = export.get('merged', {}).get('traci.')
+    cpu, rss = series.get('process.cpu_percent'), series.get('process.rss_mb')
+    return {
+        'status': 'stalled' if export['stale'] else 'running',
+        'pid': export.get('pid'),
+        'age_seconds': export['age_seconds'],
+        'steps_per_second': step['rate'] if step else 0.0,
+        'step_ms': latency(step),
+        'simulation_step_ms': latency(series.get('sim.simulationStep')),
+        'traci_calls_per_second': traci['rate'] if traci else 0.0,
+        'traci_call_ms': latency(traci),
+        'cpu_percent': round(cpu['mean'], 1) if cpu else None,
+        'rss_mb': round(rss['last'], 1) if rss else None
+    }
+
+
+metrics = MetricsCollector()
@@ -4,67 +4,109 @@ from datetime import datetime, timedelta
 import json
 from typing import List, Dict
 
+from system_metrics import SPAN, controller_summary, gauge, latency, metrics
+
 router = APIRouter(prefix="/api/telemetry", tags=["telemetry"])
 
+# Latest snapshot pushed by the controller (seeded with demo data)
+latest_junctions = {
+    "J0": {
+        "vehicles_count": 15,
+        "avg_speed": 35.2,
+        "queue_length": 8,
+        "waiting_time": 12.5,
+        "green_duration": 45,
+        "red_duration": 35,
+        "efficiency": 0.85
+    },
+    "J1": {
+        "vehicles_count": 22,
+        "avg_speed": 28.7,
+        "queue_length": 12,
+        "waiting_time": 18.3,
+        "green_duration": 50,
+        "red_duration": 30,
+        "efficiency": 0.72
+    }
+}
+
+latest_vehicles = [
+    {
+        "id": "veh_001",
+        "position": {"x": 150.5, "y": 75.2},
+        "speed": 45.3,
+        "route": ["J0", "J1", "J5"],
+        "type": "car",
+        "fuel_consumption": 8.5
+    },
+    {
+        "id": "emergency_001",
+        "position": {"x": 200.1, "y": 120.8},
+        "speed": 55.7,
+        "route": ["J2", "J0", "J3"],
+        "type": "ambulance",
+        "priority": 10
+    }
+]
+
+# Network-wide counts from SUMO's summary output (see sumo_outputs.py)
+latest_network = {}
+
+def update_snapshot(junctions, vehicles, network=None):
+    global latest_junctions, latest_vehicles, latest_network
+    latest_junctions = junctions
+    latest_vehicles = vehicles
+    if network is not None:
+        latest_network = network
+
+def get_latest_snapshot():
+    return latest_junctions, latest_vehicles
+
 @router.get("/junctions")
 async def get_junction_telemetry():
     # Real-time junction data from SUMO
-    telemetry = {
-        "J0": {
-            "vehicles_count": 15,
-            "avg_speed": 35.2,
-            "queue_length": 8,
-            "waiting_time": 12.5,
-            "green_duration": 45,
-            "red_duration": 35,
-            "efficiency": 0.85
-        },
-        "J1": {
-            "vehicles_count": 22,
-            "avg_speed": 28.7,
-            "queue_length": 12,
-            "waiting_time": 18.3,
-            "green_duration": 50,
-            "red_duration": 30,
-            "efficiency": 0.72
-        }
-    }
-    return telemetry
+    return latest_junctions
 
 @router.get("/vehicles")
 async def get_vehicle_telemetry():
     # Active vehicle tracking
-    vehicles = [
-        {
-            "id": "veh_001",
-            "position": {"x": 150.5, "y": 75.2},
-            "speed": 45.3,
-            "route": ["J0", "J1", "J5"],
-            "type": "car",
-            "fuel_consumption": 8.5
-        },
-        {
-            "id": "emergency_001",
-            "position": {"x": 200.1, "y": 120.8},
-            "speed": 55.7,
-            "route": ["J2", "J0", "J3"],
-            "type": "ambulance",
-            "priority": 10
-        }
-    ]
-    return vehicles
+    return latest_vehicles
+
+@router.get("/network")
+async def get_network_telemetry():
+    # Latest simulation step summary: running, waiting, mean speed, ...
+    return latest_network
 
 @router.get("/performance")
-async def get_system_performance():
-    # System performance metrics
-    performance = {
-        "total_vehicles": 87,
-        "avg_waiting_time": 14.2,
-        "throughput": 156,  # vehicles per hour
-        "fuel_savings": 12.5,  # percentage
-        "emissions_reduction": 8.3,  # percentage
-        "ai_accuracy": 94.7,
-        "violation_detection_rate": 91.2,
-        "emergency_response_time": 4.8  # minutes
+async def get_system_performance(window: int = 60, routes: int = 20):
+    # Measured performance over the last `window` seconds: the busiest API
+    # routes, the control loop, model serving, queues and this process
+    window = max(1, min(window, SPAN))
+    waiting = [j.get("waiting_time") for j in latest_junctions.values() if isinstance(j, dict)]
+    waiting = [w for w in waiting if isinstance(w, (int, float))]
+    route_stats = metrics.snapshot(window, prefix="http ")
+    busiest = sorted(route_stats.items(), key=lambda item: -item[1]["count"])[:max(0, routes)]
+    http = metrics.stats("http", window)
+
+    return {
+        "window_seconds": window,
+        "total_vehicles": len(latest_vehicles),
+        "avg_waiting_time": round(sum(waiting) / len(waiting), 2) if waiting else None,
+        "requests": {
+            "per_second": http["rate"] if http else 0.0,
+            "latency_ms": latency(http)
+        },
+        "routes": {name[len("http "):]: {"count": stats["count"], "per_second": stats["rate"],
+                                         "latency_ms": latency(stats)}
+                   for name, stats in busiest},
+        "controller": controller_summary(),
+        "model": {
+            "inference_ms": latency(metrics.stats("model.inference", window)),
+            "request_latency_ms": latency(metrics.stats("model.latency", window))
+        },
+        "queues": metrics.gauge_stats(window),
+        "process": {
+            "cpu_percent": gauge(metrics.stats("process.cpu_percent", window)),
+            "rss_mb": gauge(metrics.stats("process.rss_mb", window))
+        }
     }
-    return performance
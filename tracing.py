@@ -0,0 +1,539 @@
+# Latency Tracing - span context, per-thread HDR histograms and Prometheus export
+from collections import deque
+import argparse
+import atexit
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from time import perf_counter_ns
+
+# Off unless TRACING=1; TRACE_FILE additionally dumps every span as JSONL.
+# TRACE_SAMPLE < 1 traces that share of traces (decided at the root span)
+ENABLED = os.environ.get("TRACING", "0") == "1"
+TRACE_FILE = os.environ.get("TRACE_FILE")
+SAMPLE = float(os.environ.get("TRACE_SAMPLE", 1.0))
+
+SUB_BITS = 6               # 32 sub-buckets per power of two: values within ~3%
+EXACT = 1 << SUB_BITS
+HALF_BITS = SUB_BITS - 1
+MAX_MICROS = 1 << 36       # ~19 hours; longer stages land in the top bucket
+
+# Prometheus bucket bounds in seconds
+EXPORT_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def bucket_index(micros):
+    # Log-linear (HDR) index: exact below 2**SUB_BITS, then SUB_BITS
+    # significant bits per power of two
+    if micros < (1 << SUB_BITS):
+        return micros
+    shift = micros.bit_length() - SUB_BITS
+    return (shift << (SUB_BITS - 1)) + (micros >> shift)
+
+
+def bucket_floor(index):
+    # Smallest value that lands in bucket `index`
+    if index < (1 << SUB_BITS):
+        return index
+    shift = (index >> (SUB_BITS - 1)) - 1
+    return (index - (shift << (SUB_BITS - 1))) << shift
+
+
+BUCKETS = bucket_index(MAX_MICROS) + 1
+
+
+class Histogram:
+    # Counts per HDR bucket of microseconds. Each thread records into its
+    # own instances, so recording takes no lock; readers merge copies.
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+
+    def record(self, micros):
+        # bucket_index() inlined: this runs on every span
+        if micros < EXACT:
+            self.counts[micros] += 1
+        elif micros < MAX_MICROS:
+            shift = micros.bit_length() - SUB_BITS
+            self.counts[(shift << HALF_BITS) + (micros >> shift)] += 1
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.total += micros
+
+    def merge(self, other):
+        counts = self.counts
+        for i, n in enumerate(other.counts):
+            if n:
+                counts[i] += n
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen > rank:
+                # Midpoint of the bucket
+                return (bucket_floor(i) + bucket_floor(i + 1)) / 2
+        return MAX_MICROS
+
+    def cumulative(self, bounds_micros):
+        # Counts at or below each bound, for Prometheus buckets
+        result, seen, i = [], 0, 0
+        for bound in bounds_micros:
+            while i < BUCKETS and bucket_floor(i + 1) <= bound + 1:
+                seen += self.counts[i]
+                i += 1
+            result.append(seen)
+        return result
+
+
+_local = threading.local()
+_histograms = []                 # (kind, name, histogram) for every thread
+_histograms_lock = threading.Lock()
+
+
+def thread_histograms(kind):
+    # This thread's {name: Histogram} for one kind
+    try:
+        return getattr(_local, kind)
+    except AttributeError:
+        histograms = {}
+        setattr(_local, kind, histograms)
+        return histograms
+
+
+def register(histograms, kind, name):
+    # Once per thread and name; the only place recording takes a lock
+    histogram = histograms[name] = Histogram()
+    with _histograms_lock:
+        _histograms.append((kind, name, histogram))
+    return histogram
+
+
+def record(kind, name, micros):
+    histograms = thread_histograms(kind)
+    histogram = histograms.get(name) or register(histograms, kind, name)
+    histogram.record(micros)
+
+
+def snapshot():
+    # Merged copy of every thread's histograms: {(kind, name): Histogram}
+    with _histograms_lock:
+        registered = list(_histograms)
+    merged = {}
+    for kind, name, histogram in registered:
+        merged.setdefault((kind, name), Histogram()).merge(histogram)
+    return merged
+
+
+def reset():
+    with _histograms_lock:
+        for _, _, histogram in _histograms:
+            histogram.counts = [0] * BUCKETS
+            histogram.count = histogram.total = 0
+
+
+# ---- spans -------------------------------------------------------------------
+
+_current = contextvars.ContextVar("trace_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class SpanDump:
+    # Finished spans are queued and written by a background thread, so the
+    # traced code never waits on the disk
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.pending = deque()
+        self.written = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.run, name="trace-dump", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self.pending:
+                return
+            lines = []
+            while self.pending:
+                lines.append(json.dumps(self.pending.popleft()))
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+            self.written += len(lines)
+
+
+_dump = SpanDump(TRACE_FILE) if ENABLED and TRACE_FILE else None
+
+
+class Span:
+    # A timed stage. Spans opened inside it (same task or thread, or a
+    # thread started through wrap()) become its children and share its
+    # trace id and origin, the wall-clock time the trace began.
+    __slots__ = ('name', 'attrs', 'trace_id', 'parent_id', 'origin', 'span_id', '_token', '_start')
+
+    def __init__(self, name, parent=None, attrs=None):
+        self.name = name
+        self.attrs = attrs
+        if parent is None:
+            parent = _current.get()
+        if parent is None:
+            self.trace_id = random.getrandbits(64)
+            self.parent_id = None
+            self.origin = time.time()
+        elif type(parent) is Span:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.origin = parent.origin
+        else:
+            # Carrier from inject(), e.g. inside an event payload
+            self.trace_id = int(parent.get("trace_id", "0"), 16) or random.getrandbits(64)
+            self.parent_id = int(parent.get("span_id", "0"), 16) or None
+            self.origin = float(parent.get("origin") or time.time())
+        self.span_id = next(_span_ids)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self._start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        micros = (perf_counter_ns() - self._start) // 1000
+        _current.reset(self._token)
+        try:
+            stages = _local.stage
+        except AttributeError:
+            stages = thread_histograms("stage")
+        (stages.get(self.name) or register(stages, "stage", self.name)).record(micros)
+        if _dump is not None:
+            _dump.pending.append({
+                'trace_id': f"{self.trace_id:016x}", 'span_id': f"{self.span_id:x}",
+                'parent_id': f"{self.parent_id:x}" if self.parent_id else None, 'name': self.name,
+                'start': round(time.time() - micros / 1e6, 6), 'duration_us': micros,
+                'error': exc_type.__name__ if exc_type else None, **(self.attrs or {})
+            })
+        return False
+
+
+class NoopSpan:
+    name = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP = NoopSpan()
+
+
+class Unsampled:
+    # Root of a trace left out by sampling: marks the context so its
+    # children are no-ops too
+    __slots__ = ('_token',)
+
+    def __enter__(self):
+        self._token = _current.set(UNSAMPLED)
+        return NOOP
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        return False
+
+
+UNSAMPLED = Unsampled()
+
+
+def noop_span(name, parent=None, attrs=None):
+    return NOOP
+
+
+def sampled_span(name, parent=None, attrs=None):
+    if parent is None:
+        parent = _current.get()
+        if parent is UNSAMPLED:
+            return NOOP
+        if parent is None and random.random() >= SAMPLE:
+            return Unsampled()
+    return Span(name, parent, attrs)
+
+
+def span_factory():
+    if not ENABLED:
+        return noop_span
+    # Span itself when every trace is kept: one call less per span
+    return Span if SAMPLE >= 1.0 else sampled_span
+
+
+# with tracing.span("stage"): ...  A shared no-op when tracing is off
+span = span_factory()
+
+
+def traced(name):
+    # Decorator for sync and async functions; decided at import, so a
+    # disabled build runs the undecorated function
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def current():
+    current_span = _current.get() if ENABLED else None
+    return current_span if type(current_span) is Span else None
+
+
+def inject():
+    # Carrier for the current span, to send along with an event
+    current_span = current()
+    if current_span is None:
+        return None
+    return {'trace_id': f"{current_span.trace_id:016x}", 'span_id': f"{current_span.span_id:x}",
+            'origin': current_span.origin}
+
+
+def attach(payload):
+    # Adds the carrier to an outgoing event dict when a trace is running
+    carrier = inject()
+    if carrier is not None:
+        payload['trace'] = carrier
+    return payload
+
+
+def rename(current_span, name):
+    # For spans whose name is only known at the end (HTTP route templates)
+    if type(current_span) is Span:
+        current_span.name = name
+
+
+def from_traceparent(header):
+    # W3C "00-<trace id>-<parent id>-<flags>"; we keep the low 64 bits
+    try:
+        _, trace_id, span_id, _ = header.split("-")
+        return {'trace_id': trace_id[-16:], 'span_id': span_id}
+    except (AttributeError, ValueError):
+        return None
+
+
+def finish(path, carrier=None):
+    # End-to-end latency from the start of the trace (frame captured,
+    # snapshot taken, call received) to an outcome such as a signal change
+    if not ENABLED:
+        return
+    origin = carrier.get("origin") if carrier else None
+    if origin is None:
+        current_span = current()
+        if current_span is None:
+            return
+        origin = current_span.origin
+    record("e2e", path, max(0, int((time.time() - float(origin)) * 1e6)))
+
+
+def wrap(fn):
+    # Runs fn in the caller's trace context (threads and executors do not
+    # inherit context variables)
+    if not ENABLED:
+        return fn
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+def enable(trace_file=None, sample=None):
+    global ENABLED, SAMPLE, _dump, span
+    ENABLED = True
+    if sample is not None:
+        SAMPLE = sample
+    span = span_factory()
+    if trace_file and (_dump is None or _dump.path != trace_file):
+        _dump = SpanDump(trace_file)
+
+
+def disable():
+    global ENABLED, span
+    ENABLED = False
+    span = noop_span
+
+
+# ---- export ---------------------------------------------------------------------
+
+def prometheus():
+    merged = snapshot()
+    bounds = [int(b * 1e6) for b in EXPORT_BOUNDS]
+    families = (("stage", "traffic_stage_latency_seconds", "stage", "Time spent in each traced stage"),
+                ("e2e", "traffic_end_to_end_latency_seconds", "path",
+                 "Time from the start of a trace (frame, snapshot, call) to its outcome"))
+    lines = []
+    for kind, metric, label, help_text in families:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for (k, name), histogram in sorted(merged.items()):
+            if k != kind or not histogram.count:
+                continue
+            for bound, count in zip(EXPORT_BOUNDS, histogram.cumulative(bounds)):
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{{label}="{name}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{metric}_sum{{{label}="{name}"}} {histogram.total / 1e6:.6f}')
+            lines.append(f'{metric}_count{{{label}="{name}"}} {histogram.count}')
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    def ms(micros):
+        return round(micros / 1000, 3) if micros is not None else None
+
+    return {
+        f"{kind}:{name}": {'count': h.count, 'p50_ms': ms(h.quantile(0.5)), 'p95_ms': ms(h.quantile(0.95)),
+                           'p99_ms': ms(h.quantile(0.99)), 'max_ms': ms(h.quantile(1.0))}
+        for (kind, name), h in sorted(snapshot().items()) if h.count
+    }
+
+
+try:
+    # The controller and detector record spans without the API installed
+    from fastapi import APIRouter
+    from fastapi.responses import PlainTextResponse
+except ImportError:
+    router = None
+else:
+    router = APIRouter(tags=["metrics"])
+
+    @router.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        return PlainTextResponse(prometheus(), media_type="text/plain; version=0.0.4")
+
+    @router.get("/api/tracing/summary")
+    async def get_tracing_summary():
+        return {'enabled': ENABLED, 'sample': SAMPLE, 'trace_file': _dump.path if _dump else None,
+                'spans_written': _dump.written if _dump else 0, 'stages': summary()}
+
+
+def trace_cost(iterations=50000):
+    # Nanoseconds per controller-shaped trace (a root span, three decorated
+    # stages and an end-to-end mark) with empty stages
+    @traced("benchmark.control")
+    def control():
+        pass
+
+    @traced("benchmark.emergency")
+    def emergency():
+        pass
+
+    @traced("benchmark.snapshot")
+    def snapshot():
+        pass
+
+    def loop():
+        started = time.perf_counter_ns()
+        for _ in range(iterations):
+            with span("benchmark.step"):
+                control()
+                emergency()
+                finish("benchmark")
+                snapshot()
+        return (time.perf_counter_ns() - started) / iterations
+
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        pass
+    bare = (time.perf_counter_ns() - started) / iterations
+    return min(loop() for _ in range(3)) - bare
+
+
+def overhead_benchmark(steps=2000, net_file="net.net.xml", sample=0.1):
+    # Trace cost set against the untraced step time of the headless
+    # controller (whole-loop A/B timings drown in run-to-run noise)
+    was = (ENABLED, SAMPLE)
+    # Imported traced, so the stage decorators are in place for the breakdown
+    enable()
+    from controller import TrafficController
+    from sim_backend import create_backend
+
+    disable()
+    off = trace_cost()
+    enable(sample=1.0)
+    full = trace_cost()
+    enable(sample=sample)
+    sampled = trace_cost()
+
+    disable()
+    sim = create_backend("queue", net_file=net_file, demand_rate=0.5, seed=1)
+    controller = TrafficController("", step_delay=0, backend=sim, log_path=os.devnull)
+    controller.logger.disabled = True
+    sim.start()
+    for _ in range(200):
+        controller.step()
+    started = time.perf_counter()
+    for _ in range(steps):
+        controller.step()
+    step_ns = (time.perf_counter() - started) / steps * 1e9
+
+    # A traced stretch for the stage breakdown
+    reset()
+    enable(sample=1.0)
+    for _ in range(steps):
+        controller.step()
+    if was[0]:
+        enable(sample=was[1])
+    else:
+        disable()
+
+    def pct(ns):
+        return round(ns / step_ns * 100, 2)
+
+    return {'steps': steps, 'step_us': round(step_ns / 1000, 1), 'trace_off_ns': round(off),
+            'trace_on_ns': round(full), 'trace_sampled_ns': round(sampled), 'sample': sample,
+            'overhead_off_pct': pct(off), 'overhead_on_pct': pct(full - off),
+            'overhead_sampled_pct': pct(sampled - off)}
+
+
+if __name__ == "__main__":
+    import tracing     # the module the controller records into, not __main__
+
+    parser = argparse.ArgumentParser(description="Measure tracing overhead on the headless controller")
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--net", default="../sumo/net.net.xml")
+    parser.add_argument("--sample", type=float, default=0.1)
+    args = parser.parse_args()
+
+    result = tracing.overhead_benchmark(args.steps, args.net, args.sample)
+    print(f"Headless controller step: {result['step_us']} us")
+    print(f"  tracing off:            {result['trace_off_ns']} ns/step ({result['overhead_off_pct']}%)")
+    print(f"  tracing on:             +{result['trace_on_ns'] - result['trace_off_ns']} ns/step "
+          f"({result['overhead_on_pct']}%)")
+    print(f"  on, {result['sample']:.0%} of traces:    +{result['trace_sampled_ns'] - result['trace_off_ns']} "
+          f"ns/step ({result['overhead_sampled_pct']}%)")
+    for stage, stats in tracing.summary().items():
+        print(f"  {stage}: {stats}")
@@ -0,0 +1,448 @@
+# Trajectory Violation Engine - batch speeding and red-light detection over FCD chunks and recordings
+import argparse
+from collections import Counter
+from datetime import datetime
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from network import RoadNetwork
+
+# Same allowance the live checker gives (violation_checker.py)
+SPEED_TOLERANCE = 10.0      # km/h over the lane limit
+SUSTAINED_SECONDS = 3.0     # a speeding run must last this long
+RED_GRACE = 0.5             # s; the light must already have been red this long at the stop line
+MAX_GAP = 2.0               # s between samples of one vehicle still treated as continuous
+BATCH_ROWS = 1 << 20        # rows per batch when reading recordings
+RED = ord('r')
+VIOLATIONS_LOG = "../data/logs/violations.json"
+
+
+class SignalTimeline:
+    # Signal states over time: per signal, the times its state changed and
+    # one row of state characters per change. A fixed-time program is one
+    # cycle of rows looked up modulo the cycle, the way green_wave.py places
+    # offsets; recorded or SUMO-reported states grow as they are read.
+    def __init__(self, tl_ids):
+        self.tl_ids = list(tl_ids)
+        self.index = {tl_id: i for i, tl_id in enumerate(self.tl_ids)}
+        self.times = [np.zeros(0) for _ in self.tl_ids]
+        self.states = [np.zeros((0, 0), np.uint8) for _ in self.tl_ids]
+        self.size = [0] * len(self.tl_ids)
+        self.cycle = [None] * len(self.tl_ids)
+        self.offset = [0.0] * len(self.tl_ids)
+        self.last = [None] * len(self.tl_ids)
+
+    @classmethod
+    def from_programs(cls, network):
+        # Only right for fixed-time control; prefer recorded or reported states
+        timeline = cls(network.tls)
+        for i, program in enumerate(network.tls.values()):
+            durations = [duration for duration, _ in program.phases]
+            for start, (_, state) in zip(np.cumsum([0.0] + durations[:-1]), program.phases):
+                timeline.append(program.id, float(start), state)
+            timeline.cycle[i] = float(sum(durations)) or None
+            timeline.offset[i] = program.offset
+        return timeline
+
+    @classmethod
+    def from_tls_states(cls, path, network):
+        # SUMO's --tls-states output: <tlsState time=".." id=".." state=".."/>
+        timeline = cls(network.tls)
+        for _, elem in ET.iterparse(path):
+            if elem.tag == 'tlsState' and elem.get('id') in timeline.index:
+                timeline.append(elem.get('id'), float(elem.get('time')), elem.get('state'))
+            elem.clear()
+        return timeline
+
+    def append(self, tl_id, t, state):
+        i = self.index[tl_id]
+        if state == self.last[i]:
+            return
+        self.last[i] = state
+        n = self.size[i]
+        row = np.frombuffer(state.encode(), np.uint8)
+        if n == len(self.times[i]) or len(row) > self.states[i].shape[1]:
+            # Grown by doubling so appending a day of changes stays linear
+            capacity = max(16, 2 * n)
+            times = np.zeros(capacity)
+            states = np.zeros((capacity, max(len(row), self.states[i].shape[1])), np.uint8)
+            times[:n] = self.times[i][:n]
+            states[:n, :self.states[i].shape[1]] = self.states[i][:n]
+            self.times[i], self.states[i] = times, states
+        self.times[i][n] = t
+        self.states[i][n, :len(row)] = row
+        self.states[i][n, len(row):] = 0
+        self.size[i] = n + 1
+
+    def update(self, t, states):
+        # One recorded snapshot: a state per signal, in tl_ids order
+        for tl_id, state in zip(self.tl_ids, states):
+            self.append(tl_id, t, state)
+
+    def codes(self, tl, link, times):
+        # State character of signal tl's link at each time (0 where unknown)
+        out = np.zeros(len(times), np.uint8)
+        for i in np.unique(tl[tl >= 0]):
+            n = self.size[i]
+            if not n:
+                continue
+            sel = np.flatnonzero(tl == i)
+            at = times[sel]
+            if self.cycle[i]:
+                at = (at - self.offset[i]) % self.cycle[i]
+            row = np.maximum(np.searchsorted(self.times[i][:n], at, side='right') - 1, 0)
+            links = link[sel]
+            valid = (links >= 0) & (links < self.states[i].shape[1])
+            out[sel[valid]] = self.states[i][row[valid], links[valid]]
+        return out
+
+    def red(self, tl, link, times):
+        return self.codes(tl, link, times) == RED
+
+
+class TrajectoryViolationEngine:
+    # Fed batches of trajectory rows (time, vehicle, lane, position, speed,
+    # x, y) in any order. Each batch is sorted by vehicle then time and
+    # scanned with whole-array operations: speeding is a run of consecutive
+    # samples over the lane limit lasting SUSTAINED_SECONDS; a red-light
+    # violation is leaving a signalised approach lane for another edge while
+    # the movement's link was red. Rows a later batch may still need - each
+    # vehicle's last sample and speeding runs still in progress - are
+    # carried into the next batch.
+    def __init__(self, network, timeline, epoch=None, tolerance=SPEED_TOLERANCE, sustained=SUSTAINED_SECONDS,
+                 grace=RED_GRACE, max_gap=MAX_GAP):
+        self.network = network
+        self.timeline = timeline
+        # Simulation seconds are mapped onto the wall clock from this epoch
+        self.epoch = epoch if epoch is not None else time.time()
+        self.tolerance = tolerance
+        self.sustained = sustained
+        self.grace = grace
+        self.max_gap = max_gap
+
+        # Lane tables carry one extra entry so lane -1 (internal or unknown) indexes it
+        self.lane_ids = list(network.lanes)
+        self.lane_index = {lane_id: i for i, lane_id in enumerate(self.lane_ids)}
+        lanes = list(network.lanes.values())
+        self.edge_ids = list(network.edges)
+        edge_index = {edge_id: i for i, edge_id in enumerate(self.edge_ids)}
+        self.lane_limit = np.append([lane.speed * 3.6 for lane in lanes], np.nan)
+        self.lane_length = np.append([lane.length for lane in lanes], np.nan)
+        self.lane_edge = np.append([edge_index[lane.edge] for lane in lanes], -1).astype(np.int64)
+        self.lane_tl = np.full(len(lanes) + 1, -1, np.int64)
+        self.lane_links = {}
+        keys, links = [], []
+        for connection in network.connections:
+            tl = timeline.index.get(connection.tl)
+            from_lane = self.lane_index.get(connection.from_lane)
+            if tl is None or from_lane is None or connection.link_index < 0:
+                continue
+            self.lane_tl[from_lane] = tl
+            self.lane_links.setdefault(from_lane, []).append(connection.link_index)
+            keys.append(from_lane * (len(lanes) + 1) + self.lane_index.get(connection.to_lane, len(lanes)))
+            links.append(connection.link_index)
+        order = np.argsort(keys)
+        self.link_keys = np.asarray(keys, np.int64)[order]
+        self.link_values = np.asarray(links, np.int64)[order]
+
+        self.vehicle_index = {}
+        self.vehicle_names = []
+        self.carry = None
+        self.stats = {'rows': 0, 'batches': 0, 'seconds': 0.0}
+
+    # ---- id tables ----------------------------------------------------------
+
+    def vehicle_codes(self, names):
+        index, known = self.vehicle_index, self.vehicle_names
+        codes = np.empty(len(names), np.int64)
+        for i, name in enumerate(names):
+            code = index.get(name)
+            if code is None:
+                code = index[name] = len(known)
+                known.append(name)
+            codes[i] = code
+        return codes
+
+    def lane_codes(self, names):
+        # -1 for internal lanes and lanes the network does not have
+        return np.array([self.lane_index.get(name, -1) for name in names], np.int64)
+
+    # ---- detection ----------------------------------------------------------
+
+    def feed(self, t, vehicle, lane, pos, speed, x, y):
+        started = time.perf_counter()
+        batch = {'t': np.asarray(t, float), 'vehicle': np.asarray(vehicle, np.int64),
+                 'lane': np.asarray(lane, np.int64), 'pos': np.asarray(pos, float),
+                 'speed': np.asarray(speed, float), 'x': np.asarray(x, float), 'y': np.asarray(y, float)}
+        rows = len(batch['t'])
+        batch['new'] = np.ones(rows, bool)
+        end_time = float(batch['t'].max()) if rows else float("-inf")
+        if self.carry is not None:
+            batch = {name: np.concatenate((self.carry[name], column)) for name, column in batch.items()}
+        violations = self.detect(batch, end_time, final=False)
+        self.stats['rows'] += rows
+        self.stats['batches'] += 1
+        self.stats['seconds'] += time.perf_counter() - started
+        return violations
+
+    def finish(self):
+        # Whatever is still carried: runs that lasted to the end of the data
+        if self.carry is None:
+            return []
+        batch, self.carry = self.carry, None
+        return self.detect(batch, float("-inf"), final=True)
+
+    def detect(self, batch, end_time, final):
+        order = np.lexsort((batch['t'], batch['vehicle']))
+        b = {name: column[order] for name, column in batch.items()}
+        t, vehicle = b['t'], b['vehicle']
+        n = len(t)
+        # same[i]: row i continues row i-1's trajectory
+        same = np.zeros(n, bool)
+        same[1:] = (vehicle[1:] == vehicle[:-1]) & (t[1:] - t[:-1] <= self.max_gap)
+        last = np.ones(n, bool)
+        last[:-1] = vehicle[1:] != vehicle[:-1]
+
+        violations, open_from = self.speeding(b, same, last, end_time, final)
+        violations += self.red_light(b, same)
+
+        if not final:
+            # Keep each vehicle's last sample while it may still be moving,
+            # plus every row of a speeding run that has not ended yet
+            keep = last & (t > end_time - self.max_gap)
+            if len(open_from):
+                # From each open run's first row to its vehicle's last row
+                ends = np.flatnonzero(last)
+                marks = np.zeros(n + 1, np.int64)
+                np.add.at(marks, open_from, 1)
+                np.add.at(marks, ends[np.searchsorted(ends, open_from)] + 1, -1)
+                keep |= np.cumsum(marks[:n]) > 0
+            self.carry = {name: column[keep] for name, column in b.items()}
+            self.carry['new'] = np.zeros(int(keep.sum()), bool)
+        return violations
+
+    def speeding(self, b, same, last, end_time, final):
+        t, lane, speed = b['t'], b['lane'], b['speed'] * 3.6
+        limit = self.lane_limit[lane]
+        over = speed > limit + self.tolerance       # NaN limits (internal lanes) never count
+        starts = over.copy()
+        starts[1:] &= ~(over[:-1] & same[1:])
+        rows = np.flatnonzero(over)
+        if not len(rows):
+            return [], np.zeros(0, np.int64)
+        first = np.flatnonzero(starts[rows])
+        final_row = np.r_[first[1:], len(rows)] - 1
+        run = np.cumsum(starts[rows]) - 1
+        t0, t1 = t[rows[first]], t[rows[final_row]]
+        # A run reaching the batch's end may continue in the next batch
+        ongoing = last[rows[final_row]] & (t1 > end_time - self.max_gap) & (not final)
+        peak = rows[np.lexsort((speed[rows], run))[final_row]]
+        # Carried rows only ever hold runs not yet reported
+        reported = np.flatnonzero((t1 - t0 >= self.sustained) & ~ongoing)
+
+        violations = []
+        for k in reported.tolist():
+            i = int(peak[k])
+            lane_id = self.lane_ids[lane[i]]
+            violations.append(self.violation(
+                b, i, 'SPEEDING_VIOLATION', self.edge_ids[self.lane_edge[lane[i]]], float(t0[k]),
+                lane=lane_id, speed=round(float(speed[i]), 1), speed_limit=round(float(limit[i]), 1),
+                duration=round(float(t1[k] - t0[k]), 1)))
+        return violations, rows[first[ongoing]]
+
+    def red_light(self, b, same):
+        t, vehicle, lane, pos, speed = b['t'], b['vehicle'], b['lane'], b['pos'], b['speed']
+        n = len(t)
+        if n < 2:
+            return []
+        # Last sample on a signalised approach before moving off it; pairs
+        # already scanned in the previous batch (both rows carried) are skipped
+        i = np.flatnonzero(same[1:] & (lane[:-1] >= 0) & (self.lane_tl[lane[:-1]] >= 0)
+                           & (lane[1:] != lane[:-1]) & b['new'][1:])
+        if not len(i):
+            return []
+        # The movement is told by the next regular lane the vehicle reaches
+        regular = np.flatnonzero(lane >= 0)
+        at = np.searchsorted(regular, i, side='right')
+        k = regular[np.minimum(at, len(regular) - 1)]
+        found = (at < len(regular)) & (vehicle[k] == vehicle[i])
+        from_lane = lane[i]
+        to_lane = np.where(found, lane[k], -1)
+        # A lane change along the same edge is not a crossing
+        crossing = np.where(found, self.lane_edge[to_lane] != self.lane_edge[from_lane], lane[i + 1] < 0)
+        i, from_lane, to_lane, found = i[crossing], from_lane[crossing], to_lane[crossing], found[crossing]
+        if not len(i):
+            return []
+
+        # Stop line crossed between the two samples, assuming constant speed
+        remaining = self.lane_length[from_lane] - pos[i]
+        at_line = t[i] + np.clip(remaining / np.maximum(speed[i], 0.1), 0.0, t[i + 1] - t[i])
+        tl = self.lane_tl[from_lane]
+        size = len(self.lane_ids) + 1
+        keys = from_lane * size + np.where(to_lane >= 0, to_lane, size - 1)
+        slot = np.minimum(np.searchsorted(self.link_keys, keys), max(len(self.link_keys) - 1, 0))
+        known = found & (len(self.link_keys) > 0) & (self.link_keys[slot] == keys)
+        link = np.where(known, self.link_values[slot], -1)
+        red = self.timeline.red(tl, link, at_line) & self.timeline.red(tl, link, at_line - self.grace)
+        for j in np.flatnonzero(~known).tolist():
+            # Movement unknown: only a red for every link of the lane counts
+            links = np.array(self.lane_links.get(int(from_lane[j]), []), np.int64)
+            both = np.full(len(links), tl[j])
+            red[j] = len(links) > 0 and bool(
+                self.timeline.red(both, links, np.full(len(links), at_line[j])).all()
+                and self.timeline.red(both, links, np.full(len(links), at_line[j] - self.grace)).all())
+
+        violations = []
+        for j in np.flatnonzero(red).tolist():
+            row = int(i[j])
+            edge = self.network.edges[self.edge_ids[self.lane_edge[from_lane[j]]]]
+            violations.append(self.violation(
+                b, row, 'RED_LIGHT_VIOLATION', edge.to_junction, float(at_line[j]),
+                lane=self.lane_ids[from_lane[j]], signal=self.timeline.tl_ids[tl[j]],
+                link_index=int(link[j]) if link[j] >= 0 else None,
+                speed=round(float(speed[row]) * 3.6, 1)))
+        return violations
+
+    def violation(self, b, row, violation_type, location, sim_time, **details):
+        # Same fields as ViolationChecker's live records, plus the evidence
+        # the trajectory gives
+        return {
+            'vehicle_id': self.vehicle_names[b['vehicle'][row]],
+            'type': violation_type,
+            'location': location,
+            'timestamp': datetime.fromtimestamp(self.epoch + sim_time).isoformat(),
+            'sim_time': round(sim_time, 2),
+            'position': {'x': round(float(b['x'][row]), 1), 'y': round(float(b['y'][row]), 1)},
+            'source': 'trajectory',
+            **details
+        }
+
+
+# ---- sources ----------------------------------------------------------------
+
+def run_epoch(run):
+    # sumo_outputs.py names each run directory after its epoch
+    try:
+        return datetime.strptime(run, "%Y%m%d-%H%M%S").timestamp()
+    except ValueError:
+        return None
+
+
+def fcd_source(chunk_dir, network, run=None, timeline=None, **options):
+    # FCD chunks written by sumo_outputs.py, one batch per chunk. Without
+    # SUMO's tls-states output the signals are taken to follow the
+    # network's programs.
+    import sumo_outputs
+    paths = sumo_outputs.chunk_paths("fcd", run, chunk_dir)
+    if not paths:
+        raise FileNotFoundError(f"no FCD chunks under {chunk_dir}")
+    run = run or os.path.basename(os.path.dirname(paths[-1]))
+    paths = [path for path in paths if os.path.basename(os.path.dirname(path)) == run]
+    engine = TrajectoryViolationEngine(network, timeline or SignalTimeline.from_programs(network),
+                                       epoch=run_epoch(run), **options)
+
+    def batches():
+        for path in paths:
+            chunk = sumo_outputs.read_chunk(path)
+            vehicle = engine.vehicle_codes(chunk['vehicle_names'].tolist())[chunk['vehicle']]
+            lane = engine.lane_codes(chunk['lane_names'].tolist())[chunk['lane']]
+            yield chunk['time'], vehicle, lane, chunk['pos'], chunk['speed'], chunk['x'], chunk['y']
+    return engine, batches()
+
+
+def recording_source(path, batch_rows=BATCH_ROWS, **options):
+    # A replay.py recording carries its network and the exact signal state
+    # of every captured step
+    import replay
+    records = replay.read_records(path)
+    header = next(records)
+    network = RoadNetwork.from_dict(header['network'])
+    timeline = SignalTimeline(header['tls'])
+    created = datetime.fromisoformat(header['created']).timestamp()
+    engine = TrajectoryViolationEngine(network, timeline, epoch=created, **options)
+    lane_map = np.append(engine.lane_codes(header['lanes']), -1)
+
+    def batches():
+        vehicle_map, parts, rows = [], [], 0
+        previous = None
+        for record in records:
+            t = record['t']
+            if previous is None:
+                engine.epoch = created - t      # recording opened at the first snapshot
+            if record.get('ids'):
+                vehicle_map.extend(engine.vehicle_codes(record['ids']).tolist())
+            # A snapshot's signal states are the ones vehicles moved under since
+            # the previous snapshot (set by the commands issued on it)
+            timeline.update(t if previous is None else previous, record['tl'])
+            previous = t
+            vid = np.frombuffer(record['vid'], '<u4')
+            parts.append((t, vid, {name: np.frombuffer(record[name], replay.COLUMN_TYPES[name])
+                                   for name in ('lane', 'pos', 'speed', 'x', 'y')}))
+            rows += len(vid)
+            if rows >= batch_rows or record.get('final'):
+                yield join_parts(parts, np.asarray(vehicle_map, np.int64), lane_map)
+                parts, rows = [], 0
+        if parts:
+            yield join_parts(parts, np.asarray(vehicle_map, np.int64), lane_map)
+    return engine, batches()
+
+
+def join_parts(parts, vehicle_map, lane_map):
+    column = lambda name: np.concatenate([columns[name] for _, _, columns in parts])
+    return (np.concatenate([np.full(len(vid), t) for t, vid, _ in parts]),
+            vehicle_map[np.concatenate([vid for _, vid, _ in parts])], lane_map[column('lane')],
+            column('pos'), column('speed'), column('x'), column('y'))
+
+
+def detect_all(engine, batches):
+    for batch in batches:
+        yield from engine.feed(*batch)
+    yield from engine.finish()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect sustained speeding and red-light running in trajectories")
+    parser.add_argument("source", help="a replay.py recording, or 'fcd' for the sumo_outputs.py chunks")
+    parser.add_argument("--chunks", default=None, help="chunk directory (default: sumo_outputs CHUNK_DIR)")
+    parser.add_argument("--run", help="which ingest run (default: the latest)")
+    parser.add_argument("--net", default="../sumo/net.net.xml", help="network for FCD chunks")
+    parser.add_argument("--tls-states", help="SUMO --tls-states output for FCD chunks")
+    parser.add_argument("--tolerance", type=float, default=SPEED_TOLERANCE, help="km/h over the lane limit")
+    parser.add_argument("--sustained", type=float, default=SUSTAINED_SECONDS, help="seconds a speeding run lasts")
+    parser.add_argument("--grace", type=float, default=RED_GRACE, help="seconds of red before it counts")
+    parser.add_argument("--out", help="write violations as JSON lines here")
+    parser.add_argument("--log", action="store_true", help=f"append violations to {VIOLATIONS_LOG} for the rollups")
+    args = parser.parse_args()
+
+    options = {'tolerance': args.tolerance, 'sustained': args.sustained, 'grace': args.grace}
+    if args.source == "fcd":
+        import sumo_outputs
+        network = RoadNetwork.from_file(args.net)
+        timeline = SignalTimeline.from_tls_states(args.tls_states, network) if args.tls_states else None
+        engine, batches = fcd_source(args.chunks or sumo_outputs.CHUNK_DIR, network, args.run, timeline, **options)
+    else:
+        engine, batches = recording_source(args.source, **options)
+
+    outputs = [open(args.out, "w")] if args.out else []
+    if args.log:
+        os.makedirs(os.path.dirname(VIOLATIONS_LOG), exist_ok=True)
+        outputs.append(open(VIOLATIONS_LOG, "a"))
+    counts = Counter()
+    started = time.perf_counter()
+    try:
+        for violation in detect_all(engine, batches):
+            counts[violation['type']] += 1
+            line = json.dumps(violation) + "\n"
+            for f in outputs:
+                f.write(line)
+    finally:
+        for f in outputs:
+            f.close()
+    elapsed = time.perf_counter() - started
+    rows = engine.stats['rows']
+    print(f"{rows} trajectory rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9) / 1e6:.2f}M rows/s, "
+          f"{engine.stats['seconds']:.2f}s detecting): {dict(counts) or 'no violations'}")
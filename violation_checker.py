@@ -1,31 +1,35 @@
 # Traffic Violation Detection using SUMO data
-import traci
 import cv2
 import numpy as np
 from datetime import datetime
 import json
 
+from sim_backend import create_backend
+import tracing
+
 class ViolationChecker:
-    def __init__(self):
+    def __init__(self, backend=None):
+        self.sim = backend or create_backend("sumo")
         self.violations = []
         self.speed_limits = {"E0": 50, "W0": 50, "N0": 40, "S0": 40}
 
+    @tracing.traced("violations.red_light")
     def check_red_light_violation(self, junction_id):
         violations = []
         try:
-            tl_state = traci.trafficlight.getRedYellowGreenState(junction_id)
-            incoming_edges = traci.junction.getIncomingEdges(junction_id)
+            tl_state = self.sim.trafficlight.getRedYellowGreenState(junction_id)
+            incoming_edges = self.sim.junction.getIncomingEdges(junction_id)
 
             for i, edge in enumerate(incoming_edges):
                 if i < len(tl_state) and tl_state[i] == 'r':  # Red light
-                    vehicles = traci.edge.getLastStepVehicleIDs(edge)
+                    vehicles = self.sim.edge.getLastStepVehicleIDs(edge)
 
                     for vehicle_id in vehicles:
-                        position = traci.vehicle.getPosition(vehicle_id)
-                        speed = traci.vehicle.getSpeed(vehicle_id)
+                        position = self.sim.vehicle.getPosition(vehicle_id)
+                        speed = self.sim.vehicle.getSpeed(vehicle_id)
 
                         # Check if vehicle is close to junction and moving
-                        junction_pos = traci.junction.getPosition(junction_id)
+                        junction_pos = self.sim.junction.getPosition(junction_id)
                         distance = np.sqrt((position[0] - junction_pos[0])**2 + 
                                          (position[1] - junction_pos[1])**2)
 
@@ -44,15 +48,16 @@ class ViolationChecker:
 
         return violations
 
+    @tracing.traced("violations.speeding")
     def check_speeding_violation(self, edge_id):
         violations = []
         speed_limit = self.speed_limits.get(edge_id, 50)
 
         try:
-            vehicles = traci.edge.getLastStepVehicleIDs(edge_id)
+            vehicles = self.sim.edge.getLastStepVehicleIDs(edge_id)
 
             for vehicle_id in vehicles:
-                speed = traci.vehicle.getSpeed(vehicle_id) * 3.6  # Convert to km/h
+                speed = self.sim.vehicle.getSpeed(vehicle_id) * 3.6  # Convert to km/h
 
                 if speed > speed_limit + 10:  # 10 km/h tolerance
                     violation = {
@@ -90,8 +95,10 @@ class ViolationChecker:
         self.violations.append(violation)
 
         # Save to file
-        with open("../data/logs/violations.json", "a") as f:
-            f.write(json.dumps(violation) + "\n")
+        with tracing.span("violations.log"):
+            with open("../data/logs/violations.json", "a") as f:
+                f.write(json.dumps(violation) + "\n")
+        tracing.finish("snapshot_to_violation")
 
         print(f"Violation logged: {violation['type']} by {violation['vehicle_id']}")
 
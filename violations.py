@@ -2,8 +2,13 @@
 from fastapi import APIRouter, HTTPException
 from datetime import datetime, timedelta
 import json
+import uuid
 from typing import List, Dict
 
+from cache import response_cache
+from event_bus import bus
+import tracing
+
 router = APIRouter(prefix="/api/violations", tags=["violations"])
 
 # Mock violation database
@@ -55,6 +60,11 @@ async def get_violations(status: str = None, limit: int = 50):
 
     return filtered_violations[:limit]
 
+@router.get("/recent")
+async def get_recent_violations(limit: int = 10):
+    # Newest first; declared before /{violation_id} so "recent" isn't taken as an ID
+    return sorted(violations_db, key=lambda v: v["timestamp"], reverse=True)[:limit]
+
 @router.get("/{violation_id}")
 async def get_violation_details(violation_id: str):
     violation = next((v for v in violations_db if v["id"] == violation_id), None)
@@ -66,7 +76,8 @@ async def get_violation_details(violation_id: str):
 
 @router.post("/")
 async def create_violation(violation_data: dict):
-    violation_id = f"V{len(violations_db) + 1:03d}"
+    # Random rather than sequential: every worker creates records on its own
+    violation_id = f"V{uuid.uuid4().hex[:12].upper()}"
 
     new_violation = {
         "id": violation_id,
@@ -81,6 +92,9 @@ async def create_violation(violation_data: dict):
     }
 
     violations_db.append(new_violation)
+    await bus.publish("violations", {"action": "upsert", "violation": new_violation})
+    # Detector trace (camera frame) through to the stored record
+    tracing.finish("violation_record", violation_data.get("trace"))
     return new_violation
 
 @router.put("/{violation_id}/status")
@@ -92,6 +106,7 @@ async def update_violation_status(violation_id: str, status_data: dict):
 
     violation["status"] = status_data.get("status", violation["status"])
     violation["officer_notes"] = status_data.get("officer_notes", violation["officer_notes"])
+    await bus.publish("violations", {"action": "upsert", "violation": violation})
 
     return {"message": "Violation status updated successfully"}
 
@@ -116,6 +131,19 @@ async def get_violation_analytics():
         "average_fine": total_fines / total_violations if total_violations > 0 else 0
     }
 
+async def apply_violation_event(event: dict):
+    # Keep every worker's copy of the violation records in sync
+    if event.get("action") == "upsert":
+        violation = event["violation"]
+        existing = next((v for v in violations_db if v["id"] == violation["id"]), None)
+        if existing is None:
+            violations_db.append(violation)
+        elif existing is not violation:
+            existing.update(violation)
+        response_cache.bump_data_version("violations")
+
+bus.subscribe("violations", apply_violation_event)
+
 def calculate_fine(violation_type: str) -> int:
     fine_schedule = {
         "RED_LIGHT_VIOLATION": 1000,